@@ -12,14 +12,17 @@ from pydantic import BaseModel
 import tempfile
 import os
 
-from agentpress.thread_manager import ThreadManager
+from agentpress.thread_manager import ThreadManager, invalidate_thread_messages_cache
 from services.supabase import DBConnection
 from services import redis
+from services import response_stream
+from services.run_control import persist_stop
 from utils.auth_utils import get_current_user_id_from_jwt, get_user_id_from_stream_auth, verify_thread_access, verify_admin_api_key
 from utils.logger import logger, structlog
 from services.billing import check_billing_status, can_use_model
 from utils.config import config
-from sandbox.sandbox import create_sandbox, delete_sandbox
+from sandbox.sandbox import delete_sandbox
+from sandbox.pool import provision_project_sandbox
 from services.llm import make_llm_api_call
 from run_agent_background import run_agent_background, _cleanup_redis_response_list, update_agent_run_status
 from utils.constants import MODEL_NAME_ALIASES
@@ -234,17 +237,6 @@ async def stop_agent_run(agent_run_id: str, error_message: Optional[str] = None)
     client = await db.client
     final_status = "failed" if error_message else "stopped"
 
-    # Attempt to fetch final responses from Redis
-    response_list_key = f"agent_run:{agent_run_id}:responses"
-    all_responses = []
-    try:
-        all_responses_json = await redis.lrange(response_list_key, 0, -1)
-        all_responses = [json.loads(r) for r in all_responses_json]
-        logger.debug(f"Fetched {len(all_responses)} responses from Redis for DB update on stop/fail: {agent_run_id}")
-    except Exception as e:
-        logger.error(f"Failed to fetch responses from Redis for {agent_run_id} during stop/fail: {e}")
-        # Try fetching from DB as a fallback? Or proceed without responses? Proceeding without for now.
-
     # Update the agent run status in the database
     update_success = await update_agent_run_status(
         client, agent_run_id, final_status, error=error_message
@@ -257,8 +249,11 @@ async def stop_agent_run(agent_run_id: str, error_message: Optional[str] = None)
     # Send STOP signal to the global control channel
     global_control_channel = f"agent_run:{agent_run_id}:control"
     try:
+        await persist_stop(agent_run_id)
         await redis.publish(global_control_channel, "STOP")
         logger.debug(f"Published STOP signal to global channel {global_control_channel}")
+        # Also end streams being read, even if no worker is left to do it
+        await response_stream.append_control(agent_run_id, "STOP")
     except Exception as e:
         logger.error(f"Failed to publish STOP signal to global channel {global_control_channel}: {str(e)}")
 
@@ -600,9 +595,6 @@ async def log_manual_event(
     client = await db.client
     await get_agent_run_with_access_check(client, agent_run_id, user_id)
 
-    response_list_key = f"agent_run:{agent_run_id}:responses"
-    response_channel = f"agent_run:{agent_run_id}:new_response"
-
     payload = {
         "type": "manual_event",
         "event_type": event.type,
@@ -612,8 +604,12 @@ async def log_manual_event(
         "user_id": user_id,
     }
     try:
-        await redis.rpush(response_list_key, json.dumps(payload))
-        await redis.publish(response_channel, "new")
+        if await response_stream.has_legacy_responses(agent_run_id):
+            # Runs started before the stream transport are still read from the list
+            await redis.rpush(response_stream.legacy_response_list_key(agent_run_id), json.dumps(payload))
+            await redis.publish(f"agent_run:{agent_run_id}:new_response", "new")
+        else:
+            await response_stream.append_response(agent_run_id, payload)
     except Exception as e:
         logger.error(f"Failed to append manual event for {agent_run_id}: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to record manual event")
@@ -803,7 +799,12 @@ async def stream_agent_run(
     token: Optional[str] = None,
     request: Request = None
 ):
-    """Stream the responses of an agent run using Redis Lists and Pub/Sub."""
+    """Stream the responses of an agent run from its Redis stream.
+
+    Each event carries its stream entry ID, so a client reconnecting with
+    Last-Event-ID resumes after the last response it received. Runs started
+    before the stream transport are served from their Redis list and Pub/Sub.
+    """
     logger.debug(f"Starting stream for agent run: {agent_run_id}")
     client = await db.client
 
@@ -815,11 +816,67 @@ async def stream_agent_run(
         user_id=user_id,
     )
 
-    response_list_key = f"agent_run:{agent_run_id}:responses"
+    last_event_id = response_stream.parse_entry_id(request.headers.get("last-event-id") if request else None)
+
+    async def stream_generator(agent_run_data):
+        logger.debug(f"Streaming responses for {agent_run_id} from Redis stream after entry {last_event_id}")
+        last_id = last_event_id
+        caught_up = False
+        initial_yield_complete = False
+
+        try:
+            structlog.contextvars.bind_contextvars(
+                thread_id=agent_run_data.get('thread_id') if agent_run_data else None,
+            )
+
+            while True:
+                # Drain the backlog without blocking, then block for new entries
+                entries = await response_stream.read_entries(
+                    agent_run_id, last_id, block_ms=response_stream.READ_BLOCK_MS if caught_up else None
+                )
+
+                if not entries:
+                    if not caught_up:
+                        caught_up = True
+                        initial_yield_complete = True
+                        current_status = agent_run_data.get('status') if agent_run_data else None
+                        if current_status != 'running':
+                            logger.debug(f"Agent run {agent_run_id} is not running (status: {current_status}). Ending stream.")
+                            yield f"data: {json.dumps({'type': 'status', 'status': 'completed'})}\n\n"
+                            return
+                    else:
+                        # Nothing new within the block timeout, keep proxies from closing the connection
+                        yield ": keep-alive\n\n"
+                    continue
+
+                for entry in entries:
+                    last_id = entry.entry_id
+                    if entry.control:
+                        logger.debug(f"Received control signal '{entry.control}' for {agent_run_id}")
+                        yield f"id: {entry.entry_id}\ndata: {json.dumps({'type': 'status', 'status': entry.control})}\n\n"
+                        return
+                    if entry.data is None:
+                        continue
+                    yield f"id: {entry.entry_id}\ndata: {entry.data}\n\n"
+                    if entry.status in ['completed', 'failed', 'stopped']:
+                        logger.debug(f"Detected run completion via status message in stream: {entry.status}")
+                        return
+
+        except asyncio.CancelledError:
+            logger.debug(f"Stream generator cancelled for {agent_run_id}")
+            raise
+        except Exception as e:
+            logger.error(f"Error streaming agent run {agent_run_id}: {e}", exc_info=True)
+            message = f'Stream failed: {e}' if initial_yield_complete else f'Failed to start stream: {e}'
+            yield f"data: {json.dumps({'type': 'status', 'status': 'error', 'message': message})}\n\n"
+        finally:
+            logger.debug(f"Streaming cleanup complete for agent run: {agent_run_id}")
+
+    response_list_key = response_stream.legacy_response_list_key(agent_run_id)
     response_channel = f"agent_run:{agent_run_id}:new_response"
     control_channel = f"agent_run:{agent_run_id}:control" # Global control channel
 
-    async def stream_generator(agent_run_data):
+    async def legacy_stream_generator(agent_run_data):
         logger.debug(f"Streaming responses for {agent_run_id} using Redis list {response_list_key} and channel {response_channel}")
         last_processed_index = -1
         pubsub_response = None
@@ -989,7 +1046,12 @@ async def stream_agent_run(
             await asyncio.sleep(0.1)
             logger.debug(f"Streaming cleanup complete for agent run: {agent_run_id}")
 
-    return StreamingResponse(stream_generator(agent_run_data), media_type="text/event-stream", headers={
+    if await response_stream.has_legacy_responses(agent_run_id):
+        generator = legacy_stream_generator(agent_run_data)
+    else:
+        generator = stream_generator(agent_run_data)
+
+    return StreamingResponse(generator, media_type="text/event-stream", headers={
         "Cache-Control": "no-cache, no-transform", "Connection": "keep-alive",
         "X-Accel-Buffering": "no", "Content-Type": "text/event-stream",
         "Access-Control-Allow-Origin": "*"
@@ -1202,36 +1264,17 @@ async def initiate_agent_with_files(
         # which will create it lazily when tools require it.
         sandbox_id = None
         sandbox = None
-        sandbox_pass = None
-        vnc_url = None
-        website_url = None
-        token = None
 
         if files:
             # 3. Create Sandbox (lazy): only create now if files were uploaded and need the
             try:
-                sandbox_pass = str(uuid.uuid4())
-                sandbox = await create_sandbox(sandbox_pass, project_id)
+                sandbox, sandbox_info = await provision_project_sandbox(project_id)
                 sandbox_id = sandbox.id
-                logger.info(f"Created new sandbox {sandbox_id} for project {project_id}")
-
-                # Get preview links
-                vnc_link = await sandbox.get_preview_link(6080)
-                website_link = await sandbox.get_preview_link(8080)
-                vnc_url = vnc_link.url if hasattr(vnc_link, 'url') else str(vnc_link).split("url='")[1].split("'")[0]
-                website_url = website_link.url if hasattr(website_link, 'url') else str(website_link).split("url='")[1].split("'")[0]
-                token = None
-                if hasattr(vnc_link, 'token'):
-                    token = vnc_link.token
-                elif "token='" in str(vnc_link):
-                    token = str(vnc_link).split("token='")[1].split("'")[0]
+                logger.info(f"Provisioned sandbox {sandbox_id} for project {project_id}")
 
                 # Update project with sandbox info
                 update_result = await client.table('projects').update({
-                    'sandbox': {
-                        'id': sandbox_id, 'pass': sandbox_pass, 'vnc_preview': vnc_url,
-                        'sandbox_url': website_url, 'token': token
-                    }
+                    'sandbox': sandbox_info
                 }).eq('project_id', project_id).execute()
 
                 if not update_result.data:
@@ -3284,21 +3327,9 @@ async def create_thread(
         # 2. Create Sandbox
         sandbox_id = None
         try:
-            sandbox_pass = str(uuid.uuid4())
-            sandbox = await create_sandbox(sandbox_pass, project_id)
+            sandbox, sandbox_info = await provision_project_sandbox(project_id)
             sandbox_id = sandbox.id
-            logger.debug(f"Created new sandbox {sandbox_id} for project {project_id}")
-            
-            # Get preview links
-            vnc_link = await sandbox.get_preview_link(6080)
-            website_link = await sandbox.get_preview_link(8080)
-            vnc_url = vnc_link.url if hasattr(vnc_link, 'url') else str(vnc_link).split("url='")[1].split("'")[0]
-            website_url = website_link.url if hasattr(website_link, 'url') else str(website_link).split("url='")[1].split("'")[0]
-            token = None
-            if hasattr(vnc_link, 'token'):
-                token = vnc_link.token
-            elif "token='" in str(vnc_link):
-                token = str(vnc_link).split("token='")[1].split("'")[0]
+            logger.debug(f"Provisioned sandbox {sandbox_id} for project {project_id}")
         except Exception as e:
             logger.error(f"Error creating sandbox: {str(e)}")
             await client.table('projects').delete().eq('project_id', project_id).execute()
@@ -3311,13 +3342,7 @@ async def create_thread(
 
         # Update project with sandbox info
         update_result = await client.table('projects').update({
-            'sandbox': {
-                'id': sandbox_id, 
-                'pass': sandbox_pass, 
-                'vnc_preview': vnc_url,
-                'sandbox_url': website_url, 
-                'token': token
-            }
+            'sandbox': sandbox_info
         }).eq('project_id', project_id).execute()
 
         if not update_result.data:
@@ -3490,6 +3515,7 @@ async def delete_message(
     try:
         # Don't allow users to delete the "status" messages
         await client.table('messages').delete().eq('message_id', message_id).eq('is_llm_message', True).eq('thread_id', thread_id).execute()
+        await invalidate_thread_messages_cache(thread_id)
         return {"message": "Message deleted successfully"}
     except Exception as e:
         logger.error(f"Error deleting message {message_id} from thread {thread_id}: {str(e)}")
@@ -2,7 +2,7 @@ import os
 import json
 import asyncio
 import datetime
-from typing import Optional, Dict, List, Any, AsyncGenerator
+from typing import Optional, Dict, List, Any, AsyncGenerator, Tuple
 from dataclasses import dataclass
 
 from agent.tools.message_tool import MessageTool
@@ -22,6 +22,7 @@ from agent.prompt import get_system_prompt
 from utils.logger import logger
 from utils.auth_utils import get_account_id_from_thread
 from services.billing import check_billing_status
+from services.prompt_cache import PromptCache
 from agent.tools.sb_vision_tool import SandboxVisionTool
 from agent.tools.sb_image_edit_tool import SandboxImageEditTool
 from agent.tools.sb_video_generation_tool import SandboxVideoGenerationTool
@@ -246,13 +247,68 @@ class PromptManager:
                                   mcp_wrapper_instance: Optional[MCPToolWrapper],
                                   client=None, user_input: Optional[str] = None,
 ) -> dict:
-        
+        # Static sections are compiled once per agent version, tool set and knowledge base revision
+        compiled = await PromptManager._get_compiled_prompt(model_name, agent_config, mcp_wrapper_instance, client)
+        # The MCP section is static too; keeping it before the per-run sections keeps the prompt prefix stable
+        system_content = compiled['base'] + compiled['mcp']
+
+        # Add smart user DAGAD context and user personalization if available
+        if client and thread_id:
+            system_content += await PromptManager._build_user_context(client, thread_id, user_input)
+
+        system_content += PromptManager._build_datetime_info()
+
+        return {"role": "system", "content": system_content}
+
+    @staticmethod
+    async def _get_compiled_prompt(model_name: str, agent_config: Optional[dict],
+                                   mcp_wrapper_instance: Optional[MCPToolWrapper], client=None) -> Dict[str, str]:
+        """Get the static prompt sections from the prompt cache, compiling them on a miss."""
+        include_sample_response = "anthropic" not in model_name.lower()
+        mcp_enabled = bool(agent_config and (agent_config.get('configured_mcps') or agent_config.get('custom_mcps')) and mcp_wrapper_instance and mcp_wrapper_instance._initialized)
+        agent_id = agent_config.get('agent_id') if agent_config else None
+
+        if not agent_id or not client:
+            compiled, _ = await PromptManager._compile_prompt(include_sample_response, agent_config, mcp_wrapper_instance, mcp_enabled, client)
+            return compiled
+
+        version_id = agent_config.get('current_version_id')
+        # The MCP section lists each tool's description and parameters, so they are part of the key
+        mcp_tools = {
+            method_name: [schema.schema for schema in schema_list if schema.schema_type == SchemaType.OPENAPI]
+            for method_name, schema_list in mcp_wrapper_instance.get_schemas().items()
+        } if mcp_enabled else {}
+        tool_set_hash = PromptCache.tool_set_hash(agent_config, mcp_tools, include_sample_response)
+        kb_revision = await PromptCache.get_kb_revision(agent_id)
+
+        if kb_revision:
+            cached = await PromptCache.get_compiled_prompt(agent_id, version_id, tool_set_hash, kb_revision)
+            if cached:
+                return cached
+
+        compiled, cacheable = await PromptManager._compile_prompt(include_sample_response, agent_config, mcp_wrapper_instance, mcp_enabled, client)
+        # Without a revision a later knowledge base change could not invalidate the entry
+        if cacheable and kb_revision:
+            await PromptCache.cache_compiled_prompt(agent_id, version_id, tool_set_hash, kb_revision, compiled)
+        return compiled
+
+    @staticmethod
+    async def _compile_prompt(include_sample_response: bool, agent_config: Optional[dict],
+                              mcp_wrapper_instance: Optional[MCPToolWrapper], mcp_enabled: bool,
+                              client=None) -> Tuple[Dict[str, str], bool]:
+        """Build the base prompt with knowledge base and MCP sections.
+
+        Returns:
+            The compiled sections, and whether they are complete enough to cache
+        """
+        cacheable = True
+
         # Continue with normal system prompt logic
         default_system_content = get_system_prompt('agent')
         logger.info(f"PROMPT DEBUG: Using agent mode, Prompt length={len(default_system_content)}")
         logger.debug(f"PromptManager: Using agent mode, Default system content length={len(default_system_content)}")
         
-        if "anthropic" not in model_name.lower():
+        if include_sample_response:
             sample_response_path = os.path.join(os.path.dirname(__file__), 'sample_responses/1.txt')
             with open(sample_response_path, 'r') as file:
                 sample_response = file.read()
@@ -276,7 +332,7 @@ class PromptManager:
         else:
             system_content = default_system_content
             logger.debug(f"PromptManager: No agent config, using default system prompt")
-        
+
         # Add agent knowledge base context if available
         if client and agent_config and agent_config.get('agent_id'):
             try:
@@ -309,128 +365,11 @@ IMPORTANT: Always reference and utilize the knowledge base information above whe
                     
             except Exception as e:
                 logger.error(f"Error retrieving knowledge base context for agent {agent_config.get('agent_id', 'unknown')}: {e}")
-                # Continue without knowledge base context rather than failing
-        
-        # Add smart user DAGAD context and user personalization if available
-        if client and thread_id:
-            try:
-                # --- Fetch recent thread context for DAGAD ---
-                account_id = await get_account_id_from_thread(client, thread_id)
-                # Build small recent thread context for relevance
-                messages_result = await client.table('messages').select('content').eq('thread_id', thread_id).order('created_at', desc=True).limit(5).execute()
-                context_parts: List[str] = []
-                for m in messages_result.data or []:
-                    content = m.get('content', '')
-                    if isinstance(content, dict):
-                        content = content.get('content', '')
-                    if content:
-                        context_parts.append(str(content)[:200])
-                thread_context_str = ' '.join(context_parts)
-
-                # --- Add smart user DAGAD context ---
-                if account_id and user_input:
-                    dagad_result = await client.rpc('get_smart_user_dagad_context', {
-                        'p_user_id': account_id,
-                        'p_user_input': user_input,
-                        'p_thread_context': thread_context_str,
-                        'p_max_tokens': 2000
-                    }).execute()
-
-                    if dagad_result.data and isinstance(dagad_result.data, str) and dagad_result.data.strip():
-                        dagad_section = f"""
-
-=== USER PREFERENCES & INSTRUCTIONS ===
-{dagad_result.data}
-=== END USER PREFERENCES & INSTRUCTIONS ===
-"""
-                        system_content += dagad_section
-                    else:
-                        logger.debug("No relevant DAGAD context for this turn")
-                else:
-                    logger.debug("DAGAD context skipped (no account_id or user_input)")
-
-                # --- Add user personalization ---
-                if account_id:
-                    result = await (
-                        client
-                            .table('user_personalization')
-                            .select('preferred_name, occupation, profile, vibe, custom_touch')
-                            .eq('user_id', account_id)
-                            .maybe_single()
-                            .execute()
-                    )
-
-                    pdata = result.data if result and hasattr(result, 'data') else None
-                    if pdata:
-                        preferred_name = (pdata.get('preferred_name') or '').strip()
-                        occupation = (pdata.get('occupation') or '').strip()
-                        profile_text = (pdata.get('profile') or '').strip()
-                        vibe = (pdata.get('vibe') or '').strip()
-                        custom_touch = (pdata.get('custom_touch') or '').strip()
-
-                        # Skip empty section if all fields are blank
-                        if any([preferred_name, occupation, profile_text, vibe, custom_touch]):
-                            personalization_section = "\n\n=== USER PERSONALIZATION ===\n"
-
-                            # Add user identification
-                            if preferred_name:
-                                personalization_section += f"Preferred name: {preferred_name}\n"
-
-                            # Add professional context
-                            if occupation:
-                                personalization_section += f"Occupation: {occupation}\n"
-
-                            # Add user profile/bio
-                            if profile_text:
-                                personalization_section += f"Profile: {profile_text}\n"
-
-                            # Add traits with specific handling instructions
-                            if vibe:
-                                personalization_section += f"Traits: {vibe}\n"
-
-                            # Add custom instructions as explicit rules
-                            if custom_touch:
-                                personalization_section += f"Custom instructions: {custom_touch}\n"
-
-                            # Comprehensive trait-based response adaptation
-                            personalization_section += """
-=== TRAIT-BASED RESPONSE ADAPTATION ===
-CRITICAL: Adapt your responses based on the user's traits and personalization. Use the preferred name to address the user directly. Tailor examples and domain context based on occupation and profile. Apply custom instructions as explicit rules for response generation.
-
-TRAIT HANDLING EXAMPLES:
-- Chatty → Give friendly, conversational replies that feel like a natural chat; include relevant details, context, and examples, and keep the tone casual, approachable, and engaging
-- Witty → Respond with clever humor, playful wordplay, and light-hearted observations; keep the tone sharp, engaging, and fun while staying clear and professional
-- Straight Shooting → Keep answers direct, concise, and no-nonsense; focus on actionable steps, key points, or recommendations without extra fluff
-- Encouraging → Respond positively and supportively, highlighting progress, strengths, and potential; motivate the user with constructive feedback and optimism
-- Gen Z → Make responses ultra-playful, hype, and emoji-packed; use modern slang naturally (like "low-key," "vibe check," "no cap," "TBH," "fr," "bet") throughout; keep language casual, snappy, fun, and hyper-relatable; inject energy, excitement, and hype into every reply; make sentences punchy, engaging, and slightly over-the-top while staying clear and easy to understand.
-- Skeptical → Ask thoughtful, probing questions and constructively challenge assumptions; critically evaluate statements, highlight potential flaws or uncertainties, and encourage careful reasoning
-- Traditional → Maintain a formal, respectful, and conventional tone; use polite language, proper grammar, and professional phrasing suitable for business or classical correspondence
-- Forward Thinking → Emphasize innovation, future-oriented ideas, and cutting-edge approaches; explore emerging trends, anticipate challenges, and suggest visionary solutions
-- Poetic → Use creative, expressive language with metaphors, lyrical rhythm, and a touch of elegance; maintain clarity of meaning while showcasing artistic flair
-
-MULTIPLE TRAITS: When multiple traits are selected, blend them smoothly and naturally. For example:
-- Witty + Straight Shooting → Clever but concise responses
-- Encouraging + Gen Z → Supportive with modern, upbeat language
-- Traditional + Forward Thinking → Respectful tone while discussing innovation
+                # Continue without knowledge base context rather than failing, but don't cache the result
+                cacheable = False
 
-RESPONSE ADAPTATION RULES:
-1. Always use the preferred name when addressing the user
-2. Incorporate occupation-specific examples and domain knowledge
-3. Reference profile information to provide relevant context
-4. Follow custom instructions as explicit behavioral rules
-5. Adjust tone, style, and detail level based on traits
-6. Blend multiple traits harmoniously when present
-7. Ensure every response feels personally tailored to this user
-
-Remember: Every response should feel like it was crafted specifically for this individual user, taking into account their personality, professional background, and communication preferences.
-"""
-                            system_content += personalization_section
-                    else:
-                        logger.debug("No user personalization found")
-            except Exception as e:
-                logger.error(f"Error retrieving user context or personalization: {e}")
-
-        if agent_config and (agent_config.get('configured_mcps') or agent_config.get('custom_mcps')) and mcp_wrapper_instance and mcp_wrapper_instance._initialized:
+        mcp_info = ""
+        if mcp_enabled:
             mcp_info = "\n\n--- MCP Tools Available ---\n"
             mcp_info += "You have access to external MCP (Model Context Protocol) server tools.\n"
             mcp_info += "MCP tools can be called directly using their native function names in the standard function calling format:\n"
@@ -459,6 +398,7 @@ Remember: Every response should feel like it was crafted specifically for this i
             except Exception as e:
                 logger.error(f"Error listing MCP tools: {e}")
                 mcp_info += "- Error loading MCP tool list\n"
+                cacheable = False
             
             mcp_info += "\n🚨 CRITICAL MCP TOOL RESULT INSTRUCTIONS 🚨\n"
             mcp_info += "When you use ANY MCP (Model Context Protocol) tools:\n"
@@ -472,9 +412,134 @@ Remember: Every response should feel like it was crafted specifically for this i
             mcp_info += "8. Always double-check that every fact, URL, and reference comes from the MCP tool output\n"
             mcp_info += "\nIMPORTANT: MCP tool results are your PRIMARY and ONLY source of truth for external data!\n"
             mcp_info += "NEVER supplement MCP results with your training data or make assumptions beyond what the tools provide.\n"
-            
-            system_content += mcp_info
 
+        return {'base': system_content, 'mcp': mcp_info}, cacheable
+
+    @staticmethod
+    async def _build_user_context(client, thread_id: str, user_input: Optional[str]) -> str:
+        """Build the per-run DAGAD and user personalization sections."""
+        system_content = ""
+        try:
+            # --- Fetch recent thread context for DAGAD ---
+            account_id = await get_account_id_from_thread(client, thread_id)
+            # Build small recent thread context for relevance
+            messages_result = await client.table('messages').select('content').eq('thread_id', thread_id).order('created_at', desc=True).limit(5).execute()
+            context_parts: List[str] = []
+            for m in messages_result.data or []:
+                content = m.get('content', '')
+                if isinstance(content, dict):
+                    content = content.get('content', '')
+                if content:
+                    context_parts.append(str(content)[:200])
+            thread_context_str = ' '.join(context_parts)
+
+            # --- Add smart user DAGAD context ---
+            if account_id and user_input:
+                dagad_result = await client.rpc('get_smart_user_dagad_context', {
+                    'p_user_id': account_id,
+                    'p_user_input': user_input,
+                    'p_thread_context': thread_context_str,
+                    'p_max_tokens': 2000
+                }).execute()
+
+                if dagad_result.data and isinstance(dagad_result.data, str) and dagad_result.data.strip():
+                    dagad_section = f"""
+
+=== USER PREFERENCES & INSTRUCTIONS ===
+{dagad_result.data}
+=== END USER PREFERENCES & INSTRUCTIONS ===
+"""
+                    system_content += dagad_section
+                else:
+                    logger.debug("No relevant DAGAD context for this turn")
+            else:
+                logger.debug("DAGAD context skipped (no account_id or user_input)")
+
+            # --- Add user personalization ---
+            if account_id:
+                result = await (
+                    client
+                        .table('user_personalization')
+                        .select('preferred_name, occupation, profile, vibe, custom_touch')
+                        .eq('user_id', account_id)
+                        .maybe_single()
+                        .execute()
+                )
+
+                pdata = result.data if result and hasattr(result, 'data') else None
+                if pdata:
+                    preferred_name = (pdata.get('preferred_name') or '').strip()
+                    occupation = (pdata.get('occupation') or '').strip()
+                    profile_text = (pdata.get('profile') or '').strip()
+                    vibe = (pdata.get('vibe') or '').strip()
+                    custom_touch = (pdata.get('custom_touch') or '').strip()
+
+                    # Skip empty section if all fields are blank
+                    if any([preferred_name, occupation, profile_text, vibe, custom_touch]):
+                        personalization_section = "\n\n=== USER PERSONALIZATION ===\n"
+
+                        # Add user identification
+                        if preferred_name:
+                            personalization_section += f"Preferred name: {preferred_name}\n"
+
+                        # Add professional context
+                        if occupation:
+                            personalization_section += f"Occupation: {occupation}\n"
+
+                        # Add user profile/bio
+                        if profile_text:
+                            personalization_section += f"Profile: {profile_text}\n"
+
+                        # Add traits with specific handling instructions
+                        if vibe:
+                            personalization_section += f"Traits: {vibe}\n"
+
+                        # Add custom instructions as explicit rules
+                        if custom_touch:
+                            personalization_section += f"Custom instructions: {custom_touch}\n"
+
+                        # Comprehensive trait-based response adaptation
+                        personalization_section += """
+=== TRAIT-BASED RESPONSE ADAPTATION ===
+CRITICAL: Adapt your responses based on the user's traits and personalization. Use the preferred name to address the user directly. Tailor examples and domain context based on occupation and profile. Apply custom instructions as explicit rules for response generation.
+
+TRAIT HANDLING EXAMPLES:
+- Chatty → Give friendly, conversational replies that feel like a natural chat; include relevant details, context, and examples, and keep the tone casual, approachable, and engaging
+- Witty → Respond with clever humor, playful wordplay, and light-hearted observations; keep the tone sharp, engaging, and fun while staying clear and professional
+- Straight Shooting → Keep answers direct, concise, and no-nonsense; focus on actionable steps, key points, or recommendations without extra fluff
+- Encouraging → Respond positively and supportively, highlighting progress, strengths, and potential; motivate the user with constructive feedback and optimism
+- Gen Z → Make responses ultra-playful, hype, and emoji-packed; use modern slang naturally (like "low-key," "vibe check," "no cap," "TBH," "fr," "bet") throughout; keep language casual, snappy, fun, and hyper-relatable; inject energy, excitement, and hype into every reply; make sentences punchy, engaging, and slightly over-the-top while staying clear and easy to understand.
+- Skeptical → Ask thoughtful, probing questions and constructively challenge assumptions; critically evaluate statements, highlight potential flaws or uncertainties, and encourage careful reasoning
+- Traditional → Maintain a formal, respectful, and conventional tone; use polite language, proper grammar, and professional phrasing suitable for business or classical correspondence
+- Forward Thinking → Emphasize innovation, future-oriented ideas, and cutting-edge approaches; explore emerging trends, anticipate challenges, and suggest visionary solutions
+- Poetic → Use creative, expressive language with metaphors, lyrical rhythm, and a touch of elegance; maintain clarity of meaning while showcasing artistic flair
+
+MULTIPLE TRAITS: When multiple traits are selected, blend them smoothly and naturally. For example:
+- Witty + Straight Shooting → Clever but concise responses
+- Encouraging + Gen Z → Supportive with modern, upbeat language
+- Traditional + Forward Thinking → Respectful tone while discussing innovation
+
+RESPONSE ADAPTATION RULES:
+1. Always use the preferred name when addressing the user
+2. Incorporate occupation-specific examples and domain knowledge
+3. Reference profile information to provide relevant context
+4. Follow custom instructions as explicit behavioral rules
+5. Adjust tone, style, and detail level based on traits
+6. Blend multiple traits harmoniously when present
+7. Ensure every response feels personally tailored to this user
+
+Remember: Every response should feel like it was crafted specifically for this individual user, taking into account their personality, professional background, and communication preferences.
+"""
+                        system_content += personalization_section
+                else:
+                    logger.debug("No user personalization found")
+        except Exception as e:
+            logger.error(f"Error retrieving user context or personalization: {e}")
+
+        return system_content
+
+    @staticmethod
+    def _build_datetime_info() -> str:
         now = datetime.datetime.now(datetime.timezone.utc)
         datetime_info = f"\n\n=== CURRENT DATE/TIME INFORMATION ===\n"
         datetime_info += f"Today's date: {now.strftime('%A, %B %d, %Y')}\n"
@@ -483,10 +548,8 @@ Remember: Every response should feel like it was crafted specifically for this i
         datetime_info += f"Current month: {now.strftime('%B')}\n"
         datetime_info += f"Current day: {now.strftime('%A')}\n"
         datetime_info += "Use this information for any time-sensitive tasks, research, or when current date/time context is needed.\n"
-        
-        system_content += datetime_info
 
-        return {"role": "system", "content": system_content}
+        return datetime_info
 
 
 class MessageManager:
@@ -879,5 +942,14 @@ async def run_agent(
     )
     
     runner = AgentRunner(config)
-    async for chunk in runner.run():
-        yield chunk
\ No newline at end of file
+    try:
+        async for chunk in runner.run():
+            yield chunk
+    finally:
+        # Persist buffered status and tool messages, including when the run is stopped early
+        thread_manager = getattr(runner, 'thread_manager', None)
+        if thread_manager:
+            try:
+                await thread_manager.message_sink.close()
+            except Exception as e:
+                logger.error(f"Failed to flush buffered messages for thread {thread_id}: {str(e)}", exc_info=True)
\ No newline at end of file
@@ -86,7 +86,7 @@ class WorkflowTool(AgentBuilderBaseTool):
             
             tool_mapping = {
                 'sb_shell_tool': ['execute_command'],
-                'sb_files_tool': ['create_file', 'edit_file', 'str_replace', 'full_file_rewrite', 'delete_file'],
+                'sb_files_tool': ['create_file', 'edit_file', 'str_replace', 'full_file_rewrite', 'batch_file_operations', 'delete_file'],
                 'browser_tool': ['browser_navigate_to', 'browser_screenshot'],
                 'sb_vision_tool': ['see_image'],
                 'sb_deploy_tool': ['deploy'],
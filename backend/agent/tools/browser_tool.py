@@ -1,4 +1,4 @@
-from agentpress.tool import ToolResult, openapi_schema, usage_example
+from agentpress.tool import ToolResult, openapi_schema, usage_example, execution_policy
 from agentpress.thread_manager import ThreadManager
 from sandbox.tool_base import SandboxToolsBase
 from utils.logger import logger
@@ -11,6 +11,7 @@ import traceback
 from PIL import Image
 from utils.config import config
 
+@execution_policy(resources=["browser"])
 class BrowserTool(SandboxToolsBase):
     """
     Browser Tool for browser automation using local Stagehand API.
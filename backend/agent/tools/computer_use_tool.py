@@ -7,7 +7,7 @@ import logging
 from typing import Optional, Dict
 import os
 
-from agentpress.tool import Tool, ToolResult, openapi_schema, usage_example
+from agentpress.tool import Tool, ToolResult, openapi_schema, usage_example, execution_policy
 from sandbox.tool_base import SandboxToolsBase
 from daytona_sdk import AsyncSandbox
 
@@ -23,6 +23,7 @@ KEYBOARD_KEYS = [
     'alt+tab', 'alt+f4', 'ctrl+alt+delete'
 ]
 
+@execution_policy(resources=["computer"])
 class ComputerUseTool(SandboxToolsBase):
     """Computer automation tool for controlling the sandbox browser and GUI."""
     
@@ -42,8 +43,7 @@ class ComputerUseTool(SandboxToolsBase):
         if not self._url_initialized:
             await self._ensure_sandbox()
             # Get automation service URL using port 8000
-            preview_link = await self.sandbox.get_preview_link(8000)
-            self.api_base_url = preview_link.url if hasattr(preview_link, 'url') else str(preview_link)
+            self.api_base_url = await self.get_preview_url(8000)
             self._url_initialized = True
             logging.info(f"Initialized Computer Use Tool with API URL: {self.api_base_url}")
     
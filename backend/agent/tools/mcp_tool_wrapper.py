@@ -11,6 +11,7 @@ from agent.tools.utils.mcp_connection_manager import MCPConnectionManager
 from agent.tools.utils.custom_mcp_handler import CustomMCPHandler
 from agent.tools.utils.dynamic_tool_builder import DynamicToolBuilder
 from agent.tools.utils.mcp_tool_executor import MCPToolExecutor
+from agent.tools.utils.mcp_credentials import MCPCredentialResolver
 from services import redis as redis_service
 
 
@@ -119,7 +120,9 @@ class MCPToolWrapper(Tool):
         self.use_cache = use_cache
         
         self.connection_manager = MCPConnectionManager()
-        self.custom_handler = CustomMCPHandler(self.connection_manager)
+        # Shared by discovery and execution so credentials are resolved once per run
+        self.credentials = MCPCredentialResolver()
+        self.custom_handler = CustomMCPHandler(self.connection_manager, self.credentials)
         self.tool_builder = DynamicToolBuilder()
         self.tool_executor = None
         
@@ -246,7 +249,7 @@ class MCPToolWrapper(Tool):
             
             self._custom_tools = custom_tools
             
-            self.tool_executor = MCPToolExecutor(custom_tools, self)
+            self.tool_executor = MCPToolExecutor(custom_tools, self, self.credentials)
             
             dynamic_methods = self.tool_builder.create_dynamic_methods(
                 available_tools, 
@@ -73,11 +73,8 @@ class SandboxExposeTool(SandboxToolsBase):
                     # If we can't check, proceed anyway - the user might be starting a service
                     pass
 
-            # Get the preview link for the specified port
-            preview_link = await self.sandbox.get_preview_link(port)
-            
-            # Extract the actual URL from the preview link object
-            url = preview_link.url if hasattr(preview_link, 'url') else str(preview_link)
+            # Get the preview URL for the specified port
+            url = await self.get_preview_url(port)
             
             return self.success_response({
                 "url": url,
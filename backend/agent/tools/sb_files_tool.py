@@ -1,5 +1,7 @@
-from agentpress.tool import ToolResult, openapi_schema, usage_example
+from agentpress.tool import ToolResult, openapi_schema, usage_example, execution_policy
 from sandbox.tool_base import SandboxToolsBase
+from sandbox.bulk_files import MAX_BATCH_FILES, FileWrite, download_files, file_modes, write_files
+from sandbox.workspace_manifest import WorkspaceTracker
 from utils.files_utils import should_exclude_file, clean_path
 from agentpress.thread_manager import ThreadManager
 from utils.logger import logger
@@ -17,6 +19,7 @@ class SandboxFilesTool(SandboxToolsBase):
         super().__init__(project_id, thread_manager)
         self.SNIPPET_LINES = 4  # Number of context lines to show around edits
         self.workspace_path = "/workspace"  # Ensure we're always operating in /workspace
+        self._workspace_tracker = WorkspaceTracker(self.workspace_path)
 
     def clean_path(self, path: str) -> str:
         """Clean and normalize a path to be relative to /workspace"""
@@ -35,38 +38,36 @@ class SandboxFilesTool(SandboxToolsBase):
             return False
 
     async def get_workspace_state(self) -> dict:
-        """Get the current workspace state by reading all files"""
-        files_state = {}
+        """Get the current workspace state, downloading only files changed since the last call"""
         try:
             # Ensure sandbox is initialized
             await self._ensure_sandbox()
-            
-            files = await self.sandbox.fs.list_files(self.workspace_path)
-            for file_info in files:
-                rel_path = file_info.name
-                
-                # Skip excluded files and directories
-                if self._should_exclude_file(rel_path) or file_info.is_dir:
-                    continue
+            return await self._workspace_tracker.state(self.sandbox)
+        
+        except Exception as e:
+            logger.error(f"Error getting workspace state: {str(e)}")
+            return {}
 
-                try:
-                    full_path = f"{self.workspace_path}/{rel_path}"
-                    content = (await self.sandbox.fs.download_file(full_path)).decode()
-                    files_state[rel_path] = {
-                        "content": content,
-                        "is_dir": file_info.is_dir,
-                        "size": file_info.size,
-                        "modified": file_info.mod_time
-                    }
-                except Exception as e:
-                    print(f"Error reading file {rel_path}: {e}")
-                except UnicodeDecodeError:
-                    print(f"Skipping binary file: {rel_path}")
+    async def get_workspace_changes(self) -> dict:
+        """Get the files added, modified or deleted since the last workspace snapshot, without their contents"""
+        try:
+            # Ensure sandbox is initialized
+            await self._ensure_sandbox()
+            changed, deleted = await self._workspace_tracker.changes(self.sandbox)
+            return {"changed": changed, "deleted": deleted}
+
+        except Exception as e:
+            logger.error(f"Error getting workspace changes: {str(e)}")
+            return {"changed": {}, "deleted": []}
+
+    async def get_workspace_file_contents(self, paths: list) -> dict:
+        """Get the contents of text files from the last workspace snapshot, e.g. those reported as changed"""
+        try:
+            await self._ensure_sandbox()
+            return await self._workspace_tracker.read(self.sandbox, paths)
 
-            return files_state
-        
         except Exception as e:
-            print(f"Error getting workspace state: {str(e)}")
+            logger.error(f"Error reading workspace files: {str(e)}")
             return {}
 
 
@@ -76,6 +77,7 @@ class SandboxFilesTool(SandboxToolsBase):
     #         return f"{self._sandbox_url}/{(file_path.replace('/workspace/', ''))}"
     #     return None
 
+    @execution_policy(resources=["workspace", "file:{file_path}"])
     @openapi_schema({
         "type": "function",
         "function": {
@@ -145,8 +147,7 @@ class SandboxFilesTool(SandboxToolsBase):
             # Check if index.html was created and add 8080 server info (only in root workspace)
             if file_path.lower() == 'index.html':
                 try:
-                    website_link = await self.sandbox.get_preview_link(8080)
-                    website_url = website_link.url if hasattr(website_link, 'url') else str(website_link).split("url='")[1].split("'")[0]
+                    website_url = await self.get_preview_url(8080)
                     message += f"\n\n[Auto-detected index.html - HTTP server available at: {website_url}]"
                     message += "\n[Note: Use the provided HTTP server URL above instead of starting a new server]"
                 except Exception as e:
@@ -156,6 +157,7 @@ class SandboxFilesTool(SandboxToolsBase):
         except Exception as e:
             return self.fail_response(f"Error creating file: {str(e)}")
 
+    @execution_policy(resources=["workspace", "file:{file_path}"])
     @openapi_schema({
         "type": "function",
         "function": {
@@ -232,6 +234,7 @@ class SandboxFilesTool(SandboxToolsBase):
         except Exception as e:
             return self.fail_response(f"Error replacing string: {str(e)}")
 
+    @execution_policy(resources=["workspace", "file:{file_path}"])
     @openapi_schema({
         "type": "function",
         "function": {
@@ -289,8 +292,7 @@ class SandboxFilesTool(SandboxToolsBase):
             # Check if index.html was rewritten and add 8080 server info (only in root workspace)
             if file_path.lower() == 'index.html':
                 try:
-                    website_link = await self.sandbox.get_preview_link(8080)
-                    website_url = website_link.url if hasattr(website_link, 'url') else str(website_link).split("url='")[1].split("'")[0]
+                    website_url = await self.get_preview_url(8080)
                     message += f"\n\n[Auto-detected index.html - HTTP server available at: {website_url}]"
                     message += "\n[Note: Use the provided HTTP server URL above instead of starting a new server]"
                 except Exception as e:
@@ -300,6 +302,173 @@ class SandboxFilesTool(SandboxToolsBase):
         except Exception as e:
             return self.fail_response(f"Error rewriting file: {str(e)}")
 
+    # A batch may touch any file, so it holds the whole workspace like every single-file operation does
+    @execution_policy(resources=["workspace"])
+    @openapi_schema({
+        "type": "function",
+        "function": {
+            "name": "batch_file_operations",
+            "description": "Create, rewrite or edit many files in one call. Much faster than calling create_file, full_file_rewrite or str_replace once per file, e.g. when scaffolding a project. Operations run in order, so a file created earlier in the batch can be edited later in it. Each operation succeeds or fails on its own and the result lists the outcome per file. Paths must be relative to /workspace.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "operations": {
+                        "type": "array",
+                        "description": f"Operations to apply, at most {MAX_BATCH_FILES}",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "action": {
+                                    "type": "string",
+                                    "enum": ["create", "rewrite", "str_replace"],
+                                    "description": "create a new file, rewrite an existing file, or replace a unique string in a file"
+                                },
+                                "file_path": {
+                                    "type": "string",
+                                    "description": "Path to the file, relative to /workspace (e.g., 'src/main.py')"
+                                },
+                                "file_contents": {
+                                    "type": "string",
+                                    "description": "Content of the file, for create and rewrite"
+                                },
+                                "old_str": {
+                                    "type": "string",
+                                    "description": "Text to be replaced (must appear exactly once), for str_replace"
+                                },
+                                "new_str": {
+                                    "type": "string",
+                                    "description": "Replacement text, for str_replace"
+                                },
+                                "permissions": {
+                                    "type": "string",
+                                    "description": "File permissions in octal format for create and rewrite (e.g., '644')",
+                                    "default": "644"
+                                }
+                            },
+                            "required": ["action", "file_path"]
+                        }
+                    }
+                },
+                "required": ["operations"]
+            }
+        }
+    })
+    @usage_example('''
+        <function_calls>
+        <invoke name="batch_file_operations">
+        <parameter name="operations">[
+            {"action": "create", "file_path": "src/index.html", "file_contents": "<!DOCTYPE html>\\n<html>...</html>"},
+            {"action": "create", "file_path": "src/styles.css", "file_contents": "body { margin: 0; }"},
+            {"action": "str_replace", "file_path": "README.md", "old_str": "TODO", "new_str": "Done"}
+        ]</parameter>
+        </invoke>
+        </function_calls>
+        ''')
+    async def batch_file_operations(self, operations: list) -> ToolResult:
+        try:
+            if isinstance(operations, str):
+                operations = json.loads(operations)
+            if not isinstance(operations, list) or not operations:
+                return self.fail_response("operations must be a non-empty list")
+            if len(operations) > MAX_BATCH_FILES:
+                return self.fail_response(f"At most {MAX_BATCH_FILES} operations are allowed per batch")
+
+            # Ensure sandbox is initialized
+            await self._ensure_sandbox()
+
+            paths = [self.clean_path(op.get("file_path") or "") if isinstance(op, dict) else "" for op in operations]
+            modes = await file_modes(self.sandbox, sorted(set(p for p in paths if p)), self.workspace_path)
+            edited = sorted(set(
+                path for op, path in zip(operations, paths)
+                if path and isinstance(op, dict) and op.get("action") == "str_replace" and path in modes
+            ))
+            downloaded = await download_files(self.sandbox, edited, self.workspace_path)
+
+            # Pending content and permissions of each file, updated as operations apply in order
+            contents = {}
+            permissions = dict(modes)
+            errors = []
+            for op, path in zip(operations, paths):
+                errors.append(self._apply_batch_operation(op, path, contents, permissions, modes, downloaded))
+
+            writes = [FileWrite(path, content.encode(), permissions[path]) for path, content in contents.items()]
+            write_results = {result.path: result for result in await write_files(self.sandbox, writes, self.workspace_path)}
+
+            results = []
+            for op, path, error in zip(operations, paths, errors):
+                if error is None and not write_results[path].success:
+                    error = write_results[path].error
+                result = {"file_path": path or (op.get("file_path") if isinstance(op, dict) else None), "success": error is None}
+                if error is not None:
+                    result["error"] = error
+                results.append(result)
+
+            succeeded = sum(1 for result in results if result["success"])
+            response = {
+                "message": f"{succeeded} of {len(results)} file operations succeeded.",
+                "results": results
+            }
+            if "index.html" in write_results and write_results["index.html"].success:
+                try:
+                    response["website_url"] = await self.get_preview_url(8080)
+                    response["note"] = "index.html is served by the HTTP server at website_url, use it instead of starting a new server"
+                except Exception as e:
+                    logger.warning(f"Failed to get website URL for index.html: {str(e)}")
+
+            return self.success_response(response)
+        except Exception as e:
+            return self.fail_response(f"Error applying file operations: {str(e)}")
+
+    def _apply_batch_operation(self, op, path: str, contents: dict, permissions: dict, modes: dict, downloaded: dict) -> Optional[str]:
+        """Apply one batch operation to the pending contents, returning an error message if it fails."""
+        if not isinstance(op, dict) or not path:
+            return "Each operation needs an action and a file_path"
+        action = op.get("action")
+        exists = path in contents or path in modes
+
+        if action in ("create", "rewrite"):
+            if action == "create" and exists:
+                return f"File '{path}' already exists. Use rewrite to replace it."
+            if action == "rewrite" and not exists:
+                return f"File '{path}' does not exist. Use create to create a new file."
+            file_contents = op.get("file_contents")
+            if file_contents is None:
+                return "file_contents is required"
+            # convert to json string if file_contents is a dict
+            if isinstance(file_contents, dict):
+                file_contents = json.dumps(file_contents, indent=4)
+            contents[path] = file_contents
+            permissions[path] = str(op.get("permissions") or "644")
+            return None
+
+        if action == "str_replace":
+            if not exists:
+                return f"File '{path}' does not exist"
+            if path not in contents:
+                content = downloaded.get(path)
+                if isinstance(content, Exception) or content is None:
+                    return f"Error reading file: {str(content)}"
+                try:
+                    content = content.decode()
+                except UnicodeDecodeError:
+                    return f"File '{path}' is not a text file"
+            else:
+                content = contents[path]
+            old_str = (op.get("old_str") or "").expandtabs()
+            new_str = (op.get("new_str") or "").expandtabs()
+            if not old_str:
+                return "old_str is required"
+            occurrences = content.count(old_str)
+            if occurrences == 0:
+                return f"String '{old_str}' not found in file"
+            if occurrences > 1:
+                lines = [i+1 for i, line in enumerate(content.split('\n')) if old_str in line]
+                return f"Multiple occurrences found in lines {lines}. Please ensure string is unique"
+            contents[path] = content.replace(old_str, new_str)
+            return None
+
+        return f"Unknown action '{action}'"
+
     async def _call_gemini_25_pro_api(self, file_content: str, code_edit: str, instructions: str, file_path: str) -> tuple[Optional[str], Optional[str]]:
         """
         Call Vertex AI Gemini 2.5 Pro via LiteLLM to apply edits to file content.
@@ -389,6 +558,7 @@ class SandboxFilesTool(SandboxToolsBase):
             logger.error(f"Error calling Vertex AI Gemini 2.5 Pro: {error_message}", exc_info=True)
             return None, error_message
 
+    @execution_policy(resources=["workspace", "file:{target_file}"])
     @openapi_schema({
         "type": "function",
         "function": {
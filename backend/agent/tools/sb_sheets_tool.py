@@ -8,9 +8,17 @@ from io import BytesIO
 from statistics import mean
 from typing import Any, Dict, List, Optional, Tuple
 
-import chardet
-from agentpress.tool import ToolResult, openapi_schema, usage_example
+from agentpress.tool import ToolResult, openapi_schema, usage_example, execution_policy
 from sandbox.tool_base import SandboxToolsBase
+from agent.tools.utils.sheets_engine import (
+    COLUMNAR_MIN_BYTES,
+    COLUMNAR_MIN_ROWS,
+    ColumnarSheet,
+    columnar_available,
+    detect_encoding,
+    iter_csv_rows,
+)
+from agent.tools.utils.sheet_cache import sheet_cache, sheet_cache_key
 from utils.logger import logger
 
 try:
@@ -46,19 +54,47 @@ class SandboxSheetsTool(SandboxToolsBase):
     async def _upload_bytes(self, full_path: str, data: bytes, permissions: str = "644") -> None:
         await self.sandbox.fs.upload_file(data, full_path)
         await self.sandbox.fs.set_file_permissions(full_path, permissions)
+        sheet_cache.invalidate(self.sandbox_id, full_path)
 
-    def _detect_encoding(self, data: bytes) -> str:
+    async def _file_signature(self, full_path: str) -> Optional[Tuple[int, str]]:
+        """Size and modification time of a file, used to validate cached sheets."""
         try:
-            result = chardet.detect(data)
-            return result.get("encoding") or "utf-8"
+            info = await self.sandbox.fs.get_file_info(full_path)
+            return info.size, info.mod_time
         except Exception:
-            return "utf-8"
+            return None
+
+    async def _cache_saved_sheet(self, full_path: str, sheet: SheetData, sheet_name: Optional[str]) -> None:
+        """Cache a sheet the tool just wrote, so the next load of it skips the download and parse."""
+        read_back = self._as_read_back(sheet, full_path.lower().endswith(".csv"))
+        if read_back is None:
+            return
+        signature = await self._file_signature(full_path)
+        sheet_cache.put(sheet_cache_key(self.sandbox_id, full_path, sheet_name), signature, read_back)
+
+    def _as_read_back(self, sheet: SheetData, is_csv: bool) -> Optional[SheetData]:
+        """The sheet as parsing the written file would return it, None if that cannot be predicted."""
+        if not sheet.headers:
+            # Without a header row the first data row would be read back as headers
+            return None
+        if is_csv:
+            return SheetData(
+                headers=["" if h is None else str(h) for h in sheet.headers],
+                rows=[["" if v is None else str(v) for v in r] for r in sheet.rows]
+            )
+        width = max(len(sheet.headers), max((len(r) for r in sheet.rows), default=0))
+        headers = ["" if h is None else str(h) for h in sheet.headers] + [""] * (width - len(sheet.headers))
+        rows = [[None if v == "" else v for v in r] + [None] * (width - len(r)) for r in sheet.rows]
+        # Trailing empty rows are not stored in the workbook
+        while rows and all(v is None for v in rows[-1]):
+            rows.pop()
+        return SheetData(headers=headers, rows=rows)
+
+    def _detect_encoding(self, data: bytes) -> str:
+        return detect_encoding(data)
 
     def _read_csv_bytes(self, data: bytes) -> SheetData:
-        encoding = self._detect_encoding(data)
-        text = data.decode(encoding, errors="replace")
-        reader = csv.reader(io.StringIO(text))
-        rows = [list(r) for r in reader]
+        rows = list(iter_csv_rows(data, self._detect_encoding(data)))
         if not rows:
             return SheetData(headers=[], rows=[])
         headers = [str(h) for h in rows[0]]
@@ -102,25 +138,63 @@ class SandboxSheetsTool(SandboxToolsBase):
         return out.getvalue()
 
     async def _load_sheet(self, file_path: str, sheet_name: Optional[str]) -> Tuple[str, SheetData]:
-        file_path = self.clean_path(file_path)
-        full_path = f"{self.workspace_path}/{file_path}"
-        data = await self._download_bytes(full_path)
+        """Load a sheet, from the sheet cache if the file is unchanged. The result is shared, copy it before modifying it."""
+        return await self._load_cached_sheet(file_path, sheet_name, columnar=False)
+
+    def _parse_sheet(self, file_path: str, data: bytes, sheet_name: Optional[str]) -> SheetData:
         if file_path.lower().endswith(".csv"):
-            return full_path, self._read_csv_bytes(data)
+            return self._read_csv_bytes(data)
         if file_path.lower().endswith(".xlsx"):
-            return full_path, self._read_xlsx_bytes(data, sheet_name)
+            return self._read_xlsx_bytes(data, sheet_name)
         raise ValueError("Unsupported file extension. Use .csv or .xlsx")
 
+    async def _load_columnar_sheet(self, file_path: str, sheet_name: Optional[str]) -> Tuple[str, Any]:
+        """Load a sheet for analysis, as a ColumnarSheet if it is large enough to benefit, else as SheetData."""
+        return await self._load_cached_sheet(file_path, sheet_name, columnar=True)
+
+    async def _load_cached_sheet(self, file_path: str, sheet_name: Optional[str], columnar: bool) -> Tuple[str, Any]:
+        file_path = self.clean_path(file_path)
+        full_path = f"{self.workspace_path}/{file_path}"
+        key = sheet_cache_key(self.sandbox_id, full_path, sheet_name, "columnar" if columnar else "rows")
+        signature = await self._file_signature(full_path)
+        sheet = sheet_cache.get(key, signature)
+        if sheet is None and columnar:
+            # Reuse the row representation if it is cached, e.g. after the tool wrote the sheet
+            rows_sheet = sheet_cache.get(sheet_cache_key(self.sandbox_id, full_path, sheet_name, "rows"), signature)
+            if rows_sheet is not None:
+                sheet = rows_sheet
+                if columnar_available() and len(rows_sheet.rows) >= COLUMNAR_MIN_ROWS:
+                    sheet = ColumnarSheet.from_rows(rows_sheet.headers, rows_sheet.rows)
+                sheet_cache.put(key, signature, sheet)
+        if sheet is None:
+            data = await self._download_bytes(full_path)
+            sheet = self._parse_columnar_sheet(file_path, data, sheet_name) if columnar else self._parse_sheet(file_path, data, sheet_name)
+            sheet_cache.put(key, signature, sheet)
+        return full_path, sheet
+
+    def _parse_columnar_sheet(self, file_path: str, data: bytes, sheet_name: Optional[str]) -> Any:
+        if not columnar_available():
+            return self._parse_sheet(file_path, data, sheet_name)
+        if file_path.lower().endswith(".csv") and len(data) >= COLUMNAR_MIN_BYTES:
+            return ColumnarSheet.from_csv_bytes(data)
+        sheet = self._parse_sheet(file_path, data, sheet_name)
+        if len(sheet.rows) >= COLUMNAR_MIN_ROWS:
+            return ColumnarSheet.from_rows(sheet.headers, sheet.rows)
+        return sheet
+
     async def _save_sheet(self, file_path: str, sheet: SheetData, sheet_name: Optional[str]) -> str:
         file_path = self.clean_path(file_path)
         full_path = f"{self.workspace_path}/{file_path}"
         if file_path.lower().endswith(".csv"):
             await self._upload_bytes(full_path, self._write_csv_bytes(sheet))
+            await self._cache_saved_sheet(full_path, sheet, None)
         elif file_path.lower().endswith(".xlsx"):
             await self._upload_bytes(full_path, self._write_xlsx_bytes(sheet, sheet_name))
+            await self._cache_saved_sheet(full_path, sheet, sheet_name)
             try:
                 csv_full = f"{full_path.rsplit('.', 1)[0]}.csv"
                 await self._upload_bytes(csv_full, self._write_csv_bytes(sheet))
+                await self._cache_saved_sheet(csv_full, sheet, None)
             except Exception as e:
                 logger.warning(f"Failed to write CSV mirror for {full_path}: {e}")
         else:
@@ -161,6 +235,7 @@ class SandboxSheetsTool(SandboxToolsBase):
     def _to_index_map(self, headers: List[str]) -> Dict[str, int]:
         return {h: i for i, h in enumerate(headers)}
 
+    @execution_policy(resources=["workspace"])
     @openapi_schema({
         "type": "function",
         "function": {
@@ -312,15 +387,23 @@ class SandboxSheetsTool(SandboxToolsBase):
 
                 out = BytesIO()
                 wb.save(out)
-                await self._upload_bytes(full_path if not save_as else f"{self.workspace_path}/{self.clean_path(save_as)}", out.getvalue())
+                target_full = full_path if not save_as else f"{self.workspace_path}/{self.clean_path(save_as)}"
+                await self._upload_bytes(target_full, out.getvalue())
+                ws_rows = [list(r) for r in ws.iter_rows(values_only=True)]
+                updated_sheet = SheetData(headers=["" if h is None else str(h) for h in ws_rows[0]] if ws_rows else [], rows=ws_rows[1:])
+                if target_full.lower().endswith(".xlsx") and ws_rows:
+                    # Same as reading the saved workbook back, no need to predict it
+                    signature = await self._file_signature(target_full)
+                    sheet_cache.put(sheet_cache_key(self.sandbox_id, target_full, sheet_name), signature, updated_sheet)
                 try:
-                    csv_full = f"{(full_path if not save_as else f'{self.workspace_path}/{self.clean_path(save_as)}').rsplit('.', 1)[0]}.csv"
+                    csv_full = f"{target_full.rsplit('.', 1)[0]}.csv"
                     from csv import writer as csv_writer
                     csv_buf = io.StringIO()
                     w = csv_writer(csv_buf)
-                    for r in ws.iter_rows(values_only=True):
-                        w.writerow(list(r))
+                    for r in ws_rows:
+                        w.writerow(r)
                     await self._upload_bytes(csv_full, csv_buf.getvalue().encode('utf-8'))
+                    await self._cache_saved_sheet(csv_full, updated_sheet, None)
                 except Exception:
                     pass
 
@@ -328,6 +411,8 @@ class SandboxSheetsTool(SandboxToolsBase):
                 return self.success_response({"updated": f"{self.workspace_path}/{self.clean_path(saved_path)}", "headers": [ws.cell(row=1, column=c).value for c in range(1, (ws.max_column or 0)+1)], "row_count": ws.max_row})
 
             full_path, sheet = await self._load_sheet(file_path, sheet_name)
+            # The loaded sheet may be shared through the sheet cache
+            sheet = SheetData(headers=sheet.headers[:], rows=[list(r) for r in sheet.rows])
 
             headers = sheet.headers[:] or []
             index_map = self._to_index_map(headers) if headers else {}
@@ -430,6 +515,7 @@ class SandboxSheetsTool(SandboxToolsBase):
             logger.exception("update_sheet failed")
             return self.fail_response(f"Error updating sheet: {e}")
 
+    @execution_policy(resources=["workspace"])
     @openapi_schema({
         "type": "function",
         "function": {
@@ -481,6 +567,7 @@ class SandboxSheetsTool(SandboxToolsBase):
             logger.exception("view_sheet failed")
             return self.fail_response(f"Error viewing sheet: {e}")
 
+    @execution_policy(resources=["workspace"])
     @openapi_schema({
         "type": "function",
         "function": {
@@ -518,15 +605,19 @@ class SandboxSheetsTool(SandboxToolsBase):
             if exists and not overwrite:
                 return self.fail_response("File already exists. Set overwrite=true to replace.")
             if rel.lower().endswith(".csv"):
-                await self._upload_bytes(full, self._write_csv_bytes(SheetData(headers or [], rows or [])))
+                sheet = SheetData(headers or [], rows or [])
+                await self._upload_bytes(full, self._write_csv_bytes(sheet))
+                await self._cache_saved_sheet(full, sheet, None)
             elif rel.lower().endswith(".xlsx"):
                 if not openpyxl:
                     return self.fail_response("openpyxl not available to create .xlsx")
                 sheet = SheetData(headers or [], rows or [])
                 await self._upload_bytes(full, self._write_xlsx_bytes(sheet, sheet_name))
+                await self._cache_saved_sheet(full, sheet, sheet_name)
                 try:
                     csv_full = f"{full.rsplit('.', 1)[0]}.csv"
                     await self._upload_bytes(csv_full, self._write_csv_bytes(sheet))
+                    await self._cache_saved_sheet(csv_full, sheet, None)
                 except Exception as e:
                     logger.warning(f"Failed to write CSV mirror for {full}: {e}")
             else:
@@ -536,6 +627,97 @@ class SandboxSheetsTool(SandboxToolsBase):
             logger.exception("create_sheet failed")
             return self.fail_response(f"Error creating sheet: {e}")
 
+    def _analyze_rows(self, sheet: SheetData, target_columns: Optional[List[str]], group_by: Optional[str], aggregations: Optional[List[str]]) -> SheetData:
+        """Row-based analyze_sheet statistics, used for sheets too small for the columnar engine."""
+        headers = sheet.headers
+        idx_map = self._to_index_map(headers)
+
+        def to_float(v: Any) -> Optional[float]:
+            if v is None:
+                return None
+            if isinstance(v, (int, float)):
+                return float(v)
+            try:
+                return float(str(v).strip())
+            except Exception:
+                return None
+
+        numeric_cols = [c for c in (target_columns or headers) if c in idx_map]
+        if group_by and group_by in idx_map:
+            g_idx = idx_map[group_by]
+            groups: Dict[Any, List[List[Any]]] = {}
+            for row in sheet.rows:
+                key = row[g_idx] if len(row) > g_idx else None
+                groups.setdefault(key, []).append(row)
+            out_headers = [group_by]
+            aggs = aggregations or ["count", "sum", "avg", "min", "max"]
+            for col in numeric_cols:
+                for agg in aggs:
+                    out_headers.append(f"{col}_{agg}")
+            summary_rows: List[List[Any]] = []
+            for key, rows in groups.items():
+                row_out = [key]
+                for col in numeric_cols:
+                    c_idx = idx_map[col]
+                    vals = [to_float(r[c_idx]) for r in rows if len(r) > c_idx]
+                    vals = [v for v in vals if v is not None]
+                    count_v = len(vals)
+                    sum_v = sum(vals) if vals else None
+                    avg_v = mean(vals) if vals else None
+                    min_v = min(vals) if vals else None
+                    max_v = max(vals) if vals else None
+                    for agg in aggs:
+                        row_out.append({
+                            "count": count_v,
+                            "sum": sum_v,
+                            "avg": avg_v,
+                            "min": min_v,
+                            "max": max_v
+                        }[agg])
+                summary_rows.append(row_out)
+            result_sheet = SheetData(headers=out_headers, rows=summary_rows)
+        else:
+            out_headers = ["metric"] + numeric_cols
+            rows_out: List[List[Any]] = []
+            counts = []
+            for col in numeric_cols:
+                c_idx = idx_map[col]
+                vals = [to_float(r[c_idx]) for r in sheet.rows if len(r) > c_idx]
+                vals = [v for v in vals if v is not None]
+                counts.append(len(vals))
+            rows_out.append(["count", *counts])
+            sums = []
+            for col in numeric_cols:
+                c_idx = idx_map[col]
+                vals = [to_float(r[c_idx]) for r in sheet.rows if len(r) > c_idx]
+                vals = [v for v in vals if v is not None]
+                sums.append(sum(vals) if vals else None)
+            rows_out.append(["sum", *sums])
+            avgs = []
+            for col in numeric_cols:
+                c_idx = idx_map[col]
+                vals = [to_float(r[c_idx]) for r in sheet.rows if len(r) > c_idx]
+                vals = [v for v in vals if v is not None]
+                avgs.append(mean(vals) if vals else None)
+            rows_out.append(["avg", *avgs])
+            mins = []
+            for col in numeric_cols:
+                c_idx = idx_map[col]
+                vals = [to_float(r[c_idx]) for r in sheet.rows if len(r) > c_idx]
+                vals = [v for v in vals if v is not None]
+                mins.append(min(vals) if vals else None)
+            rows_out.append(["min", *mins])
+            maxs = []
+            for col in numeric_cols:
+                c_idx = idx_map[col]
+                vals = [to_float(r[c_idx]) for r in sheet.rows if len(r) > c_idx]
+                vals = [v for v in vals if v is not None]
+                maxs.append(max(vals) if vals else None)
+            rows_out.append(["max", *maxs])
+            result_sheet = SheetData(headers=out_headers, rows=rows_out)
+        return result_sheet
+
+    @execution_policy(resources=["workspace"])
     @openapi_schema({
         "type": "function",
         "function": {
@@ -568,93 +750,11 @@ class SandboxSheetsTool(SandboxToolsBase):
     async def analyze_sheet(self, file_path: str, sheet_name: Optional[str] = None, target_columns: Optional[List[str]] = None, group_by: Optional[str] = None, aggregations: Optional[List[str]] = None, export_csv_path: Optional[str] = None) -> ToolResult:
         try:
             await self._ensure_sandbox()
-            full_path, sheet = await self._load_sheet(file_path, sheet_name)
-            headers = sheet.headers
-            idx_map = self._to_index_map(headers)
-
-            def to_float(v: Any) -> Optional[float]:
-                if v is None:
-                    return None
-                if isinstance(v, (int, float)):
-                    return float(v)
-                try:
-                    return float(str(v).strip())
-                except Exception:
-                    return None
-
-            numeric_cols = [c for c in (target_columns or headers) if c in idx_map]
-            if group_by and group_by in idx_map:
-                g_idx = idx_map[group_by]
-                groups: Dict[Any, List[List[Any]]] = {}
-                for row in sheet.rows:
-                    key = row[g_idx] if len(row) > g_idx else None
-                    groups.setdefault(key, []).append(row)
-                out_headers = [group_by]
-                aggs = aggregations or ["count", "sum", "avg", "min", "max"]
-                for col in numeric_cols:
-                    for agg in aggs:
-                        out_headers.append(f"{col}_{agg}")
-                summary_rows: List[List[Any]] = []
-                for key, rows in groups.items():
-                    row_out = [key]
-                    for col in numeric_cols:
-                        c_idx = idx_map[col]
-                        vals = [to_float(r[c_idx]) for r in rows if len(r) > c_idx]
-                        vals = [v for v in vals if v is not None]
-                        count_v = len(vals)
-                        sum_v = sum(vals) if vals else None
-                        avg_v = mean(vals) if vals else None
-                        min_v = min(vals) if vals else None
-                        max_v = max(vals) if vals else None
-                        for agg in aggs:
-                            row_out.append({
-                                "count": count_v,
-                                "sum": sum_v,
-                                "avg": avg_v,
-                                "min": min_v,
-                                "max": max_v
-                            }[agg])
-                    summary_rows.append(row_out)
-                result_sheet = SheetData(headers=out_headers, rows=summary_rows)
+            full_path, sheet = await self._load_columnar_sheet(file_path, sheet_name)
+            if isinstance(sheet, ColumnarSheet):
+                result_sheet = SheetData(*sheet.analyze(target_columns, group_by, aggregations))
             else:
-                out_headers = ["metric"] + numeric_cols
-                rows_out: List[List[Any]] = []
-                counts = []
-                for col in numeric_cols:
-                    c_idx = idx_map[col]
-                    vals = [to_float(r[c_idx]) for r in sheet.rows if len(r) > c_idx]
-                    vals = [v for v in vals if v is not None]
-                    counts.append(len(vals))
-                rows_out.append(["count", *counts])
-                sums = []
-                for col in numeric_cols:
-                    c_idx = idx_map[col]
-                    vals = [to_float(r[c_idx]) for r in sheet.rows if len(r) > c_idx]
-                    vals = [v for v in vals if v is not None]
-                    sums.append(sum(vals) if vals else None)
-                rows_out.append(["sum", *sums])
-                avgs = []
-                for col in numeric_cols:
-                    c_idx = idx_map[col]
-                    vals = [to_float(r[c_idx]) for r in sheet.rows if len(r) > c_idx]
-                    vals = [v for v in vals if v is not None]
-                    avgs.append(mean(vals) if vals else None)
-                rows_out.append(["avg", *avgs])
-                mins = []
-                for col in numeric_cols:
-                    c_idx = idx_map[col]
-                    vals = [to_float(r[c_idx]) for r in sheet.rows if len(r) > c_idx]
-                    vals = [v for v in vals if v is not None]
-                    mins.append(min(vals) if vals else None)
-                rows_out.append(["min", *mins])
-                maxs = []
-                for col in numeric_cols:
-                    c_idx = idx_map[col]
-                    vals = [to_float(r[c_idx]) for r in sheet.rows if len(r) > c_idx]
-                    vals = [v for v in vals if v is not None]
-                    maxs.append(max(vals) if vals else None)
-                rows_out.append(["max", *maxs])
-                result_sheet = SheetData(headers=out_headers, rows=rows_out)
+                result_sheet = self._analyze_rows(sheet, target_columns, group_by, aggregations)
 
             exported = None
             if export_csv_path:
@@ -674,6 +774,7 @@ class SandboxSheetsTool(SandboxToolsBase):
             logger.exception("analyze_sheet failed")
             return self.fail_response(f"Error analyzing sheet: {e}")
 
+    @execution_policy(resources=["workspace"])
     @openapi_schema({
         "type": "function",
         "function": {
@@ -807,6 +908,7 @@ class SandboxSheetsTool(SandboxToolsBase):
             logger.exception("visualize_sheet failed")
             return self.fail_response(f"Error visualizing sheet: {e}")
 
+    @execution_policy(resources=["workspace"])
     @openapi_schema({
         "type": "function",
         "function": {
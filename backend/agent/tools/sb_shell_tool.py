@@ -1,12 +1,23 @@
 import asyncio
-from typing import Optional, Dict, Any
+import re
+from typing import Optional, Dict, Any, Tuple
 import time
 import asyncio
 from uuid import uuid4
-from agentpress.tool import ToolResult, openapi_schema, usage_example
+from agentpress.tool import ToolResult, openapi_schema, usage_example, execution_policy
 from sandbox.tool_base import SandboxToolsBase
 from agentpress.thread_manager import ThreadManager
 
+# Output logs and exit codes of blocking commands
+COMMAND_STATE_DIR = "/tmp/.command_state"
+# Longest a single sandbox-side wait for a blocking command may last
+COMPLETION_WAIT_SECONDS = 20
+COMPLETION_POLL_INTERVAL = 0.25
+FALLBACK_POLL_INITIAL_DELAY = 0.5
+FALLBACK_POLL_MAX_DELAY = 5.0
+WAIT_STATUS_PREFIX = "__COMMAND_STATUS__"
+ANSI_ESCAPE_PATTERN = re.compile(r"\x1b\[[0-?]*[ -/]*[@-~]|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)|\x1b[()#][0-9A-Za-z]|\x1b[=>78]")
+
 class SandboxShellTool(SandboxToolsBase):
     """Tool for executing tasks in a Daytona sandbox with browser-use capabilities. 
     Uses sessions for maintaining state between commands and provides comprehensive process management."""
@@ -38,6 +49,7 @@ class SandboxShellTool(SandboxToolsBase):
             except Exception as e:
                 print(f"Warning: Failed to cleanup session {session_name}: {str(e)}")
 
+    @execution_policy(resources=["workspace", "shell_session:{session_name}"])
     @openapi_schema({
         "type": "function",
         "function": {
@@ -133,48 +145,31 @@ class SandboxShellTool(SandboxToolsBase):
             wrapped_command = command.replace('"', '\\"')
             
             if blocking:
-                # For blocking execution, use a more reliable approach
-                # Add a unique marker to detect command completion
-                marker = f"COMMAND_DONE_{str(uuid4())[:8]}"
-                completion_command = self._format_completion_command(command, marker)
+                # Pane output is appended to a log file and the exit code written to a
+                # state file, so completion is detected inside the sandbox and only new
+                # output is transferred
+                state_path = f"{COMMAND_STATE_DIR}/{session_name}_{str(uuid4())[:8]}"
+                await self._execute_raw_command(
+                    f"mkdir -p {COMMAND_STATE_DIR} && : > {state_path}.log && "
+                    f"tmux pipe-pane -t {session_name} -o 'cat >> {state_path}.log'"
+                )
+
+                # $? is escaped so it is expanded by the tmux shell, not when sending the keys
+                completion_command = self._format_completion_command(command, f"echo \\$? > {state_path}.exit")
                 wrapped_completion_command = completion_command.replace('"', '\\"')
-                
-                # Send the command with completion marker
                 await self._execute_raw_command(f'tmux send-keys -t {session_name} "{wrapped_completion_command}" Enter')
-                
-                start_time = time.time()
-                final_output = ""
-                
-                while (time.time() - start_time) < timeout:
-                    # Wait a shorter interval for more responsive checking
-                    await asyncio.sleep(0.5)
-                    
-                    # Check if session still exists (command might have exited)
-                    check_result = await self._execute_raw_command(f"tmux has-session -t {session_name} 2>/dev/null || echo 'ended'")
-                    if "ended" in check_result.get("output", ""):
-                        break
-                        
-                    # Get current output and check for our completion marker
-                    output_result = await self._execute_raw_command(f"tmux capture-pane -t {session_name} -p -S - -E -")
-                    current_output = output_result.get("output", "")
 
-                    if self._is_command_completed(current_output, marker):
-                        final_output = current_output
-                        break
-                
-                # If we didn't get the marker, capture whatever output we have
-                if not final_output:
-                    output_result = await self._execute_raw_command(f"tmux capture-pane -t {session_name} -p -S - -E -")
-                    final_output = output_result.get("output", "")
-                
-                # Kill the session after capture
-                await self._execute_raw_command(f"tmux kill-session -t {session_name}")
+                final_output, exit_code, finished = await self._wait_for_completion(session_name, state_path, timeout)
+
+                # Kill the session and remove the command state
+                await self._execute_raw_command(f"tmux kill-session -t {session_name} 2>/dev/null; rm -f {state_path}.log {state_path}.exit")
                 
                 return self.success_response({
                     "output": final_output,
+                    "exit_code": exit_code,
                     "session_name": session_name,
                     "cwd": cwd,
-                    "completed": True
+                    "completed": finished
                 })
             else:
                 # Send command to tmux session for non-blocking execution
@@ -197,7 +192,80 @@ class SandboxShellTool(SandboxToolsBase):
                     pass
             return self.fail_response(f"Error executing command: {str(e)}")
 
-    async def _execute_raw_command(self, command: str) -> Dict[str, Any]:
+    async def _wait_for_completion(self, session_name: str, state_path: str, timeout: int) -> Tuple[str, Optional[int], bool]:
+        """Wait for a blocking command to finish, collecting its output incrementally.
+
+        Each round trip blocks inside the sandbox until the command's exit code
+        is written, its session ends or COMPLETION_WAIT_SECONDS pass, and returns
+        only the output logged since the previous round trip. If the wait
+        script cannot run, falls back to polling with exponential backoff.
+
+        Returns:
+            Tuple of (output, exit code if known, whether the command finished)
+        """
+        output_parts = []
+        offset = 0
+        backoff = FALLBACK_POLL_INITIAL_DELAY
+        deadline = time.time() + timeout
+
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return self._clean_terminal_output("".join(output_parts)), None, False
+
+            wait_seconds = max(1, int(min(COMPLETION_WAIT_SECONDS, remaining)))
+            result = await self._execute_raw_command(
+                self._completion_wait_script(session_name, state_path, offset, wait_seconds),
+                timeout=wait_seconds + 10
+            )
+            status, size, new_output = self._parse_wait_result(result.get("output", ""))
+
+            if status is None:
+                await asyncio.sleep(min(backoff, remaining))
+                backoff = min(backoff * 2, FALLBACK_POLL_MAX_DELAY)
+                continue
+
+            output_parts.append(new_output)
+            offset = max(offset, size)
+            if status != "running":
+                exit_code = int(status) if status.lstrip("-").isdigit() else None
+                return self._clean_terminal_output("".join(output_parts)), exit_code, True
+
+    def _completion_wait_script(self, session_name: str, state_path: str, offset: int, wait_seconds: int) -> str:
+        """Build the sandbox-side script that waits for completion and prints new output."""
+        iterations = int(wait_seconds / COMPLETION_POLL_INTERVAL)
+        return (
+            f"f={state_path}; n={iterations}; "
+            f"while [ $n -gt 0 ] && [ ! -f $f.exit ] && tmux has-session -t {session_name} 2>/dev/null; "
+            f"do sleep {COMPLETION_POLL_INTERVAL}; n=$((n-1)); done; "
+            # Give pipe-pane a moment to flush the last output after the exit code is written
+            f"if [ -f $f.exit ]; then sleep 0.3; st=$(cat $f.exit); "
+            f"elif tmux has-session -t {session_name} 2>/dev/null; then st=running; else st=ended; fi; "
+            f"size=$(stat -c %s $f.log 2>/dev/null || echo 0); "
+            f"echo \"{WAIT_STATUS_PREFIX} $st $size\"; "
+            f"tail -c +{offset + 1} $f.log 2>/dev/null | head -c $((size - {offset}))"
+        )
+
+    def _parse_wait_result(self, output: str) -> Tuple[Optional[str], int, str]:
+        """Split wait script output into (status, log size, new output); status is None if missing."""
+        output = output or ""
+        start = output.find(WAIT_STATUS_PREFIX)
+        if start == -1:
+            return None, 0, ""
+        line_end = output.find("\n", start)
+        if line_end == -1:
+            line_end = len(output)
+        parts = output[start:line_end].split()
+        if len(parts) != 3 or not parts[2].isdigit():
+            return None, 0, ""
+        return parts[1], int(parts[2]), output[line_end + 1:]
+
+    def _clean_terminal_output(self, output: str) -> str:
+        """Strip terminal escape sequences and carriage returns from raw pane output."""
+        output = ANSI_ESCAPE_PATTERN.sub("", output)
+        return output.replace("\r\n", "\n").replace("\r", "")
+
+    async def _execute_raw_command(self, command: str, timeout: int = 30) -> Dict[str, Any]:
         """Execute a raw command directly in the sandbox."""
         # Ensure session exists for raw commands
         session_id = await self._ensure_session("raw_commands")
@@ -213,7 +281,7 @@ class SandboxShellTool(SandboxToolsBase):
         response = await self.sandbox.process.execute_session_command(
             session_id=session_id,
             req=req,
-            timeout=30  # Short timeout for utility commands
+            timeout=timeout  # Utility commands return at once; completion waits pass COMPLETION_WAIT_SECONDS plus a margin
         )
         
         logs = await self.sandbox.process.get_session_command_logs(
@@ -226,6 +294,7 @@ class SandboxShellTool(SandboxToolsBase):
             "exit_code": response.exit_code
         }
 
+    @execution_policy(resources=["shell_session:{session_name}"])
     @openapi_schema({
         "type": "function",
         "function": {
@@ -297,6 +366,7 @@ class SandboxShellTool(SandboxToolsBase):
         except Exception as e:
             return self.fail_response(f"Error checking command output: {str(e)}")
 
+    @execution_policy(resources=["shell_session:{session_name}"])
     @openapi_schema({
         "type": "function",
         "function": {
@@ -393,97 +463,19 @@ class SandboxShellTool(SandboxToolsBase):
         except Exception as e:
             return self.fail_response(f"Error listing commands: {str(e)}")
 
-    def _format_completion_command(self, command: str, marker: str) -> str:
-        """Format command with completion marker, handling heredocs properly."""
-        import re
-        
+    def _format_completion_command(self, command: str, completion_step: str) -> str:
+        """Append a completion step to a command, handling heredocs properly."""
         # Check if command contains heredoc syntax
         # Look for patterns like: << EOF, << 'EOF', << "EOF", <<EOF
         heredoc_pattern = r'<<\s*[\'"]?\w+[\'"]?'
         
         if re.search(heredoc_pattern, command):
-            # For heredoc commands, add the completion marker on a new line
+            # For heredoc commands, add the completion step on a new line
             # This ensures it executes after the heredoc completes
-            return f"{command}\necho {marker}"
+            return f"{command}\n{completion_step}"
         else:
             # For regular commands, use semicolon separator
-            return f"{command} ; echo {marker}"
-
-    def _is_command_completed(self, current_output: str, marker: str) -> bool:
-        """
-        Check if command execution is completed by comparing marker from end to start.
-        
-        Args:
-            current_output: Current output content
-            marker: Completion marker
-            
-        Returns:
-            bool: True if command completed, False otherwise
-        """
-        if not current_output or not marker:
-            return False
-
-        # Find the last complete marker match position to start comparison
-        # Avoid terminal prompt output at the end
-        marker_end_pos = -1
-        for i in range(len(current_output) - len(marker), -1, -1):
-            if current_output[i:i+len(marker)] == marker:
-                marker_end_pos = i + len(marker) - 1
-                break
-        
-        # Start comparison from found marker position or end of output
-        if marker_end_pos != -1:
-            output_idx = marker_end_pos
-            marker_idx = len(marker) - 1
-        else:
-            output_idx = len(current_output) - 1
-            marker_idx = len(marker) - 1
-        
-        # Compare characters from end to start
-        while marker_idx >= 0 and output_idx >= 0:
-            # Skip newlines in current_output
-            if current_output[output_idx] == '\n':
-                output_idx -= 1
-                continue
-                
-            # Compare characters
-            if current_output[output_idx] != marker[marker_idx]:
-                return False
-                
-            # Continue comparison
-            output_idx -= 1
-            marker_idx -= 1
-        
-        # If marker not fully matched
-        if marker_idx >= 0:
-            return False
-            
-        # Check if preceded by "echo " (command just started)
-        check_count = 0
-        echo_chars = "echo "
-        echo_idx = len(echo_chars) - 1
-        
-        while output_idx >= 0 and check_count < 5:
-            # Skip newlines
-            if current_output[output_idx] == '\n':
-                output_idx -= 1
-                continue
-                
-            check_count += 1
-            
-            # Check for "echo " pattern
-            if echo_idx >= 0 and current_output[output_idx] == echo_chars[echo_idx]:
-                echo_idx -= 1
-            else:
-                echo_idx = len(echo_chars) - 1
-                
-            output_idx -= 1
-            
-        # If "echo " found, command just started
-        if echo_idx < 0:
-            return False
-            
-        return True
+            return f"{command} ; {completion_step}"
 
     async def cleanup(self):
         """Clean up all sessions."""
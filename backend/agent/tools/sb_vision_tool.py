@@ -8,8 +8,16 @@ from urllib.parse import urlparse
 from agentpress.tool import ToolResult, openapi_schema, usage_example
 from sandbox.tool_base import SandboxToolsBase
 from agentpress.thread_manager import ThreadManager
-import json
-import requests
+from agent.tools.utils.image_pipeline import (
+    CompressedImage,
+    compressed_image_key,
+    file_alias_key,
+    image_cache,
+    run_in_image_pool,
+    source_hash,
+)
+from services import http_client
+from services.image_store import store_image
 
 # Add common image MIME types if mimetypes module is limited
 mimetypes.add_type("image/webp", ".webp")
@@ -27,6 +35,8 @@ DEFAULT_MAX_WIDTH = 1920
 DEFAULT_MAX_HEIGHT = 1080
 DEFAULT_JPEG_QUALITY = 85
 DEFAULT_PNG_COMPRESS_LEVEL = 6
+# Part of the cache key of compressed images, so changing a setting invalidates old entries
+COMPRESSION_PARAMS = (DEFAULT_MAX_WIDTH, DEFAULT_MAX_HEIGHT, DEFAULT_JPEG_QUALITY, DEFAULT_PNG_COMPRESS_LEVEL)
 
 class SandboxVisionTool(SandboxToolsBase):
     """Tool for allowing the agent to 'see' images within the sandbox."""
@@ -39,6 +49,8 @@ class SandboxVisionTool(SandboxToolsBase):
 
     def compress_image(self, image_bytes: bytes, mime_type: str, file_path: str) -> Tuple[bytes, str]:
         """Compress an image to reduce its size while maintaining reasonable quality.
+
+        CPU-bound, see_image runs it in the image thread pool.
         
         Args:
             image_bytes: Original image bytes
@@ -106,39 +118,46 @@ class SandboxVisionTool(SandboxToolsBase):
         parsed_url = urlparse(file_path)
         return parsed_url.scheme in ('http', 'https')
     
-    def download_image_from_url(self, url: str) -> Tuple[bytes, str]:
-        """Download image from a URL"""
-        try:
-            headers = {
-                "User-Agent": "Mozilla/5.0"  # Some servers block default Python
-            }
-
-            # HEAD request to get the image size
-            head_response = requests.head(url, timeout=10, headers=headers, stream=True)
-            head_response.raise_for_status()
-            
-            # Check content length
-            content_length = int(head_response.headers.get('Content-Length'))
-            if content_length and content_length > MAX_IMAGE_SIZE:
-                raise Exception(f"Image is too large ({(content_length)/(1024*1024):.2f}MB) for the maximum allowed size of {MAX_IMAGE_SIZE/(1024*1024):.2f}MB")
-            
-            # Download the image
-            response = requests.get(url, timeout=10, headers=headers, stream=True)
+    async def download_image_from_url(self, url: str) -> Tuple[bytes, str]:
+        """Download image from a URL, streaming it so oversized images are cut off early"""
+        headers = {
+            "User-Agent": "Mozilla/5.0"  # Some servers block default Python
+        }
+        async with http_client.stream("GET", url, headers=headers, timeout=10, follow_redirects=True) as response:
             response.raise_for_status()
 
-            image_bytes = response.content
-            if len(image_bytes) > MAX_IMAGE_SIZE:
-                raise Exception(f"Downloaded image is too large ({(len(image_bytes))/(1024*1024):.2f}MB). Maximum allowed size of {MAX_IMAGE_SIZE/(1024*1024):.2f}MB")
+            content_length = response.headers.get('Content-Length')
+            if content_length and content_length.isdigit() and int(content_length) > MAX_IMAGE_SIZE:
+                raise Exception(f"Image is too large ({int(content_length)/(1024*1024):.2f}MB) for the maximum allowed size of {MAX_IMAGE_SIZE/(1024*1024):.2f}MB")
 
             # Get MIME type
-            mime_type = response.headers.get('Content-Type')
-            if not mime_type or not mime_type.startswith('image/'):
-                raise Exception(f"URL does not point to an image (Content-Type: {mime_type}): {url}")
-            
-            return image_bytes, mime_type
-        except Exception as e:
-            return self.fail_response(f"Failed to download image from URL: {str(e)}")
-    
+            mime_type = (response.headers.get('Content-Type') or '').split(';')[0].strip()
+            if not mime_type.startswith('image/'):
+                raise Exception(f"URL does not point to an image (Content-Type: {mime_type or None}): {url}")
+
+            chunks = []
+            downloaded = 0
+            async for chunk in response.aiter_bytes():
+                downloaded += len(chunk)
+                if downloaded > MAX_IMAGE_SIZE:
+                    raise Exception(f"Downloaded image is too large (over {MAX_IMAGE_SIZE/(1024*1024):.2f}MB). Maximum allowed size of {MAX_IMAGE_SIZE/(1024*1024):.2f}MB")
+                chunks.append(chunk)
+
+        return b"".join(chunks), mime_type
+
+    async def _compress_cached(self, image_bytes: bytes, mime_type: str, file_path: str, alias: Optional[str] = None) -> CompressedImage:
+        """Compress an image in the image pool, reusing an earlier result for the same content."""
+        key = compressed_image_key(await run_in_image_pool(source_hash, image_bytes), mime_type, COMPRESSION_PARAMS)
+        image = await image_cache.get(key)
+        if image is None:
+            compressed_bytes, compressed_mime_type = await run_in_image_pool(self.compress_image, image_bytes, mime_type, file_path)
+            image = CompressedImage(compressed_mime_type, base64.b64encode(compressed_bytes).decode('utf-8'), len(compressed_bytes))
+            if image.size <= MAX_COMPRESSED_SIZE:
+                await image_cache.put(key, image, alias)
+        elif alias:
+            await image_cache.put(key, image, alias)
+        return image
+
     @openapi_schema({
         "type": "function",
         "function": {
@@ -177,11 +196,12 @@ class SandboxVisionTool(SandboxToolsBase):
             is_url = self.is_url(file_path)
             if is_url:
                 try:
-                    image_bytes, mime_type = self.download_image_from_url(file_path)
+                    image_bytes, mime_type = await self.download_image_from_url(file_path)
                     original_size = len(image_bytes)
                     cleaned_path = file_path
                 except Exception as e:
                     return self.fail_response(f"Failed to download image from URL: {str(e)}")
+                image = await self._compress_cached(image_bytes, mime_type, cleaned_path)
             else:
                 # Ensure sandbox is initialized
                 await self._ensure_sandbox()
@@ -202,12 +222,6 @@ class SandboxVisionTool(SandboxToolsBase):
                 if file_info.size > MAX_IMAGE_SIZE:
                     return self.fail_response(f"Image file '{cleaned_path}' is too large ({file_info.size / (1024*1024):.2f}MB). Maximum size is {MAX_IMAGE_SIZE / (1024*1024)}MB.")
 
-                # Read image file content
-                try:
-                    image_bytes = await self.sandbox.fs.download_file(full_path)
-                except Exception as e:
-                    return self.fail_response(f"Could not read image file: {cleaned_path}")
-
                 # Determine MIME type
                 mime_type, _ = mimetypes.guess_type(full_path)
                 if not mime_type or not mime_type.startswith('image/'):
@@ -219,28 +233,37 @@ class SandboxVisionTool(SandboxToolsBase):
                     elif ext == '.webp': mime_type = 'image/webp'
                     else:
                         return self.fail_response(f"Unsupported or unknown image format for file: '{cleaned_path}'. Supported: JPG, PNG, GIF, WEBP.")
-                
+
                 original_size = file_info.size
-            
 
-            # Compress the image
-            compressed_bytes, compressed_mime_type = self.compress_image(image_bytes, mime_type, cleaned_path)
-            
-            # Check if compressed image is still too large
-            if len(compressed_bytes) > MAX_COMPRESSED_SIZE:
-                return self.fail_response(f"Image file '{cleaned_path}' is still too large after compression ({len(compressed_bytes) / (1024*1024):.2f}MB). Maximum compressed size is {MAX_COMPRESSED_SIZE / (1024*1024)}MB.")
+                # An unchanged file that was seen before needs neither a download nor compression
+                alias = file_alias_key(self.sandbox_id, full_path, file_info.size, getattr(file_info, 'mod_time', None))
+                image = await image_cache.get_by_alias(alias)
+                if image is None:
+                    # Read image file content
+                    try:
+                        image_bytes = await self.sandbox.fs.download_file(full_path)
+                    except Exception as e:
+                        return self.fail_response(f"Could not read image file: {cleaned_path}")
+                    image = await self._compress_cached(image_bytes, mime_type, cleaned_path, alias)
 
-            # Convert to base64
-            base64_image = base64.b64encode(compressed_bytes).decode('utf-8')
+            # Check if compressed image is still too large
+            if image.size > MAX_COMPRESSED_SIZE:
+                return self.fail_response(f"Image file '{cleaned_path}' is still too large after compression ({image.size / (1024*1024):.2f}MB). Maximum compressed size is {MAX_COMPRESSED_SIZE / (1024*1024)}MB.")
 
             # Prepare the temporary message content
             image_context_data = {
-                "mime_type": compressed_mime_type,
-                "base64": base64_image,
+                "mime_type": image.mime_type,
                 "file_path": cleaned_path, # Include path for context
                 "original_size": original_size,
-                "compressed_size": len(compressed_bytes)
+                "compressed_size": image.size
             }
+            # Reference the stored image instead of inlining it, unless it could not be stored
+            image_path = await store_image(base64.b64decode(image.base64), image.mime_type)
+            if image_path:
+                image_context_data["image_path"] = image_path
+            else:
+                image_context_data["base64"] = image.base64
 
             # Add the temporary message using the thread_manager callback
             # Use a distinct type like 'image_context'
@@ -252,7 +275,7 @@ class SandboxVisionTool(SandboxToolsBase):
             )
 
             # Inform the agent the image will be available next turn
-            return self.success_response(f"Successfully loaded and compressed the image '{cleaned_path}' (reduced from {original_size / 1024:.1f}KB to {len(compressed_bytes) / 1024:.1f}KB).")
+            return self.success_response(f"Successfully loaded and compressed the image '{cleaned_path}' (reduced from {original_size / 1024:.1f}KB to {image.size / 1024:.1f}KB).")
 
         except Exception as e:
             return self.fail_response(f"An unexpected error occurred while trying to see the image: {str(e)}") 
\ No newline at end of file
@@ -1,17 +1,15 @@
-import json
 import asyncio
-from typing import Dict, Any, List
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.sse import sse_client
-from mcp.client.stdio import stdio_client
-from mcp.client.streamable_http import streamablehttp_client
+from typing import Dict, Any, List, Optional
 from utils.logger import logger
 from .mcp_connection_manager import MCPConnectionManager
+from .mcp_credentials import PIPEDREAM_MCP_URL, MCPCredentialResolver
+from .mcp_session_pool import get_session_pool, http_server
 
 
 class CustomMCPHandler:
-    def __init__(self, connection_manager: MCPConnectionManager):
+    def __init__(self, connection_manager: MCPConnectionManager, credentials: Optional[MCPCredentialResolver] = None):
         self.connection_manager = connection_manager
+        self.credentials = credentials or MCPCredentialResolver()
         self.custom_tools = {}
     
     async def initialize_custom_mcps(self, custom_configs: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
@@ -76,14 +74,11 @@ class CustomMCPHandler:
             
             logger.debug(f"Resolved Composio profile {profile_id} to MCP URL")
 
-            async with streamablehttp_client(mcp_url) as (read_stream, write_stream, _):
-                async with ClientSession(read_stream, write_stream) as session:
-                    await session.initialize()
-                    tools_result = await session.list_tools()
-                    tools = tools_result.tools if hasattr(tools_result, 'tools') else tools_result
-                    
-                    self._register_custom_tools(tools, server_name, enabled_tools, 'composio', server_config)
-                    logger.debug(f"Registered {len(tools)} tools from Composio MCP {server_name}")
+            tools_result = await get_session_pool().list_tools(http_server(mcp_url))
+            tools = tools_result.tools if hasattr(tools_result, 'tools') else tools_result
+            
+            self._register_custom_tools(tools, server_name, enabled_tools, 'composio', server_config)
+            logger.debug(f"Registered {len(tools)} tools from Composio MCP {server_name}")
             
         except Exception as e:
             logger.error(f"Failed to initialize Composio MCP {server_name}: {str(e)}")
@@ -105,39 +100,12 @@ class CustomMCPHandler:
         logger.debug(f"Initializing Pipedream MCP for {app_slug} (user: {external_user_id}, oauth_app_id: {oauth_app_id})")
         
         try:
-            import os
-            from pipedream import connection_service
-            from mcp import ClientSession
-            from mcp.client.streamable_http import streamablehttp_client
-            
-            access_token = await connection_service._ensure_access_token()
-            
-            project_id = os.getenv("PIPEDREAM_PROJECT_ID")
-            environment = os.getenv("PIPEDREAM_X_PD_ENVIRONMENT", "development")
-            
-            headers = {
-                "Authorization": f"Bearer {access_token}",
-                "x-pd-project-id": project_id,
-                "x-pd-environment": environment,
-                "x-pd-external-user-id": external_user_id,
-                "x-pd-app-slug": app_slug,
-            }
-            
-            if hasattr(connection_service, 'rate_limit_token') and connection_service.rate_limit_token:
-                headers["x-pd-rate-limit"] = connection_service.rate_limit_token
+            headers = await self.credentials.pipedream_headers(external_user_id, app_slug, oauth_app_id)
             
-            if oauth_app_id:
-                headers["x-pd-oauth-app-id"] = oauth_app_id
-
-            url = "https://remote.mcp.pipedream.net"
+            tools_result = await get_session_pool().list_tools(http_server(PIPEDREAM_MCP_URL, headers))
+            tools = tools_result.tools if hasattr(tools_result, 'tools') else tools_result
             
-            async with streamablehttp_client(url, headers=headers) as (read_stream, write_stream, _):
-                async with ClientSession(read_stream, write_stream) as session:
-                    await session.initialize()
-                    tools_result = await session.list_tools()
-                    tools = tools_result.tools if hasattr(tools_result, 'tools') else tools_result
-                    
-                    self._register_custom_tools(tools, server_name, enabled_tools, 'pipedream', server_config)
+            self._register_custom_tools(tools, server_name, enabled_tools, 'pipedream', server_config)
                     
         except Exception as e:
             logger.error(f"Pipedream MCP {server_name}: Connection failed - {str(e)}")
@@ -187,19 +155,9 @@ class CustomMCPHandler:
             return external_user_id
         
         try:
-            from services.supabase import DBConnection
-            from utils.encryption import decrypt_data
-            
-            db = DBConnection()
-            supabase = await db.client
-            
-            result = await supabase.table('user_mcp_credential_profiles').select(
-                'encrypted_config'
-            ).eq('profile_id', profile_id).single().execute()
+            config_data = await self.credentials.profile_config(profile_id)
             
-            if result.data:
-                decrypted_config = decrypt_data(result.data['encrypted_config'])
-                config_data = json.loads(decrypted_config)
+            if config_data:
                 profile_external_user_id = config_data.get('external_user_id')
                 
                 if external_user_id and external_user_id != profile_external_user_id:
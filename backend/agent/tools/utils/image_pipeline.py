@@ -0,0 +1,119 @@
+"""
+Image processing pipeline for the vision tool.
+
+Decoding, resizing and re-encoding images is CPU-bound, so it runs in a small
+thread pool (Pillow releases the GIL for most of that work) instead of on the
+event loop that also drives other agent runs.
+
+Compressed results are cached by content: the key is the SHA-256 of the source
+image plus the compression parameters, so the same screenshot or downloaded
+image is never compressed twice. Entries live in a per-process LRU bounded by
+size and in Redis, shared across workers. Sandbox files additionally get an
+alias from (sandbox, path, size, mtime) to their content key, which lets a
+repeated look at an unchanged file skip the download as well.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, NamedTuple, Optional, Tuple
+
+from services import redis
+from utils.logger import logger
+
+IMAGE_WORKERS = min(4, os.cpu_count() or 1)
+CACHE_TTL = 24 * 3600
+LOCAL_CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHE_PREFIX = "image_cache"
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+async def run_in_image_pool(fn: Callable, *args: Any) -> Any:
+    """Run a CPU-bound image function in the shared image thread pool."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+    return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+
+class CompressedImage(NamedTuple):
+    mime_type: str
+    base64: str
+    size: int
+
+
+def source_hash(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def compressed_image_key(image_hash: str, mime_type: str, params: Tuple) -> str:
+    params_hash = hashlib.sha256(json.dumps([mime_type, *params]).encode()).hexdigest()[:16]
+    return f"{CACHE_PREFIX}:{image_hash}:{params_hash}"
+
+
+def file_alias_key(sandbox_id: str, path: str, size: int, modified: Any) -> str:
+    identity = hashlib.sha256(f"{sandbox_id}:{path}:{size}:{modified}".encode()).hexdigest()[:32]
+    return f"{CACHE_PREFIX}:file:{identity}"
+
+
+class CompressedImageCache:
+    """Compressed images by content key, in a local LRU and in Redis."""
+
+    def __init__(self, max_local_bytes: int = LOCAL_CACHE_MAX_BYTES):
+        self.max_local_bytes = max_local_bytes
+        self._local_bytes = 0
+        self._local: "OrderedDict[str, CompressedImage]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[CompressedImage]:
+        image = self._local.get(key)
+        if image is not None:
+            self._local.move_to_end(key)
+            return image
+        try:
+            cached = await redis.get(key)
+            if not cached:
+                return None
+            image = CompressedImage(**json.loads(cached))
+            self._remember(key, image)
+            return image
+        except Exception as e:
+            logger.warning(f"Failed to read cached image {key}: {str(e)}")
+            return None
+
+    async def put(self, key: str, image: CompressedImage, alias: Optional[str] = None) -> None:
+        self._remember(key, image)
+        try:
+            await redis.set(key, json.dumps(image._asdict()), ex=CACHE_TTL)
+            if alias:
+                await redis.set(alias, key, ex=CACHE_TTL)
+        except Exception as e:
+            logger.warning(f"Failed to cache image {key}: {str(e)}")
+
+    async def get_by_alias(self, alias: str) -> Optional[CompressedImage]:
+        """Look up a compressed image through a file alias."""
+        try:
+            key = await redis.get(alias)
+        except Exception as e:
+            logger.warning(f"Failed to read image alias {alias}: {str(e)}")
+            return None
+        return await self.get(key) if key else None
+
+    def _remember(self, key: str, image: CompressedImage) -> None:
+        size = len(image.base64)
+        if size > self.max_local_bytes:
+            return
+        previous = self._local.pop(key, None)
+        if previous is not None:
+            self._local_bytes -= len(previous.base64)
+        self._local[key] = image
+        self._local_bytes += size
+        while self._local_bytes > self.max_local_bytes:
+            _, evicted = self._local.popitem(last=False)
+            self._local_bytes -= len(evicted.base64)
+
+
+image_cache = CompressedImageCache()
@@ -0,0 +1,81 @@
+"""
+Credentials for MCP servers, resolved once per agent run.
+
+Pipedream tools need the decrypted credential profile (for the external user
+id) and a Pipedream access token on every call. The resolver is created by the
+run's MCPToolWrapper and shared by tool discovery and execution, so each profile
+is read and decrypted once per run, and parallel tool calls wait for the same
+lookup instead of each starting their own. Access tokens are reused until
+shortly before they expire by the Pipedream connection service, which also
+makes sure concurrent callers trigger a single refresh.
+"""
+
+import asyncio
+import json
+import os
+from typing import Any, Dict, Optional
+
+from utils.logger import logger
+
+PIPEDREAM_MCP_URL = "https://remote.mcp.pipedream.net"
+
+
+class MCPCredentialResolver:
+    """Per-run cache of resolved credential profiles and Pipedream request headers."""
+
+    def __init__(self):
+        self._profiles: Dict[str, asyncio.Task] = {}
+
+    async def profile_config(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the decrypted config of a credential profile.
+
+        Returns:
+            The profile config, or None if the profile does not exist
+
+        Raises:
+            Exception: If the profile could not be loaded. Failures are not cached.
+        """
+        task = self._profiles.get(profile_id)
+        if task is None or (task.done() and (task.cancelled() or task.exception() is not None)):
+            task = asyncio.ensure_future(self._load_profile_config(profile_id))
+            self._profiles[profile_id] = task
+        return await asyncio.shield(task)
+
+    async def _load_profile_config(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        from services.supabase import DBConnection
+        from utils.encryption import decrypt_data
+
+        db = DBConnection()
+        supabase = await db.client
+
+        result = await supabase.table('user_mcp_credential_profiles').select(
+            'encrypted_config'
+        ).eq('profile_id', profile_id).single().execute()
+
+        if not result.data:
+            return None
+        logger.debug(f"Resolved credential profile {profile_id}")
+        return json.loads(decrypt_data(result.data['encrypted_config']))
+
+    async def pipedream_headers(self, external_user_id: str, app_slug: Optional[str], oauth_app_id: Optional[str] = None) -> Dict[str, str]:
+        """Build the headers of a Pipedream MCP request for a user and app."""
+        from pipedream import connection_service
+
+        access_token = await connection_service._ensure_access_token()
+
+        headers = {
+            "Authorization": f"Bearer {access_token}",
+            "x-pd-project-id": os.getenv("PIPEDREAM_PROJECT_ID"),
+            "x-pd-environment": os.getenv("PIPEDREAM_X_PD_ENVIRONMENT", "development"),
+            "x-pd-external-user-id": external_user_id,
+            "x-pd-app-slug": app_slug,
+        }
+
+        if hasattr(connection_service, 'rate_limit_token') and connection_service.rate_limit_token:
+            headers["x-pd-rate-limit"] = connection_service.rate_limit_token
+
+        if oauth_app_id:
+            headers["x-pd-oauth-app-id"] = oauth_app_id
+
+        return headers
@@ -0,0 +1,314 @@
+"""
+Pool of persistent MCP client sessions.
+
+Opening an MCP session costs a transport connection (or, for stdio servers, a
+new process) plus the initialize handshake. The pool keeps one initialized
+session per server and reuses it for tool discovery and every tool call, so
+that cost is paid once instead of per call.
+
+Servers are identified by transport and url plus a hash of the headers, or by
+command, args and env for stdio servers. Each session is owned by a background
+task, because the MCP transports must be entered and exited in the same task.
+Sessions are pinged before reuse after being idle for a while, closed after
+IDLE_TIMEOUT seconds without use, and reopened when the transport fails.
+Concurrent calls to one server are limited per session.
+
+There is one pool per event loop, like the shared HTTP client.
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+import weakref
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+import anyio
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.sse import sse_client
+from mcp.client.stdio import stdio_client
+from mcp.client.streamable_http import streamablehttp_client
+from mcp.shared.exceptions import McpError
+from mcp.types import CONNECTION_CLOSED
+
+from utils.logger import logger
+
+MAX_SESSIONS = 32
+SERVER_CONCURRENCY = 8
+CONNECT_TIMEOUT = 15
+IDLE_TIMEOUT = 300
+# Sessions idle for longer than this are pinged before they are reused
+HEALTH_CHECK_AFTER = 60
+PING_TIMEOUT = 5
+
+# Errors raised when a request could not be sent because the transport is already gone
+_NOT_SENT_ERRORS = (anyio.ClosedResourceError, anyio.BrokenResourceError)
+
+
+@dataclass(frozen=True)
+class MCPServer:
+    """Connection parameters of an MCP server. Use sse_server, http_server or stdio_server."""
+
+    transport: str
+    url: Optional[str] = None
+    headers: Tuple[Tuple[str, str], ...] = ()
+    command: Optional[str] = None
+    args: Tuple[str, ...] = ()
+    env: Tuple[Tuple[str, str], ...] = ()
+
+    @property
+    def key(self) -> str:
+        identity = json.dumps([self.transport, self.url, self.headers, self.command, self.args, self.env])
+        return hashlib.sha256(identity.encode()).hexdigest()
+
+    @property
+    def label(self) -> str:
+        return self.url or " ".join((self.command or "", *self.args))
+
+
+def _items(mapping: Optional[Dict[str, Any]]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((str(k), str(v)) for k, v in (mapping or {}).items() if v is not None))
+
+
+def sse_server(url: str, headers: Optional[Dict[str, Any]] = None) -> MCPServer:
+    return MCPServer("sse", url=url, headers=_items(headers))
+
+
+def http_server(url: str, headers: Optional[Dict[str, Any]] = None) -> MCPServer:
+    return MCPServer("http", url=url, headers=_items(headers))
+
+
+def stdio_server(command: str, args: Optional[list] = None, env: Optional[Dict[str, Any]] = None) -> MCPServer:
+    return MCPServer("stdio", command=command, args=tuple(args or ()), env=_items(env))
+
+
+@dataclass(eq=False)
+class _PooledSession:
+    server: MCPServer
+    slots: asyncio.Semaphore
+    session: Optional[ClientSession] = None
+    task: Optional[asyncio.Task] = None
+    closing: asyncio.Event = field(default_factory=asyncio.Event)
+    in_use: int = 0
+    last_used: float = field(default_factory=time.monotonic)
+    # Set when a call timed out on the session, which is then pinged before its next use
+    needs_ping: bool = False
+
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and self.task is not None and not self.task.done()
+
+
+class MCPSessionPool:
+    """Initialized MCP sessions shared by everything that talks to MCP servers in one event loop."""
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, server_concurrency: int = SERVER_CONCURRENCY,
+                 idle_timeout: float = IDLE_TIMEOUT, connect_timeout: float = CONNECT_TIMEOUT):
+        self.max_sessions = max_sessions
+        self.server_concurrency = server_concurrency
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self._sessions: Dict[str, _PooledSession] = {}
+        self._connecting: Dict[str, asyncio.Lock] = {}
+        self._reaper: Optional[asyncio.Task] = None
+
+    @asynccontextmanager
+    async def session(self, server: MCPServer) -> AsyncIterator[ClientSession]:
+        """Borrow the server's session, opening it if needed, within the server's concurrency limit."""
+        async with self._borrow(server) as entry:
+            yield entry.session
+
+    @asynccontextmanager
+    async def _borrow(self, server: MCPServer) -> AsyncIterator[_PooledSession]:
+        entry = await self._acquire(server)
+        async with entry.slots:
+            entry.in_use += 1
+            try:
+                yield entry
+            finally:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+
+    async def call_tool(self, server: MCPServer, tool_name: str, arguments: Dict[str, Any], timeout: float = 30) -> Any:
+        """
+        Call a tool on a pooled session.
+
+        A call that could not be sent because the session's transport was
+        already closed is sent once more on a new session. Error responses from
+        the server keep the session, and so does a call that times out, since
+        other calls share the session: it is pinged before its next use
+        instead. Any other failure discards the session, since its state is
+        unknown, and is raised without retrying: the server may have received
+        the call, and a tool with side effects must not run twice.
+        """
+        for attempt in range(2):
+            entry = None
+            try:
+                async with asyncio.timeout(timeout):
+                    async with self._borrow(server) as entry:
+                        return await entry.session.call_tool(tool_name, arguments)
+            except TimeoutError:
+                if entry is not None:
+                    entry.needs_ping = True
+                raise
+            except Exception as e:
+                if entry is not None and (not isinstance(e, McpError) or e.error.code == CONNECTION_CLOSED):
+                    await self._discard(entry)
+                if attempt or not isinstance(e, _NOT_SENT_ERRORS):
+                    raise
+                logger.debug(f"MCP session to {server.label} was closed, reconnecting: {e}")
+
+    async def list_tools(self, server: MCPServer, timeout: float = CONNECT_TIMEOUT) -> Any:
+        entry = None
+        try:
+            async with asyncio.timeout(timeout):
+                async with self._borrow(server) as entry:
+                    return await entry.session.list_tools()
+        except TimeoutError:
+            if entry is not None:
+                entry.needs_ping = True
+            raise
+        except Exception:
+            if entry is not None:
+                await self._discard(entry)
+            raise
+
+    async def close_all(self) -> None:
+        entries = list(self._sessions.values())
+        self._sessions.clear()
+        await asyncio.gather(*(self._close(entry) for entry in entries), return_exceptions=True)
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "in_use": sum(1 for entry in self._sessions.values() if entry.in_use),
+            "servers": [entry.server.label for entry in self._sessions.values()],
+        }
+
+    async def _acquire(self, server: MCPServer) -> _PooledSession:
+        key = server.key
+        entry = self._sessions.get(key)
+        if entry is not None and entry.alive and await self._healthy(entry):
+            return entry
+
+        # One connection attempt per server at a time; concurrent callers wait for it
+        lock = self._connecting.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._sessions.get(key)
+            if entry is not None and entry.alive:
+                return entry
+            if entry is not None:
+                await self._discard(entry)
+            entry = await self._open(server)
+            self._sessions[key] = entry
+            await self._evict_over_capacity()
+            if self._reaper is None or self._reaper.done():
+                self._reaper = asyncio.create_task(self._reap_idle())
+            return entry
+
+    async def _healthy(self, entry: _PooledSession) -> bool:
+        if not entry.needs_ping and time.monotonic() - entry.last_used < HEALTH_CHECK_AFTER:
+            return True
+        try:
+            async with asyncio.timeout(PING_TIMEOUT):
+                await entry.session.send_ping()
+            entry.last_used = time.monotonic()
+            entry.needs_ping = False
+            return True
+        except Exception as e:
+            logger.debug(f"MCP session to {entry.server.label} failed its health check: {e}")
+            await self._discard(entry)
+            return False
+
+    async def _open(self, server: MCPServer) -> _PooledSession:
+        entry = _PooledSession(server, asyncio.Semaphore(self.server_concurrency))
+        ready = asyncio.get_running_loop().create_future()
+        entry.task = asyncio.create_task(self._own_session(entry, ready))
+        try:
+            async with asyncio.timeout(self.connect_timeout):
+                await ready
+        except BaseException:
+            await self._close(entry)
+            raise
+        logger.debug(f"Opened MCP session to {server.label} ({server.transport})")
+        return entry
+
+    async def _own_session(self, entry: _PooledSession, ready: asyncio.Future) -> None:
+        """Hold the session's transport open until the session is closed or the transport fails."""
+        try:
+            async with AsyncExitStack() as stack:
+                streams = await stack.enter_async_context(self._transport(entry.server))
+                session = await stack.enter_async_context(ClientSession(streams[0], streams[1]))
+                await session.initialize()
+                entry.session = session
+                ready.set_result(None)
+                await entry.closing.wait()
+        except BaseException as e:
+            if not ready.done():
+                ready.set_exception(e if isinstance(e, Exception) else ConnectionError(f"MCP session to {entry.server.label} was cancelled"))
+            elif not entry.closing.is_set():
+                logger.debug(f"MCP session to {entry.server.label} closed: {e}")
+            if not isinstance(e, Exception):
+                raise
+
+    @staticmethod
+    def _transport(server: MCPServer):
+        headers = dict(server.headers)
+        if server.transport == "stdio":
+            return stdio_client(StdioServerParameters(command=server.command, args=list(server.args), env=dict(server.env)))
+        if server.transport == "http":
+            return streamablehttp_client(server.url, headers=headers or None)
+        try:
+            return sse_client(server.url, headers=headers)
+        except TypeError as e:
+            # Older MCP clients do not accept headers
+            if "unexpected keyword argument" not in str(e):
+                raise
+            return sse_client(server.url)
+
+    async def _discard(self, entry: _PooledSession) -> None:
+        """Close a session; the server's next use opens a new one unless a newer session replaced it."""
+        if self._sessions.get(entry.server.key) is entry:
+            del self._sessions[entry.server.key]
+        await self._close(entry)
+
+    async def _close(self, entry: _PooledSession) -> None:
+        entry.closing.set()
+        if entry.task is None:
+            return
+        try:
+            async with asyncio.timeout(5):
+                await asyncio.shield(entry.task)
+        except BaseException:
+            entry.task.cancel()
+
+    async def _evict_over_capacity(self) -> None:
+        idle = sorted((entry for entry in self._sessions.values() if not entry.in_use), key=lambda entry: entry.last_used)
+        while len(self._sessions) > self.max_sessions and idle:
+            await self._discard(idle.pop(0))
+
+    async def _reap_idle(self) -> None:
+        while self._sessions:
+            await asyncio.sleep(min(self.idle_timeout, HEALTH_CHECK_AFTER))
+            now = time.monotonic()
+            for entry in list(self._sessions.values()):
+                if not entry.alive or (not entry.in_use and now - entry.last_used > self.idle_timeout):
+                    await self._discard(entry)
+
+
+_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, MCPSessionPool]" = weakref.WeakKeyDictionary()
+
+
+def get_session_pool() -> MCPSessionPool:
+    """Get the session pool of the running event loop."""
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = MCPSessionPool()
+        _pools[loop] = pool
+    return pool
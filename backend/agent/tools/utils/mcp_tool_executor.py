@@ -1,20 +1,17 @@
-import json
-import asyncio
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from agentpress.tool import ToolResult
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.sse import sse_client
-from mcp.client.stdio import stdio_client
-from mcp.client.streamable_http import streamablehttp_client
+from agent.tools.utils.mcp_credentials import PIPEDREAM_MCP_URL, MCPCredentialResolver
+from agent.tools.utils.mcp_session_pool import MCPServer, get_session_pool, http_server, sse_server, stdio_server
 from mcp_module import mcp_service
 from utils.logger import logger
 
 
 class MCPToolExecutor:
-    def __init__(self, custom_tools: Dict[str, Dict[str, Any]], tool_wrapper=None):
+    def __init__(self, custom_tools: Dict[str, Dict[str, Any]], tool_wrapper=None, credentials: Optional[MCPCredentialResolver] = None):
         self.mcp_manager = mcp_service
         self.custom_tools = custom_tools
         self.tool_wrapper = tool_wrapper
+        self.credentials = credentials or MCPCredentialResolver()
     
     async def execute_tool(self, tool_name: str, arguments: Dict[str, Any]) -> ToolResult:
         logger.debug(f"Executing MCP tool {tool_name} with arguments {arguments}")
@@ -90,36 +87,9 @@ class MCPToolExecutor:
         oauth_app_id = custom_config.get('oauth_app_id')
         
         try:
-            import os
-            from pipedream import connection_service
+            headers = await self.credentials.pipedream_headers(external_user_id, app_slug, oauth_app_id)
             
-            access_token = await connection_service._ensure_access_token()
-            
-            project_id = os.getenv("PIPEDREAM_PROJECT_ID")
-            environment = os.getenv("PIPEDREAM_X_PD_ENVIRONMENT", "development")
-            
-            headers = {
-                "Authorization": f"Bearer {access_token}",
-                "x-pd-project-id": project_id,
-                "x-pd-environment": environment,
-                "x-pd-external-user-id": external_user_id,
-                "x-pd-app-slug": app_slug,
-            }
-            
-            if hasattr(connection_service, 'rate_limit_token') and connection_service.rate_limit_token:
-                headers["x-pd-rate-limit"] = connection_service.rate_limit_token
-            
-            if oauth_app_id:
-                headers["x-pd-oauth-app-id"] = oauth_app_id
-            
-            url = "https://remote.mcp.pipedream.net"
-            
-            async with asyncio.timeout(30):
-                async with streamablehttp_client(url, headers=headers) as (read_stream, write_stream, _):
-                    async with ClientSession(read_stream, write_stream) as session:
-                        await session.initialize()
-                        result = await session.call_tool(original_tool_name, arguments)
-                        return self._create_success_result(self._extract_content(result))
+            return await self._call_pooled_tool(http_server(PIPEDREAM_MCP_URL, headers), original_tool_name, arguments)
                         
         except Exception as e:
             logger.error(f"Error executing Pipedream MCP tool: {str(e)}")
@@ -127,42 +97,15 @@ class MCPToolExecutor:
     
     async def _execute_sse_tool(self, tool_name: str, arguments: Dict[str, Any], tool_info: Dict[str, Any]) -> ToolResult:
         custom_config = tool_info['custom_config']
-        original_tool_name = tool_info['original_name']
-        
-        url = custom_config['url']
-        headers = custom_config.get('headers', {})
-        
-        async with asyncio.timeout(30):
-            try:
-                async with sse_client(url, headers=headers) as (read, write):
-                    async with ClientSession(read, write) as session:
-                        await session.initialize()
-                        result = await session.call_tool(original_tool_name, arguments)
-                        return self._create_success_result(self._extract_content(result))
-                        
-            except TypeError as e:
-                if "unexpected keyword argument" in str(e):
-                    async with sse_client(url) as (read, write):
-                        async with ClientSession(read, write) as session:
-                            await session.initialize()
-                            result = await session.call_tool(original_tool_name, arguments)
-                            return self._create_success_result(self._extract_content(result))
-                else:
-                    raise
+        server = sse_server(custom_config['url'], custom_config.get('headers', {}))
+        return await self._call_pooled_tool(server, tool_info['original_name'], arguments)
     
     async def _execute_http_tool(self, tool_name: str, arguments: Dict[str, Any], tool_info: Dict[str, Any]) -> ToolResult:
         custom_config = tool_info['custom_config']
         original_tool_name = tool_info['original_name']
         
-        url = custom_config['url']
-        
         try:
-            async with asyncio.timeout(30):
-                async with streamablehttp_client(url) as (read, write, _):
-                    async with ClientSession(read, write) as session:
-                        await session.initialize()
-                        result = await session.call_tool(original_tool_name, arguments)
-                        return self._create_success_result(self._extract_content(result))
+            return await self._call_pooled_tool(http_server(custom_config['url']), original_tool_name, arguments)
                         
         except Exception as e:
             logger.error(f"Error executing HTTP MCP tool: {str(e)}")
@@ -170,20 +113,12 @@ class MCPToolExecutor:
     
     async def _execute_json_tool(self, tool_name: str, arguments: Dict[str, Any], tool_info: Dict[str, Any]) -> ToolResult:
         custom_config = tool_info['custom_config']
-        original_tool_name = tool_info['original_name']
-        
-        server_params = StdioServerParameters(
-            command=custom_config["command"],
-            args=custom_config.get("args", []),
-            env=custom_config.get("env", {})
-        )
-        
-        async with asyncio.timeout(30):
-            async with stdio_client(server_params) as (read, write):
-                async with ClientSession(read, write) as session:
-                    await session.initialize()
-                    result = await session.call_tool(original_tool_name, arguments)
-                    return self._create_success_result(self._extract_content(result))
+        server = stdio_server(custom_config["command"], custom_config.get("args", []), custom_config.get("env", {}))
+        return await self._call_pooled_tool(server, tool_info['original_name'], arguments)
+    
+    async def _call_pooled_tool(self, server: MCPServer, original_tool_name: str, arguments: Dict[str, Any]) -> ToolResult:
+        result = await get_session_pool().call_tool(server, original_tool_name, arguments, timeout=30)
+        return self._create_success_result(self._extract_content(result))
     
     async def _resolve_external_user_id(self, custom_config: Dict[str, Any]) -> str:
         profile_id = custom_config.get('profile_id')
@@ -193,19 +128,9 @@ class MCPToolExecutor:
             return external_user_id
         
         try:
-            from services.supabase import DBConnection
-            from utils.encryption import decrypt_data
-            
-            db = DBConnection()
-            supabase = await db.client
-            
-            result = await supabase.table('user_mcp_credential_profiles').select(
-                'encrypted_config'
-            ).eq('profile_id', profile_id).single().execute()
+            config_data = await self.credentials.profile_config(profile_id)
             
-            if result.data:
-                decrypted_config = decrypt_data(result.data['encrypted_config'])
-                config_data = json.loads(decrypted_config)
+            if config_data:
                 return config_data.get('external_user_id', external_user_id)
             
         except Exception as e:
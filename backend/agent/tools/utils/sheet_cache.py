@@ -0,0 +1,100 @@
+"""
+Parsed sheet cache for the sheets tool.
+
+Parsing a sheet (downloading it and running openpyxl or the CSV reader) is the
+expensive part of view/analyze/visualize calls, and agents often repeat them on
+an unchanged file. Parsed sheets are cached per process, keyed by sandbox, path,
+sheet name and representation, and validated against the file's size and
+modification time, which costs one file info call instead of a download. Sheets
+the tool writes itself are stored right away, so follow-up calls skip the parse.
+
+The cache is an LRU bounded by an estimate of the parsed sheets' memory.
+Cached sheets are shared, callers that modify one must copy it first.
+"""
+
+import sys
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Hashable, Optional, Tuple
+
+SHEET_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Rows sampled to estimate the memory of a parsed sheet
+SIZE_SAMPLE_ROWS = 200
+
+SheetKey = Tuple[str, str, str, str]
+
+
+def sheet_cache_key(sandbox_id: str, full_path: str, sheet_name: Optional[str], kind: str = "rows") -> SheetKey:
+    return (sandbox_id, full_path, sheet_name or "", kind)
+
+
+def estimate_sheet_size(sheet: Any) -> int:
+    """Estimate the memory held by a parsed sheet from a sample of its rows."""
+    if hasattr(sheet, "columns"):
+        # ColumnarSheet: pointer arrays plus the cell objects they reference
+        row_count = sheet.row_count
+        pointer_bytes = sum(column.nbytes for column in sheet.columns)
+        sample_rows = [[column[i] for column in sheet.columns] for i in range(min(row_count, SIZE_SAMPLE_ROWS))]
+        numeric_bytes = len(sheet.columns) * row_count * 8
+    else:
+        row_count = len(sheet.rows)
+        sample_rows = sheet.rows[:SIZE_SAMPLE_ROWS]
+        pointer_bytes = sum(sys.getsizeof(row) for row in sample_rows) * row_count // max(1, len(sample_rows))
+        numeric_bytes = 0
+    cell_bytes = sum(sys.getsizeof(cell) for row in sample_rows for cell in row)
+    per_row = cell_bytes / max(1, len(sample_rows))
+    return int(pointer_bytes + numeric_bytes + per_row * row_count) + 1024
+
+
+@dataclass
+class _Entry:
+    signature: Hashable
+    sheet: Any
+    size: int
+
+
+class SheetCache:
+    """LRU of parsed sheets, bounded by estimated memory."""
+
+    def __init__(self, max_bytes: int = SHEET_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: "OrderedDict[SheetKey, _Entry]" = OrderedDict()
+
+    def get(self, key: SheetKey, signature: Optional[Hashable]) -> Optional[Any]:
+        """Return the cached sheet if it was parsed from a file with this signature."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if signature is None or entry.signature != signature:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry.sheet
+
+    def put(self, key: SheetKey, signature: Optional[Hashable], sheet: Any) -> None:
+        """Cache a parsed sheet. Sheets without a signature or too large for the cache are not stored."""
+        self._remove(key)
+        if signature is None:
+            return
+        size = estimate_sheet_size(sheet)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = _Entry(signature, sheet, size)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+
+    def invalidate(self, sandbox_id: str, full_path: str) -> None:
+        """Drop every cached sheet of a file."""
+        for key in [k for k in self._entries if k[0] == sandbox_id and k[1] == full_path]:
+            self._remove(key)
+
+    def _remove(self, key: SheetKey) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+
+
+sheet_cache = SheetCache()
@@ -0,0 +1,248 @@
+"""
+Columnar sheet engine for large CSV/XLSX analysis.
+
+Sheets are held as one NumPy object array per column instead of a list per
+row. CSV bytes are parsed as a stream in chunks of CHUNK_ROWS rows without
+decoding the whole file first, the encoding is detected from a sample, numeric
+views of columns are converted in bulk (missing and non-numeric cells become
+NaN) and cached, and statistics and group_by aggregations run as vectorized
+NumPy operations.
+
+NumPy is optional: callers check columnar_available() and sheets below
+COLUMNAR_MIN_BYTES / COLUMNAR_MIN_ROWS stay on the row-based path, where
+building arrays costs more than it saves.
+"""
+
+import codecs
+import csv
+import io
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import chardet
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+ENCODING_SAMPLE_BYTES = 64 * 1024
+CHUNK_ROWS = 50_000
+COLUMNAR_MIN_BYTES = 256 * 1024
+COLUMNAR_MIN_ROWS = 5_000
+AGGREGATIONS = ("count", "sum", "avg", "min", "max")
+
+
+def columnar_available() -> bool:
+    return np is not None
+
+
+def detect_encoding(data: bytes, sample_size: int = ENCODING_SAMPLE_BYTES) -> str:
+    """Detect the encoding of text data from its first sample_size bytes."""
+    if data.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    sample = data[:sample_size]
+    try:
+        # Incremental so a multi-byte character cut off by the sample does not count as invalid
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=len(sample) == len(data))
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    try:
+        return chardet.detect(sample).get("encoding") or "utf-8"
+    except Exception:
+        return "utf-8"
+
+
+def iter_csv_rows(data: bytes, encoding: Optional[str] = None) -> Iterator[List[str]]:
+    """Parse CSV bytes row by row without decoding them all up front."""
+    stream = io.TextIOWrapper(io.BytesIO(data), encoding=encoding or detect_encoding(data), errors="replace", newline="")
+    return csv.reader(stream)
+
+
+def _to_float(v: Any) -> float:
+    if isinstance(v, (int, float)):
+        return float(v)
+    try:
+        return float(str(v).strip())
+    except Exception:
+        return float("nan")
+
+
+def _clean(value: Any) -> Any:
+    """Convert NumPy scalars to plain Python values for JSON output."""
+    return value.item() if hasattr(value, "item") else value
+
+
+class ColumnarSheet:
+    """A sheet stored as one object array per column, padded with None."""
+
+    def __init__(self, headers: List[str], columns: List[Any]):
+        self.headers = headers
+        self.columns = columns
+        self.row_count = len(columns[0]) if columns else 0
+        self._numeric: Dict[int, Any] = {}
+
+    @classmethod
+    def from_csv_bytes(cls, data: bytes, chunk_rows: int = CHUNK_ROWS) -> "ColumnarSheet":
+        """Parse CSV bytes, the first row being the headers."""
+        rows = iter_csv_rows(data)
+        headers = [str(h) for h in next(rows, [])]
+        chunks: List[List[Any]] = []
+        row_count = 0
+        while True:
+            chunk = list(islice(rows, chunk_rows))
+            if not chunk:
+                break
+            row_count = cls._add_chunk(chunks, chunk, row_count)
+        return cls._assemble(headers, chunks, row_count)
+
+    @classmethod
+    def from_rows(cls, headers: List[str], rows: List[List[Any]]) -> "ColumnarSheet":
+        """Build from row lists, e.g. as read from an XLSX sheet."""
+        chunks: List[List[Any]] = []
+        row_count = 0
+        for start in range(0, len(rows), CHUNK_ROWS):
+            row_count = cls._add_chunk(chunks, rows[start:start + CHUNK_ROWS], row_count)
+        return cls._assemble(headers, chunks, row_count)
+
+    @staticmethod
+    def _add_chunk(chunks: List[List[Any]], rows: List[List[Any]], row_count: int) -> int:
+        """Append a chunk of rows to the per-column chunk lists, returning the new row count."""
+        width = max(map(len, rows), default=0)
+        if min(map(len, rows), default=0) != width:
+            rows = [list(r) + [None] * (width - len(r)) for r in rows]
+        block = np.empty((len(rows), width), dtype=object)
+        if width:
+            block[:] = rows
+        # Columns first seen in this chunk are missing in every earlier row
+        while len(chunks) < width:
+            chunks.append([np.full(row_count, None, dtype=object)] if row_count else [])
+        for c, column_chunks in enumerate(chunks):
+            column_chunks.append(block[:, c] if c < width else np.full(len(rows), None, dtype=object))
+        return row_count + len(rows)
+
+    @classmethod
+    def _assemble(cls, headers: List[str], chunks: List[List[Any]], row_count: int) -> "ColumnarSheet":
+        columns = [np.concatenate(column_chunks) if column_chunks else np.empty(0, dtype=object) for column_chunks in chunks]
+        while len(columns) < len(headers):
+            columns.append(np.full(row_count, None, dtype=object))
+        return cls(headers, columns)
+
+    def numeric(self, index: int) -> Any:
+        """Float view of a column, NaN where a cell is missing or not a number."""
+        if index not in self._numeric:
+            column = self.columns[index]
+            values = np.full(len(column), np.nan)
+            present = np.not_equal(column, None) & np.not_equal(column, "")
+            cells = column[present]
+            try:
+                values[present] = cells.astype(np.float64)
+            except (TypeError, ValueError):
+                values[present] = self._parse_chunked(cells)
+            self._numeric[index] = values
+        return self._numeric[index]
+
+    @staticmethod
+    def _parse_chunked(cells: Any) -> Any:
+        """Convert cells chunk by chunk, going cell by cell only in chunks with bad values."""
+        parts = []
+        for start in range(0, len(cells), CHUNK_ROWS):
+            part = cells[start:start + CHUNK_ROWS]
+            try:
+                parts.append(part.astype(np.float64))
+            except (TypeError, ValueError):
+                parts.append(np.fromiter((_to_float(v) for v in part), dtype=np.float64, count=len(part)))
+        return np.concatenate(parts) if parts else np.empty(0)
+
+    def analyze(self, target_columns: Optional[List[str]] = None, group_by: Optional[str] = None, aggregations: Optional[List[str]] = None) -> Tuple[List[str], List[List[Any]]]:
+        """Compute statistics of numeric columns, optionally per group_by value.
+
+        Returns:
+            Headers and rows of the result: one row per metric, or with group_by
+            one row per group with a column per column and aggregation
+        """
+        idx_map = {h: i for i, h in enumerate(self.headers)}
+        numeric_cols = [c for c in (target_columns or self.headers) if c in idx_map]
+        if group_by and group_by in idx_map:
+            return self._group_by(idx_map[group_by], group_by, [(c, idx_map[c]) for c in numeric_cols], aggregations or list(AGGREGATIONS))
+
+        stats = [self._column_stats(idx_map[c]) for c in numeric_cols]
+        rows = [[metric, *[s[metric] for s in stats]] for metric in AGGREGATIONS]
+        return ["metric"] + numeric_cols, rows
+
+    def _column_stats(self, index: int) -> Dict[str, Any]:
+        values = self.numeric(index)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return {"count": 0, "sum": None, "avg": None, "min": None, "max": None}
+        total = float(values.sum())
+        return {"count": len(values), "sum": total, "avg": total / len(values), "min": float(values.min()), "max": float(values.max())}
+
+    def _group_by(self, group_index: int, group_by: str, columns: List[Tuple[str, int]], aggregations: List[str]) -> Tuple[List[str], List[List[Any]]]:
+        unknown = [agg for agg in aggregations if agg not in AGGREGATIONS]
+        if unknown:
+            raise ValueError(f"Unsupported aggregations: {unknown}")
+
+        group_keys, codes = self._factorize(self.columns[group_index])
+        group_count = len(group_keys)
+
+        out_headers = [group_by] + [f"{col}_{agg}" for col, _ in columns for agg in aggregations]
+        per_column = [self._group_stats(codes, self.numeric(index), group_count, aggregations) for _, index in columns]
+
+        rows = []
+        for group, key in enumerate(group_keys):
+            row = [_clean(key)]
+            for stats in per_column:
+                for agg in aggregations:
+                    row.append(stats[agg][group])
+            rows.append(row)
+        return out_headers, rows
+
+    @staticmethod
+    def _factorize(keys: Any) -> Tuple[List[Any], Any]:
+        """Number the distinct keys in order of first appearance.
+
+        Returns:
+            The distinct keys and the code of every row
+        """
+        if len(keys) and set(map(type, keys)) == {str}:
+            # Text keys (every CSV column without short rows) are sorted as a fixed-width array in C
+            uniques, first_index, inverse = np.unique(keys.astype(str), return_index=True, return_inverse=True)
+            order = np.argsort(first_index, kind="stable")
+            rank = np.empty(len(order), dtype=np.intp)
+            rank[order] = np.arange(len(order))
+            return [str(u) for u in uniques[order]], rank[inverse.reshape(-1)]
+
+        key_codes: Dict[Any, int] = {}
+        codes = np.fromiter((key_codes.setdefault(k, len(key_codes)) for k in keys), dtype=np.intp, count=len(keys))
+        return list(key_codes), codes
+
+    @staticmethod
+    def _group_stats(codes: Any, values: Any, group_count: int, aggregations: List[str]) -> Dict[str, List[Any]]:
+        valid = ~np.isnan(values)
+        group_codes, group_values = codes[valid], values[valid]
+        counts = np.bincount(group_codes, minlength=group_count)
+        sums = np.bincount(group_codes, weights=group_values, minlength=group_count)
+        has_values = counts > 0
+        stats = {
+            "count": counts,
+            "sum": sums,
+            "avg": np.divide(sums, counts, out=np.zeros(group_count), where=has_values)
+        }
+
+        if "min" in aggregations or "max" in aggregations:
+            order = np.argsort(group_codes, kind="stable")
+            sorted_codes, sorted_values = group_codes[order], group_values[order]
+            starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]]) if len(sorted_codes) else np.empty(0, dtype=np.intp)
+            present_groups = sorted_codes[starts]
+            for agg, ufunc in (("min", np.minimum), ("max", np.maximum)):
+                result = np.full(group_count, np.nan)
+                if len(starts):
+                    result[present_groups] = ufunc.reduceat(sorted_values, starts)
+                stats[agg] = result
+
+        return {
+            agg: [int(v) for v in counts] if agg == "count" else [float(v) if ok else None for v, ok in zip(stats[agg], has_values)]
+            for agg in aggregations
+        }
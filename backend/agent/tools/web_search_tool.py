@@ -1,16 +1,20 @@
-from tavily import AsyncTavilyClient
 import httpx
 from dotenv import load_dotenv
-from agentpress.tool import Tool, ToolResult, openapi_schema, usage_example
+from agentpress.tool import Tool, ToolResult, openapi_schema, usage_example, execution_policy
 from utils.config import config
 from sandbox.tool_base import SandboxToolsBase
 from agentpress.thread_manager import ThreadManager
+from services import http_client
+from services.web_cache import WebCache
 import json
 import os
 import datetime
 import asyncio
 import logging
 
+TAVILY_API_URL = "https://api.tavily.com"
+TAVILY_TIMEOUT_SECONDS = 60
+
 class SandboxWebSearchTool(SandboxToolsBase):
     """Tool for performing web searches using Tavily API and web scraping using Firecrawl."""
 
@@ -28,9 +32,8 @@ class SandboxWebSearchTool(SandboxToolsBase):
         if not self.firecrawl_api_key:
             raise ValueError("FIRECRAWL_API_KEY not found in configuration")
 
-        # Tavily asynchronous search client
-        self.tavily_client = AsyncTavilyClient(api_key=self.tavily_api_key)
 
+    @execution_policy(max_concurrency=5, timeout=120)
     @openapi_schema({
         "type": "function",
         "function": {
@@ -95,16 +98,23 @@ class SandboxWebSearchTool(SandboxToolsBase):
             else:
                 num_results = 20
 
-            # Execute the search with Tavily
-            logging.info(f"Executing web search for query: '{query}' with {num_results} results")
-            search_response = await self.tavily_client.search(
-                query=query,
-                max_results=num_results,
-                include_images=True,
-                include_answer="advanced",
-                search_depth="advanced",
-            )
-            
+            search_options = {
+                "max_results": num_results,
+                "include_images": True,
+                "include_answer": "advanced",
+                "search_depth": "advanced",
+            }
+            cache_key = WebCache.search_key(query, **search_options)
+            search_response = await WebCache.get(cache_key)
+            from_cache = search_response is not None
+
+            if not from_cache:
+                # Execute the search with Tavily
+                logging.info(f"Executing web search for query: '{query}' with {num_results} results")
+                search_response = await self._tavily_search(query, **search_options)
+            else:
+                logging.info(f"Serving cached web search results for query: '{query}'")
+
             # Check if we have actual results or an answer
             results = search_response.get('results', [])
             answer = search_response.get('answer', '')
@@ -115,6 +125,9 @@ class SandboxWebSearchTool(SandboxToolsBase):
             
             # Consider search successful if we have either results OR an answer
             if len(results) > 0 or (answer and answer.strip()):
+                # Cache hits keep their original expiry
+                if not from_cache:
+                    await WebCache.set(cache_key, search_response, WebCache.SEARCH_TTL)
                 return ToolResult(
                     success=True,
                     output=json.dumps(search_response, ensure_ascii=False)
@@ -135,6 +148,25 @@ class SandboxWebSearchTool(SandboxToolsBase):
                 simplified_message += "..."
             return self.fail_response(simplified_message)
 
+    async def _tavily_search(self, query: str, **options) -> dict:
+        """Run a Tavily search through the shared HTTP client."""
+        response = await http_client.request(
+            "POST",
+            f"{TAVILY_API_URL}/search",
+            json={"query": query, "topic": "general", "include_raw_content": False, **options},
+            headers={"Authorization": f"Bearer {self.tavily_api_key}"},
+            timeout=TAVILY_TIMEOUT_SECONDS,
+        )
+        if response.status_code != 200:
+            detail = None
+            try:
+                detail = response.json().get("detail", {}).get("error")
+            except Exception:
+                pass
+            raise Exception(f"Tavily search failed with status {response.status_code}: {detail or response.text[:200]}")
+        return response.json()
+
+    @execution_policy(max_concurrency=3, timeout=300)
     @openapi_schema({
         "type": "function",
         "function": {
@@ -261,48 +293,14 @@ class SandboxWebSearchTool(SandboxToolsBase):
         logging.info(f"Scraping single URL: {url}")
         
         try:
-            # ---------- Firecrawl scrape endpoint ----------
-            logging.info(f"Sending request to Firecrawl for URL: {url}")
-            async with httpx.AsyncClient() as client:
-                headers = {
-                    "Authorization": f"Bearer {self.firecrawl_api_key}",
-                    "Content-Type": "application/json",
-                }
-                payload = {
-                    "url": url,
-                    "formats": ["markdown"]
-                }
-                
-                # Use longer timeout and retry logic for more reliability
-                max_retries = 3
-                timeout_seconds = 30
-                retry_count = 0
-                
-                while retry_count < max_retries:
-                    try:
-                        logging.info(f"Sending request to Firecrawl (attempt {retry_count + 1}/{max_retries})")
-                        response = await client.post(
-                            f"{self.firecrawl_url}/v1/scrape",
-                            json=payload,
-                            headers=headers,
-                            timeout=timeout_seconds,
-                        )
-                        response.raise_for_status()
-                        data = response.json()
-                        logging.info(f"Successfully received response from Firecrawl for {url}")
-                        break
-                    except (httpx.ReadTimeout, httpx.ConnectTimeout, httpx.ReadError) as timeout_err:
-                        retry_count += 1
-                        logging.warning(f"Request timed out (attempt {retry_count}/{max_retries}): {str(timeout_err)}")
-                        if retry_count >= max_retries:
-                            raise Exception(f"Request timed out after {max_retries} attempts with {timeout_seconds}s timeout")
-                        # Exponential backoff
-                        logging.info(f"Waiting {2 ** retry_count}s before retry")
-                        await asyncio.sleep(2 ** retry_count)
-                    except Exception as e:
-                        # Don't retry on non-timeout errors
-                        logging.error(f"Error during scraping: {str(e)}")
-                        raise e
+            cache_key = WebCache.scrape_key(url)
+            data = await WebCache.get(cache_key)
+            if data is not None:
+                logging.info(f"Serving cached Firecrawl content for URL: {url}")
+            else:
+                data = await self._firecrawl_scrape(url)
+                if data.get("data", {}).get("markdown"):
+                    await WebCache.set(cache_key, data, WebCache.SCRAPE_TTL)
 
             # Format the response
             title = data.get("data", {}).get("metadata", {}).get("title", "")
@@ -366,6 +364,52 @@ class SandboxWebSearchTool(SandboxToolsBase):
                 "error": error_message
             }
 
+    async def _firecrawl_scrape(self, url: str) -> dict:
+        """
+        Scrape a URL with Firecrawl through the shared HTTP client, retrying timeouts.
+        """
+        logging.info(f"Sending request to Firecrawl for URL: {url}")
+        headers = {
+            "Authorization": f"Bearer {self.firecrawl_api_key}",
+            "Content-Type": "application/json",
+        }
+        payload = {
+            "url": url,
+            "formats": ["markdown"]
+        }
+        
+        # Use longer timeout and retry logic for more reliability
+        max_retries = 3
+        timeout_seconds = 30
+        retry_count = 0
+        
+        while True:
+            try:
+                logging.info(f"Sending request to Firecrawl (attempt {retry_count + 1}/{max_retries})")
+                response = await http_client.request(
+                    "POST",
+                    f"{self.firecrawl_url}/v1/scrape",
+                    json=payload,
+                    headers=headers,
+                    timeout=timeout_seconds,
+                )
+                response.raise_for_status()
+                data = response.json()
+                logging.info(f"Successfully received response from Firecrawl for {url}")
+                return data
+            except (httpx.ReadTimeout, httpx.ConnectTimeout, httpx.ReadError) as timeout_err:
+                retry_count += 1
+                logging.warning(f"Request timed out (attempt {retry_count}/{max_retries}): {str(timeout_err)}")
+                if retry_count >= max_retries:
+                    raise Exception(f"Request timed out after {max_retries} attempts with {timeout_seconds}s timeout")
+                # Exponential backoff
+                logging.info(f"Waiting {2 ** retry_count}s before retry")
+                await asyncio.sleep(2 ** retry_count)
+            except Exception as e:
+                # Don't retry on non-timeout errors
+                logging.error(f"Error during scraping: {str(e)}")
+                raise e
+
 if __name__ == "__main__":
     async def test_web_search():
         """Test function for the web search tool"""
@@ -5,8 +5,11 @@ This module handles token counting and thread summarization to prevent
 reaching the context window limitations of LLM models.
 """
 
+import hashlib
 import json
-from typing import List, Dict, Any, Optional, Union
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Union, Callable, Tuple
 
 from litellm.utils import token_counter
 from services.supabase import DBConnection
@@ -14,6 +17,22 @@ from utils.logger import logger
 from utils.constants import get_model_context_window
 
 DEFAULT_TOKEN_THRESHOLD = 120000
+TOKEN_COUNT_CACHE_SIZE = 50000
+
+# Per-message token counts keyed by (model, message_id, content hash), shared by
+# all ContextManager instances in the worker so auto-continue turns and later runs
+# on the same thread only tokenize messages they have not seen before.
+_token_count_cache: "OrderedDict[Tuple[str, Optional[str], str], int]" = OrderedDict()
+_token_count_cache_lock = threading.Lock()
+
+
+def _is_user_message(msg: Dict[str, Any]) -> bool:
+    return msg.get('role') == 'user'
+
+
+def _is_assistant_message(msg: Dict[str, Any]) -> bool:
+    return msg.get('role') == 'assistant'
+
 
 class ContextManager:
     """Manages thread context including token counting and summarization."""
@@ -108,21 +127,77 @@ class ContextManager:
             else:
                 return msg_content
   
-    def compress_tool_result_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: int = 1000) -> List[Dict[str, Any]]:
-        """Compress the tool result messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
+    def _token_cache_key(self, msg: Dict[str, Any], llm_model: str) -> Tuple[str, Optional[str], str]:
+        """Build the token cache key for a message from its message_id and a hash of its content."""
+        content_hash = hashlib.blake2b(digest_size=16)
+        for field in sorted(msg):
+            value = msg[field]
+            if not isinstance(value, str):
+                value = json.dumps(value, sort_keys=True, default=str)
+            content_hash.update(field.encode('utf-8'))
+            content_hash.update(b'\0')
+            content_hash.update(value.encode('utf-8', errors='replace'))
+            content_hash.update(b'\0')
+        return (llm_model, msg.get('message_id'), content_hash.hexdigest())
+
+    def count_message_tokens(self, msg: Dict[str, Any], llm_model: str) -> int:
+        """Count the tokens of a single message, reusing the cached count when the content is unchanged."""
+        if not isinstance(msg, dict):
+            return token_counter(model=llm_model, messages=[msg])
+
+        key = self._token_cache_key(msg, llm_model)
+        with _token_count_cache_lock:
+            cached = _token_count_cache.get(key)
+            if cached is not None:
+                _token_count_cache.move_to_end(key)
+                return cached
+
+        count = token_counter(model=llm_model, messages=[msg])
+
+        with _token_count_cache_lock:
+            _token_count_cache[key] = count
+            _token_count_cache.move_to_end(key)
+            while len(_token_count_cache) > TOKEN_COUNT_CACHE_SIZE:
+                _token_count_cache.popitem(last=False)
+        return count
+
+    def count_tokens(self, messages: List[Dict[str, Any]], llm_model: str) -> int:
+        """Count the tokens of a message list as the sum of the cached per-message counts.
+
+        Only messages that were not seen before (or whose content changed) are
+        passed to the tokenizer. The per-message sum slightly over-estimates the
+        litellm whole-list count, which errs on the safe side for compression.
+        """
+        return sum(self.count_message_tokens(msg, llm_model) for msg in messages)
+
+    def _compress_matching_messages(
+            self,
+            messages: List[Dict[str, Any]],
+            llm_model: str,
+            max_tokens: Optional[int],
+            token_threshold: int,
+            matches: Callable[[Dict[str, Any]], bool],
+            total_token_count: Optional[int] = None
+        ) -> Tuple[List[Dict[str, Any]], int]:
+        """Compress the messages selected by `matches` except the most recent one.
+
+        Returns the messages along with the updated total token count, which is
+        adjusted per compressed message instead of recounting the whole list.
+        """
+        if total_token_count is None:
+            total_token_count = self.count_tokens(messages, llm_model)
         max_tokens_value = max_tokens or (100 * 1000)
 
-        if uncompressed_total_token_count > max_tokens_value:
-            _i = 0  # Count the number of ToolResult messages
+        if total_token_count > max_tokens_value:
+            _i = 0  # Count the number of matching messages
             for msg in reversed(messages):  # Start from the end and work backwards
                 if not isinstance(msg, dict):
                     continue  # Skip non-dict messages
-                if self.is_tool_result_message(msg):  # Only compress ToolResult messages
-                    _i += 1  # Count the number of ToolResult messages
-                    msg_token_count = token_counter(messages=[msg])  # Count the number of tokens in the message
+                if matches(msg):  # Only compress matching messages
+                    _i += 1  # Count the number of matching messages
+                    msg_token_count = self.count_message_tokens(msg, llm_model)  # Count the number of tokens in the message
                     if msg_token_count > token_threshold:  # If the message is too long
-                        if _i > 1:  # If this is not the most recent ToolResult message
+                        if _i > 1:  # If this is not the most recent matching message
                             message_id = msg.get('message_id')  # Get the message_id
                             if message_id:
                                 msg["content"] = self.compress_message(msg["content"], message_id, token_threshold * 3)
@@ -130,55 +205,22 @@ class ContextManager:
                                 logger.warning(f"UNEXPECTED: Message has no message_id {str(msg)[:100]}")
                         else:
                             msg["content"] = self.safe_truncate(msg["content"], int(max_tokens_value * 2))
+                        total_token_count += self.count_message_tokens(msg, llm_model) - msg_token_count
+        return messages, total_token_count
+
+    def compress_tool_result_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: int = 1000) -> List[Dict[str, Any]]:
+        """Compress the tool result messages except the most recent one."""
+        messages, _ = self._compress_matching_messages(messages, llm_model, max_tokens, token_threshold, self.is_tool_result_message)
         return messages
 
     def compress_user_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: int = 1000) -> List[Dict[str, Any]]:
         """Compress the user messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
-        max_tokens_value = max_tokens or (100 * 1000)
-
-        if uncompressed_total_token_count > max_tokens_value:
-            _i = 0  # Count the number of User messages
-            for msg in reversed(messages):  # Start from the end and work backwards
-                if not isinstance(msg, dict):
-                    continue  # Skip non-dict messages
-                if msg.get('role') == 'user':  # Only compress User messages
-                    _i += 1  # Count the number of User messages
-                    msg_token_count = token_counter(messages=[msg])  # Count the number of tokens in the message
-                    if msg_token_count > token_threshold:  # If the message is too long
-                        if _i > 1:  # If this is not the most recent User message
-                            message_id = msg.get('message_id')  # Get the message_id
-                            if message_id:
-                                msg["content"] = self.compress_message(msg["content"], message_id, token_threshold * 3)
-                            else:
-                                logger.warning(f"UNEXPECTED: Message has no message_id {str(msg)[:100]}")
-                        else:
-                            msg["content"] = self.safe_truncate(msg["content"], int(max_tokens_value * 2))
+        messages, _ = self._compress_matching_messages(messages, llm_model, max_tokens, token_threshold, _is_user_message)
         return messages
 
     def compress_assistant_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: int = 1000) -> List[Dict[str, Any]]:
         """Compress the assistant messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
-        max_tokens_value = max_tokens or (100 * 1000)
-        
-        if uncompressed_total_token_count > max_tokens_value:
-            _i = 0  # Count the number of Assistant messages
-            for msg in reversed(messages):  # Start from the end and work backwards
-                if not isinstance(msg, dict):
-                    continue  # Skip non-dict messages
-                if msg.get('role') == 'assistant':  # Only compress Assistant messages
-                    _i += 1  # Count the number of Assistant messages
-                    msg_token_count = token_counter(messages=[msg])  # Count the number of tokens in the message
-                    if msg_token_count > token_threshold:  # If the message is too long
-                        if _i > 1:  # If this is not the most recent Assistant message
-                            message_id = msg.get('message_id')  # Get the message_id
-                            if message_id:
-                                msg["content"] = self.compress_message(msg["content"], message_id, token_threshold * 3)
-                            else:
-                                logger.warning(f"UNEXPECTED: Message has no message_id {str(msg)[:100]}")
-                        else:
-                            msg["content"] = self.safe_truncate(msg["content"], int(max_tokens_value * 2))
-                            
+        messages, _ = self._compress_matching_messages(messages, llm_model, max_tokens, token_threshold, _is_assistant_message)
         return messages
 
     def remove_meta_messages(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -238,13 +280,12 @@ class ContextManager:
         result = messages
         result = self.remove_meta_messages(result)
 
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=result)
-
-        result = self.compress_tool_result_messages(result, llm_model, max_tokens, token_threshold)
-        result = self.compress_user_messages(result, llm_model, max_tokens, token_threshold)
-        result = self.compress_assistant_messages(result, llm_model, max_tokens, token_threshold)
+        uncompressed_total_token_count = self.count_tokens(result, llm_model)
 
-        compressed_token_count = token_counter(model=llm_model, messages=result)
+        # Thread the running total through each pass so only compressed messages are recounted
+        result, compressed_token_count = self._compress_matching_messages(result, llm_model, max_tokens, token_threshold, self.is_tool_result_message, uncompressed_total_token_count)
+        result, compressed_token_count = self._compress_matching_messages(result, llm_model, max_tokens, token_threshold, _is_user_message, compressed_token_count)
+        result, compressed_token_count = self._compress_matching_messages(result, llm_model, max_tokens, token_threshold, _is_assistant_message, compressed_token_count)
 
         logger.debug(f"compress_messages: {uncompressed_total_token_count} -> {compressed_token_count}")  # Log the token compression for debugging later
 
@@ -283,7 +324,8 @@ class ContextManager:
         result = self.remove_meta_messages(result)
 
         # Early exit if no compression needed
-        initial_token_count = token_counter(model=llm_model, messages=result)
+        message_token_counts = [self.count_message_tokens(msg, llm_model) for msg in result]
+        initial_token_count = sum(message_token_counts)
         max_allowed_tokens = max_tokens or (100 * 1000)
         
         if initial_token_count <= max_allowed_tokens:
@@ -292,6 +334,8 @@ class ContextManager:
         # Separate system message (assumed to be first) from conversation messages
         system_message = messages[0] if messages and isinstance(messages[0], dict) and messages[0].get('role') == 'system' else None
         conversation_messages = result[1:] if system_message else result
+        system_token_count = message_token_counts[0] if system_message else 0
+        conversation_token_counts = message_token_counts[1:] if system_message else message_token_counts
         
         safety_limit = 500
         current_token_count = initial_token_count
@@ -309,22 +353,23 @@ class ContextManager:
                 middle_start = len(conversation_messages) // 2 - (removal_batch_size // 2)
                 middle_end = middle_start + removal_batch_size
                 conversation_messages = conversation_messages[:middle_start] + conversation_messages[middle_end:]
+                conversation_token_counts = conversation_token_counts[:middle_start] + conversation_token_counts[middle_end:]
             else:
                 # Remove from earlier messages, preserving recent context
                 messages_to_remove = min(removal_batch_size, len(conversation_messages) // 2)
                 if messages_to_remove > 0:
                     conversation_messages = conversation_messages[messages_to_remove:]
+                    conversation_token_counts = conversation_token_counts[messages_to_remove:]
                 else:
                     # Can't remove any more messages
                     break
 
-            # Recalculate token count
-            messages_to_count = ([system_message] + conversation_messages) if system_message else conversation_messages
-            current_token_count = token_counter(model=llm_model, messages=messages_to_count)
+            # Recalculate token count from the cached per-message counts
+            current_token_count = system_token_count + sum(conversation_token_counts)
 
         # Prepare final result
         final_messages = ([system_message] + conversation_messages) if system_message else conversation_messages
-        final_token_count = token_counter(model=llm_model, messages=final_messages)
+        final_token_count = current_token_count
         
         logger.debug(f"compress_messages_by_omitting_messages: {initial_token_count} -> {final_token_count} tokens ({len(messages)} -> {len(final_messages)} messages)")
             
@@ -0,0 +1,157 @@
+"""
+Write-behind message persistence for AgentPress threads.
+
+Status and tool result messages do not need to be in the database before they
+are streamed to the client, so they are buffered here and inserted in bulk
+instead of paying one Supabase round-trip each on the streaming critical path.
+
+Message ids are assigned when a message is enqueued, so callers get a message
+object back immediately. created_at is assigned by the database when the batch
+is inserted (insert_messages_in_order), in the order the rows were produced, so
+timestamps never depend on the worker's clock. Every immediate write flushes
+the buffered messages ahead of it, which keeps the database order equal to the
+order in which messages were produced. The created_at returned for a buffered
+message is provisional until it is flushed.
+"""
+
+import asyncio
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import List, Dict, Any, Optional
+
+from services.supabase import DBConnection
+from utils.logger import logger
+from utils.retry import retry
+
+DEFAULT_MAX_BATCH_SIZE = 25
+DEFAULT_FLUSH_INTERVAL_SECONDS = 0.5
+
+
+class MessageSink:
+    """Buffers message inserts and flushes them to the messages table in order."""
+
+    def __init__(
+        self,
+        db: DBConnection,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL_SECONDS
+    ):
+        """Initialize the MessageSink.
+
+        Args:
+            db: Database connection used for the inserts
+            max_batch_size: Number of buffered messages that triggers a flush
+            flush_interval: Seconds after the first buffered message before a flush
+        """
+        self.db = db
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self._pending: List[Dict[str, Any]] = []
+        self._lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._last_created_at: Optional[datetime] = None
+
+    def _prepare_row(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Assign a message_id to a row; created_at is left to the database."""
+        row = dict(data)
+        row.setdefault('message_id', str(uuid.uuid4()))
+        row.pop('created_at', None)
+        row.pop('updated_at', None)
+        return row
+
+    def _provisional_timestamp(self) -> str:
+        """Strictly increasing local timestamp for messages that are not inserted yet."""
+        now = datetime.now(timezone.utc)
+        if self._last_created_at and now <= self._last_created_at:
+            now = self._last_created_at + timedelta(microseconds=1)
+        self._last_created_at = now
+        return now.isoformat()
+
+    def enqueue(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Buffer a message for a later bulk insert.
+
+        Returns:
+            The message object as it will be stored, including its message_id
+            and a provisional created_at.
+        """
+        row = self._prepare_row(data)
+        self._pending.append(row)
+
+        if len(self._pending) >= self.max_batch_size:
+            self._schedule_flush(0)
+        elif self._flush_task is None or self._flush_task.done():
+            self._schedule_flush(self.flush_interval)
+        created_at = self._provisional_timestamp()
+        return {**row, 'created_at': created_at, 'updated_at': created_at}
+
+    async def write(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Insert a message immediately, flushing any buffered messages ahead of it.
+
+        Returns:
+            The saved message row, or None if the insert returned no data.
+        """
+        row = self._prepare_row(data)
+        async with self._lock:
+            rows = self._pending + [row]
+            self._pending = []
+            try:
+                result = await self._insert(rows)
+            except BaseException:
+                # Keep the buffered messages for the next flush, the caller handles the failure of its own row
+                self._pending = rows[:-1] + self._pending
+                raise
+
+        for saved in result.data or []:
+            if saved.get('message_id') == row['message_id']:
+                return saved
+        return None
+
+    async def flush(self):
+        """Insert all buffered messages in a single ordered batch."""
+        async with self._lock:
+            if not self._pending:
+                return
+            rows = self._pending
+            self._pending = []
+            try:
+                await self._insert(rows)
+                logger.debug(f"Flushed {len(rows)} buffered messages")
+            except BaseException as e:
+                logger.error(f"Failed to flush {len(rows)} buffered messages: {str(e)}", exc_info=True)
+                self._pending = rows + self._pending
+                raise
+
+    async def close(self):
+        """Flush remaining messages and stop the background flush timer."""
+        if self._flush_task and not self._flush_task.done() and self._flush_task is not asyncio.current_task():
+            self._flush_task.cancel()
+        self._flush_task = None
+        await self.flush()
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    async def _insert(self, rows: List[Dict[str, Any]]):
+        client = await self.db.client
+        return await retry(lambda: client.rpc('insert_messages_in_order', {'p_messages': rows}).execute(), max_attempts=3, delay_seconds=1)
+
+    def _schedule_flush(self, delay: float):
+        if delay > 0 and self._flush_task and not self._flush_task.done():
+            return
+        try:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_after(delay))
+        except RuntimeError:
+            # No running loop, buffered messages are flushed by the next explicit flush
+            self._flush_task = None
+
+    async def _flush_after(self, delay: float):
+        try:
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # Shield the insert so cancelling the timer never drops a batch mid-flight
+            await asyncio.shield(self.flush())
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Background message flush failed: {str(e)}")
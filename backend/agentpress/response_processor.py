@@ -18,7 +18,8 @@ from dataclasses import dataclass
 from utils.logger import logger
 from agentpress.tool import ToolResult
 from agentpress.tool_registry import ToolRegistry
-from agentpress.xml_tool_parser import XMLToolParser
+from agentpress.xml_tool_parser import XMLToolParser, StreamingXMLToolParser, XMLToolCall
+from agentpress.tool_scheduler import ToolScheduler
 from langfuse.client import StatefulTraceClient
 from services.langfuse import langfuse
 from utils.json_helpers import (
@@ -92,7 +93,9 @@ class ResponseProcessor:
         Args:
             tool_registry: Registry of available tools
             add_message_callback: Callback function to add messages to the thread.
-                MUST return the full saved message object (dict) or None.
+                MUST return the full saved message object (dict) or None, and accept
+                a `defer` flag for status and tool messages that may be persisted
+                write-behind.
             agent_config: Optional agent configuration with version information
         """
         self.tool_registry = tool_registry
@@ -100,6 +103,8 @@ class ResponseProcessor:
         self.trace = trace or langfuse.trace(name="anonymous:response_processor")
         # Initialize the XML parser
         self.xml_parser = XMLToolParser()
+        # Starts tool calls as they are parsed, serializing calls that share a resource
+        self.tool_scheduler = ToolScheduler(self.tool_registry, self._execute_tool)
         self.is_agent_builder = False  # Deprecated - keeping for compatibility
         self.target_agent_id = None  # Deprecated - keeping for compatibility
         self.agent_config = agent_config
@@ -121,7 +126,8 @@ class ResponseProcessor:
         type: str,
         content: Union[Dict[str, Any], List[Any], str],
         is_llm_message: bool = False,
-        metadata: Optional[Dict[str, Any]] = None
+        metadata: Optional[Dict[str, Any]] = None,
+        defer: bool = False
     ):
         """Helper to add a message with agent version information if available."""
         agent_id = None
@@ -138,7 +144,8 @@ class ResponseProcessor:
             is_llm_message=is_llm_message,
             metadata=metadata,
             agent_id=agent_id,
-            agent_version_id=agent_version_id
+            agent_version_id=agent_version_id,
+            defer=defer
         )
 
     async def process_streaming_response(
@@ -171,8 +178,12 @@ class ResponseProcessor:
         continuous_state = continuous_state or {}
         accumulated_content = continuous_state.get('accumulated_content', "")
         tool_calls_buffer = {}
-        current_xml_content = accumulated_content   # equal to accumulated_content if auto-continuing, else blank
-        xml_chunks_buffer = []
+        xml_stream_parser = StreamingXMLToolParser(self.xml_parser)
+        # Prime the parser with content from before an auto-continue, so a tool call split across
+        # the continuation is completed. Calls completed in that content were handled by the previous run.
+        xml_stream_parser.feed(accumulated_content)
+        xml_tool_calls_buffer = [] # (tool_call, parsing_details) for XML tool calls parsed from the stream
+        last_xml_tool_call_end = None # End of the last parsed XML tool call in accumulated_content
         pending_tool_executions = []
         yielded_tool_indices = set() # Stores indices of tools whose *status* has been yielded
         tool_index = 0
@@ -212,14 +223,16 @@ class ResponseProcessor:
                 start_content = {"status_type": "thread_run_start", "thread_run_id": thread_run_id}
                 start_msg_obj = await self.add_message(
                     thread_id=thread_id, type="status", content=start_content, 
-                    is_llm_message=False, metadata={"thread_run_id": thread_run_id}
+                    is_llm_message=False, metadata={"thread_run_id": thread_run_id},
+                    defer=True
                 )
                 if start_msg_obj: yield format_for_yield(start_msg_obj)
 
                 assist_start_content = {"status_type": "assistant_response_start"}
                 assist_start_msg_obj = await self.add_message(
                     thread_id=thread_id, type="status", content=assist_start_content, 
-                    is_llm_message=False, metadata={"thread_run_id": thread_run_id}
+                    is_llm_message=False, metadata={"thread_run_id": thread_run_id},
+                    defer=True
                 )
                 if assist_start_msg_obj: yield format_for_yield(assist_start_msg_obj)
             # --- End Start Events ---
@@ -267,8 +280,8 @@ class ResponseProcessor:
                     if delta and hasattr(delta, 'content') and delta.content:
                         chunk_content = delta.content
                         # print(chunk_content, end='', flush=True)
+                        chunk_start_pos = len(accumulated_content)
                         accumulated_content += chunk_content
-                        current_xml_content += chunk_content
 
                         if not (config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls):
                             # Yield ONLY content chunk (don't save)
@@ -288,13 +301,13 @@ class ResponseProcessor:
 
                         # --- Process XML Tool Calls (if enabled and limit not reached) ---
                         if config.xml_tool_calling and not (config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls):
-                            xml_chunks = self._extract_xml_chunks(current_xml_content)
-                            for xml_chunk in xml_chunks:
-                                current_xml_content = current_xml_content.replace(xml_chunk, "", 1)
-                                xml_chunks_buffer.append(xml_chunk)
-                                result = self._parse_xml_tool_call(xml_chunk)
+                            stream_pos_before_chunk = xml_stream_parser.position
+                            for xml_tool_call in xml_stream_parser.feed(chunk_content):
+                                last_xml_tool_call_end = chunk_start_pos + (xml_tool_call.end_offset - stream_pos_before_chunk)
+                                result = self._convert_xml_tool_call(xml_tool_call)
                                 if result:
                                     tool_call, parsing_details = result
+                                    xml_tool_calls_buffer.append(result)
                                     xml_tool_call_count += 1
                                     current_assistant_id = last_assistant_message_object['message_id'] if last_assistant_message_object else None
                                     context = self._create_tool_context(
@@ -307,7 +320,9 @@ class ResponseProcessor:
                                         if started_msg_obj: yield format_for_yield(started_msg_obj)
                                         yielded_tool_indices.add(tool_index) # Mark status as yielded
 
-                                        execution_task = asyncio.create_task(self._execute_tool(tool_call))
+                                        execution_task = self.tool_scheduler.schedule(
+                                            tool_call, sequential=config.tool_execution_strategy == "sequential"
+                                        )
                                         pending_tool_executions.append({
                                             "task": execution_task, "tool_call": tool_call,
                                             "tool_index": tool_index, "context": context
@@ -377,7 +392,9 @@ class ResponseProcessor:
                                 if started_msg_obj: yield format_for_yield(started_msg_obj)
                                 yielded_tool_indices.add(tool_index) # Mark status as yielded
 
-                                execution_task = asyncio.create_task(self._execute_tool(tool_call_data))
+                                execution_task = self.tool_scheduler.schedule(
+                                    tool_call_data, sequential=config.tool_execution_strategy == "sequential"
+                                )
                                 pending_tool_executions.append({
                                     "task": execution_task, "tool_call": tool_call_data,
                                     "tool_index": tool_index, "context": context
@@ -500,7 +517,8 @@ class ResponseProcessor:
                 finish_content = {"status_type": "finish", "finish_reason": "xml_tool_limit_reached"}
                 finish_msg_obj = await self.add_message(
                     thread_id=thread_id, type="status", content=finish_content, 
-                    is_llm_message=False, metadata={"thread_run_id": thread_run_id}
+                    is_llm_message=False, metadata={"thread_run_id": thread_run_id},
+                    defer=True
                 )
                 if finish_msg_obj: yield format_for_yield(finish_msg_obj)
                 logger.debug(f"Stream finished with reason: xml_tool_limit_reached after {xml_tool_call_count} XML tool calls")
@@ -513,11 +531,11 @@ class ResponseProcessor:
             # Only save assistant message if NOT auto-continuing due to length to avoid duplicate messages
             if accumulated_content and not should_auto_continue:
                 # ... (Truncate accumulated_content logic) ...
-                if config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls and xml_chunks_buffer:
-                    last_xml_chunk = xml_chunks_buffer[-1]
-                    last_chunk_end_pos = accumulated_content.find(last_xml_chunk) + len(last_xml_chunk)
-                    if last_chunk_end_pos > 0:
-                        accumulated_content = accumulated_content[:last_chunk_end_pos]
+                if config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls and last_xml_tool_call_end:
+                    accumulated_content = accumulated_content[:last_xml_tool_call_end]
+                    # Close the function_calls block the last tool call was cut from
+                    if accumulated_content.rfind('<function_calls>') > accumulated_content.rfind('</function_calls>'):
+                        accumulated_content += "\n</function_calls>"
 
                 # ... (Extract complete_native_tool_calls logic) ...
                 # Update complete_native_tool_calls from buffer (initialized earlier)
@@ -557,7 +575,8 @@ class ResponseProcessor:
                     err_content = {"role": "system", "status_type": "error", "message": "Failed to save final assistant message"}
                     err_msg_obj = await self.add_message(
                         thread_id=thread_id, type="status", content=err_content, 
-                        is_llm_message=False, metadata={"thread_run_id": thread_run_id}
+                        is_llm_message=False, metadata={"thread_run_id": thread_run_id},
+                        defer=True
                     )
                     if err_msg_obj: yield format_for_yield(err_msg_obj)
 
@@ -576,21 +595,15 @@ class ResponseProcessor:
                  # Gather XML tool calls from buffer (up to limit)
                 parsed_xml_data = []
                 if config.xml_tool_calling:
-                    # Reparse remaining content just in case (should be empty if processed correctly)
-                    xml_chunks = self._extract_xml_chunks(current_xml_content)
-                    xml_chunks_buffer.extend(xml_chunks)
-                    # Process only chunks not already handled in the stream loop
-                    remaining_limit = config.max_xml_tool_calls - xml_tool_call_count if config.max_xml_tool_calls > 0 else len(xml_chunks_buffer)
-                    xml_chunks_to_process = xml_chunks_buffer[:remaining_limit] # Ensure limit is respected
-
-                    for chunk in xml_chunks_to_process:
-                         parsed_result = self._parse_xml_tool_call(chunk)
-                         if parsed_result:
-                             tool_call, parsing_details = parsed_result
-                             # Avoid adding if already processed during streaming
-                             if not any(exec['tool_call'] == tool_call for exec in pending_tool_executions):
-                                 final_tool_calls_to_process.append(tool_call)
-                                 parsed_xml_data.append({'tool_call': tool_call, 'parsing_details': parsing_details})
+                    # The stream parser emits every complete tool call as it arrives, so the buffer is final here
+                    remaining_limit = config.max_xml_tool_calls - xml_tool_call_count if config.max_xml_tool_calls > 0 else len(xml_tool_calls_buffer)
+                    xml_tool_calls_to_process = xml_tool_calls_buffer[:remaining_limit] # Ensure limit is respected
+
+                    for tool_call, parsing_details in xml_tool_calls_to_process:
+                         # Avoid adding if already processed during streaming
+                         if not any(exec['tool_call'] == tool_call for exec in pending_tool_executions):
+                             final_tool_calls_to_process.append(tool_call)
+                             parsed_xml_data.append({'tool_call': tool_call, 'parsing_details': parsing_details})
 
 
                 all_tool_data_map = {} # tool_index -> {'tool_call': ..., 'parsing_details': ...}
@@ -691,7 +704,8 @@ class ResponseProcessor:
                 finish_content = {"status_type": "finish", "finish_reason": finish_reason}
                 finish_msg_obj = await self.add_message(
                     thread_id=thread_id, type="status", content=finish_content, 
-                    is_llm_message=False, metadata={"thread_run_id": thread_run_id}
+                    is_llm_message=False, metadata={"thread_run_id": thread_run_id},
+                    defer=True
                 )
                 if finish_msg_obj: yield format_for_yield(finish_msg_obj)
 
@@ -707,7 +721,8 @@ class ResponseProcessor:
                 finish_content = {"status_type": "finish", "finish_reason": "agent_terminated"}
                 finish_msg_obj = await self.add_message(
                     thread_id=thread_id, type="status", content=finish_content, 
-                    is_llm_message=False, metadata={"thread_run_id": thread_run_id}
+                    is_llm_message=False, metadata={"thread_run_id": thread_run_id},
+                    defer=True
                 )
                 if finish_msg_obj: yield format_for_yield(finish_msg_obj)
                 
@@ -823,7 +838,8 @@ class ResponseProcessor:
             if (not "AnthropicException - Overloaded" in str(e)):
                 err_msg_obj = await self.add_message(
                     thread_id=thread_id, type="status", content=err_content, 
-                    is_llm_message=False, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None}
+                    is_llm_message=False, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None},
+                    defer=True
                 )
                 if err_msg_obj: yield format_for_yield(err_msg_obj) # Yield the saved error message
                 # Re-raise the same exception (not a new one) to ensure proper error propagation
@@ -847,7 +863,8 @@ class ResponseProcessor:
                     end_content = {"status_type": "thread_run_end"}
                     end_msg_obj = await self.add_message(
                         thread_id=thread_id, type="status", content=end_content, 
-                        is_llm_message=False, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None}
+                        is_llm_message=False, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None},
+                        defer=True
                     )
                     if end_msg_obj: yield format_for_yield(end_msg_obj)
                 except Exception as final_e:
@@ -888,7 +905,8 @@ class ResponseProcessor:
             start_content = {"status_type": "thread_run_start", "thread_run_id": thread_run_id}
             start_msg_obj = await self.add_message(
                 thread_id=thread_id, type="status", content=start_content,
-                is_llm_message=False, metadata={"thread_run_id": thread_run_id}
+                is_llm_message=False, metadata={"thread_run_id": thread_run_id},
+                defer=True
             )
             if start_msg_obj: yield format_for_yield(start_msg_obj)
 
@@ -949,7 +967,8 @@ class ResponseProcessor:
                  err_content = {"role": "system", "status_type": "error", "message": "Failed to save assistant message"}
                  err_msg_obj = await self.add_message(
                      thread_id=thread_id, type="status", content=err_content, 
-                     is_llm_message=False, metadata={"thread_run_id": thread_run_id}
+                     is_llm_message=False, metadata={"thread_run_id": thread_run_id},
+                     defer=True
                  )
                  if err_msg_obj: yield format_for_yield(err_msg_obj)
 
@@ -1004,7 +1023,8 @@ class ResponseProcessor:
                 finish_content = {"status_type": "finish", "finish_reason": finish_reason}
                 finish_msg_obj = await self.add_message(
                     thread_id=thread_id, type="status", content=finish_content, 
-                    is_llm_message=False, metadata={"thread_run_id": thread_run_id}
+                    is_llm_message=False, metadata={"thread_run_id": thread_run_id},
+                    defer=True
                 )
                 if finish_msg_obj: yield format_for_yield(finish_msg_obj)
 
@@ -1031,7 +1051,8 @@ class ResponseProcessor:
              err_content = {"role": "system", "status_type": "error", "message": str(e)}
              err_msg_obj = await self.add_message(
                  thread_id=thread_id, type="status", content=err_content, 
-                 is_llm_message=False, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None}
+                 is_llm_message=False, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None},
+                 defer=True
              )
              if err_msg_obj: yield format_for_yield(err_msg_obj)
              
@@ -1045,7 +1066,8 @@ class ResponseProcessor:
             end_content = {"status_type": "thread_run_end"}
             end_msg_obj = await self.add_message(
                 thread_id=thread_id, type="status", content=end_content, 
-                is_llm_message=False, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None}
+                is_llm_message=False, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None},
+                defer=True
             )
             if end_msg_obj: yield format_for_yield(end_msg_obj)
 
@@ -1082,14 +1104,13 @@ class ResponseProcessor:
             # If no new format found, fall back to old format for backwards compatibility
             if not chunks:
                 pos = 0
+                available_functions = self.tool_registry.get_available_functions()
                 while pos < len(content):
                     # Find the next tool tag
                     next_tag_start = -1
                     current_tag = None
                     
                     # Find the earliest occurrence of any registered tool function name
-                    # Check for available function names
-                    available_functions = self.tool_registry.get_available_functions()
                     for func_name in available_functions.keys():
                         # Convert function name to potential tag name (underscore to dash)
                         tag_name = func_name.replace('_', '-')
@@ -1146,6 +1167,21 @@ class ResponseProcessor:
         
         return chunks
 
+    def _convert_xml_tool_call(self, xml_tool_call: XMLToolCall) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Convert a parsed XMLToolCall into tool call format and parsing details."""
+        tool_call = {
+            "function_name": xml_tool_call.function_name,
+            "xml_tag_name": xml_tool_call.function_name.replace('_', '-'),  # For backwards compatibility
+            "arguments": xml_tool_call.parameters
+        }
+        
+        # Include the parsing details
+        parsing_details = xml_tool_call.parsing_details
+        parsing_details["raw_xml"] = xml_tool_call.raw_xml
+        
+        logger.debug(f"Parsed new format tool call: {tool_call}")
+        return tool_call, parsing_details
+
     def _parse_xml_tool_call(self, xml_chunk: str) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
         """Parse XML chunk into tool call format and return parsing details.
         
@@ -1165,21 +1201,7 @@ class ResponseProcessor:
                     return None
                 
                 # Take the first tool call (should only be one per chunk)
-                xml_tool_call = parsed_calls[0]
-                
-                # Convert to the expected format
-                tool_call = {
-                    "function_name": xml_tool_call.function_name,
-                    "xml_tag_name": xml_tool_call.function_name.replace('_', '-'),  # For backwards compatibility
-                    "arguments": xml_tool_call.parameters
-                }
-                
-                # Include the parsing details
-                parsing_details = xml_tool_call.parsing_details
-                parsing_details["raw_xml"] = xml_tool_call.raw_xml
-                
-                logger.debug(f"Parsed new format tool call: {tool_call}")
-                return tool_call, parsing_details
+                return self._convert_xml_tool_call(parsed_calls[0])
             
             # If not the expected <function_calls><invoke> format, return None
             logger.error(f"XML chunk does not contain expected <function_calls><invoke> format: {xml_chunk}")
@@ -1444,8 +1466,9 @@ class ResponseProcessor:
     async def _execute_tools_in_parallel(self, tool_calls: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], ToolResult]]:
         """Execute tool calls in parallel and return results.
         
-        This method executes all tool calls simultaneously using asyncio.gather, which
-        can significantly improve performance when executing multiple independent tools.
+        This method executes tool calls concurrently through the tool scheduler, which
+        runs independent tools simultaneously and serializes tools that declare a
+        shared resource (such as a shell session or file path) in call order.
         
         Args:
             tool_calls: List of tool calls to execute
@@ -1495,11 +1518,8 @@ class ResponseProcessor:
             except Exception:
                 pass
 
-            # Create tasks for all tool calls
-            tasks = [self._execute_tool(tool_call) for tool_call in prefixed_calls]
-            
-            # Execute all tasks concurrently with error handling
-            results = await asyncio.gather(*tasks, return_exceptions=True)
+            # Execute concurrently, serializing only calls that share a declared resource
+            results = await self.tool_scheduler.run_all(prefixed_calls)
             
             # Process results and handle any exceptions
             processed_results = []
@@ -1722,7 +1742,8 @@ class ResponseProcessor:
                     type="tool",  # Special type for tool responses
                     content=tool_message,
                     is_llm_message=True,
-                    metadata=metadata
+                    metadata=metadata,
+                    defer=True
                 )
                 return message_obj # Return the full message object
             
@@ -1753,7 +1774,8 @@ class ResponseProcessor:
                 type="tool",
                 content=result_message_for_llm, # Save the LLM-friendly version
                 is_llm_message=True,
-                metadata=metadata
+                metadata=metadata,
+                defer=True
             )
 
             # If the message was saved, modify it in-memory for the frontend before returning
@@ -1780,7 +1802,8 @@ class ResponseProcessor:
                     type="tool", 
                     content=fallback_message,
                     is_llm_message=True,
-                    metadata={"assistant_message_id": assistant_message_id} if assistant_message_id else {}
+                    metadata={"assistant_message_id": assistant_message_id} if assistant_message_id else {},
+                    defer=True
                 )
                 return message_obj # Return the full message object
             except Exception as e2:
@@ -1876,7 +1899,8 @@ class ResponseProcessor:
         }
         metadata = {"thread_run_id": thread_run_id}
         saved_message_obj = await self.add_message(
-            thread_id=thread_id, type="status", content=content, is_llm_message=False, metadata=metadata
+            thread_id=thread_id, type="status", content=content, is_llm_message=False, metadata=metadata,
+            defer=True
         )
         return saved_message_obj # Return the full object (or None if saving failed)
 
@@ -1909,7 +1933,8 @@ class ResponseProcessor:
         # <<< END ADDED >>>
 
         saved_message_obj = await self.add_message(
-            thread_id=thread_id, type="status", content=content, is_llm_message=False, metadata=metadata
+            thread_id=thread_id, type="status", content=content, is_llm_message=False, metadata=metadata,
+            defer=True
         )
         return saved_message_obj
 
@@ -1927,6 +1952,7 @@ class ResponseProcessor:
         metadata = {"thread_run_id": thread_run_id}
         # Save the status message with is_llm_message=False
         saved_message_obj = await self.add_message(
-            thread_id=thread_id, type="status", content=content, is_llm_message=False, metadata=metadata
+            thread_id=thread_id, type="status", content=content, is_llm_message=False, metadata=metadata,
+            defer=True
         )
         return saved_message_obj
@@ -11,23 +11,26 @@ This module provides comprehensive conversation management, including:
 """
 
 import json
-from typing import List, Dict, Any, Optional, Type, Union, AsyncGenerator, Literal, cast
+from typing import List, Dict, Any, Optional, Tuple, Type, Union, AsyncGenerator, Literal, cast
 from services.llm import make_llm_api_call
 from agentpress.tool import Tool
 from agentpress.tool_registry import ToolRegistry
 from agentpress.context_manager import ContextManager
+from agentpress.message_sink import MessageSink
 from agentpress.response_processor import (
     ResponseProcessor,
     ProcessorConfig
 )
 from services.supabase import DBConnection
+from services import redis
+from services.image_store import age_image_context, image_context_message, inline_stored_images
 from utils.logger import logger
 from langfuse.client import StatefulGenerationClient, StatefulTraceClient
 from services.langfuse import langfuse
-from litellm.utils import token_counter
-from services.billing import calculate_token_cost, handle_usage_with_credits
+from services.usage_events import record_usage_event
 from utils.constants import get_model_context_window
 import re
+import uuid
 from datetime import datetime, timezone, timedelta
 import aiofiles
 import yaml
@@ -35,6 +38,24 @@ import yaml
 # Type alias for tool choice
 ToolChoice = Literal["auto", "required", "none"]
 
+# Redis marker bumped whenever thread messages are deleted, so cached messages get reloaded
+THREAD_MESSAGES_VERSION_PREFIX = "thread_messages_version"
+THREAD_MESSAGES_VERSION_TTL = 24 * 3600
+_VERSION_UNAVAILABLE = object()
+
+
+def _thread_messages_version_key(thread_id: str) -> str:
+    return f"{THREAD_MESSAGES_VERSION_PREFIX}:{thread_id}"
+
+
+async def invalidate_thread_messages_cache(thread_id: str):
+    """Force ThreadManager message caches for a thread to reload on their next read."""
+    try:
+        await redis.set(_thread_messages_version_key(thread_id), str(uuid.uuid4()), ex=THREAD_MESSAGES_VERSION_TTL)
+    except Exception as e:
+        logger.warning(f"Failed to invalidate message cache for thread {thread_id}: {str(e)}")
+
+
 class ThreadManager:
     """Manages conversation threads with LLM models and tool execution.
 
@@ -66,6 +87,11 @@ class ThreadManager:
             agent_config=self.agent_config
         )
         self.context_manager = ContextManager()
+        self.message_sink = MessageSink(self.db)
+        # Per-run cache of LLM-formatted messages, keyed by thread_id
+        self._message_cache: Dict[str, Dict[str, Any]] = {}
+        # Rendered XML tool examples and the registered tools they were rendered for
+        self._xml_examples_cache: Optional[Tuple[tuple, str]] = None
 
     def add_tool(self, tool_class: Type[Tool], function_names: Optional[List[str]] = None, **kwargs):
         """Add a tool to the ThreadManager."""
@@ -131,7 +157,8 @@ class ThreadManager:
         is_llm_message: bool = False,
         metadata: Optional[Dict[str, Any]] = None,
         agent_id: Optional[str] = None,
-        agent_version_id: Optional[str] = None
+        agent_version_id: Optional[str] = None,
+        defer: bool = False
     ):
         """Add a message to the thread in the database.
 
@@ -146,9 +173,12 @@ class ThreadManager:
                       Defaults to None, stored as an empty JSONB object if None.
             agent_id: Optional ID of the agent associated with this message.
             agent_version_id: Optional ID of the specific agent version used.
+            defer: Buffer the insert in the message sink and return the message
+                   object immediately. Deferred messages are flushed in order before
+                   the next immediate write, on the sink's size or time threshold,
+                   and at the end of the run.
         """
         logger.debug(f"Adding message of type '{type}' to thread {thread_id} (agent: {agent_id}, version: {agent_version_id})")
-        client = await self.db.client
 
         # Prepare data for insertion
         data_to_insert = {
@@ -165,55 +195,24 @@ class ThreadManager:
         if agent_version_id:
             data_to_insert['agent_version_id'] = agent_version_id
 
+        if defer:
+            return self.message_sink.enqueue(data_to_insert)
+
         try:
-            # Insert the message and get the inserted row data including the id
-            result = await client.table('messages').insert(data_to_insert).execute()
+            # Insert the message (after any buffered ones) and get the inserted row data including the id
+            saved_message = await self.message_sink.write(data_to_insert)
             logger.debug(f"Successfully added message to thread {thread_id}")
 
-            if result.data and len(result.data) > 0 and isinstance(result.data[0], dict) and 'message_id' in result.data[0]:
-                saved_message = result.data[0]
-                # If this is an assistant_response_end, attempt to deduct credits if over limit
+            if isinstance(saved_message, dict) and 'message_id' in saved_message:
+                # Bill assistant_response_end asynchronously through the usage event pipeline
                 if type == "assistant_response_end" and isinstance(content, dict):
                     try:
-                        usage = content.get("usage", {}) if isinstance(content, dict) else {}
-                        prompt_tokens = int(usage.get("prompt_tokens", 0) or 0)
-                        completion_tokens = int(usage.get("completion_tokens", 0) or 0)
-                        model = content.get("model") if isinstance(content, dict) else None
-                        # Compute token cost
-                        token_cost = calculate_token_cost(prompt_tokens, completion_tokens, model or "unknown")
-                        # Fetch account_id for this thread, which equals user_id for personal accounts
-                        thread_row = await client.table('threads').select('account_id').eq('thread_id', thread_id).limit(1).execute()
-                        user_id = thread_row.data[0]['account_id'] if thread_row.data and len(thread_row.data) > 0 else None
-                        if user_id and token_cost > 0:
-                            # Deduct credits if applicable and record usage against this message
-                            await handle_usage_with_credits(
-                                client,
-                                user_id,
-                                token_cost,
-                                thread_id=thread_id,
-                                message_id=saved_message['message_id'],
-                                model=model or "unknown"
-                            )
-                            # Persist usage log for durable accounting of subscription usage
-                            total_tokens = prompt_tokens + completion_tokens
-                            try:
-                                await client.table('usage_logs').insert({
-                                    'user_id': user_id,
-                                    'thread_id': thread_id,
-                                    'message_id': saved_message['message_id'],
-                                    'total_prompt_tokens': prompt_tokens,
-                                    'total_completion_tokens': completion_tokens,
-                                    'total_tokens': total_tokens,
-                                    'estimated_cost': float(token_cost),
-                                    'content': content
-                                }).execute()
-                            except Exception as log_e:
-                                logger.error(f"Failed to insert usage_logs for message {saved_message.get('message_id')}: {str(log_e)}", exc_info=True)
+                        await record_usage_event(thread_id, saved_message['message_id'], content)
                     except Exception as billing_e:
-                        logger.error(f"Error handling credit usage for message {saved_message.get('message_id')}: {str(billing_e)}", exc_info=True)
+                        logger.error(f"Error queueing usage event for message {saved_message.get('message_id')}: {str(billing_e)}", exc_info=True)
                 return saved_message
             else:
-                logger.error(f"Insert operation failed or did not return expected data structure for thread {thread_id}. Result data: {result.data}")
+                logger.error(f"Insert operation failed or did not return expected data structure for thread {thread_id}. Result data: {saved_message}")
                 return None
         except Exception as e:
             logger.error(f"Failed to add message to thread {thread_id}: {str(e)}", exc_info=True)
@@ -221,8 +220,6 @@ class ThreadManager:
 
     def _emergency_compress_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: int) -> List[Dict[str, Any]]:
         """Emergency compression by removing older messages when normal compression fails."""
-        from litellm.utils import token_counter
-        
         # Keep system message and last few messages
         system_msg = messages[0] if messages and messages[0].get('role') == 'system' else None
         remaining_messages = messages[1:] if system_msg else messages
@@ -235,14 +232,14 @@ class ThreadManager:
         compressed_messages.extend(recent_messages)
         
         # If still too large, keep only the last 5 messages
-        current_tokens = token_counter(model=llm_model, messages=compressed_messages)
+        current_tokens = self.context_manager.count_tokens(compressed_messages, llm_model)
         if current_tokens > max_tokens and len(recent_messages) > 5:
             logger.warning("Emergency compression: Reducing to last 5 messages")
             compressed_messages = [system_msg] if system_msg else []
             compressed_messages.extend(recent_messages[-5:])
         
         # If still too large, keep only the last 3 messages
-        current_tokens = token_counter(model=llm_model, messages=compressed_messages)
+        current_tokens = self.context_manager.count_tokens(compressed_messages, llm_model)
         if current_tokens > max_tokens and len(recent_messages) > 3:
             logger.warning("Emergency compression: Reducing to last 3 messages")
             compressed_messages = [system_msg] if system_msg else []
@@ -250,12 +247,95 @@ class ThreadManager:
         
         return compressed_messages
 
+    async def _fetch_llm_message_rows(self, client, thread_id: str, since: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Fetch LLM message rows for a thread in batches, optionally only rows created at or after `since`."""
+        # Fetch messages in batches of 1000 to avoid overloading the database
+        all_messages = []
+        batch_size = 1000
+        offset = 0
+
+        while True:
+            query = client.table('messages').select('message_id, content, type, created_at').eq('thread_id', thread_id).or_('is_llm_message.eq.true,type.eq.image_context')
+            if since:
+                query = query.gte('created_at', since)
+            result = await query.order('created_at').range(offset, offset + batch_size - 1).execute()
+
+            if not result.data or len(result.data) == 0:
+                break
+
+            all_messages.extend(result.data)
+
+            # If we got fewer than batch_size records, we've reached the end
+            if len(result.data) < batch_size:
+                break
+
+            offset += batch_size
+
+        return all_messages
+
+    def _parse_llm_message_rows(self, result_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Convert message rows into LLM-formatted message objects."""
+        messages = []
+        for item in result_data:
+            # Handle image_context messages specially
+            if item.get('type') == 'image_context':
+                # Convert image_context to a user message with image content for LLM
+                content = item['content']
+                if isinstance(content, str):
+                    try:
+                        content = json.loads(content)
+                    except json.JSONDecodeError:
+                        logger.error(f"Failed to parse image_context message: {item['content']}")
+                        continue
+
+                messages.append(image_context_message(content, item['message_id']))
+            else:
+                # Handle regular messages
+                if isinstance(item['content'], str):
+                    try:
+                        parsed_item = json.loads(item['content'])
+                        parsed_item['message_id'] = item['message_id']
+                        messages.append(parsed_item)
+                    except json.JSONDecodeError:
+                        logger.error(f"Failed to parse message: {item['content']}")
+                else:
+                    content = item['content']
+                    content['message_id'] = item['message_id']
+                    messages.append(content)
+        return messages
+
+    async def _get_thread_messages_version(self, thread_id: str) -> Optional[str]:
+        """Get the thread's message version marker, bumped whenever messages are deleted."""
+        try:
+            return await redis.get(_thread_messages_version_key(thread_id))
+        except Exception as e:
+            logger.warning(f"Failed to read message version for thread {thread_id}, reloading messages: {str(e)}")
+            return _VERSION_UNAVAILABLE
+
+    def invalidate_message_cache(self, thread_id: Optional[str] = None):
+        """Drop cached messages for a thread, or for all threads if thread_id is None."""
+        if thread_id is None:
+            self._message_cache.clear()
+        else:
+            self._message_cache.pop(thread_id, None)
+
+    async def delete_message(self, thread_id: str, message_id: str):
+        """Delete an LLM message from the thread and invalidate cached thread messages."""
+        client = await self.db.client
+        await client.table('messages').delete().eq('message_id', message_id).eq('is_llm_message', True).eq('thread_id', thread_id).execute()
+        self.invalidate_message_cache(thread_id)
+        await invalidate_thread_messages_cache(thread_id)
+
     async def get_llm_messages(self, thread_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
         """Get messages for a thread.
 
         When limit is provided, fetch only the most recent messages for
         faster simple-chat performance.
 
+        Otherwise the thread is loaded once per ThreadManager and cached; later
+        calls only fetch and parse rows created since the last seen row. The
+        cache is reloaded in full when messages are deleted from the thread.
+
         Args:
             thread_id: The ID of the thread to get messages for.
 
@@ -265,89 +345,109 @@ class ThreadManager:
         logger.debug(f"Getting messages for thread {thread_id}")
         client = await self.db.client
 
+        # Make buffered tool results from the previous turn visible to this read. A failed
+        # flush is raised: reading without them would send the LLM an incomplete history.
+        await self.message_sink.flush()
+
         try:
             # result = await client.rpc('get_llm_formatted_messages', {'p_thread_id': thread_id}).execute()
             
             if limit is not None and limit > 0:
                 # Fast path: only fetch latest N LLM messages + image_context messages
                 result = await client.table('messages').select('message_id, content, type').eq('thread_id', thread_id).or_('is_llm_message.eq.true,type.eq.image_context').order('created_at', desc=True).limit(limit).execute()
-                result_data = list(reversed(result.data or []))
+                return age_image_context(self._parse_llm_message_rows(list(reversed(result.data or []))))
+
+            version = await self._get_thread_messages_version(thread_id)
+            cached = self._message_cache.get(thread_id)
+
+            if cached is None or version == _VERSION_UNAVAILABLE or cached['version'] != version:
+                result_data = await self._fetch_llm_message_rows(client, thread_id)
+                cached = {
+                    'version': version,
+                    'messages': self._parse_llm_message_rows(result_data),
+                    'message_ids': {item['message_id'] for item in result_data},
+                    'last_created_at': result_data[-1]['created_at'] if result_data else None,
+                }
+                self._message_cache[thread_id] = cached
+                logger.debug(f"Loaded {len(result_data)} messages for thread {thread_id} into message cache")
             else:
-                # Fetch messages in batches of 1000 to avoid overloading the database
-                all_messages = []
-                batch_size = 1000
-                offset = 0
-                
-                while True:
-                    result = await client.table('messages').select('message_id, content, type').eq('thread_id', thread_id).or_('is_llm_message.eq.true,type.eq.image_context').order('created_at').range(offset, offset + batch_size - 1).execute()
-                    
-                    if not result.data or len(result.data) == 0:
-                        break
-                        
-                    all_messages.extend(result.data)
-                    
-                    # If we got fewer than batch_size records, we've reached the end
-                    if len(result.data) < batch_size:
-                        break
-                        
-                    offset += batch_size
-                
-                # Use all_messages instead of result.data in the rest of the method
-                result_data = all_messages
-
-            # Parse the returned data which might be stringified JSON
-            if not result_data:
-                return []
-
-            # Return properly parsed JSON objects
-            messages = []
-            for item in result_data:
-                # Handle image_context messages specially
-                if item.get('type') == 'image_context':
-                    # Convert image_context to a user message with image content for LLM
-                    content = item['content']
-                    if isinstance(content, str):
-                        try:
-                            content = json.loads(content)
-                        except json.JSONDecodeError:
-                            logger.error(f"Failed to parse image_context message: {item['content']}")
-                            continue
-                    
-                    # Convert to OpenAI-compatible image message format
-                    image_message = {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:{content.get('mime_type', 'image/jpeg')};base64,{content.get('base64', '')}"
-                                }
-                            }
-                        ],
-                        "message_id": item['message_id']
-                    }
-                    messages.append(image_message)
-                else:
-                    # Handle regular messages
-                    if isinstance(item['content'], str):
-                        try:
-                            parsed_item = json.loads(item['content'])
-                            parsed_item['message_id'] = item['message_id']
-                            messages.append(parsed_item)
-                        except json.JSONDecodeError:
-                            logger.error(f"Failed to parse message: {item['content']}")
-                    else:
-                        content = item['content']
-                        content['message_id'] = item['message_id']
-                        messages.append(content)
-
-            return messages
+                # Delta fetch: rows sharing the last seen timestamp are refetched and skipped by message_id
+                result_data = await self._fetch_llm_message_rows(client, thread_id, since=cached['last_created_at'])
+                new_rows = [item for item in result_data if item['message_id'] not in cached['message_ids']]
+                if new_rows:
+                    cached['messages'].extend(self._parse_llm_message_rows(new_rows))
+                    cached['message_ids'].update(item['message_id'] for item in new_rows)
+                    cached['last_created_at'] = new_rows[-1]['created_at']
+                logger.debug(f"Fetched {len(new_rows)} new messages for thread {thread_id}")
+
+            # Return shallow copies so context compression cannot rewrite cached messages
+            return age_image_context([dict(msg) for msg in cached['messages']])
 
         except Exception as e:
             logger.error(f"Failed to get messages for thread {thread_id}: {str(e)}", exc_info=True)
             return []
 
 
+    def _get_xml_examples_content(self) -> str:
+        """Render the XML tool calling instructions for the registered tools.
+
+        The rendered text is reused across iterations of a run until the set of
+        registered tools changes, instead of re-serializing every schema each time.
+        """
+        registered = tuple((name, tool_info['schema']) for name, tool_info in self.tool_registry.tools.items())
+        if self._xml_examples_cache is not None:
+            cached_registered, cached_content = self._xml_examples_cache
+            if len(cached_registered) == len(registered) and all(
+                name == cached_name and schema is cached_schema
+                for (name, schema), (cached_name, cached_schema) in zip(registered, cached_registered)
+            ):
+                return cached_content
+
+        openapi_schemas = self.tool_registry.get_openapi_schemas()
+        usage_examples = self.tool_registry.get_usage_examples()
+        examples_content = ""
+
+        if openapi_schemas:
+            # Convert schemas to JSON string
+            schemas_json = json.dumps(openapi_schemas, indent=2)
+            
+            # Build usage examples section if any exist
+            usage_examples_section = ""
+            if usage_examples:
+                usage_examples_section = "\n\nUsage Examples:\n"
+                for func_name, example in usage_examples.items():
+                    usage_examples_section += f"\n{func_name}:\n{example}\n"
+
+            examples_content = f"""
+In this environment you have access to a set of tools you can use to answer the user's question.
+
+You can invoke functions by writing a <function_calls> block like the following as part of your reply to the user:
+
+<function_calls>
+<invoke name="function_name">
+<parameter name="param_name">param_value</parameter>
+...
+</invoke>
+</function_calls>
+
+String and scalar parameters should be specified as-is, while lists and objects should use JSON format.
+
+Here are the functions available in JSON Schema format:
+
+```json
+{schemas_json}
+```
+
+When using the tools:
+- Use the exact function names from the JSON schema above
+- Include all required parameters as specified in the schema
+- Format complex data (objects, arrays) as JSON strings within the parameter tags
+- Boolean values should be "true" or "false" (lowercase)
+{usage_examples_section}"""
+
+        self._xml_examples_cache = (registered, examples_content)
+        return examples_content
+
     async def run_thread(
         self,
         thread_id: str,
@@ -412,47 +512,8 @@ class ThreadManager:
 
         # Add XML tool calling instructions to system prompt if requested
         if include_xml_examples and config.xml_tool_calling:
-            openapi_schemas = self.tool_registry.get_openapi_schemas()
-            usage_examples = self.tool_registry.get_usage_examples()
-            
-            if openapi_schemas:
-                # Convert schemas to JSON string
-                schemas_json = json.dumps(openapi_schemas, indent=2)
-                
-                # Build usage examples section if any exist
-                usage_examples_section = ""
-                if usage_examples:
-                    usage_examples_section = "\n\nUsage Examples:\n"
-                    for func_name, example in usage_examples.items():
-                        usage_examples_section += f"\n{func_name}:\n{example}\n"
-                
-                examples_content = f"""
-In this environment you have access to a set of tools you can use to answer the user's question.
-
-You can invoke functions by writing a <function_calls> block like the following as part of your reply to the user:
-
-<function_calls>
-<invoke name="function_name">
-<parameter name="param_name">param_value</parameter>
-...
-</invoke>
-</function_calls>
-
-String and scalar parameters should be specified as-is, while lists and objects should use JSON format.
-
-Here are the functions available in JSON Schema format:
-
-```json
-{schemas_json}
-```
-
-When using the tools:
-- Use the exact function names from the JSON schema above
-- Include all required parameters as specified in the schema
-- Format complex data (objects, arrays) as JSON strings within the parameter tags
-- Boolean values should be "true" or "false" (lowercase)
-{usage_examples_section}"""
-
+            examples_content = self._get_xml_examples_content()
+            if examples_content:
                 # # Save examples content to a file
                 # try:
                 #     with open('xml_examples.txt', 'w') as f:
@@ -505,7 +566,8 @@ When using the tools:
                 if not simple_chat_mode:
                     try:
                         # Use the potentially modified working_system_prompt for token counting
-                        token_count = token_counter(model=llm_model, messages=[working_system_prompt] + messages)
+                        # Per-message counts are cached, so only messages added since the last turn are tokenized
+                        token_count = self.context_manager.count_tokens([working_system_prompt] + messages, llm_model)
                         token_threshold = self.context_manager.token_threshold
                         logger.debug(f"Thread {thread_id} token count: {token_count}/{token_threshold} ({(token_count/token_threshold)*100:.1f}%)")
 
@@ -567,7 +629,7 @@ When using the tools:
                     
                     # Final token count check after compression
                     try:
-                        final_token_count = token_counter(model=llm_model, messages=prepared_messages)
+                        final_token_count = self.context_manager.count_tokens(prepared_messages, llm_model)
                         context_window = get_model_context_window(llm_model)
                         max_safe_tokens = context_window - 32000  # Reserve space for response
                         
@@ -575,7 +637,7 @@ When using the tools:
                             logger.error(f"Token count {final_token_count} still exceeds safe limit {max_safe_tokens} after compression. Context window: {context_window}")
                             # Apply emergency compression by removing older messages
                             prepared_messages = self._emergency_compress_messages(prepared_messages, llm_model, max_safe_tokens)
-                            final_token_count = token_counter(model=llm_model, messages=prepared_messages)
+                            final_token_count = self.context_manager.count_tokens(prepared_messages, llm_model)
                             logger.warning(f"Emergency compression applied. Final token count: {final_token_count}")
                         
                         logger.debug(f"Final token count after compression: {final_token_count}/{context_window}")
@@ -583,6 +645,9 @@ When using the tools:
                     except Exception as e:
                         logger.error(f"Error in final token count check: {str(e)}")
 
+                # Stored images are private; inline them before they reach any provider
+                prepared_messages = await inline_stored_images(prepared_messages)
+
                 # 5. Make LLM API call
                 logger.debug("Making LLM API call")
                 try:
@@ -756,11 +821,25 @@ When using the tools:
                     "content": f"\n[Agent reached maximum auto-continue limit of {native_max_auto_continues}]"
                 }
 
+        # Define a wrapper generator that persists buffered messages when the run ends
+        async def flush_messages_wrapper(response_gen: AsyncGenerator):
+            try:
+                async for chunk in response_gen:
+                    yield chunk
+            finally:
+                try:
+                    await self.message_sink.close()
+                except Exception as e:
+                    logger.error(f"Failed to flush buffered messages for thread {thread_id}: {str(e)}", exc_info=True)
+
         # If auto-continue is disabled (max=0), just run once
         if native_max_auto_continues == 0:
             logger.debug("Auto-continue is disabled (native_max_auto_continues=0)")
             # Pass the potentially modified system prompt and temp message
-            return await _run_once(temporary_message)
+            response_gen = await _run_once(temporary_message)
+            if hasattr(response_gen, '__aiter__'):
+                return flush_messages_wrapper(cast(AsyncGenerator, response_gen))
+            return response_gen
 
         # Otherwise return the auto-continue wrapper generator
-        return auto_continue_wrapper()
\ No newline at end of file
+        return flush_messages_wrapper(auto_continue_wrapper())
\ No newline at end of file
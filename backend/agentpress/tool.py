@@ -4,6 +4,7 @@ Core tool system providing the foundation for creating and managing tools.
 This module defines the base classes and decorators for creating tools in AgentPress:
 - Tool base class for implementing tool functionality
 - Schema decorators for OpenAPI tool definitions
+- Execution policy decorator for scheduling tool calls
 - Result containers for standardized tool outputs
 """
 
@@ -31,6 +32,44 @@ class ToolSchema:
     schema_type: SchemaType
     schema: Dict[str, Any]
 
+@dataclass
+class ToolExecutionPolicy:
+    """Scheduling constraints for a tool function.
+    
+    Attributes:
+        resources (List[str]): Resources the call uses exclusively. Calls sharing a
+            resource run one after another in the order they were scheduled.
+            Entries may reference call arguments, e.g. "file:{file_path}"; an entry
+            whose arguments are missing or None is ignored.
+        max_concurrency (Optional[int]): Maximum concurrent calls of the function
+        timeout (Optional[float]): Seconds after which a call is abandoned
+    """
+    resources: List[str] = field(default_factory=list)
+    max_concurrency: Optional[int] = None
+    timeout: Optional[float] = None
+
+    def resolve_resources(self, arguments: Dict[str, Any]) -> List[str]:
+        """Resolve resource templates against the call arguments."""
+        resolved = []
+        for resource in self.resources:
+            try:
+                value = resource.format_map(_RequiredArguments(arguments))
+            except (KeyError, IndexError, ValueError):
+                continue
+            resolved.append(value)
+        return resolved
+
+class _RequiredArguments(dict):
+    """Mapping for resource templates that treats None arguments as missing."""
+    def __missing__(self, key):
+        raise KeyError(key)
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
 @dataclass
 class ToolResult:
     """Container for tool execution results.
@@ -78,6 +117,16 @@ class Tool(ABC):
         """
         return self._schemas
 
+    def get_execution_policy(self, method_name: str) -> ToolExecutionPolicy:
+        """Get the execution policy for a tool method.
+        
+        Returns:
+            The method's policy, else the class policy, else an unrestricted policy
+        """
+        method = getattr(self.__class__, method_name, None)
+        policy = getattr(method, 'tool_execution_policy', None) or getattr(self.__class__, 'tool_execution_policy', None)
+        return policy or ToolExecutionPolicy()
+
     def success_response(self, data: Union[Dict[str, Any], str]) -> ToolResult:
         """Create a successful tool result.
         
@@ -134,6 +183,18 @@ def usage_example(example: str):
         ))
     return decorator
 
+def execution_policy(resources: Optional[List[str]] = None, max_concurrency: Optional[int] = None, timeout: Optional[float] = None):
+    """Decorator declaring scheduling constraints for a tool method, or for all methods of a tool class."""
+    def decorator(target):
+        target.tool_execution_policy = ToolExecutionPolicy(
+            resources=list(resources or []),
+            max_concurrency=max_concurrency,
+            timeout=timeout
+        )
+        logger.debug(f"Applied execution policy to {target.__name__}")
+        return target
+    return decorator
+
 # def xml_schema(**kwargs):
 #     """Deprecated decorator - does nothing, kept for compatibility."""
 #     def decorator(func):
@@ -0,0 +1,127 @@
+"""
+Dependency-aware tool call scheduling for AgentPress.
+
+Tool calls are started as soon as they are scheduled, typically while the LLM is
+still streaming the rest of its response. Calls that share a resource declared
+through the `execution_policy` decorator (a shell session, a file path, the
+browser) run one after another in the order they were scheduled, while
+independent calls such as web searches run concurrently. Per-function
+concurrency limits and timeouts from the policy are applied here as well.
+"""
+
+import asyncio
+import contextlib
+import json
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from agentpress.tool import ToolExecutionPolicy, ToolResult
+from agentpress.tool_registry import ToolRegistry
+from utils.json_helpers import safe_json_parse
+from utils.logger import logger
+
+
+class ToolScheduler:
+    """Schedules tool executions, serializing calls that share a resource."""
+
+    def __init__(self, tool_registry: ToolRegistry, execute: Callable[[Dict[str, Any]], Awaitable[ToolResult]]):
+        """Initialize the ToolScheduler.
+
+        Args:
+            tool_registry: Registry used to look up each tool's execution policy
+            execute: Coroutine function that executes a single tool call
+        """
+        self.tool_registry = tool_registry
+        self.execute = execute
+        # Most recently scheduled task holding each resource
+        self._resource_tails: Dict[str, asyncio.Task] = {}
+        self._running: Set[asyncio.Task] = set()
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def schedule(self, tool_call: Dict[str, Any], sequential: bool = False) -> asyncio.Task:
+        """Start a tool call as soon as the resources it uses are free.
+
+        Args:
+            tool_call: Tool call with 'function_name' and 'arguments'
+            sequential: Also wait for every call scheduled before this one
+
+        Returns:
+            Task resolving to the call's ToolResult
+        """
+        function_name = tool_call["function_name"]
+        policy = self._get_policy(function_name)
+        resources = policy.resolve_resources(self._get_arguments(tool_call))
+
+        if sequential:
+            predecessors = list(self._running)
+        else:
+            predecessors = [self._resource_tails[r] for r in resources if r in self._resource_tails]
+
+        task = asyncio.create_task(self._run(tool_call, policy, predecessors))
+        self._running.add(task)
+        for resource in resources:
+            self._resource_tails[resource] = task
+        task.add_done_callback(self._release)
+
+        if predecessors:
+            logger.debug(f"Scheduled tool {function_name} after {len(predecessors)} earlier call(s) sharing {resources or 'the sequence'}")
+        return task
+
+    async def run_all(self, tool_calls: List[Dict[str, Any]]) -> List[Any]:
+        """Schedule tool calls together and wait for all of them.
+
+        Returns:
+            Results in call order, with exceptions returned in place of results
+        """
+        tasks = [self.schedule(tool_call) for tool_call in tool_calls]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, tool_call: Dict[str, Any], policy: ToolExecutionPolicy, predecessors: List[asyncio.Task]) -> ToolResult:
+        if predecessors:
+            # Wait regardless of how the predecessors finished
+            await asyncio.wait(predecessors)
+
+        function_name = tool_call["function_name"]
+        semaphore = self._get_semaphore(function_name, policy)
+        async with semaphore if semaphore else contextlib.nullcontext():
+            if not policy.timeout:
+                return await self.execute(tool_call)
+            try:
+                return await asyncio.wait_for(self.execute(tool_call), timeout=policy.timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Tool {function_name} timed out after {policy.timeout} seconds")
+                return ToolResult(success=False, output=f"Tool '{function_name}' timed out after {policy.timeout} seconds")
+
+    def _release(self, task: asyncio.Task):
+        self._running.discard(task)
+        for resource, tail in list(self._resource_tails.items()):
+            if tail is task:
+                del self._resource_tails[resource]
+
+    def _get_policy(self, function_name: str) -> ToolExecutionPolicy:
+        tool_info = self.tool_registry.tools.get(function_name)
+        instance = tool_info.get("instance") if tool_info else None
+        get_policy = getattr(instance, "get_execution_policy", None)
+        if not get_policy:
+            return ToolExecutionPolicy()
+        try:
+            return get_policy(function_name)
+        except Exception as e:
+            logger.warning(f"Failed to get execution policy for {function_name}: {e}")
+            return ToolExecutionPolicy()
+
+    def _get_semaphore(self, function_name: str, policy: ToolExecutionPolicy) -> Optional[asyncio.Semaphore]:
+        if not policy.max_concurrency:
+            return None
+        if function_name not in self._semaphores:
+            self._semaphores[function_name] = asyncio.Semaphore(policy.max_concurrency)
+        return self._semaphores[function_name]
+
+    @staticmethod
+    def _get_arguments(tool_call: Dict[str, Any]) -> Dict[str, Any]:
+        arguments = tool_call.get("arguments") or {}
+        if isinstance(arguments, str):
+            try:
+                arguments = safe_json_parse(arguments)
+            except json.JSONDecodeError:
+                return {}
+        return arguments if isinstance(arguments, dict) else {}
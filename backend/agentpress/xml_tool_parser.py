@@ -22,6 +22,8 @@ class XMLToolCall:
     parameters: Dict[str, Any]
     raw_xml: str
     parsing_details: Dict[str, Any]
+    # Offset just past the closing </invoke> in the streamed content, set by StreamingXMLToolParser
+    end_offset: Optional[int] = None
 
 
 class XMLToolParser:
@@ -221,6 +223,115 @@ class XMLToolParser:
         return True, None
 
 
+class StreamingXMLToolParser:
+    """
+    Incremental parser for XML tool calls in streamed content.
+    
+    Content is fed delta by delta. The parser is a small state machine (outside
+    a function_calls block, inside a block, inside an invoke) that resumes from
+    where the previous delta stopped, so each character is scanned a bounded
+    number of times however long the response gets. A tool call is returned as
+    soon as its closing </invoke> tag arrives, without waiting for the end of
+    the function_calls block.
+    """
+    
+    BLOCK_START = '<function_calls>'
+    BLOCK_END = '</function_calls>'
+    INVOKE_END = '</invoke>'
+    
+    # Next token of interest inside a function_calls block
+    BLOCK_TOKEN_PATTERN = re.compile(r'<invoke\s|</function_calls>')
+    BLOCK_TOKEN_MAX_LENGTH = len(BLOCK_END)
+    
+    def __init__(self, parser: Optional[XMLToolParser] = None):
+        """
+        Initialize the streaming parser.
+        
+        Args:
+            parser: XMLToolParser used to parse completed invoke blocks
+        """
+        self.parser = parser or XMLToolParser()
+        self.position = 0
+        self._in_block = False
+        # Raw text of the invoke being received, None when not inside an invoke
+        self._invoke_parts: Optional[List[str]] = None
+        # Unscanned tail that may hold the beginning of a tag split across deltas
+        self._carry = ''
+    
+    def feed(self, text: str) -> List[XMLToolCall]:
+        """
+        Feed the next piece of streamed content.
+        
+        Args:
+            text: The newly received content
+            
+        Returns:
+            Tool calls whose invoke block was completed by this content
+        """
+        data_offset = self.position - len(self._carry)
+        self.position += len(text)
+        data = self._carry + text
+        self._carry = ''
+        pos = 0
+        tool_calls = []
+        
+        while True:
+            if self._invoke_parts is not None:
+                end = data.find(self.INVOKE_END, pos)
+                if end == -1:
+                    keep_from = max(pos, len(data) - len(self.INVOKE_END) + 1)
+                    self._invoke_parts.append(data[pos:keep_from])
+                    self._carry = data[keep_from:]
+                    break
+                
+                end += len(self.INVOKE_END)
+                self._invoke_parts.append(data[pos:end])
+                tool_call = self._parse_invoke(''.join(self._invoke_parts))
+                self._invoke_parts = None
+                if tool_call:
+                    tool_call.end_offset = data_offset + end
+                    tool_calls.append(tool_call)
+                pos = end
+            
+            elif self._in_block:
+                match = self.BLOCK_TOKEN_PATTERN.search(data, pos)
+                if not match:
+                    self._carry = data[max(pos, len(data) - self.BLOCK_TOKEN_MAX_LENGTH + 1):]
+                    break
+                
+                if match.group(0) == self.BLOCK_END:
+                    self._in_block = False
+                    pos = match.end()
+                else:
+                    self._invoke_parts = []
+                    pos = match.start()
+            
+            else:
+                start = data.find(self.BLOCK_START, pos)
+                if start == -1:
+                    self._carry = data[max(pos, len(data) - len(self.BLOCK_START) + 1):]
+                    break
+                
+                self._in_block = True
+                pos = start + len(self.BLOCK_START)
+        
+        return tool_calls
+    
+    def _parse_invoke(self, raw_invoke: str) -> Optional[XMLToolCall]:
+        """Parse one complete invoke block."""
+        match = self.parser.INVOKE_PATTERN.match(raw_invoke)
+        if not match:
+            logger.error(f"Malformed invoke block in streamed content: {raw_invoke[:200]}")
+            return None
+        
+        function_name, invoke_content = match.groups()
+        try:
+            return self.parser._parse_invoke_block(function_name, invoke_content, raw_invoke)
+        except Exception as e:
+            logger.error(f"Error parsing invoke block for {function_name}: {e}")
+            return None
+
+
 # Convenience function for quick parsing
 def parse_xml_tool_calls(content: str) -> List[XMLToolCall]:
     """
@@ -4,7 +4,7 @@ load_dotenv()
 from fastapi import FastAPI, Request, HTTPException, Response, Depends, APIRouter
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, StreamingResponse
-from services import redis
+from services import redis, http_client
 import sentry
 from contextlib import asynccontextmanager
 from agentpress.thread_manager import ThreadManager
@@ -68,6 +68,8 @@ async def lifespan(app: FastAPI):
         
         # Start background tasks
         # asyncio.create_task(agent_api.restore_running_agent_runs())
+        from sandbox.pool import sandbox_pool
+        sandbox_pool.schedule_refill()
         
         triggers_api.initialize(db)
         pipedream_api.initialize(db)
@@ -80,6 +82,11 @@ async def lifespan(app: FastAPI):
         # Clean up agent resources
         logger.debug("Cleaning up agent resources")
         await agent_api.cleanup()
+
+        try:
+            await http_client.close_http_client()
+        except Exception as e:
+            logger.error(f"Error closing shared HTTP client: {e}")
         
         # Clean up Redis connection
         try:
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Benchmark for ContextManager.compress_messages token accounting.
+
+Compares, on synthetic 50/300/1000-message threads:
+
+- baseline: the previous implementation, which ran litellm's token_counter over
+  the whole message list before and after every compression pass
+- cold: per-message counting with an empty token cache
+- warm: per-message counting where only the message appended since the
+  previous turn is tokenized
+"""
+
+import copy
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import agentpress.context_manager as context_manager_module
+from agentpress.context_manager import ContextManager, _is_assistant_message, _is_user_message
+from utils.constants import get_model_context_window
+
+LLM_MODEL = "gpt-4o"
+THREAD_SIZES = [50, 300, 1000]
+
+
+class BaselineContextManager(ContextManager):
+    """compress_messages as it was before per-message token counting, for comparison."""
+
+    def _baseline_compress(self, messages, llm_model, max_tokens, token_threshold, matches):
+        uncompressed_total_token_count = context_manager_module.token_counter(model=llm_model, messages=messages)
+        max_tokens_value = max_tokens or (100 * 1000)
+
+        if uncompressed_total_token_count > max_tokens_value:
+            _i = 0
+            for msg in reversed(messages):
+                if not isinstance(msg, dict) or not matches(msg):
+                    continue
+                _i += 1
+                msg_token_count = context_manager_module.token_counter(messages=[msg])
+                if msg_token_count > token_threshold:
+                    if _i > 1:
+                        if msg.get('message_id'):
+                            msg["content"] = self.compress_message(msg["content"], msg['message_id'], token_threshold * 3)
+                    else:
+                        msg["content"] = self.safe_truncate(msg["content"], int(max_tokens_value * 2))
+        return messages
+
+    def compress_messages(self, messages, llm_model, max_tokens=41000, token_threshold=4096, max_iterations=5):
+        context_window = get_model_context_window(llm_model)
+        if context_window >= 1_000_000:
+            max_tokens = context_window - 300_000
+        elif context_window >= 400_000:
+            max_tokens = context_window - 64_000
+        elif context_window >= 200_000:
+            max_tokens = context_window - 32_000
+        elif context_window >= 100_000:
+            max_tokens = context_window - 16_000
+        else:
+            max_tokens = context_window - 8_000
+
+        result = self.remove_meta_messages(messages)
+        context_manager_module.token_counter(model=llm_model, messages=result)
+        result = self._baseline_compress(result, llm_model, max_tokens, token_threshold, self.is_tool_result_message)
+        result = self._baseline_compress(result, llm_model, max_tokens, token_threshold, _is_user_message)
+        result = self._baseline_compress(result, llm_model, max_tokens, token_threshold, _is_assistant_message)
+        compressed_token_count = context_manager_module.token_counter(model=llm_model, messages=result)
+
+        if max_iterations <= 0:
+            return self.compress_messages_by_omitting_messages(messages, llm_model, max_tokens)
+        if compressed_token_count > max_tokens:
+            result = self.compress_messages(messages, llm_model, max_tokens, token_threshold // 2, max_iterations - 1)
+        return self.middle_out_messages(result)
+
+    def compress_messages_by_omitting_messages(self, messages, llm_model, max_tokens=41000, removal_batch_size=10, min_messages_to_keep=10):
+        if not messages:
+            return messages
+        result = self.remove_meta_messages(messages)
+        max_allowed_tokens = max_tokens or (100 * 1000)
+        current_token_count = context_manager_module.token_counter(model=llm_model, messages=result)
+        if current_token_count <= max_allowed_tokens:
+            return result
+
+        system_message = messages[0] if isinstance(messages[0], dict) and messages[0].get('role') == 'system' else None
+        conversation_messages = result[1:] if system_message else result
+        safety_limit = 500
+        while current_token_count > max_allowed_tokens and safety_limit > 0:
+            safety_limit -= 1
+            if len(conversation_messages) <= min_messages_to_keep:
+                break
+            if len(conversation_messages) > (removal_batch_size * 2):
+                middle_start = len(conversation_messages) // 2 - (removal_batch_size // 2)
+                conversation_messages = conversation_messages[:middle_start] + conversation_messages[middle_start + removal_batch_size:]
+            else:
+                messages_to_remove = min(removal_batch_size, len(conversation_messages) // 2)
+                if messages_to_remove <= 0:
+                    break
+                conversation_messages = conversation_messages[messages_to_remove:]
+            messages_to_count = ([system_message] + conversation_messages) if system_message else conversation_messages
+            current_token_count = context_manager_module.token_counter(model=llm_model, messages=messages_to_count)
+
+        final_messages = ([system_message] + conversation_messages) if system_message else conversation_messages
+        context_manager_module.token_counter(model=llm_model, messages=final_messages)
+        return final_messages
+
+
+def build_thread(size: int):
+    """Build a synthetic thread mixing user, assistant and tool result messages."""
+    messages = [{"role": "system", "content": "You are a helpful AI assistant.", "message_id": "msg_system"}]
+    for i in range(size):
+        if i % 3 == 0:
+            content = f"Please look at step {i} of the dataset analysis. " * 20
+            messages.append({"role": "user", "content": content, "message_id": f"msg_{i}"})
+        elif i % 3 == 1:
+            content = f"Working on step {i}, running the analysis now. " * 40
+            messages.append({"role": "assistant", "content": content, "message_id": f"msg_{i}"})
+        else:
+            content = '{"tool_execution": {"function_name": "execute_command", "result": {"output": "' + ("row,value\\n" * 200) + '"}}}'
+            messages.append({"role": "user", "content": content, "message_id": f"msg_{i}"})
+    return messages
+
+
+def count_tokenizer_calls():
+    """Wrap the module-level token_counter to count tokenizer invocations."""
+    calls = {"count": 0}
+    original = context_manager_module.token_counter
+
+    def counting_token_counter(*args, **kwargs):
+        calls["count"] += 1
+        return original(*args, **kwargs)
+
+    context_manager_module.token_counter = counting_token_counter
+    return calls
+
+
+def run_compress(cm: ContextManager, messages):
+    messages = copy.deepcopy(messages)  # compress_messages mutates message content in place
+    start = time.perf_counter()
+    cm.compress_messages(messages, LLM_MODEL)
+    return time.perf_counter() - start
+
+
+def benchmark_thread_size(baseline_cm: ContextManager, cm: ContextManager, calls, size: int):
+    messages = build_thread(size)
+
+    # Baseline: whole-list token_counter calls, no cache
+    calls["count"] = 0
+    baseline_seconds = run_compress(baseline_cm, messages)
+    baseline_calls = calls["count"]
+
+    # Cold: nothing cached, every message goes through the tokenizer
+    context_manager_module._token_count_cache.clear()
+    calls["count"] = 0
+    cold_seconds = run_compress(cm, messages)
+    cold_calls = calls["count"]
+
+    # Warm: the previous turn is cached, only the new message is tokenized
+    messages.append({"role": "user", "content": "One more question about the results.", "message_id": "msg_next"})
+    calls["count"] = 0
+    warm_seconds = run_compress(cm, messages)
+    warm_calls = calls["count"]
+
+    print(f"{size:>5} messages | baseline: {baseline_seconds * 1000:9.1f} ms, {baseline_calls:>5} tokenizer calls"
+          f" | cold: {cold_seconds * 1000:9.1f} ms, {cold_calls:>5} calls"
+          f" | warm: {warm_seconds * 1000:9.1f} ms, {warm_calls:>5} calls"
+          f" | speedup vs baseline: cold {baseline_seconds / max(cold_seconds, 1e-9):6.1f}x,"
+          f" warm {baseline_seconds / max(warm_seconds, 1e-9):6.1f}x")
+
+
+def main():
+    cm = ContextManager()
+    baseline_cm = BaselineContextManager()
+    cm.count_tokens(build_thread(1), LLM_MODEL)  # Load the tokenizer outside of the measurements
+    calls = count_tokenizer_calls()
+    print(f"Benchmarking compress_messages with model {LLM_MODEL}")
+    for size in THREAD_SIZES:
+        benchmark_thread_size(baseline_cm, cm, calls, size)
+
+
+if __name__ == "__main__":
+    main()
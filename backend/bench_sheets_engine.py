@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark for analyze_sheet on large CSV files.
+
+Compares the row-based path (chardet over the whole file, every row parsed into
+a list, per-cell float conversion in Python loops) with the columnar engine
+(sample-based encoding detection, chunked streaming parse into NumPy columns,
+vectorized statistics and group_by) on synthetic 100k and 1M-row sheets.
+Pass --memory to also report peak traced memory (much slower).
+"""
+
+import csv
+import io
+import os
+import random
+import sys
+import time
+import tracemalloc
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import chardet
+
+from agent.tools.sb_sheets_tool import SandboxSheetsTool, SheetData
+from agent.tools.utils.sheets_engine import ColumnarSheet
+
+ROW_COUNTS = [100_000, 1_000_000]
+REGIONS = ["NA", "EU", "APAC", "LATAM", "MEA"]
+TARGET_COLUMNS = ["revenue", "units", "discount"]
+GROUP_BY = "region"
+
+
+def build_csv(rows: int) -> bytes:
+    """Build a synthetic sales sheet with a few missing and non-numeric cells."""
+    rng = random.Random(42)
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(["order_id", "region", "product", "revenue", "units", "discount"])
+    for i in range(rows):
+        units = str(rng.randint(1, 50)) if i % 50 else ""
+        discount = f"{rng.random():.3f}" if i % 333 else "n/a"
+        writer.writerow([i, rng.choice(REGIONS), f"product-{rng.randint(1, 500)}", f"{rng.uniform(5, 5000):.2f}", units, discount])
+    return buf.getvalue().encode("utf-8")
+
+
+def legacy_read(data: bytes) -> SheetData:
+    """The row-based CSV read as it was before the columnar engine."""
+    encoding = chardet.detect(data).get("encoding") or "utf-8"
+    rows = [list(r) for r in csv.reader(io.StringIO(data.decode(encoding, errors="replace")))]
+    return SheetData(headers=[str(h) for h in rows[0]], rows=rows[1:])
+
+
+def measure(fn, trace_memory: bool):
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def benchmark_rows(tool: SandboxSheetsTool, rows: int, trace_memory: bool):
+    data = build_csv(rows)
+
+    def row_path():
+        sheet = legacy_read(data)
+        summary = tool._analyze_rows(sheet, TARGET_COLUMNS, None, None)
+        grouped = tool._analyze_rows(sheet, TARGET_COLUMNS, GROUP_BY, None)
+        return summary, grouped
+
+    def columnar_path():
+        sheet = ColumnarSheet.from_csv_bytes(data)
+        summary = SheetData(*sheet.analyze(TARGET_COLUMNS, None, None))
+        grouped = SheetData(*sheet.analyze(TARGET_COLUMNS, GROUP_BY, None))
+        return summary, grouped
+
+    (row_summary, row_grouped), row_seconds, row_peak = measure(row_path, trace_memory)
+    (col_summary, col_grouped), col_seconds, col_peak = measure(columnar_path, trace_memory)
+    assert row_summary.headers == col_summary.headers and row_grouped.headers == col_grouped.headers
+    assert [r[0] for r in row_grouped.rows] == [r[0] for r in col_grouped.rows]
+
+    line = (f"{rows:>9} rows ({len(data) / 1024 / 1024:6.1f} MB)"
+            f" | rows: {row_seconds:7.2f} s | columnar: {col_seconds:6.2f} s"
+            f" | speedup: {row_seconds / max(col_seconds, 1e-9):5.1f}x")
+    if trace_memory:
+        line += f" | peak memory: {row_peak:7.1f} MB -> {col_peak:7.1f} MB"
+    print(line)
+
+
+def main():
+    trace_memory = "--memory" in sys.argv[1:]
+    tool = SandboxSheetsTool.__new__(SandboxSheetsTool)
+    print(f"Benchmarking analyze_sheet (summary + group_by {GROUP_BY}) on {', '.join(TARGET_COLUMNS)}")
+    for rows in ROW_COUNTS:
+        benchmark_rows(tool, rows, trace_memory)
+
+
+if __name__ == "__main__":
+    main()
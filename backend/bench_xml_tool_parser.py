@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark for XML tool call extraction on a streamed response.
+
+Replays a ~50k-token response delta by delta and compares the previous approach
+(rescanning the whole unprocessed buffer with ResponseProcessor._extract_xml_chunks
+after every delta) with StreamingXMLToolParser, which resumes from its last scan
+position and emits each tool call when its </invoke> closes.
+"""
+
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from agentpress.response_processor import ResponseProcessor
+from agentpress.xml_tool_parser import StreamingXMLToolParser
+
+TARGET_TOKENS = 50_000
+CHARS_PER_TOKEN = 4
+DELTA_TOKENS = 3  # Typical number of tokens per streamed content delta
+REGISTERED_TOOLS = 60
+
+
+class _StubToolRegistry:
+    def __init__(self):
+        self._functions = {f"tool_function_{i}": None for i in range(REGISTERED_TOOLS)}
+
+    def get_available_functions(self):
+        return self._functions
+
+
+class _StubTrace:
+    def event(self, **kwargs):
+        pass
+
+
+def record_stream():
+    """Build a response mixing prose with tool calls and split it into deltas."""
+    parts = []
+    length = 0
+    i = 0
+    while length < TARGET_TOKENS * CHARS_PER_TOKEN:
+        prose = f"Step {i}: reviewing the intermediate results before the next action. " * 12
+        call = (
+            "<function_calls>\n"
+            f'<invoke name="create_file">\n'
+            f'<parameter name="file_path">src/module_{i}.py</parameter>\n'
+            f'<parameter name="file_contents">' + ("def handler(event):\n    return event\n" * 25) + "</parameter>\n"
+            "</invoke>\n"
+            "</function_calls>\n"
+        )
+        parts.extend([prose, call])
+        length += len(prose) + len(call)
+        i += 1
+    content = "".join(parts)
+    delta_size = DELTA_TOKENS * CHARS_PER_TOKEN
+    return [content[pos:pos + delta_size] for pos in range(0, len(content), delta_size)], i
+
+
+def run_rescan(deltas):
+    """Previous approach: rescan the unprocessed buffer on every delta."""
+    processor = ResponseProcessor.__new__(ResponseProcessor)
+    processor.tool_registry = _StubToolRegistry()
+    processor.trace = _StubTrace()
+    current_xml_content = ""
+    calls = 0
+    start = time.perf_counter()
+    for delta in deltas:
+        current_xml_content += delta
+        for xml_chunk in processor._extract_xml_chunks(current_xml_content):
+            current_xml_content = current_xml_content.replace(xml_chunk, "", 1)
+            calls += 1
+    return time.perf_counter() - start, calls
+
+
+def run_streaming(deltas):
+    parser = StreamingXMLToolParser()
+    calls = 0
+    start = time.perf_counter()
+    for delta in deltas:
+        calls += len(parser.feed(delta))
+    return time.perf_counter() - start, calls
+
+
+def main():
+    deltas, expected_calls = record_stream()
+    print(f"Replaying {len(deltas)} deltas (~{TARGET_TOKENS} tokens, {expected_calls} tool calls)")
+
+    rescan_seconds, rescan_calls = run_rescan(deltas)
+    streaming_seconds, streaming_calls = run_streaming(deltas)
+
+    print(f"rescan:    {rescan_seconds * 1000:9.1f} ms, {rescan_calls} tool call blocks")
+    print(f"streaming: {streaming_seconds * 1000:9.1f} ms, {streaming_calls} tool calls")
+    print(f"speedup:   {rescan_seconds / max(streaming_seconds, 1e-9):9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
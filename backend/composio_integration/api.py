@@ -306,7 +306,8 @@ async def list_toolkits(
             "total_pages": result.get('total_pages', 0),
             "current_page": result.get('current_page', 1),
             "next_cursor": result.get('next_cursor'),
-            "has_more": result.get('next_cursor') is not None
+            "has_more": result.get('next_cursor') is not None,
+            **({"facets": result['facets']} if 'facets' in result else {})
         }
         
     except Exception as e:
@@ -1,90 +1,265 @@
+"""
+Cache for Composio toolkit data.
+
+Entries live in a per-process LRU bounded by entry count and approximate size
+in bytes. Values loaded through get_or_load are:
+
+- loaded once per key at a time; concurrent misses wait for the same load
+  instead of each calling Composio
+- served stale for up to stale_ttl seconds after they expire while a
+  background refresh replaces them, so requests at the TTL boundary do not
+  wait for Composio
+- optionally shared across workers through Redis (JSON-serializable values
+  only), so a worker with a cold cache reuses what another worker loaded
+
+Loaders that derive their data from another entry read it with get_fresh, so
+a derived entry is never rebuilt from stale data and then cached as fresh.
+"""
+
 import asyncio
+import json
 import time
-from typing import Dict, List, Any, Optional
+import weakref
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from services import redis
 from utils.logger import logger
 
+MAX_ENTRIES = 256
+MAX_BYTES = 32 * 1024 * 1024
+REDIS_PREFIX = "composio:toolkit_cache"
+INVALIDATE_BATCH_SIZE = 500
+
+
+class _Entry(NamedTuple):
+    data: Any
+    stored_at: float
+    size: int
+
+
+def _estimate_size(data: Any) -> int:
+    return len(json.dumps(data, default=lambda value: value.dict() if hasattr(value, "dict") else str(value)))
+
 
 class ToolkitCache:
     """
     Enhanced cache for toolkit data to improve performance when switching categories
     """
-    
-    def __init__(self, cache_ttl: int = 600):  # 10 minutes TTL (increased for better performance)
+
+    def __init__(self, cache_ttl: int = 600, stale_ttl: int = 3600,
+                 max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES):
         self.cache_ttl = cache_ttl
-        self._cache: Dict[str, Dict[str, Any]] = {}
-        self._cache_timestamps: Dict[str, float] = {}
-        self._category_cache: Dict[str, List[Dict[str, Any]]] = {}  # Per-category cache
-        self._lock = asyncio.Lock()
-        self._preload_lock = asyncio.Lock()
-        self._preloaded = False
-    
-    def _is_cache_valid(self, key: str) -> bool:
-        """Check if cache entry is still valid"""
-        if key not in self._cache_timestamps:
-            return False
-        
-        age = time.time() - self._cache_timestamps[key]
-        return age < self.cache_ttl
-    
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        # In-flight loads per event loop and key
+        self._loads: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Task]]" = weakref.WeakKeyDictionary()
+        self._stats = {"hits": 0, "stale_hits": 0, "misses": 0, "redis_hits": 0, "loads": 0, "load_errors": 0, "evictions": 0}
+
+    def _age(self, entry: _Entry) -> float:
+        return time.time() - entry.stored_at
+
+    def _lookup(self, key: str, max_age: float) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._age(entry) >= self.cache_ttl + self.stale_ttl:
+            self._remove(key)
+            return None
+        if self._age(entry) >= max_age:
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key: str, data: Any, stored_at: Optional[float] = None) -> None:
+        size = _estimate_size(data)
+        self._remove(key)
+        if size > self.max_bytes:
+            logger.warning(f"Not caching toolkit data for {key}: {size} bytes exceeds the cache size")
+            return
+        self._entries[key] = _Entry(data, stored_at or time.time(), size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            evicted_key, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            self._stats["evictions"] += 1
+            logger.debug(f"Evicted toolkit cache entry: {evicted_key}")
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
     async def get(self, key: str) -> Optional[Dict[str, Any]]:
         """Get cached data if valid"""
-        async with self._lock:
-            if key in self._cache and self._is_cache_valid(key):
-                logger.debug(f"Cache hit for key: {key}")
-                return self._cache[key]
-            
-            logger.debug(f"Cache miss for key: {key}")
+        entry = self._lookup(key, self.cache_ttl)
+        if entry is not None:
+            self._stats["hits"] += 1
+            logger.debug(f"Cache hit for key: {key}")
+            return entry.data
+
+        self._stats["misses"] += 1
+        logger.debug(f"Cache miss for key: {key}")
+        return None
+
+    async def set(self, key: str, data: Dict[str, Any], shared: bool = False) -> None:
+        """Set cache data, also in Redis if shared"""
+        self._store(key, data)
+        if shared:
+            await self._redis_set(key, data, time.time())
+        logger.debug(f"Cached data for key: {key}")
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]], shared: bool = False) -> Any:
+        """
+        Get cached data, loading it with loader when missing.
+
+        Expired data within stale_ttl is returned immediately and refreshed in
+        the background. Concurrent calls for a key share one load.
+
+        Args:
+            key: Cache key
+            loader: Coroutine function producing the data
+            shared: Also cache the data in Redis; it must be JSON-serializable
+        """
+        entry = self._lookup(key, self.cache_ttl + self.stale_ttl)
+        if entry is not None:
+            if self._age(entry) < self.cache_ttl:
+                self._stats["hits"] += 1
+                return entry.data
+            self._stats["stale_hits"] += 1
+            logger.debug(f"Serving stale toolkit data for {key} while refreshing")
+            self._start_load(key, loader, shared)
+            return entry.data
+
+        self._stats["misses"] += 1
+        return await asyncio.shield(self._start_load(key, loader, shared))
+
+    async def get_fresh(self, key: str, loader: Callable[[], Awaitable[Any]], shared: bool = False) -> Any:
+        """
+        Get data no older than cache_ttl, waiting for a load when it is stale or missing.
+
+        Takes the same arguments as get_or_load and shares its in-flight loads.
+        """
+        entry = self._lookup(key, self.cache_ttl)
+        if entry is not None:
+            self._stats["hits"] += 1
+            return entry.data
+
+        self._stats["misses"] += 1
+        return await asyncio.shield(self._start_load(key, loader, shared))
+
+    def _start_load(self, key: str, loader: Callable[[], Awaitable[Any]], shared: bool) -> asyncio.Task:
+        loop = asyncio.get_running_loop()
+        loads = self._loads.setdefault(loop, {})
+        task = loads.get(key)
+        if task is None:
+            task = loop.create_task(self._load(key, loader, shared))
+            task.add_done_callback(lambda done: self._finish_load(loads, key, done))
+            loads[key] = task
+        return task
+
+    def _finish_load(self, loads: Dict[str, asyncio.Task], key: str, task: asyncio.Task) -> None:
+        if loads.get(key) is task:
+            del loads[key]
+        if not task.cancelled() and task.exception() is not None:
+            # Background refreshes have no awaiting caller; keep the failure from going unretrieved
+            logger.debug(f"Loading toolkit data for {key} failed: {task.exception()}")
+
+    async def _load(self, key: str, loader: Callable[[], Awaitable[Any]], shared: bool) -> Any:
+        if shared:
+            cached = await self._redis_get(key)
+            if cached is not None and time.time() - cached["stored_at"] < self.cache_ttl:
+                self._stats["redis_hits"] += 1
+                self._store(key, cached["data"], cached["stored_at"])
+                return cached["data"]
+
+        self._stats["loads"] += 1
+        try:
+            data = await loader()
+        except Exception:
+            self._stats["load_errors"] += 1
+            raise
+        self._store(key, data)
+        if shared:
+            await self._redis_set(key, data, time.time())
+        return data
+
+    async def _redis_get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            cached = await redis.get(f"{REDIS_PREFIX}:{key}")
+            return json.loads(cached) if cached else None
+        except Exception as e:
+            logger.warning(f"Failed to read toolkit cache {key} from Redis: {str(e)}")
             return None
-    
-    async def set(self, key: str, data: Dict[str, Any]) -> None:
-        """Set cache data"""
-        async with self._lock:
-            self._cache[key] = data
-            self._cache_timestamps[key] = time.time()
-            logger.debug(f"Cached data for key: {key}")
-    
+
+    async def _redis_set(self, key: str, data: Any, stored_at: float) -> None:
+        try:
+            payload = json.dumps({"stored_at": stored_at, "data": data})
+            await redis.set(f"{REDIS_PREFIX}:{key}", payload, ex=self.cache_ttl + self.stale_ttl)
+        except Exception as e:
+            logger.warning(f"Failed to write toolkit cache {key} to Redis: {str(e)}")
+
     async def set_category_cache(self, category_id: str, apps: List[Dict[str, Any]]) -> None:
         """Set per-category cache for faster category switching"""
-        async with self._lock:
-            self._category_cache[category_id] = apps
-            self._cache_timestamps[f"category_{category_id}"] = time.time()
-            logger.debug(f"Cached {len(apps)} apps for category: {category_id}")
-    
+        self._store(f"category_{category_id}", apps)
+        logger.debug(f"Cached {len(apps)} apps for category: {category_id}")
+
     async def get_category_cache(self, category_id: str) -> Optional[List[Dict[str, Any]]]:
         """Get cached data for specific category"""
-        async with self._lock:
-            cache_key = f"category_{category_id}"
-            if category_id in self._category_cache and self._is_cache_valid(cache_key):
-                logger.debug(f"Category cache hit for: {category_id}")
-                return self._category_cache[category_id]
-            
-            logger.debug(f"Category cache miss for: {category_id}")
-            return None
-    
+        entry = self._lookup(f"category_{category_id}", self.cache_ttl)
+        if entry is not None:
+            self._stats["hits"] += 1
+            logger.debug(f"Category cache hit for: {category_id}")
+            return entry.data
+
+        self._stats["misses"] += 1
+        logger.debug(f"Category cache miss for: {category_id}")
+        return None
+
     async def invalidate(self, key: Optional[str] = None) -> None:
-        """Invalidate cache entry or entire cache"""
-        async with self._lock:
+        """Invalidate cache entry or entire cache, locally and in Redis"""
+        try:
             if key:
-                self._cache.pop(key, None)
-                self._cache_timestamps.pop(key, None)
+                self._remove(key)
+                await redis.delete(f"{REDIS_PREFIX}:{key}")
                 logger.debug(f"Invalidated cache for key: {key}")
             else:
-                self._cache.clear()
-                self._cache_timestamps.clear()
+                self._entries.clear()
+                self._bytes = 0
+                redis_client = await redis.get_client()
+                batch = []
+                async for redis_key in redis_client.scan_iter(match=f"{REDIS_PREFIX}:*", count=INVALIDATE_BATCH_SIZE):
+                    batch.append(redis_key)
+                    if len(batch) >= INVALIDATE_BATCH_SIZE:
+                        await redis_client.delete(*batch)
+                        batch = []
+                if batch:
+                    await redis_client.delete(*batch)
                 logger.debug("Invalidated entire cache")
-    
+        except Exception as e:
+            logger.warning(f"Failed to invalidate toolkit cache in Redis: {str(e)}")
+
     def get_cache_stats(self) -> Dict[str, Any]:
         """Get cache statistics"""
-        total_entries = len(self._cache)
-        valid_entries = sum(1 for key in self._cache if self._is_cache_valid(key))
-        
+        valid_entries = sum(1 for entry in self._entries.values() if self._age(entry) < self.cache_ttl)
+        lookups = self._stats["hits"] + self._stats["stale_hits"] + self._stats["misses"]
+
         return {
-            "total_entries": total_entries,
+            "total_entries": len(self._entries),
             "valid_entries": valid_entries,
-            "cache_keys": list(self._cache.keys()),
-            "cache_ttl": self.cache_ttl
+            "cache_keys": list(self._entries.keys()),
+            "cache_ttl": self.cache_ttl,
+            "stale_ttl": self.stale_ttl,
+            "size_bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hit_rate": (self._stats["hits"] + self._stats["stale_hits"]) / lookups if lookups else 0.0,
+            **self._stats
         }
 
 
 # Global cache instance
-toolkit_cache = ToolkitCache()
\ No newline at end of file
+toolkit_cache = ToolkitCache()
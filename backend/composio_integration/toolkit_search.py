@@ -0,0 +1,184 @@
+"""
+In-process search index over Composio toolkits.
+
+Toolkit search used to fetch the toolkit list from Composio and scan every
+name, description and tag for the query on each request. The index is built
+once from the categorized toolkit list (and rebuilt when that cached list is
+refreshed), so a search is a few dictionary lookups:
+
+- name, slug, tag/category and description tokens are indexed with field
+  weights, as are the names and descriptions of a toolkit's tools once they
+  have been fetched
+- a query token matches indexed tokens exactly, by prefix ("goo" finds
+  "google"), inside a word ("mail" finds "gmail") via trigrams, and with a
+  typo via trigram similarity
+- every query token has to match; results are ordered by score, then by the
+  registry's priority and name, so pagination over them is stable
+- category counts (facets) are precomputed for the whole catalog and counted
+  for each result set
+"""
+
+import bisect
+import re
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Score of a token match per field
+FIELD_WEIGHTS = {"name": 4.0, "slug": 3.0, "tag": 2.0, "description": 1.0, "tool": 0.5}
+PREFIX_FACTOR = 0.7
+INFIX_FACTOR = 0.5
+FUZZY_FACTOR = 0.4
+# Minimum trigram similarity for a typo match
+FUZZY_MIN_SIMILARITY = 0.45
+MIN_INFIX_LENGTH = 3
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+def _trigrams(token: str) -> Set[str]:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ToolkitSearchIndex:
+    """Inverted index over categorized toolkits (CategorizedApp-like objects)."""
+
+    def __init__(self, apps: Iterable[Any], tools: Optional[Dict[str, Iterable[Any]]] = None):
+        self.apps: List[Any] = list(apps)
+        self._vocabulary: Optional[List[str]] = None
+        self._postings: Dict[str, Dict[int, float]] = defaultdict(dict)
+        self._trigram_tokens: Dict[str, Set[str]] = defaultdict(set)
+        self._app_categories: List[str] = [app.category_id for app in self.apps]
+        self._order: List[Tuple[int, str, str]] = [(app.priority, app.name.lower(), app.slug) for app in self.apps]
+        self._by_slug: Dict[str, List[int]] = defaultdict(list)
+
+        for doc_id, app in enumerate(self.apps):
+            self._by_slug[app.slug].append(doc_id)
+            self._add_field(doc_id, "name", app.name)
+            self._add_field(doc_id, "slug", app.slug.replace("_", " "))
+            self._add_field(doc_id, "tag", " ".join([*app.tags, getattr(app, "category_name", "")]))
+            self._add_field(doc_id, "description", app.description)
+        for slug, slug_tools in (tools or {}).items():
+            self.add_tools(slug, slug_tools)
+
+        self.facets: Dict[str, int] = self._count_categories(range(len(self.apps)))
+
+    def _add_field(self, doc_id: int, field: str, text: Optional[str]) -> None:
+        weight = FIELD_WEIGHTS[field]
+        for token in tokenize(text):
+            postings = self._postings[token]
+            if postings.get(doc_id, 0.0) < weight:
+                postings[doc_id] = weight
+        self._vocabulary = None
+
+    def add_tools(self, toolkit_slug: str, tools: Iterable[Any]) -> None:
+        """Index the names and descriptions of a toolkit's tools."""
+        for doc_id in self._by_slug.get(toolkit_slug, []):
+            for tool in tools:
+                self._add_field(doc_id, "tool", f"{tool.name} {tool.description or ''}")
+
+    @property
+    def vocabulary(self) -> List[str]:
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self._postings)
+            self._trigram_tokens.clear()
+            for token in self._vocabulary:
+                for trigram in _trigrams(token):
+                    self._trigram_tokens[trigram].add(token)
+        return self._vocabulary
+
+    def _expand(self, query_token: str) -> Dict[str, float]:
+        """Indexed tokens matching a query token, with the factor of their match kind."""
+        vocabulary = self.vocabulary
+        matches: Dict[str, float] = {}
+        if query_token in self._postings:
+            matches[query_token] = 1.0
+
+        start = bisect.bisect_left(vocabulary, query_token)
+        for token in vocabulary[start:]:
+            if not token.startswith(query_token):
+                break
+            matches.setdefault(token, PREFIX_FACTOR)
+
+        query_trigrams = _trigrams(query_token)
+        if len(query_token) >= MIN_INFIX_LENGTH:
+            # Tokens containing the query share all of its inner trigrams
+            inner = {query_token[i:i + 3] for i in range(len(query_token) - 2)}
+            candidates = set.intersection(*(self._trigram_tokens.get(t, set()) for t in inner))
+            for token in candidates:
+                if query_token in token:
+                    matches.setdefault(token, INFIX_FACTOR)
+
+        if not matches and len(query_token) >= MIN_INFIX_LENGTH:
+            shared: Dict[str, int] = defaultdict(int)
+            for trigram in query_trigrams:
+                for token in self._trigram_tokens.get(trigram, ()):
+                    shared[token] += 1
+            for token, count in shared.items():
+                similarity = count / len(query_trigrams | _trigrams(token))
+                if similarity >= FUZZY_MIN_SIMILARITY:
+                    matches[token] = FUZZY_FACTOR * similarity
+        return matches
+
+    def search(self, query: str, category_id: Optional[str] = None) -> List[int]:
+        """
+        Find toolkits matching every token of the query.
+
+        Args:
+            query: Search text
+            category_id: Only return toolkits listed in this category
+
+        Returns:
+            Document ids ordered by relevance; without a category each toolkit
+            appears once
+        """
+        scores: Optional[Dict[int, float]] = None
+        for query_token in dict.fromkeys(tokenize(query)):
+            token_scores: Dict[int, float] = {}
+            for token, factor in self._expand(query_token).items():
+                for doc_id, weight in self._postings[token].items():
+                    score = weight * factor
+                    if score > token_scores.get(doc_id, 0.0):
+                        token_scores[doc_id] = score
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {doc_id: score + token_scores[doc_id] for doc_id, score in scores.items() if doc_id in token_scores}
+            if not scores:
+                return []
+        if scores is None:
+            return []
+
+        if category_id:
+            doc_ids = [doc_id for doc_id in scores if self._app_categories[doc_id] == category_id]
+        else:
+            # Popular toolkits are listed twice (in "popular" and their own category); keep the better entry
+            best: Dict[str, int] = {}
+            for doc_id in scores:
+                slug = self.apps[doc_id].slug
+                if slug not in best or self._rank(doc_id, scores) < self._rank(best[slug], scores):
+                    best[slug] = doc_id
+            doc_ids = list(best.values())
+        doc_ids.sort(key=lambda doc_id: self._rank(doc_id, scores))
+        return doc_ids
+
+    def _rank(self, doc_id: int, scores: Dict[int, float]) -> Tuple[float, int, str, str]:
+        return (-scores[doc_id], *self._order[doc_id])
+
+    def result_facets(self, doc_ids: Iterable[int]) -> Dict[str, int]:
+        return self._count_categories(doc_ids)
+
+    def _count_categories(self, doc_ids: Iterable[int]) -> Dict[str, int]:
+        counts: Dict[str, int] = defaultdict(int)
+        for doc_id in doc_ids:
+            counts[self._app_categories[doc_id]] += 1
+        return dict(counts)
+
+
+def decode_cursor(cursor: Optional[str]) -> int:
+    """Offset encoded in a search cursor; unknown cursors start at the beginning."""
+    return int(cursor) if cursor and cursor.isdigit() else 0
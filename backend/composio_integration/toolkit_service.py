@@ -1,9 +1,10 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from pydantic import BaseModel
 from utils.logger import logger
 from .client import ComposioClient
 from .composio_registry import composio_registry, AppCategory, CategorizedApp
 from .toolkit_cache import toolkit_cache
+from .toolkit_search import ToolkitSearchIndex, decode_cursor
 
 
 class CategoryInfo(BaseModel):
@@ -75,6 +76,12 @@ class ToolsListResponse(BaseModel):
     total_pages: int = 1
 
 
+# Search index with the categorized toolkit data it was built from, rebuilt when that data is refreshed
+_search_index: Optional[Tuple[Dict[str, Any], ToolkitSearchIndex]] = None
+# Tools fetched per toolkit, indexed so searches also match tool names and descriptions
+_indexed_tools: Dict[str, Dict[str, "ToolInfo"]] = {}
+
+
 class ToolkitService:
     def __init__(self, api_key: Optional[str] = None):
         self.client = ComposioClient.get_client(api_key)
@@ -100,18 +107,17 @@ class ToolkitService:
                 return True
         return False
     
-    async def _fetch_all_toolkits_from_api(self) -> List[ToolkitInfo]:
-        """Fetch all toolkits from API and cache them"""
+    async def _fetch_all_toolkits_from_api(self, fresh: bool = False) -> List[ToolkitInfo]:
+        """Fetch all toolkits from cache, loading them from the API once when missing (or stale, if fresh)"""
+        # Shared through Redis so every worker does not fetch the full list separately
+        load = toolkit_cache.get_fresh if fresh else toolkit_cache.get_or_load
+        cached_data = await load(self._all_toolkits_cache_key, self._load_all_toolkits, shared=True)
+        return [ToolkitInfo(**toolkit) for toolkit in cached_data["toolkits"]]
+    
+    async def _load_all_toolkits(self) -> Dict[str, Any]:
         try:
             logger.debug("Fetching all toolkits from Composio API")
             
-            # Check cache first
-            cached_data = await toolkit_cache.get(self._all_toolkits_cache_key)
-            if cached_data:
-                logger.debug("Using cached toolkit data")
-                return [ToolkitInfo(**toolkit) for toolkit in cached_data["toolkits"]]
-            
-            # Fetch from API
             params = {
                 "limit": 1000,  # Increased limit to get more apps
                 "managed_by": "composio"
@@ -188,15 +194,13 @@ class ToolkitService:
                 )
                 toolkits.append(toolkit)
             
-            # Cache the results
             cache_data = {
                 "toolkits": [toolkit.dict() for toolkit in toolkits],
                 "total_items": len(toolkits)
             }
-            await toolkit_cache.set(self._all_toolkits_cache_key, cache_data)
             
-            logger.debug(f"Successfully fetched and cached {len(toolkits)} toolkits")
-            return toolkits
+            logger.debug(f"Successfully fetched {len(toolkits)} toolkits")
+            return cache_data
             
         except Exception as e:
             logger.error(f"Failed to fetch toolkits from API: {e}", exc_info=True)
@@ -327,17 +331,14 @@ class ToolkitService:
         """
         Get toolkits organized by categories using the composio registry with caching
         """
+        return await toolkit_cache.get_or_load(self._categorized_cache_key, self._categorize_toolkits)
+    
+    async def _categorize_toolkits(self) -> Dict[str, Any]:
         try:
-            logger.debug("Fetching and categorizing toolkits with caching")
-            
-            # Check cache first
-            cached_data = await toolkit_cache.get(self._categorized_cache_key)
-            if cached_data:
-                logger.debug("Using cached categorized toolkit data")
-                return cached_data
+            logger.debug("Categorizing toolkits")
             
-            # Get all toolkits from cache or API
-            toolkits = await self._fetch_all_toolkits_from_api()
+            # The categorized view is cached as fresh, so it must not be built from a stale list
+            toolkits = await self._fetch_all_toolkits_from_api(fresh=True)
             
             # Convert to dict format for registry
             toolkit_dicts = []
@@ -367,9 +368,6 @@ class ToolkitService:
                 "total_categories": len([cat for cat in categorized_toolkits.values() if cat])
             }
             
-            # Cache the categorized results
-            await toolkit_cache.set(self._categorized_cache_key, result)
-            
             logger.debug(f"Successfully categorized {len(toolkits)} toolkits into {result['total_categories']} categories")
             return result
             
@@ -467,37 +465,31 @@ class ToolkitService:
             logger.error(f"Failed to get toolkit {slug}: {e}", exc_info=True)
             raise
     
+    async def _get_search_index(self) -> ToolkitSearchIndex:
+        global _search_index
+        categorized_data = await self.list_categorized_toolkits()
+        if _search_index is None or _search_index[0] is not categorized_data:
+            apps = [app for category_apps in categorized_data.get("categorized_toolkits", {}).values() for app in category_apps]
+            index = ToolkitSearchIndex(apps, {slug: tools.values() for slug, tools in _indexed_tools.items()})
+            _search_index = (categorized_data, index)
+            logger.debug(f"Built toolkit search index over {len(apps)} categorized toolkits")
+        return _search_index[1]
+
     async def search_toolkits(self, query: str, category: Optional[str] = None, limit: int = 100, cursor: Optional[str] = None) -> Dict[str, Any]:
         try:
             logger.debug(f"Searching toolkits with query: {query}, category: {category}")
             
-            # Get all toolkits first
-            toolkits_response = await self.list_toolkits(limit=500, cursor=cursor)
-            toolkits = toolkits_response.get("items", [])
-            
-            # Convert to dict format for registry
-            toolkit_dicts = []
-            for toolkit in toolkits:
-                toolkit_dict = {
-                    "slug": toolkit.slug,
-                    "name": toolkit.name,
-                    "description": toolkit.description,
-                    "logo": toolkit.logo,
-                    "tags": toolkit.tags,
-                    "auth_schemes": toolkit.auth_schemes,
-                    "categories": toolkit.categories
-                }
-                toolkit_dicts.append(toolkit_dict)
-            
-            # Use registry for smart search
-            search_results = composio_registry.search_apps(toolkit_dicts, query, category)
+            index = await self._get_search_index()
+            matches = index.search(query, category)
             
-            # Apply limit
-            limited_results = search_results[:limit]
+            # Cursors are offsets into the ranked matches, which are stable while the index is
+            offset = decode_cursor(cursor)
+            page = matches[offset:offset + limit] if limit > 0 else []
+            next_offset = offset + len(page)
             
-            # Convert back to ToolkitInfo format
             result_toolkits = []
-            for app in limited_results:
+            for doc_id in page:
+                app = index.apps[doc_id]
                 toolkit = ToolkitInfo(
                     slug=app.slug,
                     name=app.name,
@@ -511,14 +503,16 @@ class ToolkitService:
             
             result = {
                 "items": result_toolkits,
-                "total_items": len(search_results),
-                "total_pages": (len(search_results) + limit - 1) // limit if limit > 0 else 1,
-                "current_page": 1,
+                "total_items": len(matches),
+                "total_pages": (len(matches) + limit - 1) // limit if limit > 0 else 1,
+                "current_page": offset // limit + 1 if limit > 0 else 1,
+                "next_cursor": str(next_offset) if page and next_offset < len(matches) else None,
+                "facets": index.result_facets(matches),
                 "query": query,
                 "category": category
             }
             
-            logger.debug(f"Found {len(search_results)} toolkits matching query: {query}" + (f" in category {category}" if category else ""))
+            logger.debug(f"Found {len(matches)} toolkits matching query: {query}" + (f" in category {category}" if category else ""))
             return result
             
         except Exception as e:
@@ -751,6 +745,8 @@ class ToolkitService:
                 )
                 tools.append(tool)
             
+            self._index_tools(toolkit_slug, tools)
+            
             result = ToolsListResponse(
                 items=tools,
                 total_items=response_data.get("total_items", len(tools)),
@@ -769,4 +765,13 @@ class ToolkitService:
                 total_items=0,
                 current_page=1,
                 total_pages=1
-            ) 
\ No newline at end of file
+            )
+
+    def _index_tools(self, toolkit_slug: str, tools: List[ToolInfo]) -> None:
+        known = _indexed_tools.setdefault(toolkit_slug, {})
+        new_tools = [tool for tool in tools if tool.slug not in known]
+        if not new_tools:
+            return
+        known.update((tool.slug, tool) for tool in new_tools)
+        if _search_index is not None:
+            _search_index[1].add_tools(toolkit_slug, new_tools)
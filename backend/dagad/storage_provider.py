@@ -12,6 +12,10 @@ Usage:
     url = await storage.upload_bytes(path, data, content_type)
     # or
     url = await storage.upload_base64_image(base64_data, path_prefix)
+
+Private storage (get_private_storage) keeps objects in a bucket that is not
+publicly readable; they are only read back with download_bytes using the
+service credentials.
 """
 
 import os
@@ -23,9 +27,12 @@ from typing import Optional, Protocol
 
 
 class StorageProvider(Protocol):
+    # Returns the public URL, or the path for private storage
     async def upload_bytes(self, path: str, data: bytes, content_type: Optional[str] = None) -> str: ...
+    async def download_bytes(self, path: str) -> bytes: ...
     async def upload_base64_image(self, base64_data: str, path_prefix: str = "images/") -> str: ...
     async def delete(self, path: str) -> None: ...
+    async def public_url(self, path: str) -> str: ...
 
 
 def _unique_path(prefix: str, filename: str) -> str:
@@ -35,9 +42,10 @@ def _unique_path(prefix: str, filename: str) -> str:
 
 
 class SupabaseStorage:
-    def __init__(self, bucket: str):
+    def __init__(self, bucket: str, public: bool = True):
         from services.supabase import DBConnection
         self.bucket = bucket
+        self.public = public
         self._db = DBConnection()
 
     async def upload_bytes(self, path: str, data: bytes, content_type: Optional[str] = None) -> str:
@@ -47,6 +55,14 @@ class SupabaseStorage:
             data,
             {"content-type": content_type or "application/octet-stream"}
         )
+        return await self.public_url(path) if self.public else path
+
+    async def download_bytes(self, path: str) -> bytes:
+        client = await self._db.client
+        return await client.storage.from_(self.bucket).download(path)
+
+    async def public_url(self, path: str) -> str:
+        client = await self._db.client
         return await client.storage.from_(self.bucket).get_public_url(path)
 
     async def upload_base64_image(self, base64_data: str, path_prefix: str = "images/") -> str:
@@ -63,9 +79,10 @@ class SupabaseStorage:
 
 
 class S3Storage:
-    def __init__(self, bucket: str, region: Optional[str] = None, endpoint_url: Optional[str] = None):
+    def __init__(self, bucket: str, region: Optional[str] = None, endpoint_url: Optional[str] = None, public: bool = True):
         import boto3  # type: ignore
         self.bucket = bucket
+        self.public = public
         self.region = region or os.getenv("AWS_REGION")
         self.public_base = os.getenv("S3_PUBLIC_BASE_URL")
         self.s3 = boto3.client(
@@ -78,15 +95,23 @@ class S3Storage:
 
     async def upload_bytes(self, path: str, data: bytes, content_type: Optional[str] = None) -> str:
         def _put():
+            extra = {"ACL": "public-read"} if self.public else {}
             self.s3.put_object(
                 Bucket=self.bucket,
                 Key=path,
                 Body=data,
                 ContentType=content_type or "application/octet-stream",
-                ACL="public-read"
+                **extra
             )
         await asyncio.to_thread(_put)
+        return await self.public_url(path) if self.public else path
+
+    async def download_bytes(self, path: str) -> bytes:
+        def _get():
+            return self.s3.get_object(Bucket=self.bucket, Key=path)["Body"].read()
+        return await asyncio.to_thread(_get)
 
+    async def public_url(self, path: str) -> str:
         if self.public_base:
             return f"{self.public_base.rstrip('/')}/{path}"
         if os.getenv("S3_ENDPOINT_URL"):
@@ -122,3 +147,16 @@ def get_storage() -> StorageProvider:
     return SupabaseStorage(bucket=os.getenv("SUPABASE_BUCKET", "dagad-images"))
 
 
+
+
+def get_private_storage() -> StorageProvider:
+    """Storage for objects that must not be publicly readable, in a separate private bucket."""
+    provider = (os.getenv("STORAGE_PROVIDER") or "supabase").lower()
+    if provider == "s3" or provider == "r2":
+        return S3Storage(
+            bucket=os.getenv("S3_PRIVATE_BUCKET", "dagad-private"),
+            region=os.getenv("AWS_REGION"),
+            endpoint_url=os.getenv("S3_ENDPOINT_URL"),
+            public=False,
+        )
+    return SupabaseStorage(bucket=os.getenv("SUPABASE_PRIVATE_BUCKET", "image-context"), public=False)
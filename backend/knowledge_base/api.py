@@ -4,6 +4,7 @@ from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form, B
 from pydantic import BaseModel, Field, HttpUrl
 from utils.auth_utils import get_current_user_id_from_jwt, verify_agent_access
 from services.supabase import DBConnection
+from services.prompt_cache import invalidate_agent_kb_prompts
 from knowledge_base.file_processor import FileProcessor
 from utils.logger import logger
 from flags.flags import is_enabled
@@ -159,6 +160,7 @@ async def create_agent_knowledge_base_entry(
             raise HTTPException(status_code=500, detail="Failed to create agent knowledge base entry")
         
         created_entry = result.data[0]
+        await invalidate_agent_kb_prompts(agent_id)
         
         return KnowledgeBaseEntryResponse(
             entry_id=created_entry['entry_id'],
@@ -287,6 +289,7 @@ async def update_knowledge_base_entry(
             raise HTTPException(status_code=500, detail="Failed to update knowledge base entry")
         
         updated_entry = result.data[0]
+        await invalidate_agent_kb_prompts(agent_id)
         
         logger.debug(f"Updated agent knowledge base entry {entry_id} for agent {agent_id}")
         
@@ -340,6 +343,7 @@ async def delete_knowledge_base_entry(
         await verify_agent_access(client, agent_id, user_id)
         
         result = await client.table('agent_knowledge_base_entries').delete().eq('entry_id', entry_id).execute()
+        await invalidate_agent_kb_prompts(agent_id)
         
         logger.debug(f"Deleted agent knowledge base entry {entry_id} for agent {agent_id}")
         
@@ -474,6 +478,7 @@ async def process_file_background(
         )
         
         if result['success']:
+            await invalidate_agent_kb_prompts(agent_id)
             await client.rpc('update_agent_kb_job_status', {
                 'p_job_id': job_id,
                 'p_status': 'completed',
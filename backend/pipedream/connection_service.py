@@ -1,5 +1,7 @@
+import asyncio
 import os
 import re
+import weakref
 from dataclasses import dataclass, field
 from datetime import datetime, timezone, timedelta
 from typing import List, Optional, Dict, Any
@@ -85,6 +87,8 @@ class ConnectionService:
         self.session = None
         self.access_token = None
         self.token_expires_at = None
+        # In-flight token refresh per event loop, awaited by every caller that needs a token meanwhile
+        self._token_refreshes: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Task]" = weakref.WeakKeyDictionary()
 
     async def _get_session(self) -> httpx.AsyncClient:
         if self.session is None or self.session.is_closed:
@@ -102,7 +106,12 @@ class ConnectionService:
                 self.access_token = None
                 self.token_expires_at = None
 
-        return await self._fetch_fresh_token()
+        loop = asyncio.get_running_loop()
+        refresh = self._token_refreshes.get(loop)
+        if refresh is None or refresh.done():
+            refresh = loop.create_task(self._fetch_fresh_token())
+            self._token_refreshes[loop] = refresh
+        return await asyncio.shield(refresh)
 
     async def _fetch_fresh_token(self) -> str:
         project_id = os.getenv("PIPEDREAM_PROJECT_ID")
@@ -3,7 +3,6 @@ dotenv.load_dotenv(".env")
 
 import sentry
 import asyncio
-import json
 import traceback
 from datetime import datetime, timezone
 from typing import Optional
@@ -18,6 +17,9 @@ from services import redis
 from dramatiq.brokers.redis import RedisBroker
 import os
 from services.langfuse import langfuse
+from services import usage_events
+from services import response_stream
+from services.run_control import control_dispatcher
 from utils.retry import retry
 
 import sentry_sdk
@@ -52,6 +54,13 @@ async def check_health(key: str):
     structlog.contextvars.clear_contextvars()
     await redis.set(key, "healthy", ex=redis.REDIS_KEY_TTL)
 
+@dramatiq.actor
+async def process_usage_events():
+    """Drain queued usage events and apply billing in batches."""
+    structlog.contextvars.clear_contextvars()
+    await initialize()
+    await usage_events.process_usage_events()
+
 @dramatiq.actor
 async def run_agent_background(
     agent_run_id: str,
@@ -138,64 +147,22 @@ async def run_agent_background(
     client = await db.client
     start_time = datetime.now(timezone.utc)
     total_responses = 0
-    pubsub = None
-    stop_checker = None
-    stop_signal_received = False
+    agent_gen = None
+    stream_writer = response_stream.ResponseStreamWriter(agent_run_id)
 
     # Define Redis keys and channels
-    response_list_key = f"agent_run:{agent_run_id}:responses"
-    response_channel = f"agent_run:{agent_run_id}:new_response"
-    instance_control_channel = f"agent_run:{agent_run_id}:control:{instance_id}"
     global_control_channel = f"agent_run:{agent_run_id}:control"
     instance_active_key = f"active_run:{instance_id}:{agent_run_id}"
 
-    # Cooperative pause state shared with listener and main loop
-    paused = False
-    async def check_for_stop_signal():
-        nonlocal stop_signal_received, paused
-        if not pubsub: return
-        try:
-            while not stop_signal_received:
-                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=0.5)
-                if message and message.get("type") == "message":
-                    data = message.get("data")
-                    if isinstance(data, bytes): data = data.decode('utf-8')
-                    if data == "STOP":
-                        logger.debug(f"Received STOP signal for agent run {agent_run_id} (Instance: {instance_id})")
-                        stop_signal_received = True
-                        break
-                    elif data in ["PAUSE", "TAKEOVER"]:
-                        if not paused:
-                            paused = True
-                            logger.debug(f"Received {data} signal; pausing agent run {agent_run_id}")
-                    elif data in ["RESUME", "RELEASE"]:
-                        if paused:
-                            paused = False
-                            logger.debug(f"Received {data} signal; resuming agent run {agent_run_id}")
-                # Periodically refresh the active run key TTL
-                if total_responses % 50 == 0: # Refresh every 50 responses or so
-                    try: await redis.expire(instance_active_key, redis.REDIS_KEY_TTL)
-                    except Exception as ttl_err: logger.warning(f"Failed to refresh TTL for {instance_active_key}: {ttl_err}")
-                await asyncio.sleep(0.1) # Short sleep to prevent tight loop
-        except asyncio.CancelledError:
-            logger.debug(f"Stop signal checker cancelled for {agent_run_id} (Instance: {instance_id})")
-        except Exception as e:
-            logger.error(f"Error in stop signal checker for {agent_run_id}: {e}", exc_info=True)
-            stop_signal_received = True # Stop the run if the checker fails
-
     trace = langfuse.trace(name="agent_run", id=agent_run_id, session_id=thread_id, metadata={"project_id": project_id, "instance_id": instance_id})
     try:
-        # Setup Pub/Sub listener for control signals
-        pubsub = await redis.create_pubsub()
+        # Receive STOP/PAUSE/RESUME signals through the worker's shared control listener
         try:
-            await retry(lambda: pubsub.subscribe(instance_control_channel, global_control_channel))
+            run_control = await control_dispatcher.register(agent_run_id)
         except Exception as e:
             logger.error(f"Redis failed to subscribe to control channels: {e}", exc_info=True)
             raise e
 
-        logger.debug(f"Subscribed to control channels: {instance_control_channel}, {global_control_channel}")
-        stop_checker = asyncio.create_task(check_for_stop_signal())
-
         # Ensure active run key exists and has TTL
         await redis.set(instance_active_key, "running", ex=redis.REDIS_KEY_TTL)
 
@@ -213,36 +180,29 @@ async def run_agent_background(
         final_status = "running"
         error_message = None
 
-        pending_redis_operations = []
-        paused_announced = False
-
         async for response in agent_gen:
-            if stop_signal_received:
+            if run_control.stopped.is_set():
                 logger.debug(f"Agent run {agent_run_id} stopped by signal.")
                 final_status = "stopped"
                 trace.span(name="agent_run_stopped").end(status_message="agent_run_stopped", level="WARNING")
                 break
 
-            # If paused, block advancing the generator until resumed
-            while paused and not stop_signal_received:
-                # Emit a status message once when entering paused state
-                if not paused_announced:
-                    pause_message = {"type": "status", "status": "paused", "message": "Agent run paused"}
-                    pending_redis_operations.append(asyncio.create_task(redis.rpush(response_list_key, json.dumps(pause_message))))
-                    pending_redis_operations.append(asyncio.create_task(redis.publish(response_channel, "new")))
-                    paused_announced = True
-                await asyncio.sleep(0.2)
-                # Loop continues until paused becomes False by control signal
-            if not paused and paused_announced:
-                # Clear the announcement flag on resume so future pauses can announce again
-                paused_announced = False
-
-            # Store response in Redis list and publish notification
-            response_json = json.dumps(response)
-            pending_redis_operations.append(asyncio.create_task(redis.rpush(response_list_key, response_json)))
-            pending_redis_operations.append(asyncio.create_task(redis.publish(response_channel, "new")))
+            # If paused, block advancing the generator until resumed or stopped
+            if run_control.paused:
+                # Emit a status message when entering paused state
+                pause_message = {"type": "status", "status": "paused", "message": "Agent run paused"}
+                await stream_writer.write(pause_message)
+                await run_control.wait_until_resumed()
+
+            # Append response to the run's Redis stream, streamed chunks are coalesced
+            await stream_writer.write(response)
             total_responses += 1
 
+            # Periodically refresh the active run key TTL
+            if total_responses % 50 == 0:
+                try: await redis.expire(instance_active_key, redis.REDIS_KEY_TTL)
+                except Exception as ttl_err: logger.warning(f"Failed to refresh TTL for {instance_active_key}: {ttl_err}")
+
             # Check for agent-signaled completion or error
             if response.get('type') == 'status':
                  status_val = response.get('status')
@@ -260,12 +220,10 @@ async def run_agent_background(
              logger.debug(f"Agent run {agent_run_id} completed normally (duration: {duration:.2f}s, responses: {total_responses})")
              completion_message = {"type": "status", "status": "completed", "message": "Agent run completed successfully"}
              trace.span(name="agent_run_completed").end(status_message="agent_run_completed")
-             await redis.rpush(response_list_key, json.dumps(completion_message))
-             await redis.publish(response_channel, "new") # Notify about the completion message
+             await stream_writer.write(completion_message)
 
-        # Fetch final responses from Redis for DB update
-        all_responses_json = await redis.lrange(response_list_key, 0, -1)
-        all_responses = [json.loads(r) for r in all_responses_json]
+        # Let buffered responses land before the final control entry
+        await stream_writer.drain()
 
         # Update DB status
         await update_agent_run_status(client, agent_run_id, final_status, error=error_message)
@@ -273,6 +231,8 @@ async def run_agent_background(
         # Publish final control signal (END_STREAM or ERROR)
         control_signal = "END_STREAM" if final_status == "completed" else "ERROR" if final_status == "failed" else "STOP"
         try:
+            # Stream readers stop on the control entry, pub/sub is kept for legacy list readers
+            await response_stream.append_control(agent_run_id, control_signal)
             await redis.publish(global_control_channel, control_signal)
             # No need to publish to instance channel as the run is ending on this instance
             logger.debug(f"Published final control signal '{control_signal}' to {global_control_channel}")
@@ -287,51 +247,43 @@ async def run_agent_background(
         final_status = "failed"
         trace.span(name="agent_run_failed").end(status_message=error_message, level="ERROR")
 
-        # Push error message to Redis list
+        # Append error message to the run's Redis stream
         error_response = {"type": "status", "status": "error", "message": error_message}
         try:
-            await redis.rpush(response_list_key, json.dumps(error_response))
-            await redis.publish(response_channel, "new")
+            await stream_writer.write(error_response)
+            await stream_writer.drain()
         except Exception as redis_err:
              logger.error(f"Failed to push error response to Redis for {agent_run_id}: {redis_err}")
 
-        # Fetch final responses (including the error)
-        all_responses = []
-        try:
-             all_responses_json = await redis.lrange(response_list_key, 0, -1)
-             all_responses = [json.loads(r) for r in all_responses_json]
-        except Exception as fetch_err:
-             logger.error(f"Failed to fetch responses from Redis after error for {agent_run_id}: {fetch_err}")
-             all_responses = [error_response] # Use the error message we tried to push
-
         # Update DB status
         await update_agent_run_status(client, agent_run_id, "failed", error=f"{error_message}\n{traceback_str}")
 
         # Publish ERROR signal
         try:
+            await response_stream.append_control(agent_run_id, "ERROR")
             await redis.publish(global_control_channel, "ERROR")
             logger.debug(f"Published ERROR signal to {global_control_channel}")
         except Exception as e:
             logger.warning(f"Failed to publish ERROR signal: {str(e)}")
 
     finally:
-        # Cleanup stop checker task
-        if stop_checker and not stop_checker.done():
-            stop_checker.cancel()
-            try: await stop_checker
-            except asyncio.CancelledError: pass
-            except Exception as e: logger.warning(f"Error during stop_checker cancellation: {e}")
-
-        # Close pubsub connection
-        if pubsub:
+        # Close the agent generator so buffered messages are persisted when the run ends early
+        if agent_gen is not None:
             try:
-                await pubsub.unsubscribe()
-                await pubsub.close()
-                logger.debug(f"Closed pubsub connection for {agent_run_id}")
+                await agent_gen.aclose()
             except Exception as e:
-                logger.warning(f"Error closing pubsub for {agent_run_id}: {str(e)}")
+                logger.warning(f"Error closing agent generator for {agent_run_id}: {str(e)}")
+
+        # Stop routing control signals to this run
+        control_dispatcher.unregister(agent_run_id)
+
+        # Wait for buffered responses to be written, with timeout
+        try:
+            await asyncio.wait_for(stream_writer.close(), timeout=30.0)
+        except asyncio.TimeoutError:
+            logger.warning(f"Timeout waiting for pending Redis operations for {agent_run_id}")
 
-        # Set TTL on the response list in Redis
+        # Set TTL on the stored responses in Redis
         await _cleanup_redis_response_list(agent_run_id)
 
         # Remove the instance-specific active run key
@@ -340,12 +292,6 @@ async def run_agent_background(
         # Clean up the run lock
         await _cleanup_redis_run_lock(agent_run_id)
 
-        # Wait for all pending redis operations to complete, with timeout
-        try:
-            await asyncio.wait_for(asyncio.gather(*pending_redis_operations), timeout=30.0)
-        except asyncio.TimeoutError:
-            logger.warning(f"Timeout waiting for pending Redis operations for {agent_run_id}")
-
         logger.debug(f"Agent run background task fully completed for: {agent_run_id} (Instance: {instance_id}) with final status: {final_status}")
 
 async def _cleanup_redis_instance_key(agent_run_id: str):
@@ -371,17 +317,16 @@ async def _cleanup_redis_run_lock(agent_run_id: str):
     except Exception as e:
         logger.warning(f"Failed to clean up Redis run lock key {run_lock_key}: {str(e)}")
 
-# TTL for Redis response lists (24 hours)
+# TTL for Redis response streams and lists (24 hours)
 REDIS_RESPONSE_LIST_TTL = 3600 * 24
 
 async def _cleanup_redis_response_list(agent_run_id: str):
-    """Set TTL on the Redis response list."""
-    response_list_key = f"agent_run:{agent_run_id}:responses"
+    """Set TTL on the Redis response stream (and legacy response list)."""
     try:
-        await redis.expire(response_list_key, REDIS_RESPONSE_LIST_TTL)
-        logger.debug(f"Set TTL ({REDIS_RESPONSE_LIST_TTL}s) on response list: {response_list_key}")
+        await response_stream.expire_responses(agent_run_id, REDIS_RESPONSE_LIST_TTL)
+        logger.debug(f"Set TTL ({REDIS_RESPONSE_LIST_TTL}s) on responses for agent run: {agent_run_id}")
     except Exception as e:
-        logger.warning(f"Failed to set TTL on response list {response_list_key}: {str(e)}")
+        logger.warning(f"Failed to set TTL on responses for agent run {agent_run_id}: {str(e)}")
 
 async def update_agent_run_status(
     client,
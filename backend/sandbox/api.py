@@ -8,8 +8,9 @@ from pydantic import BaseModel
 from daytona_sdk import AsyncSandbox
 
 from sandbox.sandbox import get_or_start_sandbox, delete_sandbox
+from sandbox.pool import sandbox_pool
 from utils.logger import logger
-from utils.auth_utils import get_optional_user_id
+from utils.auth_utils import get_optional_user_id, verify_admin_api_key
 from services.supabase import DBConnection
 
 # Initialize shared resources
@@ -328,6 +329,15 @@ async def delete_sandbox_route(
         logger.error(f"Error deleting sandbox {sandbox_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/sandboxes/pool/stats")
+async def get_sandbox_pool_stats(_: bool = Depends(verify_admin_api_key)):
+    """Get warm sandbox pool size, watermarks and hit/miss counters (admin only)"""
+    try:
+        return await sandbox_pool.get_stats()
+    except Exception as e:
+        logger.error(f"Error getting sandbox pool stats: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Should happen on server-side fully
 @router.post("/project/{project_id}/sandbox/ensure-active")
 async def ensure_project_sandbox_active(
@@ -0,0 +1,187 @@
+"""
+Bulk file operations for sandboxes.
+
+Writing files one by one costs several remote calls per file (existence check,
+folder creation, upload, permissions). The helpers here check any number of
+paths with one exec, and write any number of files by uploading a single
+gzipped tar archive that is extracted, with its permissions, by one more exec.
+Every file gets its own result, so one bad path does not fail the batch.
+"""
+
+import asyncio
+import io
+import shlex
+import tarfile
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from daytona_sdk import AsyncSandbox
+
+from utils.logger import logger
+
+MAX_BATCH_FILES = 100
+DOWNLOAD_CONCURRENCY = 8
+EXEC_TIMEOUT = 120
+_SECTION_SEPARATOR = "==BULK_FILES_STAT=="
+
+
+@dataclass
+class FileWrite:
+    """A file to write, path relative to the root directory."""
+    path: str
+    content: bytes
+    permissions: str = "644"
+
+
+@dataclass
+class FileResult:
+    """Outcome of a bulk operation for one file."""
+    path: str
+    success: bool
+    error: Optional[str] = None
+
+
+def _is_safe_path(path: str) -> bool:
+    return bool(path) and not path.startswith("/") and ".." not in path.split("/")
+
+
+def _sh(script: str) -> str:
+    return f"/bin/sh -c {shlex.quote(script)}"
+
+
+def _quoted(paths: Iterable[str]) -> str:
+    return " ".join(shlex.quote(path) for path in paths)
+
+
+def _parse_modes(output: str) -> Dict[str, str]:
+    modes = {}
+    for line in output.splitlines():
+        mode, _, path = line.partition(" ")
+        if path:
+            modes[path] = mode
+    return modes
+
+
+def _parse_stats(output: str) -> Dict[str, Tuple[str, int]]:
+    stats = {}
+    for line in output.splitlines():
+        mode, _, rest = line.partition(" ")
+        size, _, path = rest.partition(" ")
+        if path and size.isdigit():
+            stats[path] = (mode, int(size))
+    return stats
+
+
+def _extraction_errors(tar_output: str, paths: List[str]) -> Dict[str, str]:
+    """Attribute tar error lines to the files they name; unattributed errors fail every file."""
+    lines = [line.strip() for line in tar_output.splitlines() if line.strip()]
+    if not lines:
+        return {}
+    errors = {}
+    for path in paths:
+        named = [line for line in lines if line.startswith(f"tar: {path}:")]
+        if named:
+            errors[path] = "; ".join(named)
+    if not errors:
+        return {path: "; ".join(lines) for path in paths}
+    return errors
+
+
+async def file_modes(sandbox: AsyncSandbox, paths: List[str], root: str = "/workspace") -> Dict[str, str]:
+    """Look up which of the given paths exist, and their permissions, with one exec call.
+
+    Returns:
+        Octal permissions by path relative to root, missing paths left out
+    """
+    if not paths:
+        return {}
+    script = f"cd {shlex.quote(root)} && stat -c '%a %n' -- {_quoted(paths)} 2>/dev/null; true"
+    response = await sandbox.process.exec(_sh(script), timeout=EXEC_TIMEOUT)
+    if response.exit_code != 0:
+        raise RuntimeError(f"Failed to check files: {response.result}")
+    wanted = set(paths)
+    return {path: mode for path, mode in _parse_modes(response.result or "").items() if path in wanted}
+
+
+async def download_files(sandbox: AsyncSandbox, paths: List[str], root: str = "/workspace", concurrency: int = DOWNLOAD_CONCURRENCY) -> Dict[str, object]:
+    """Download several files, at most `concurrency` at a time.
+
+    Returns:
+        The content of each path as bytes, or the exception raised while downloading it
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def download(path: str):
+        async with semaphore:
+            return await sandbox.fs.download_file(f"{root}/{path}")
+
+    results = await asyncio.gather(*[download(path) for path in paths], return_exceptions=True)
+    return dict(zip(paths, results))
+
+
+def _build_archive(files: List[FileWrite]) -> bytes:
+    buffer = io.BytesIO()
+    now = time.time()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for file in files:
+            info = tarfile.TarInfo(file.path)
+            info.size = len(file.content)
+            info.mode = int(file.permissions, 8)
+            info.mtime = now
+            archive.addfile(info, io.BytesIO(file.content))
+    return buffer.getvalue()
+
+
+async def write_files(sandbox: AsyncSandbox, files: List[FileWrite], root: str = "/workspace") -> List[FileResult]:
+    """Write files with one archive upload and one exec, creating parent folders as needed.
+
+    Existing files are overwritten. Permissions are applied while extracting.
+    A file only succeeds if tar reported no error for it and it has the
+    expected size and permissions afterwards.
+
+    Returns:
+        One result per file, in the order given
+    """
+    results: Dict[str, FileResult] = {}
+    valid: List[FileWrite] = []
+    for file in files:
+        if not _is_safe_path(file.path):
+            results[file.path] = FileResult(file.path, False, "Path must be relative to the workspace")
+            continue
+        try:
+            int(file.permissions, 8)
+        except (TypeError, ValueError):
+            results[file.path] = FileResult(file.path, False, f"Invalid permissions '{file.permissions}'")
+            continue
+        valid.append(file)
+
+    if valid:
+        archive_path = f"/tmp/.bulk_upload_{uuid.uuid4().hex}.tar.gz"
+        await sandbox.fs.upload_file(_build_archive(valid), archive_path)
+        script = (
+            f"cd {shlex.quote(root)} && tar -xzpf {archive_path} 2>&1; rm -f {archive_path}; "
+            f"echo {_SECTION_SEPARATOR}; stat -c '%a %s %n' -- {_quoted(file.path for file in valid)} 2>/dev/null; true"
+        )
+        response = await sandbox.process.exec(_sh(script), timeout=EXEC_TIMEOUT)
+        tar_output, _, stats = (response.result or "").partition(_SECTION_SEPARATOR)
+        if tar_output.strip():
+            logger.warning(f"Bulk file extraction reported: {tar_output.strip()}")
+
+        errors = _extraction_errors(tar_output, [file.path for file in valid])
+        written = _parse_stats(stats)
+        for file in valid:
+            mode, size = written.get(file.path, (None, None))
+            if file.path in errors:
+                results[file.path] = FileResult(file.path, False, errors[file.path])
+            elif mode is None:
+                results[file.path] = FileResult(file.path, False, "File was not written")
+            elif size != len(file.content):
+                results[file.path] = FileResult(file.path, False, f"File has {size} bytes instead of {len(file.content)}")
+            elif int(mode, 8) != int(file.permissions, 8):
+                results[file.path] = FileResult(file.path, False, f"File written but permissions are {mode} instead of {file.permissions}")
+            else:
+                results[file.path] = FileResult(file.path, True)
+
+    return [results[file.path] for file in files]
@@ -0,0 +1,294 @@
+"""
+Warm Sandbox Pool
+
+Keeps pre-created, pre-started Daytona sandboxes per snapshot so new projects
+and trigger sessions do not wait for a sandbox to be created, for supervisord to
+come up and for preview links to be fetched.
+
+Pooled sandboxes are recorded in a Redis list per snapshot and claimed with
+LPOP, so each one is handed to exactly one project across all API and worker
+processes. A claimed sandbox that cannot be activated, or that has been pooled
+for longer than MAX_POOLED_AGE, is deleted instead of handed out. Claims that leave fewer than the low watermark trigger a background
+refill up to the high watermark, guarded by a Redis lock so only one process
+refills at a time. The lock holds a random token and is only released by the
+refill that took it. Hits, misses, created sandboxes and failures are counted in
+a Redis hash, see SandboxPool.get_stats().
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+from daytona_sdk import AsyncSandbox, SandboxState
+
+from sandbox import sandbox as sandbox_module
+from sandbox.sandbox import (
+    SANDBOX_AUTO_STOP_INTERVAL,
+    create_sandbox,
+    get_sandbox_preview_links,
+    sandbox_create_params,
+    start_supervisord_session,
+)
+from services import redis
+from utils.config import Configuration, config
+from utils.logger import logger
+
+POOL_PREFIX = "sandbox_pool"
+# A refill creating sandboxes one by one is considered dead after this long
+REFILL_LOCK_TTL = 600
+# Stale pool entries (e.g. sandboxes deleted in Daytona) skipped per claim
+MAX_CLAIM_ATTEMPTS = 3
+# Pooled sandboxes never stop on their own, so old ones are replaced rather than kept running forever
+MAX_POOLED_AGE = 24 * 3600
+# Seconds new sandboxes need before their services accept requests
+SERVICES_STARTUP_SECONDS = 5
+
+# KEYS[1]: lock; ARGV[1]: token of the holder. Deletes the lock only if it is still held with that token
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class SandboxPool:
+    """Pool of warm sandboxes for one snapshot."""
+
+    def __init__(
+        self,
+        snapshot: Optional[str] = None,
+        low_watermark: Optional[int] = None,
+        high_watermark: Optional[int] = None,
+        daytona=None
+    ):
+        """Initialize the SandboxPool.
+
+        Args:
+            snapshot: Snapshot the pooled sandboxes are created from
+            low_watermark: Refill once fewer sandboxes than this are pooled
+            high_watermark: Number of sandboxes a refill tops the pool up to
+            daytona: Daytona client, defaults to the shared AsyncDaytona client
+        """
+        self.snapshot = snapshot or Configuration.SANDBOX_SNAPSHOT_NAME
+        self.low_watermark = config.SANDBOX_POOL_LOW_WATERMARK if low_watermark is None else low_watermark
+        self.high_watermark = config.SANDBOX_POOL_HIGH_WATERMARK if high_watermark is None else high_watermark
+        self.high_watermark = max(self.high_watermark, self.low_watermark)
+        self.daytona = daytona or sandbox_module.daytona
+        self._refill_task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.high_watermark > 0
+
+    @property
+    def _pool_key(self) -> str:
+        return f"{POOL_PREFIX}:{self.snapshot}"
+
+    @property
+    def _metrics_key(self) -> str:
+        return f"{POOL_PREFIX}:{self.snapshot}:metrics"
+
+    @property
+    def _refill_lock_key(self) -> str:
+        return f"{POOL_PREFIX}:{self.snapshot}:refill_lock"
+
+    async def claim(self, project_id: str) -> Optional[Tuple[AsyncSandbox, Dict[str, Any]]]:
+        """Take a warm sandbox from the pool and assign it to a project.
+
+        Returns:
+            The started sandbox and its project sandbox metadata, or None if the
+            pool is disabled or empty
+        """
+        if not self.enabled:
+            return None
+
+        try:
+            redis_client = await redis.get_client()
+            for _ in range(MAX_CLAIM_ATTEMPTS):
+                raw_entry = await redis_client.lpop(self._pool_key)
+                if not raw_entry:
+                    break
+                entry = json.loads(raw_entry)
+                if time.time() - entry.get('created_at', time.time()) > MAX_POOLED_AGE:
+                    logger.debug(f"Deleting pooled sandbox {entry['id']} older than {MAX_POOLED_AGE} seconds")
+                    await self._delete(entry['id'])
+                    continue
+
+                try:
+                    sandbox = await self._activate(entry['id'], project_id)
+                except Exception as e:
+                    # Nothing references the sandbox anymore and it never stops on its own
+                    logger.warning(f"Discarding pooled sandbox {entry['id']}: {str(e)}")
+                    await self._record("failures")
+                    await self._delete(entry['id'])
+                    continue
+                except BaseException:
+                    # Cancelled before the sandbox was handed over; the next claim activates it again
+                    await redis_client.lpush(self._pool_key, raw_entry)
+                    raise
+
+                await self._record("hits")
+                logger.debug(f"Claimed pooled sandbox {sandbox.id} for project {project_id}")
+                return sandbox, {key: entry.get(key) for key in ('id', 'pass', 'vnc_preview', 'sandbox_url', 'token')}
+
+            await self._record("misses")
+            return None
+
+        except Exception as e:
+            logger.warning(f"Failed to claim pooled sandbox for project {project_id}: {str(e)}")
+            return None
+
+        finally:
+            self.schedule_refill()
+
+    async def _activate(self, sandbox_id: str, project_id: str) -> AsyncSandbox:
+        """Make sure a pooled sandbox is running and hand it over to a project."""
+        sandbox = await self.daytona.get(sandbox_id)
+        if sandbox.state in (SandboxState.STOPPED, SandboxState.ARCHIVED):
+            await self.daytona.start(sandbox)
+            sandbox = await self.daytona.get(sandbox_id)
+            await start_supervisord_session(sandbox)
+        await sandbox.set_labels({'id': project_id})
+        # Pooled sandboxes never stop on their own, project sandboxes do
+        await sandbox.set_autostop_interval(SANDBOX_AUTO_STOP_INTERVAL)
+        return sandbox
+
+    async def _delete(self, sandbox_id: str) -> None:
+        try:
+            sandbox = await self.daytona.get(sandbox_id)
+            await self.daytona.delete(sandbox)
+        except Exception as e:
+            logger.warning(f"Failed to delete pooled sandbox {sandbox_id}: {str(e)}")
+
+    def schedule_refill(self) -> None:
+        """Refill the pool in the background unless a refill is already running here."""
+        if not self.enabled or (self._refill_task and not self._refill_task.done()):
+            return
+        self._refill_task = asyncio.create_task(self.refill())
+
+    async def refill(self) -> int:
+        """Create sandboxes until the pool reaches the high watermark.
+
+        Does nothing while the pool is at or above the low watermark, or while
+        another process is refilling it.
+
+        Returns:
+            Number of sandboxes added
+        """
+        added = 0
+        try:
+            redis_client = await redis.get_client()
+            if await redis_client.llen(self._pool_key) >= self.low_watermark:
+                return 0
+            lock_token = uuid.uuid4().hex
+            if not await redis.set(self._refill_lock_key, lock_token, ex=REFILL_LOCK_TTL, nx=True):
+                return 0
+
+            try:
+                while await redis_client.llen(self._pool_key) < self.high_watermark:
+                    entry = await self._create_pooled_sandbox()
+                    await redis_client.rpush(self._pool_key, json.dumps(entry))
+                    await self._record("created")
+                    added += 1
+            finally:
+                # A refill outliving REFILL_LOCK_TTL must not release a lock another process has taken since
+                await redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, self._refill_lock_key, lock_token)
+
+        except Exception as e:
+            logger.error(f"Error refilling sandbox pool for {self.snapshot}: {str(e)}", exc_info=True)
+            await self._record("failures")
+
+        if added:
+            logger.debug(f"Added {added} sandboxes to the {self.snapshot} pool")
+        return added
+
+    async def _create_pooled_sandbox(self) -> Dict[str, Any]:
+        password = str(uuid.uuid4())
+        sandbox = await self.daytona.create(sandbox_create_params(password, snapshot=self.snapshot, auto_stop_interval=0))
+        try:
+            await start_supervisord_session(sandbox)
+            await asyncio.sleep(SERVICES_STARTUP_SECONDS)
+            vnc_url, website_url, token = await get_sandbox_preview_links(sandbox)
+        except Exception:
+            await self.daytona.delete(sandbox)
+            raise
+        return {
+            'id': sandbox.id,
+            'pass': password,
+            'vnc_preview': vnc_url,
+            'sandbox_url': website_url,
+            'token': token,
+            'created_at': time.time()
+        }
+
+    async def _record(self, metric: str) -> None:
+        try:
+            redis_client = await redis.get_client()
+            await redis_client.hincrby(self._metrics_key, metric, 1)
+        except Exception as e:
+            logger.warning(f"Failed to record sandbox pool metric {metric}: {str(e)}")
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Return the pool size, watermarks and hit/miss/created/failure counters."""
+        redis_client = await redis.get_client()
+        size = await redis_client.llen(self._pool_key)
+        counters = await redis_client.hgetall(self._metrics_key)
+        stats = {
+            'snapshot': self.snapshot,
+            'size': size,
+            'low_watermark': self.low_watermark,
+            'high_watermark': self.high_watermark,
+        }
+        for metric in ('hits', 'misses', 'created', 'failures'):
+            stats[metric] = int(counters.get(metric, 0))
+        return stats
+
+
+sandbox_pool = SandboxPool()
+
+
+async def provision_project_sandbox(project_id: str, wait_for_services: bool = False,
+                                    require_preview_links: bool = True) -> Tuple[AsyncSandbox, Dict[str, Any]]:
+    """Get a running sandbox for a new project, from the warm pool when possible.
+
+    Args:
+        project_id: The project the sandbox is for
+        wait_for_services: When a sandbox has to be created, wait for its
+            services to start before returning
+        require_preview_links: Raise if the preview links of a created sandbox
+            cannot be fetched, deleting the sandbox; otherwise store them as None
+
+    Returns:
+        The sandbox and the metadata to store in the project's `sandbox` column
+    """
+    claimed = await sandbox_pool.claim(project_id)
+    if claimed:
+        return claimed
+
+    sandbox_pass = str(uuid.uuid4())
+    sandbox = await create_sandbox(sandbox_pass, project_id)
+    try:
+        if wait_for_services:
+            logger.info(f"Waiting {SERVICES_STARTUP_SECONDS} seconds for sandbox {sandbox.id} services to initialize...")
+            await asyncio.sleep(SERVICES_STARTUP_SECONDS)
+        vnc_url, website_url, token = await get_sandbox_preview_links(sandbox)
+    except Exception:
+        if require_preview_links:
+            try:
+                await sandbox_module.daytona.delete(sandbox)
+            except Exception as e:
+                logger.error(f"Error deleting sandbox {sandbox.id} without preview links: {str(e)}")
+            raise
+        logger.warning(f"Failed to extract preview links for sandbox {sandbox.id}", exc_info=True)
+        vnc_url, website_url, token = None, None, None
+
+    return sandbox, {
+        'id': sandbox.id,
+        'pass': sandbox_pass,
+        'vnc_preview': vnc_url,
+        'sandbox_url': website_url,
+        'token': token
+    }
@@ -0,0 +1,157 @@
+"""
+Per-process sandbox handle registry.
+
+Sandbox tools of the same project share one handle instead of each loading the
+project row and calling Daytona on first use. Concurrent lookups for a project
+are coalesced into a single load, handles and their preview URLs are cached for
+HANDLE_TTL seconds, and handles no tool has used for IDLE_HANDLE_SECONDS are
+dropped by a background sweeper.
+
+Sandboxes are not stopped here. Tool calls are only one kind of use: preview
+URLs, VNC, dev servers started in the background and the sandbox file API keep
+a sandbox busy without going through this registry. Stopping is left to
+Daytona's activity-based auto-stop (SANDBOX_AUTO_STOP_INTERVAL).
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from daytona_sdk import AsyncSandbox
+
+from sandbox.sandbox import delete_sandbox, get_or_start_sandbox
+from sandbox.pool import provision_project_sandbox
+from utils.logger import logger
+
+# Handles are re-validated against Daytona after this long, a sandbox may have been auto-stopped meanwhile
+HANDLE_TTL = 300
+IDLE_HANDLE_SECONDS = 30 * 60
+SWEEP_INTERVAL_SECONDS = 60
+
+
+@dataclass
+class SandboxHandle:
+    """A started sandbox of a project together with its project metadata."""
+    project_id: str
+    sandbox: AsyncSandbox
+    sandbox_id: str
+    sandbox_pass: Optional[str]
+    loaded_at: float = field(default_factory=time.monotonic)
+    last_used: float = field(default_factory=time.monotonic)
+    preview_urls: Dict[int, str] = field(default_factory=dict)
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() - self.loaded_at > HANDLE_TTL
+
+
+class SandboxRegistry:
+    """Shares sandbox handles between the sandbox tools of this process."""
+
+    def __init__(self):
+        self._handles: Dict[str, SandboxHandle] = {}
+        self._loading: Dict[str, asyncio.Task] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+
+    async def get(self, project_id: str, db) -> SandboxHandle:
+        """Get the handle of a project's sandbox, starting or creating the sandbox if needed.
+
+        Args:
+            project_id: The project ID
+            db: DBConnection used to read and update the project row
+
+        Returns:
+            Handle of the running sandbox
+        """
+        handle = self._handles.get(project_id)
+        if handle is None or handle.expired:
+            task = self._loading.get(project_id)
+            if task is None:
+                task = asyncio.create_task(self._load(project_id, db))
+                self._loading[project_id] = task
+                task.add_done_callback(lambda _: self._loading.pop(project_id, None))
+            # Shielded so one caller being cancelled does not fail the others
+            handle = await asyncio.shield(task)
+            self._ensure_sweeper()
+
+        handle.last_used = time.monotonic()
+        return handle
+
+    def invalidate(self, project_id: str) -> None:
+        """Forget a project's handle so the next lookup reloads it."""
+        self._handles.pop(project_id, None)
+
+    async def get_preview_url(self, handle: SandboxHandle, port: int) -> str:
+        """Get the preview URL of a sandbox port, cached with the handle."""
+        if port not in handle.preview_urls:
+            link = await handle.sandbox.get_preview_link(port)
+            handle.preview_urls[port] = link.url if hasattr(link, 'url') else str(link).split("url='")[1].split("'")[0]
+        return handle.preview_urls[port]
+
+    async def _load(self, project_id: str, db) -> SandboxHandle:
+        client = await db.client
+
+        project = await client.table('projects').select('sandbox').eq('project_id', project_id).execute()
+        if not project.data or len(project.data) == 0:
+            raise ValueError(f"Project {project_id} not found")
+
+        sandbox_info = project.data[0].get('sandbox') or {}
+
+        if sandbox_info.get('id'):
+            sandbox = await get_or_start_sandbox(sandbox_info['id'])
+        else:
+            # If there is no sandbox recorded for this project, create one lazily
+            logger.debug(f"No sandbox recorded for project {project_id}; creating lazily")
+            sandbox, sandbox_info = await provision_project_sandbox(project_id, wait_for_services=True, require_preview_links=False)
+
+            # Persist sandbox metadata to project record
+            update_result = await client.table('projects').update({
+                'sandbox': sandbox_info
+            }).eq('project_id', project_id).execute()
+
+            if not update_result.data:
+                # Cleanup created sandbox if DB update failed
+                try:
+                    await delete_sandbox(sandbox.id)
+                except Exception:
+                    logger.error(f"Failed to delete sandbox {sandbox.id} after DB update failure", exc_info=True)
+                raise Exception("Database update failed when storing sandbox metadata")
+
+        handle = SandboxHandle(
+            project_id=project_id,
+            sandbox=sandbox,
+            sandbox_id=sandbox_info['id'],
+            sandbox_pass=sandbox_info.get('pass')
+        )
+        self._handles[project_id] = handle
+        return handle
+
+    def _ensure_sweeper(self) -> None:
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_idle())
+
+    async def _sweep_idle(self) -> None:
+        while self._handles:
+            await asyncio.sleep(SWEEP_INTERVAL_SECONDS)
+            try:
+                self.drop_idle()
+            except Exception as e:
+                logger.error(f"Error dropping idle sandbox handles: {str(e)}", exc_info=True)
+
+    def drop_idle(self, idle_seconds: int = IDLE_HANDLE_SECONDS) -> int:
+        """Drop the handles of sandboxes no tool has used for idle_seconds; the sandboxes keep running.
+
+        Returns:
+            Number of handles dropped
+        """
+        now = time.monotonic()
+        dropped = 0
+        for project_id, handle in list(self._handles.items()):
+            if now - handle.last_used >= idle_seconds and project_id not in self._loading:
+                self._handles.pop(project_id, None)
+                dropped += 1
+        return dropped
+
+
+sandbox_registry = SandboxRegistry()
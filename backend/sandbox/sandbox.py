@@ -1,5 +1,6 @@
 from daytona_sdk import AsyncDaytona, DaytonaConfig, CreateSandboxFromSnapshotParams, AsyncSandbox, SessionExecuteRequest, Resources, SandboxState
 from dotenv import load_dotenv
+from typing import Optional, Tuple
 from utils.logger import logger
 from utils.config import config
 from utils.config import Configuration
@@ -78,19 +79,18 @@ async def start_supervisord_session(sandbox: AsyncSandbox):
         logger.error(f"Error starting supervisord session: {str(e)}")
         raise e
 
-async def create_sandbox(password: str, project_id: str = None) -> AsyncSandbox:
-    """Create a new sandbox with all required services configured and running."""
-    
-    logger.debug("Creating new Daytona sandbox environment")
-    logger.debug("Configuring sandbox with snapshot and environment variables")
-    
+# Minutes of inactivity before a project sandbox is stopped
+SANDBOX_AUTO_STOP_INTERVAL = 120
+
+def sandbox_create_params(password: str, project_id: str = None, snapshot: str = None, auto_stop_interval: int = SANDBOX_AUTO_STOP_INTERVAL) -> CreateSandboxFromSnapshotParams:
+    """Build the Daytona parameters for a new sandbox."""
     labels = None
     if project_id:
         logger.debug(f"Using sandbox_id as label: {project_id}")
         labels = {'id': project_id}
-        
-    params = CreateSandboxFromSnapshotParams(
-        snapshot=Configuration.SANDBOX_SNAPSHOT_NAME,
+
+    return CreateSandboxFromSnapshotParams(
+        snapshot=snapshot or Configuration.SANDBOX_SNAPSHOT_NAME,
         public=True,
         labels=labels,
         env_vars={
@@ -111,9 +111,16 @@ async def create_sandbox(password: str, project_id: str = None) -> AsyncSandbox:
             memory=4,
             disk=5,
         ),
-        auto_stop_interval=120,
+        auto_stop_interval=auto_stop_interval,
         auto_archive_interval=2 * 60,
     )
+
+async def create_sandbox(password: str, project_id: str = None) -> AsyncSandbox:
+    """Create a new sandbox with all required services configured and running."""
+    
+    logger.debug("Creating new Daytona sandbox environment")
+    logger.debug("Configuring sandbox with snapshot and environment variables")
+    params = sandbox_create_params(password, project_id)
     
     # Create the sandbox
     sandbox = await daytona.create(params)
@@ -125,6 +132,19 @@ async def create_sandbox(password: str, project_id: str = None) -> AsyncSandbox:
     logger.debug(f"Sandbox environment successfully initialized")
     return sandbox
 
+async def get_sandbox_preview_links(sandbox: AsyncSandbox) -> Tuple[str, str, Optional[str]]:
+    """Return the VNC preview URL, website URL and preview token of a sandbox."""
+    vnc_link = await sandbox.get_preview_link(6080)
+    website_link = await sandbox.get_preview_link(8080)
+    vnc_url = vnc_link.url if hasattr(vnc_link, 'url') else str(vnc_link).split("url='")[1].split("'")[0]
+    website_url = website_link.url if hasattr(website_link, 'url') else str(website_link).split("url='")[1].split("'")[0]
+    token = None
+    if hasattr(vnc_link, 'token'):
+        token = vnc_link.token
+    elif "token='" in str(vnc_link):
+        token = str(vnc_link).split("token='")[1].split("'")[0]
+    return vnc_url, website_url, token
+
 async def delete_sandbox(sandbox_id: str) -> bool:
     """Delete a sandbox by its ID."""
     logger.debug(f"Deleting sandbox with ID: {sandbox_id}")
@@ -0,0 +1,183 @@
+"""
+Workspace manifests for sandboxes.
+
+A manifest lists every workspace file with its size, modification time and
+content hash, built inside the sandbox with a single exec call. WorkspaceTracker
+keeps only its previous manifest, so it can report what changed between
+snapshots without downloading anything. Contents are read on demand, a bounded
+number of downloads at a time, and kept in an LRU bounded by total size, so
+repeated reads only download files whose hash changed.
+"""
+
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from daytona_sdk import AsyncSandbox
+
+from utils.files_utils import EXCLUDED_DIRS, should_exclude_file
+from utils.logger import logger
+
+# Larger files are listed but neither hashed nor downloaded
+MAX_CONTENT_BYTES = 1_000_000
+DOWNLOAD_CONCURRENCY = 8
+# Total size of the decoded file contents kept between reads
+MAX_CACHED_BYTES = 16_000_000
+MANIFEST_TIMEOUT = 60
+_SECTION_SEPARATOR = "==MANIFEST_HASHES=="
+
+
+@dataclass
+class ManifestEntry:
+    """A workspace file as seen by the manifest."""
+    size: int
+    modified: float
+    sha1: Optional[str] = None
+
+    @property
+    def signature(self) -> str:
+        """Hash of the content, or size and mtime for files too large to hash."""
+        return self.sha1 or f"{self.size}:{self.modified}"
+
+    def metadata(self) -> Dict[str, Any]:
+        return {
+            "is_dir": False,
+            "size": self.size,
+            "modified": datetime.fromtimestamp(self.modified, tz=timezone.utc).isoformat()
+        }
+
+
+def _manifest_command(root: str) -> str:
+    prune = " -o ".join(f"-name {name}" for name in sorted(EXCLUDED_DIRS))
+    find = f"find . \\( {prune} \\) -prune -o -type f"
+    return (
+        f"/bin/sh -c 'cd {root} && "
+        f"{find} -print0 | xargs -0 -r stat -c \"%s %Y %n\"; "
+        f"echo {_SECTION_SEPARATOR}; "
+        f"{find} -size -{MAX_CONTENT_BYTES + 1}c -print0 | xargs -0 -r sha1sum'"
+    )
+
+
+def _relative(path: str) -> str:
+    return path[2:] if path.startswith("./") else path
+
+
+async def build_manifest(sandbox: AsyncSandbox, root: str = "/workspace") -> Dict[str, ManifestEntry]:
+    """Build the manifest of a sandbox directory with one exec call.
+
+    Returns:
+        Manifest entries by path relative to root, excluded files left out
+    """
+    response = await sandbox.process.exec(_manifest_command(root), timeout=MANIFEST_TIMEOUT)
+    if response.exit_code != 0:
+        raise RuntimeError(f"Failed to build workspace manifest: {response.result}")
+
+    stats, _, hashes = (response.result or "").partition(_SECTION_SEPARATOR)
+    manifest: Dict[str, ManifestEntry] = {}
+    for line in stats.splitlines():
+        parts = line.split(" ", 2)
+        if len(parts) != 3:
+            continue
+        rel_path = _relative(parts[2])
+        if should_exclude_file(rel_path):
+            continue
+        manifest[rel_path] = ManifestEntry(size=int(parts[0]), modified=float(parts[1]))
+
+    for line in hashes.splitlines():
+        digest, _, path = line.partition("  ")
+        entry = manifest.get(_relative(path))
+        if entry is not None:
+            entry.sha1 = digest
+    return manifest
+
+
+class WorkspaceTracker:
+    """Tracks a sandbox workspace across snapshots, reading file contents on demand."""
+
+    def __init__(self, root: str = "/workspace", concurrency: int = DOWNLOAD_CONCURRENCY,
+                 max_cached_bytes: int = MAX_CACHED_BYTES):
+        self.root = root
+        self.max_cached_bytes = max_cached_bytes
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # Manifest of the previous snapshot
+        self._manifest: Dict[str, ManifestEntry] = {}
+        # Decoded contents by path with the signature they were read at, None for binary files
+        self._contents: "OrderedDict[str, Tuple[str, Optional[str]]]" = OrderedDict()
+        self._cached_bytes = 0
+
+    async def changes(self, sandbox: AsyncSandbox) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+        """Snapshot the workspace and return what changed since the previous snapshot.
+
+        Nothing is downloaded; use read() for the contents of changed files.
+
+        Returns:
+            Tuple of (metadata of added or modified files by path, deleted paths)
+        """
+        manifest = await build_manifest(sandbox, self.root)
+
+        deleted = [path for path in self._manifest if path not in manifest]
+        changed = {
+            path: entry.metadata() for path, entry in manifest.items()
+            if path not in self._manifest or self._manifest[path].signature != entry.signature
+        }
+        self._manifest = manifest
+        for path in deleted:
+            self._uncache(path)
+        return changed, deleted
+
+    async def state(self, sandbox: AsyncSandbox) -> Dict[str, Dict[str, Any]]:
+        """Snapshot the workspace and return the state of every readable text file."""
+        await self.changes(sandbox)
+        contents = await self.read(sandbox, self._manifest)
+        return {path: {"content": content, **self._manifest[path].metadata()} for path, content in contents.items()}
+
+    async def read(self, sandbox: AsyncSandbox, paths: Iterable[str]) -> Dict[str, str]:
+        """Read text files of the latest snapshot, downloading only those not cached at their current hash.
+
+        Returns:
+            Contents by path; large, binary, unreadable and unknown files are left out
+        """
+        paths = [path for path in paths if path in self._manifest]
+        contents = await asyncio.gather(*[self._read(sandbox, path, self._manifest[path]) for path in paths])
+        return {path: content for path, content in zip(paths, contents) if content is not None}
+
+    async def _read(self, sandbox: AsyncSandbox, path: str, entry: ManifestEntry) -> Optional[str]:
+        if entry.size > MAX_CONTENT_BYTES:
+            logger.debug(f"Skipping large file in workspace state: {path} ({entry.size} bytes)")
+            return None
+        cached = self._contents.get(path)
+        if cached is not None and cached[0] == entry.signature:
+            self._contents.move_to_end(path)
+            return cached[1]
+
+        async with self._semaphore:
+            try:
+                data = await sandbox.fs.download_file(f"{self.root}/{path}")
+            except Exception as e:
+                logger.warning(f"Error reading file {path}: {e}")
+                return None
+        try:
+            content = data.decode()
+        except UnicodeDecodeError:
+            logger.debug(f"Skipping binary file in workspace state: {path}")
+            content = None
+        self._cache(path, entry.signature, content)
+        return content
+
+    def _cache(self, path: str, signature: str, content: Optional[str]) -> None:
+        self._uncache(path)
+        size = len(content or "")
+        if size > self.max_cached_bytes:
+            return
+        self._contents[path] = (signature, content)
+        self._cached_bytes += size
+        while self._cached_bytes > self.max_cached_bytes:
+            _, (_, evicted) = self._contents.popitem(last=False)
+            self._cached_bytes -= len(evicted or "")
+
+    def _uncache(self, path: str) -> None:
+        cached = self._contents.pop(path, None)
+        if cached is not None:
+            self._cached_bytes -= len(cached[1] or "")
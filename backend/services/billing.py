@@ -5,7 +5,7 @@ stripe listen --forward-to localhost:8000/api/billing/webhook
 """
 
 from fastapi import APIRouter, HTTPException, Depends, Request
-from typing import Optional, Dict, Tuple
+from typing import Optional, Dict, List, Tuple
 import stripe
 from datetime import datetime, timezone, timedelta
 
@@ -14,6 +14,7 @@ from utils.cache import Cache
 from utils.logger import logger
 from utils.config import config, EnvMode
 from services.supabase import DBConnection
+from services.usage_counters import get_monthly_usage
 from utils.auth_utils import get_current_user_id_from_jwt
 from pydantic import BaseModel
 from utils.constants import MODEL_ACCESS_TIERS, MODEL_NAME_ALIASES, HARDCODED_MODEL_PRICES, MODELS
@@ -294,42 +295,9 @@ async def get_user_subscription(user_id: str) -> Optional[Dict]:
         return None
 
 async def calculate_monthly_usage(client, user_id: str) -> float:
-    """Calculate total dollar cost for the current month using durable usage_logs."""
-    result = await Cache.get(f"monthly_usage:{user_id}")
-    if result is not None:
-        return result
-
-    now = datetime.now(timezone.utc)
-    start_of_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-
+    """Get total dollar cost for the current month from the account's usage counter, kept in sync with usage_logs."""
     try:
-        # Sum estimated_cost for this month from usage_logs
-        # Supabase PostgREST doesn't support SUM directly with select(); use RPC fallback if present
-        # Fallback to client-side sum
-        page = 0
-        page_size = 1000
-        total_cost = 0.0
-        while True:
-            res = await client.table('usage_logs') \
-                .select('estimated_cost, created_at') \
-                .eq('user_id', user_id) \
-                .gte('created_at', start_of_month.isoformat()) \
-                .order('created_at', desc=True) \
-                .range(page * page_size, (page + 1) * page_size - 1) \
-                .execute()
-            if not res.data:
-                break
-            for row in res.data:
-                try:
-                    total_cost += float(row.get('estimated_cost') or 0.0)
-                except Exception:
-                    continue
-            if len(res.data) < page_size:
-                break
-            page += 1
-
-        await Cache.set(f"monthly_usage:{user_id}", total_cost, ttl=5)
-        return total_cost
+        return await get_monthly_usage(client, user_id)
     except Exception as e:
         logger.error(f"Error calculating monthly usage from usage_logs: {str(e)}")
         return 0.0
@@ -867,29 +835,83 @@ async def use_credits_from_balance(
         logger.error(f"Error using credits for user {user_id}: {str(e)}")
         return False
 
+async def apply_usage_credits(
+    client: SupabaseClient,
+    user_id: str,
+    message_ids: List[str],
+    amount: float,
+    description: str = None,
+    thread_id: str = None,
+    message_id: str = None
+) -> bool:
+    """
+    Mark usage logs as charged and deduct their overage from the credit balance in one transaction.
+    
+    Returns:
+        bool: False if the balance no longer covered the amount; the logs are marked either way
+    
+    Raises:
+        Exception: If the logs could not be charged, e.g. because another consumer charged them
+    """
+    result = await client.rpc('apply_usage_credits', {
+        'p_user_id': user_id,
+        'p_message_ids': message_ids,
+        'p_amount': amount,
+        'p_description': description,
+        'p_thread_id': thread_id,
+        'p_message_id': message_id
+    }).execute()
+    return bool(result.data)
+
 async def handle_usage_with_credits(
     client: SupabaseClient,
     user_id: str,
     token_cost: float,
     thread_id: str = None,
     message_id: str = None,
-    model: str = None
+    model: str = None,
+    current_usage: Optional[float] = None,
+    message_ids: Optional[List[str]] = None
 ) -> Tuple[bool, str]:
     """
     Handle token usage that may require credits if subscription limit is exceeded.
     This should be called after each agent response to track and deduct from credits if needed.
+    Pass current_usage when the monthly usage was read before this usage was logged.
+    The usage logs in message_ids are marked as charged together with any deduction,
+    so calling this again for the same logs fails instead of charging twice.
     
     Returns:
         Tuple[bool, str]: (success, message)
+    
+    Raises:
+        Exception: If the usage could not be processed; no credits were deducted
     """
-    # DISABLED FOR PRODUCTION: Skip all credit usage tracking
+    if message_ids is None:
+        message_ids = [message_id] if message_id else []
+    
+    async def charge(amount: float) -> bool:
+        if not message_ids and amount <= 0:
+            return True
+        return await apply_usage_credits(
+            client,
+            user_id,
+            message_ids,
+            amount,
+            description=f"Token overage for model {model or 'unknown'}",
+            thread_id=thread_id,
+            message_id=message_id
+        )
+    
+    # DISABLED FOR PRODUCTION: Skip all credit usage tracking; the usage is still marked as processed
     if config.ENV_MODE == EnvMode.PRODUCTION:
         logger.debug("Production mode - credit usage tracking disabled")
+        await charge(0.0)
         return True, "Production mode - credit tracking disabled"
     
-    # DISABLED FOR LOCAL: Skip all credit usage tracking
+    # DISABLED FOR LOCAL: Skip all credit usage tracking; the usage is still marked as processed
     if config.ENV_MODE == EnvMode.LOCAL:
         logger.debug("Local mode - credit usage tracking disabled")
+        await charge(0.0)
         return True, "Local mode - credit tracking disabled"
     
     try:
@@ -906,7 +928,8 @@ async def handle_usage_with_credits(
         tier_info = SUBSCRIPTION_TIERS.get(price_id, SUBSCRIPTION_TIERS[config.STRIPE_FREE_TIER_ID])
         
         # Get current month's usage
-        current_usage = await calculate_monthly_usage(client, user_id)
+        if current_usage is None:
+            current_usage = await calculate_monthly_usage(client, user_id)
         
         # Check if this usage would exceed the subscription limit
         new_total_usage = current_usage + token_cost
@@ -923,14 +946,7 @@ async def handle_usage_with_credits(
             
             if credit_balance.balance_dollars >= overage_amount:
                 # Deduct from credits
-                success = await use_credits_from_balance(
-                    client,
-                    user_id,
-                    overage_amount,
-                    description=f"Token overage for model {model or 'unknown'}",
-                    thread_id=thread_id,
-                    message_id=message_id
-                )
+                success = await charge(overage_amount)
                 
                 if success:
                     logger.debug(f"Used {int(overage_amount * 100)} credits for user {user_id} overage")
@@ -938,18 +954,20 @@ async def handle_usage_with_credits(
                 else:
                     return False, "Failed to deduct credits"
             else:
-                # Insufficient credits
+                # Insufficient credits; the usage is still marked as processed
+                await charge(0.0)
                 if credit_balance.can_purchase_credits:
                     return False, f"Insufficient credits. Balance: {credit_balance.balance_credits} credits, Required: {int(overage_amount * 100)} credits. Purchase more credits to continue."
                 else:
                     return False, f"Monthly limit exceeded and no credits available. Upgrade to the highest tier to purchase credits."
         
         # Within subscription limits, no credits needed
+        await charge(0.0)
         return True, "Within subscription limits"
         
     except Exception as e:
         logger.error(f"Error handling usage with credits: {str(e)}")
-        return False, f"Error processing usage: {str(e)}"
+        raise
 
 # API endpoints
 @router.post("/create-checkout-session")
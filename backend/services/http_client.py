@@ -0,0 +1,99 @@
+"""
+Shared HTTP Client
+
+One pooled httpx.AsyncClient per event loop, so calls to external APIs reuse
+connections (and HTTP/2 multiplexing when the h2 package is installed) instead
+of opening a new client, TCP connection and TLS session per request. Requests
+made through request() also wait for a per-host slot, which keeps a burst of
+parallel tool calls from flooding a single upstream.
+
+Clients are bound to the event loop that created them, so API processes and
+each Dramatiq worker loop get their own.
+"""
+
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from utils.logger import logger
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+DEFAULT_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+POOL_LIMITS = httpx.Limits(max_connections=200, max_keepalive_connections=50, keepalive_expiry=60.0)
+DEFAULT_HOST_CONCURRENCY = 16
+# Concurrent requests allowed per host, for hosts that need a different limit than the default
+HOST_CONCURRENCY: Dict[str, int] = {}
+
+
+class _LoopState:
+    def __init__(self):
+        self.client: Optional[httpx.AsyncClient] = None
+        self.host_slots: Dict[str, asyncio.Semaphore] = {}
+
+
+_loop_states: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopState]" = weakref.WeakKeyDictionary()
+
+
+def _state() -> _LoopState:
+    loop = asyncio.get_running_loop()
+    state = _loop_states.get(loop)
+    if state is None:
+        state = _LoopState()
+        _loop_states[loop] = state
+    return state
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Get the shared client of the running event loop, creating it on first use."""
+    state = _state()
+    if state.client is None or state.client.is_closed:
+        state.client = httpx.AsyncClient(http2=HTTP2_AVAILABLE, timeout=DEFAULT_TIMEOUT, limits=POOL_LIMITS)
+        logger.debug(f"Created shared HTTP client (http2={HTTP2_AVAILABLE})")
+    return state.client
+
+
+def set_host_concurrency(host: str, limit: int) -> None:
+    """Set how many requests to a host may run at once. Applies to hosts not used yet."""
+    HOST_CONCURRENCY[host.lower()] = limit
+
+
+def _host_slot(url: str) -> asyncio.Semaphore:
+    host = (urlsplit(url).hostname or "").lower()
+    slots = _state().host_slots
+    if host not in slots:
+        slots[host] = asyncio.Semaphore(HOST_CONCURRENCY.get(host, DEFAULT_HOST_CONCURRENCY))
+    return slots[host]
+
+
+async def request(method: str, url: str, **kwargs) -> httpx.Response:
+    """Send a request with the shared client once the host has a free slot.
+
+    Takes the same keyword arguments as httpx.AsyncClient.request.
+    """
+    async with _host_slot(url):
+        return await get_http_client().request(method, url, **kwargs)
+
+
+@asynccontextmanager
+async def stream(method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+    """Stream a response with the shared client, holding a host slot until the body is read."""
+    async with _host_slot(url):
+        async with get_http_client().stream(method, url, **kwargs) as response:
+            yield response
+
+
+async def close_http_client() -> None:
+    """Close the shared client of the running event loop."""
+    state = _loop_states.get(asyncio.get_running_loop())
+    if state is not None and state.client is not None:
+        await state.client.aclose()
+        state.client = None
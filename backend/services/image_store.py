@@ -0,0 +1,218 @@
+"""
+Image Store for Thread Image Context
+
+Images the agent looks at (image_context messages) used to be stored inline as
+base64 in the message rows and re-sent with every LLM call. They are now
+uploaded once to private storage (dagad.storage_provider.get_private_storage)
+under a path derived from their SHA-256, so the same image is stored once no
+matter how often it is viewed, and messages only keep that path.
+
+Stored images are never publicly readable. When building LLM messages:
+- Only the newest image context messages of a thread are sent in full. Older
+  ones are sent at low detail, and the oldest are replaced by a short note.
+- References to stored images are replaced with data URIs for every provider,
+  from a bounded in-memory LRU of encoded payloads that is filled by
+  downloading the images with the service credentials.
+"""
+
+import asyncio
+import base64
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from services import redis
+from utils.logger import logger
+
+IMAGE_PATH_PREFIX = "image_context"
+# URL scheme of stored image references in LLM messages until they are inlined
+IMAGE_REF_SCHEME = "image-store://"
+STORE_KEY_PREFIX = "image_ref"
+STORE_KEY_TTL = 30 * 24 * 3600
+
+# Newest image context messages per thread sent in full, then at low detail; older ones are dropped
+FULL_DETAIL_IMAGES = 3
+LOW_DETAIL_IMAGES = 5
+OMITTED_IMAGE_NOTE = "[An earlier image was omitted to save context. Use see_image again if you need to look at it.]"
+UNAVAILABLE_IMAGE_NOTE = "[An earlier image could not be loaded. Use see_image again if you need to look at it.]"
+
+INLINE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+_EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/gif": "gif", "image/webp": "webp"}
+_MIME_TYPES = {extension: mime_type for mime_type, extension in _EXTENSIONS.items()}
+
+
+def _store_key(image_hash: str) -> str:
+    return f"{STORE_KEY_PREFIX}:{image_hash}"
+
+
+async def store_image(data: bytes, mime_type: str) -> Optional[str]:
+    """
+    Store an image by content in private storage and return its path.
+
+    Args:
+        data: Image bytes
+        mime_type: MIME type of the image
+
+    Returns:
+        The storage path of the image, or None if it could not be stored
+    """
+    image_hash = hashlib.sha256(data).hexdigest()
+    try:
+        path = await redis.get(_store_key(image_hash))
+        if path:
+            return path
+    except Exception as e:
+        logger.warning(f"Failed to look up stored image {image_hash}: {str(e)}")
+
+    from dagad.storage_provider import get_private_storage
+
+    path = f"{IMAGE_PATH_PREFIX}/{image_hash[:2]}/{image_hash}.{_EXTENSIONS.get(mime_type, 'img')}"
+    try:
+        await get_private_storage().upload_bytes(path, data, mime_type)
+    except Exception as e:
+        # Stored before but no longer recorded in Redis: the content at the path is the same
+        if "duplicate" not in str(e).lower() and "already exists" not in str(e).lower():
+            logger.warning(f"Failed to store image {image_hash}: {str(e)}")
+            return None
+
+    try:
+        await redis.set(_store_key(image_hash), path, ex=STORE_KEY_TTL)
+    except Exception as e:
+        logger.warning(f"Failed to record stored image {image_hash}: {str(e)}")
+    return path
+
+
+def image_context_message(content: Dict[str, Any], message_id: str) -> Dict[str, Any]:
+    """Convert image_context content to an OpenAI-compatible user message with the image."""
+    if content.get("image_path"):
+        url = f"{IMAGE_REF_SCHEME}{content['image_path']}"
+    else:
+        url = content.get("image_url") or f"data:{content.get('mime_type', 'image/jpeg')};base64,{content.get('base64', '')}"
+    return {
+        "role": "user",
+        "content": [{"type": "image_url", "image_url": {"url": url}}],
+        "message_id": message_id,
+        "image_context": True,
+    }
+
+
+def age_image_context(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Downscale and drop older image context messages.
+
+    The newest FULL_DETAIL_IMAGES image messages are kept as they are, the next
+    LOW_DETAIL_IMAGES are sent at low detail and older ones become a text note.
+    The image_context marker is removed from every message.
+
+    Args:
+        messages: LLM messages in thread order
+
+    Returns:
+        A new list; changed messages are copies
+    """
+    aged = []
+    seen = 0
+    for msg in reversed(messages):
+        if isinstance(msg, dict) and msg.get("image_context"):
+            seen += 1
+            msg = {key: value for key, value in msg.items() if key != "image_context"}
+            if seen > FULL_DETAIL_IMAGES + LOW_DETAIL_IMAGES:
+                msg["content"] = OMITTED_IMAGE_NOTE
+            elif seen > FULL_DETAIL_IMAGES:
+                msg["content"] = [
+                    {**part, "image_url": {**part["image_url"], "detail": "low"}} if part.get("type") == "image_url" else part
+                    for part in msg["content"]
+                ]
+        aged.append(msg)
+    aged.reverse()
+    return aged
+
+
+class _InlineCache:
+    """LRU of image data URIs by storage path, bounded by their total size."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+
+    def get(self, path: str) -> Optional[str]:
+        data_uri = self._entries.get(path)
+        if data_uri is not None:
+            self._entries.move_to_end(path)
+        return data_uri
+
+    def put(self, path: str, data_uri: str) -> None:
+        if len(data_uri) > self.max_bytes or path in self._entries:
+            return
+        self._entries[path] = data_uri
+        self.total_bytes += len(data_uri)
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= len(evicted)
+
+
+_inline_cache = _InlineCache(INLINE_CACHE_MAX_BYTES)
+
+
+async def _data_uri(path: str) -> Optional[str]:
+    data_uri = _inline_cache.get(path)
+    if data_uri is not None:
+        return data_uri
+
+    from dagad.storage_provider import get_private_storage
+
+    try:
+        data = await get_private_storage().download_bytes(path)
+    except Exception as e:
+        logger.warning(f"Failed to download stored image {path} for inlining: {str(e)}")
+        return None
+    mime_type = _MIME_TYPES.get(path.rsplit(".", 1)[-1], "image/jpeg")
+    data_uri = f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+    _inline_cache.put(path, data_uri)
+    return data_uri
+
+
+async def inline_stored_images(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Replace references to stored images with data URIs.
+
+    Stored images are private, so every reference must be inlined before the
+    messages are sent. A message whose image cannot be downloaded is replaced
+    by a short note. Other image URLs are left to the provider.
+
+    Args:
+        messages: LLM messages
+
+    Returns:
+        A new list; changed messages are copies
+    """
+    def stored_paths(msg: Any) -> List[str]:
+        if not isinstance(msg, dict) or not isinstance(msg.get("content"), list):
+            return []
+        return [
+            part["image_url"]["url"][len(IMAGE_REF_SCHEME):] for part in msg["content"]
+            if isinstance(part, dict) and part.get("type") == "image_url"
+            and str(part.get("image_url", {}).get("url", "")).startswith(IMAGE_REF_SCHEME)
+        ]
+
+    paths = list(dict.fromkeys(path for msg in messages for path in stored_paths(msg)))
+    if not paths:
+        return messages
+    data_uris = dict(zip(paths, await asyncio.gather(*(_data_uri(path) for path in paths))))
+
+    inlined = []
+    for msg in messages:
+        msg_paths = stored_paths(msg)
+        if msg_paths and not all(data_uris.get(path) for path in msg_paths):
+            msg = {**msg, "content": UNAVAILABLE_IMAGE_NOTE}
+        elif msg_paths:
+            msg = {**msg, "content": [
+                {**part, "image_url": {**part["image_url"], "url": data_uris[part["image_url"]["url"][len(IMAGE_REF_SCHEME):]]}}
+                if isinstance(part, dict) and part.get("type") == "image_url"
+                and part["image_url"]["url"].startswith(IMAGE_REF_SCHEME) else part
+                for part in msg["content"]
+            ]}
+        inlined.append(msg)
+    return inlined
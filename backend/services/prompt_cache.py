@@ -0,0 +1,179 @@
+"""
+Compiled System Prompt Caching Service
+
+This service caches the static part of an agent's system prompt (base prompt,
+knowledge base section and MCP tool listing) in Redis, so runs of the same
+agent version do not rebuild it or re-fetch the knowledge base every time.
+Per-run sections such as the current date and user context are added by the
+caller on top of the cached artifact.
+
+Cache keys combine the agent id, agent version, a hash of the tool set and the
+agent's knowledge base revision. The knowledge base revision is a token that is
+rotated whenever the agent's knowledge base entries change.
+"""
+
+import json
+import hashlib
+import uuid
+from typing import Dict, Any, Optional
+from utils.logger import logger
+from services import redis
+
+
+class PromptCache:
+    """Redis-based cache for compiled system prompts."""
+
+    # Cache TTL: 1 hour, also bounds staleness for knowledge base edits made outside the API
+    CACHE_TTL = 3600
+
+    # Knowledge base revisions outlive compiled prompts so a rotation is never lost
+    KB_REVISION_TTL = 24 * 3600
+
+    # Cache key prefixes
+    CACHE_PREFIX = "compiled_prompt"
+    KB_REVISION_PREFIX = "kb_revision"
+
+    @staticmethod
+    def _kb_revision_key(agent_id: str) -> str:
+        return f"{PromptCache.KB_REVISION_PREFIX}:{agent_id}"
+
+    @staticmethod
+    async def get_kb_revision(agent_id: str) -> Optional[str]:
+        """
+        Get the current knowledge base revision for an agent, creating one if needed.
+
+        Args:
+            agent_id: The agent ID
+
+        Returns:
+            Revision token, or None if Redis is unavailable
+        """
+        try:
+            key = PromptCache._kb_revision_key(agent_id)
+            revision = await redis.get(key)
+            if revision:
+                return revision
+
+            revision = str(uuid.uuid4())
+            # Another run may have created the revision concurrently, keep whichever won
+            if not await redis.set(key, revision, ex=PromptCache.KB_REVISION_TTL, nx=True):
+                revision = await redis.get(key)
+            return revision
+
+        except Exception as e:
+            logger.warning(f"Failed to get knowledge base revision for {agent_id}: {e}")
+            return None
+
+    @staticmethod
+    async def bump_kb_revision(agent_id: str) -> None:
+        """
+        Rotate the knowledge base revision so compiled prompts are rebuilt.
+
+        Args:
+            agent_id: The agent ID
+        """
+        try:
+            key = PromptCache._kb_revision_key(agent_id)
+            await redis.set(key, str(uuid.uuid4()), ex=PromptCache.KB_REVISION_TTL)
+            logger.debug(f"Rotated knowledge base revision for agent: {agent_id}")
+
+        except Exception as e:
+            logger.warning(f"Failed to rotate knowledge base revision for {agent_id}: {e}")
+
+    @staticmethod
+    def tool_set_hash(agent_config: Optional[Dict[str, Any]], mcp_tools: Dict[str, Any], include_sample_response: bool) -> str:
+        """
+        Hash everything besides the agent version that changes the compiled prompt.
+
+        Args:
+            agent_config: The agent configuration, if any
+            mcp_tools: Schemas of the MCP tools registered for this run, by tool name
+            include_sample_response: Whether the sample assistant response is appended
+
+        Returns:
+            Hex digest identifying the tool set
+        """
+        agent_config = agent_config or {}
+        key_data = json.dumps({
+            'system_prompt': agent_config.get('system_prompt'),
+            'agentpress_tools': agent_config.get('agentpress_tools'),
+            'configured_mcps': agent_config.get('configured_mcps'),
+            'custom_mcps': agent_config.get('custom_mcps'),
+            'mcp_tools': mcp_tools,
+            'sample_response': include_sample_response,
+        }, sort_keys=True, default=str)
+        return hashlib.md5(key_data.encode()).hexdigest()
+
+    @staticmethod
+    def _generate_cache_key(agent_id: str, version_id: Optional[str], tool_set_hash: str, kb_revision: Optional[str]) -> str:
+        """Generate a cache key for a compiled prompt."""
+        key_data = f"{agent_id}:{version_id or ''}:{tool_set_hash}:{kb_revision or ''}"
+
+        # Create a hash to ensure key length consistency
+        key_hash = hashlib.md5(key_data.encode()).hexdigest()[:16]
+        return f"{PromptCache.CACHE_PREFIX}:{key_hash}"
+
+    @staticmethod
+    async def get_compiled_prompt(
+        agent_id: str,
+        version_id: Optional[str],
+        tool_set_hash: str,
+        kb_revision: Optional[str]
+    ) -> Optional[Dict[str, str]]:
+        """
+        Retrieve a cached compiled prompt.
+
+        Args:
+            agent_id: The agent ID
+            version_id: The agent version ID
+            tool_set_hash: Hash from tool_set_hash()
+            kb_revision: Knowledge base revision from get_kb_revision()
+
+        Returns:
+            Dict of prompt sections or None if not found
+        """
+        try:
+            cache_key = PromptCache._generate_cache_key(agent_id, version_id, tool_set_hash, kb_revision)
+            cached_data = await redis.get(cache_key)
+
+            if cached_data:
+                logger.debug(f"Cache HIT for compiled prompt: {agent_id} (version: {version_id})")
+                return json.loads(cached_data)
+            else:
+                logger.debug(f"Cache MISS for compiled prompt: {agent_id} (version: {version_id})")
+                return None
+
+        except Exception as e:
+            logger.warning(f"Failed to retrieve cached compiled prompt for {agent_id}: {e}")
+            return None
+
+    @staticmethod
+    async def cache_compiled_prompt(
+        agent_id: str,
+        version_id: Optional[str],
+        tool_set_hash: str,
+        kb_revision: Optional[str],
+        compiled: Dict[str, str]
+    ) -> None:
+        """
+        Cache a compiled prompt.
+
+        Args:
+            agent_id: The agent ID
+            version_id: The agent version ID
+            tool_set_hash: Hash from tool_set_hash()
+            kb_revision: Knowledge base revision from get_kb_revision()
+            compiled: Dict of prompt sections to cache
+        """
+        try:
+            cache_key = PromptCache._generate_cache_key(agent_id, version_id, tool_set_hash, kb_revision)
+            await redis.set(cache_key, json.dumps(compiled), ex=PromptCache.CACHE_TTL)
+            logger.debug(f"Cached compiled prompt: {agent_id} (version: {version_id})")
+
+        except Exception as e:
+            logger.warning(f"Failed to cache compiled prompt for {agent_id}: {e}")
+
+
+async def invalidate_agent_kb_prompts(agent_id: str) -> None:
+    """Convenience function to invalidate compiled prompts after a knowledge base change."""
+    await PromptCache.bump_kb_revision(agent_id)
@@ -3,7 +3,7 @@ import os
 from dotenv import load_dotenv
 import asyncio
 from utils.logger import logger
-from typing import List, Any
+from typing import List, Any, Dict, Optional
 from utils.retry import retry
 
 # Redis client and connection pool
@@ -166,6 +166,25 @@ async def lrange(key: str, start: int, end: int) -> List[str]:
     return await redis_client.lrange(key, start, end)
 
 
+# Stream operations
+async def xadd(key: str, fields: Dict[str, str], maxlen: Optional[int] = None, approximate: bool = True, nomkstream: bool = False) -> Optional[str]:
+    """Append an entry to a stream, optionally trimming it to about maxlen entries."""
+    redis_client = await get_client()
+    return await redis_client.xadd(key, fields, maxlen=maxlen, approximate=approximate, nomkstream=nomkstream)
+
+
+async def xread(streams: Dict[str, str], count: Optional[int] = None, block: Optional[int] = None) -> List[Any]:
+    """Read stream entries newer than the given IDs, blocking up to block milliseconds."""
+    redis_client = await get_client()
+    return await redis_client.xread(streams, count=count, block=block)
+
+
+async def exists(*keys: str) -> int:
+    """Count how many of the given keys exist."""
+    redis_client = await get_client()
+    return await redis_client.exists(*keys)
+
+
 # Key management
 
 
@@ -0,0 +1,295 @@
+"""
+Agent Run Response Streams
+
+Agent run responses are appended to a Redis stream per run
+(agent_run:{id}:response_stream). Readers block on XREAD from the last entry
+ID they saw, so there is no separate notification channel and no re-reading of
+the whole response list, and clients that reconnect resume from their
+Last-Event-ID instead of replaying the run from the start.
+
+Besides responses, the stream carries a final control entry (END_STREAM, ERROR
+or STOP) so readers know when to stop without listening on a pub/sub channel.
+Runs started before this transport keep their responses in the legacy
+agent_run:{id}:responses list, see has_legacy_responses().
+
+Workers write through ResponseStreamWriter, which merges consecutive streamed
+assistant chunks and sends each batch as one pipelined request.
+"""
+
+import asyncio
+import json
+import re
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from services import redis
+from utils.logger import logger
+
+# Streams are trimmed to about this many entries; long runs drop their oldest chunks
+RESPONSE_STREAM_MAX_LENGTH = 20_000
+# Stays below the Redis socket timeout so blocking reads never time out the connection
+READ_BLOCK_MS = 5000
+READ_BATCH_SIZE = 500
+
+# Streamed assistant chunks are merged until this much time or text has accumulated
+COALESCE_INTERVAL_SECONDS = 0.03
+COALESCE_MAX_BYTES = 512
+# Batches waiting to be written before the producer is slowed down
+MAX_PENDING_BATCHES = 32
+
+STREAM_START_ID = "0"
+_ENTRY_ID_PATTERN = re.compile(r"^\d+-\d+$")
+
+
+class StreamEntry(NamedTuple):
+    """A response stream entry. Exactly one of data and control is set."""
+    entry_id: str
+    data: Optional[str]
+    status: Optional[str]
+    control: Optional[str]
+
+
+def response_stream_key(agent_run_id: str) -> str:
+    return f"agent_run:{agent_run_id}:response_stream"
+
+
+def legacy_response_list_key(agent_run_id: str) -> str:
+    return f"agent_run:{agent_run_id}:responses"
+
+
+def _response_fields(response: Dict[str, Any]) -> Dict[str, str]:
+    fields = {"data": json.dumps(response)}
+    # Stored next to the payload so readers can spot terminal statuses without decoding it
+    if response.get("type") == "status" and response.get("status"):
+        fields["status"] = response["status"]
+    return fields
+
+
+def parse_entry_id(value: Optional[str]) -> str:
+    """Validate a client-supplied Last-Event-ID, falling back to the stream start."""
+    if value and _ENTRY_ID_PATTERN.match(value.strip()):
+        return value.strip()
+    return STREAM_START_ID
+
+
+async def append_response(agent_run_id: str, response: Dict[str, Any]) -> str:
+    """Append a response to the run's stream.
+
+    Returns:
+        ID of the new entry
+    """
+    return await redis.xadd(
+        response_stream_key(agent_run_id),
+        _response_fields(response),
+        maxlen=RESPONSE_STREAM_MAX_LENGTH,
+        approximate=True
+    )
+
+
+async def append_responses(agent_run_id: str, responses: List[Dict[str, Any]]) -> List[str]:
+    """Append several responses to the run's stream in one round trip.
+
+    Returns:
+        IDs of the new entries
+    """
+    redis_client = await redis.get_client()
+    pipe = redis_client.pipeline(transaction=False)
+    for response in responses:
+        pipe.xadd(
+            response_stream_key(agent_run_id),
+            _response_fields(response),
+            maxlen=RESPONSE_STREAM_MAX_LENGTH,
+            approximate=True
+        )
+    return await pipe.execute()
+
+
+async def append_control(agent_run_id: str, signal: str) -> Optional[str]:
+    """Append a control signal for readers of the run's stream.
+
+    The stream is not created if it does not exist yet, so runs on the legacy
+    response list are left untouched.
+
+    Returns:
+        ID of the new entry, or None if the run has no stream
+    """
+    return await redis.xadd(
+        response_stream_key(agent_run_id),
+        {"control": signal},
+        maxlen=RESPONSE_STREAM_MAX_LENGTH,
+        approximate=True,
+        nomkstream=True
+    )
+
+
+async def read_entries(agent_run_id: str, last_id: str, block_ms: Optional[int] = None) -> List[StreamEntry]:
+    """Read up to READ_BATCH_SIZE entries after last_id.
+
+    Args:
+        agent_run_id: The agent run ID
+        last_id: ID of the last entry already seen, STREAM_START_ID for all
+        block_ms: Wait up to this long for new entries, None to return immediately
+
+    Returns:
+        Entries in stream order, empty if none arrived in time
+    """
+    result = await redis.xread({response_stream_key(agent_run_id): last_id}, count=READ_BATCH_SIZE, block=block_ms)
+    entries = []
+    for _stream, stream_entries in result or []:
+        for entry_id, fields in stream_entries:
+            entries.append(StreamEntry(
+                entry_id=entry_id,
+                data=fields.get("data"),
+                status=fields.get("status"),
+                control=fields.get("control")
+            ))
+    return entries
+
+
+async def has_legacy_responses(agent_run_id: str) -> bool:
+    """Whether the run stores its responses in the legacy list."""
+    return bool(await redis.exists(legacy_response_list_key(agent_run_id)))
+
+
+async def expire_responses(agent_run_id: str, seconds: int) -> None:
+    """Set a TTL on the run's stored responses."""
+    await redis.expire(response_stream_key(agent_run_id), seconds)
+    await redis.expire(legacy_response_list_key(agent_run_id), seconds)
+
+
+async def delete_responses(agent_run_id: str) -> None:
+    """Delete the run's stored responses."""
+    await redis.delete(response_stream_key(agent_run_id))
+    await redis.delete(legacy_response_list_key(agent_run_id))
+
+
+class ResponseStreamWriter:
+    """Writes an agent run's responses to its stream, coalescing streamed chunks.
+
+    Consecutive assistant chunks (metadata stream_status "chunk") of the same
+    thread run are merged into one response for up to COALESCE_INTERVAL_SECONDS
+    or COALESCE_MAX_BYTES of text. Any other response flushes the merged chunk
+    first and is sent right away, so ordering is preserved. Batches are written
+    in order by a single sender task; write() waits once MAX_PENDING_BATCHES
+    batches are queued.
+    """
+
+    def __init__(
+        self,
+        agent_run_id: str,
+        coalesce_interval: float = COALESCE_INTERVAL_SECONDS,
+        coalesce_max_bytes: int = COALESCE_MAX_BYTES,
+        max_pending_batches: int = MAX_PENDING_BATCHES
+    ):
+        self.agent_run_id = agent_run_id
+        self.coalesce_interval = coalesce_interval
+        self.coalesce_max_bytes = coalesce_max_bytes
+        self._batches: asyncio.Queue = asyncio.Queue(maxsize=max_pending_batches)
+        self._put_lock = asyncio.Lock()
+        self._sender: Optional[asyncio.Task] = None
+        self._timer: Optional[asyncio.Task] = None
+        self._pending: List[Dict[str, Any]] = []
+        # Chunk being coalesced: first chunk, its stream_status metadata and collected text
+        self._chunk: Optional[Dict[str, Any]] = None
+        self._chunk_metadata: Optional[str] = None
+        self._chunk_parts: List[str] = []
+        self._chunk_bytes = 0
+        self._chunk_started = 0.0
+
+    async def write(self, response: Dict[str, Any]) -> None:
+        """Queue a response for the stream."""
+        text = self._chunk_text(response)
+        if text is None:
+            self._close_chunk()
+            self._pending.append(response)
+            await self.flush()
+            return
+
+        if self._chunk is not None and response.get("metadata") != self._chunk_metadata:
+            self._close_chunk()
+        if self._chunk is None:
+            self._chunk = response
+            self._chunk_metadata = response.get("metadata")
+            self._chunk_started = time.monotonic()
+            self._timer = asyncio.create_task(self._flush_later())
+        self._chunk_parts.append(text)
+        self._chunk_bytes += len(text)
+
+        if self._chunk_bytes >= self.coalesce_max_bytes or time.monotonic() - self._chunk_started >= self.coalesce_interval:
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Send everything buffered, including a partially coalesced chunk."""
+        self._close_chunk()
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        if self._sender is None:
+            self._sender = asyncio.create_task(self._send_batches())
+        # The lock is fair, so batches are queued in the order they were taken
+        async with self._put_lock:
+            await self._batches.put(batch)
+
+    async def drain(self) -> None:
+        """Flush and wait until every queued batch has been written."""
+        await self.flush()
+        if self._sender is not None:
+            await self._batches.join()
+
+    async def close(self) -> None:
+        """Drain and stop the sender task."""
+        try:
+            await self.drain()
+        finally:
+            if self._timer is not None:
+                self._timer.cancel()
+            if self._sender is not None:
+                self._sender.cancel()
+                try:
+                    await self._sender
+                except asyncio.CancelledError:
+                    pass
+                self._sender = None
+
+    def _chunk_text(self, response: Dict[str, Any]) -> Optional[str]:
+        """Return the text of a streamed assistant chunk, or None for other responses."""
+        if response.get("type") != "assistant" or '"chunk"' not in (response.get("metadata") or ""):
+            return None
+        try:
+            metadata = json.loads(response["metadata"])
+            content = json.loads(response["content"])
+        except (KeyError, TypeError, json.JSONDecodeError):
+            return None
+        if metadata.get("stream_status") != "chunk" or not isinstance(content.get("content"), str):
+            return None
+        return content["content"]
+
+    def _close_chunk(self) -> None:
+        """Move the coalesced chunk, if any, to the pending batch."""
+        if self._chunk is None:
+            return
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+        self._timer = None
+        merged = dict(self._chunk)
+        if len(self._chunk_parts) > 1:
+            merged["content"] = json.dumps({"role": "assistant", "content": "".join(self._chunk_parts)})
+        self._pending.append(merged)
+        self._chunk = None
+        self._chunk_metadata = None
+        self._chunk_parts = []
+        self._chunk_bytes = 0
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.coalesce_interval)
+        await self.flush()
+
+    async def _send_batches(self) -> None:
+        while True:
+            batch = await self._batches.get()
+            try:
+                await append_responses(self.agent_run_id, batch)
+            except Exception as e:
+                logger.warning(f"Failed to write {len(batch)} responses for agent run {self.agent_run_id}: {str(e)}")
+            finally:
+                self._batches.task_done()
@@ -0,0 +1,174 @@
+"""
+Agent Run Control Dispatcher
+
+Delivers control signals (STOP, PAUSE/TAKEOVER, RESUME/RELEASE) to the agent
+runs of a worker process. One Pub/Sub connection per process pattern-subscribes
+to every run's control channels and routes each signal to the RunControl of the
+run it names, so concurrent runs neither open their own connection nor poll.
+
+Pub/Sub is not durable: a STOP published while the listener is reconnecting is
+lost. Stops are therefore also persisted as a flag with a TTL, which the
+dispatcher checks for every registered run whenever it (re)subscribes.
+"""
+
+import asyncio
+from typing import Dict, Optional
+
+from services import redis
+from utils.logger import logger
+
+# Matches agent_run:{id}:control and agent_run:{id}:control:{instance_id}
+CONTROL_CHANNEL_PATTERN = "agent_run:*:control*"
+RECONNECT_DELAY_SECONDS = 1.0
+SUBSCRIBE_TIMEOUT_SECONDS = 15.0
+# Kept below the pool's socket timeout so an idle listener never times out a read
+POLL_TIMEOUT_SECONDS = 1.0
+STOP_FLAG_TTL = 3600
+
+PAUSE_SIGNALS = ("PAUSE", "TAKEOVER")
+RESUME_SIGNALS = ("RESUME", "RELEASE")
+
+
+def stop_flag_key(agent_run_id: str) -> str:
+    return f"agent_run:{agent_run_id}:stop_requested"
+
+
+async def persist_stop(agent_run_id: str) -> None:
+    """Record a STOP for a run so it is seen even if the Pub/Sub message is missed."""
+    await redis.set(stop_flag_key(agent_run_id), "1", ex=STOP_FLAG_TTL)
+
+
+class RunControl:
+    """Control state of one agent run, updated by the dispatcher."""
+
+    def __init__(self, agent_run_id: str):
+        self.agent_run_id = agent_run_id
+        self.stopped = asyncio.Event()
+        # Set while the run may proceed, cleared while it is paused
+        self._resumed = asyncio.Event()
+        self._resumed.set()
+
+    @property
+    def paused(self) -> bool:
+        return not self._resumed.is_set()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        # Wake the run if it is paused so it can see the stop
+        self._resumed.set()
+
+    async def wait_until_resumed(self) -> None:
+        """Block while the run is paused. Returns early once the run is stopped."""
+        await self._resumed.wait()
+
+    def handle_signal(self, signal: str) -> None:
+        if signal == "STOP":
+            logger.debug(f"Received STOP signal for agent run {self.agent_run_id}")
+            self.stop()
+        elif signal in PAUSE_SIGNALS:
+            if not self.paused and not self.stopped.is_set():
+                logger.debug(f"Received {signal} signal; pausing agent run {self.agent_run_id}")
+                self._resumed.clear()
+        elif signal in RESUME_SIGNALS:
+            if self.paused:
+                logger.debug(f"Received {signal} signal; resuming agent run {self.agent_run_id}")
+                self._resumed.set()
+
+
+class RunControlDispatcher:
+    """Routes control signals from one pattern subscription to registered runs."""
+
+    def __init__(self):
+        self._runs: Dict[str, RunControl] = {}
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+        self._subscribed = asyncio.Event()
+
+    async def register(self, agent_run_id: str) -> RunControl:
+        """Start receiving control signals for a run.
+
+        Returns once the subscription is active, so signals published after
+        this call are not missed.
+
+        Raises:
+            asyncio.TimeoutError: If the subscription could not be established
+        """
+        control = self._runs.get(agent_run_id)
+        if control is None:
+            control = RunControl(agent_run_id)
+            self._runs[agent_run_id] = control
+
+        if self._listener is None or self._listener.done():
+            self._subscribed.clear()
+            self._listener = asyncio.create_task(self._listen())
+        try:
+            await asyncio.wait_for(self._subscribed.wait(), timeout=SUBSCRIBE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            self.unregister(agent_run_id)
+            raise
+        # A stop may have been requested before the subscription covered this run
+        await self._apply_persisted_stops([agent_run_id])
+        return control
+
+    def unregister(self, agent_run_id: str) -> None:
+        """Stop routing signals to a run."""
+        self._runs.pop(agent_run_id, None)
+
+    async def _subscribe(self) -> None:
+        self._pubsub = await redis.create_pubsub()
+        await self._pubsub.psubscribe(CONTROL_CHANNEL_PATTERN)
+        self._subscribed.set()
+        logger.debug(f"Subscribed to control channels matching {CONTROL_CHANNEL_PATTERN}")
+        # Stops published while no subscription was active were only persisted
+        await self._apply_persisted_stops(list(self._runs))
+
+    async def _apply_persisted_stops(self, agent_run_ids) -> None:
+        for agent_run_id in agent_run_ids:
+            control = self._runs.get(agent_run_id)
+            if control is None or control.stopped.is_set():
+                continue
+            try:
+                if await redis.exists(stop_flag_key(agent_run_id)):
+                    logger.debug(f"Found persisted STOP for agent run {agent_run_id}")
+                    control.stop()
+            except Exception as e:
+                logger.warning(f"Failed to check stop flag for agent run {agent_run_id}: {str(e)}")
+
+    async def _close_pubsub(self) -> None:
+        if self._pubsub is None:
+            return
+        try:
+            await self._pubsub.close()
+        except Exception as e:
+            logger.warning(f"Error closing control pubsub: {str(e)}")
+        self._pubsub = None
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                await self._subscribe()
+                while True:
+                    message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=POLL_TIMEOUT_SECONDS)
+                    if message and message.get("type") == "pmessage":
+                        self._route(message.get("channel"), message.get("data"))
+            except asyncio.CancelledError:
+                await self._close_pubsub()
+                raise
+            except Exception as e:
+                logger.error(f"Control signal listener failed, reconnecting: {str(e)}", exc_info=True)
+            self._subscribed.clear()
+            await self._close_pubsub()
+            await asyncio.sleep(RECONNECT_DELAY_SECONDS)
+
+    def _route(self, channel, data) -> None:
+        if isinstance(channel, bytes): channel = channel.decode('utf-8')
+        if isinstance(data, bytes): data = data.decode('utf-8')
+        parts = channel.split(":") if channel else []
+        if len(parts) < 3:
+            return
+        control = self._runs.get(parts[1])
+        if control:
+            control.handle_signal(data)
+
+
+control_dispatcher = RunControlDispatcher()
@@ -0,0 +1,210 @@
+"""
+Running monthly usage counters per account.
+
+Billing checks need the account's spend for the current month. Summing
+usage_logs for that means paging through every row of the month, so the total
+is kept in a Redis hash per account and month instead:
+
+- base: sum of usage_logs at the last reconciliation
+- delta: costs of usage logs recorded since then
+- m:{message_id}: the cost of each recorded log, or BASE_MARKER once the log
+  is part of base
+
+Usage is base + delta. Recording a log sets its field only if it has none
+(HSETNX) and adds its cost to delta in the same script, so a log is counted
+once however often it is recorded. Reconciliation sums usage_logs created
+before a cutoff and, in one script, sets base to that sum, subtracts the
+recorded costs of the logs it summed from delta and marks them as part of
+base. A log recorded after the reconciliation finds its marker and is not
+counted again.
+
+Counters are reconciled in the background once they are older than
+RECONCILE_INTERVAL. Only a missing counter (expired, evicted or never built)
+is rebuilt while the caller waits. One worker rebuilds a counter at a time;
+the others sum usage_logs directly in the meantime.
+"""
+
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from services import redis
+from utils.logger import logger
+
+RECONCILE_INTERVAL = 15 * 60
+# Counters outlive their month a little so late reads of the previous month still hit
+COUNTER_TTL = 40 * 24 * 3600
+RECONCILE_LOCK_TTL = 120
+USAGE_LOGS_PAGE_SIZE = 1000
+BASE_MARKER = "b"
+
+# KEYS[1]: counter; ARGV: ttl, then message_id, cost pairs
+_RECORD_SCRIPT = """
+for i = 2, #ARGV, 2 do
+    if redis.call('HSETNX', KEYS[1], 'm:' .. ARGV[i], ARGV[i + 1]) == 1 then
+        redis.call('HINCRBYFLOAT', KEYS[1], 'delta', ARGV[i + 1])
+    end
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+"""
+
+# KEYS[1]: counter; ARGV: ttl, base, reconciled_at, then message_ids summed into base
+_RECONCILE_SCRIPT = """
+for i = 4, #ARGV do
+    local field = 'm:' .. ARGV[i]
+    local cost = redis.call('HGET', KEYS[1], field)
+    if cost and cost ~= '""" + BASE_MARKER + """' then
+        redis.call('HINCRBYFLOAT', KEYS[1], 'delta', -tonumber(cost))
+    end
+    redis.call('HSET', KEYS[1], field, '""" + BASE_MARKER + """')
+end
+redis.call('HSET', KEYS[1], 'base', ARGV[2], 'reconciled_at', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return redis.call('HGET', KEYS[1], 'delta') or '0'
+"""
+
+# Background reconciliations, referenced until done so they are not garbage collected
+_reconciliations: Set[asyncio.Task] = set()
+
+
+def _start_of_month(now: Optional[datetime] = None) -> datetime:
+    now = now or datetime.now(timezone.utc)
+    return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _counter_key(user_id: str, start_of_month: datetime) -> str:
+    return f"usage_counter:{user_id}:{start_of_month:%Y-%m}"
+
+
+async def sum_usage_logs(client, user_id: str, start_of_month: datetime, before: Optional[datetime] = None) -> float:
+    """Sum estimated_cost of an account's usage_logs from start_of_month (until before, if given)."""
+    total_cost, _ = await _sum_usage_logs(client, user_id, start_of_month, before)
+    return total_cost
+
+
+async def _sum_usage_logs(client, user_id: str, start_of_month: datetime, before: Optional[datetime] = None) -> Tuple[float, List[str]]:
+    """Sum estimated_cost of an account's usage_logs, also returning the message_ids of the summed logs."""
+    # Supabase PostgREST doesn't support SUM directly with select(); sum client-side
+    page = 0
+    total_cost = 0.0
+    message_ids = []
+    while True:
+        query = client.table('usage_logs') \
+            .select('estimated_cost, message_id, created_at') \
+            .eq('user_id', user_id) \
+            .gte('created_at', start_of_month.isoformat())
+        if before is not None:
+            query = query.lt('created_at', before.isoformat())
+        res = await query \
+            .order('created_at', desc=True) \
+            .range(page * USAGE_LOGS_PAGE_SIZE, (page + 1) * USAGE_LOGS_PAGE_SIZE - 1) \
+            .execute()
+        if not res.data:
+            break
+        for row in res.data:
+            try:
+                total_cost += float(row.get('estimated_cost') or 0.0)
+            except Exception:
+                continue
+            if row.get('message_id'):
+                message_ids.append(row['message_id'])
+        if len(res.data) < USAGE_LOGS_PAGE_SIZE:
+            break
+        page += 1
+    return total_cost, message_ids
+
+
+async def record_usage(user_id: str, costs: Dict[str, float]) -> None:
+    """
+    Add usage logs to the account's counter for the current month.
+
+    Args:
+        user_id: Account the usage belongs to
+        costs: Cost of each usage log by message_id; logs already counted are skipped
+    """
+    costs = {message_id: cost for message_id, cost in costs.items() if cost > 0}
+    if not costs:
+        return
+    key = _counter_key(user_id, _start_of_month())
+    args = [COUNTER_TTL]
+    for message_id, cost in costs.items():
+        args.extend((message_id, repr(float(cost))))
+    try:
+        redis_client = await redis.get_client()
+        # A counter lost before this gets delta and cost fields only, which reads treat as missing and rebuild
+        await redis_client.eval(_RECORD_SCRIPT, 1, key, *args)
+    except Exception as e:
+        # The counter is corrected by the next reconciliation
+        logger.warning(f"Failed to update usage counter for {user_id}: {str(e)}")
+
+
+async def get_monthly_usage(client, user_id: str) -> float:
+    """
+    Get the account's usage for the current month in dollars.
+
+    Raises:
+        Exception: If the counter is missing and usage_logs could not be summed
+    """
+    start_of_month = _start_of_month()
+    key = _counter_key(user_id, start_of_month)
+
+    try:
+        redis_client = await redis.get_client()
+        base, delta, reconciled_at = await redis_client.hmget(key, "base", "delta", "reconciled_at")
+    except Exception as e:
+        logger.warning(f"Failed to read usage counter for {user_id}: {str(e)}")
+        return await sum_usage_logs(client, user_id, start_of_month)
+
+    if reconciled_at is not None:
+        if time.time() - float(reconciled_at) > RECONCILE_INTERVAL:
+            task = asyncio.create_task(_reconcile_safe(client, user_id, start_of_month))
+            _reconciliations.add(task)
+            task.add_done_callback(_reconciliations.discard)
+        return float(base or 0.0) + float(delta or 0.0)
+
+    logger.debug(f"Usage counter for {user_id} is missing, rebuilding it from usage_logs")
+    total = await reconcile_usage_counter(client, user_id, start_of_month)
+    if total is None:
+        # Another worker is rebuilding the counter
+        total = await sum_usage_logs(client, user_id, start_of_month)
+    return total
+
+
+async def reconcile_usage_counter(client, user_id: str, start_of_month: datetime) -> Optional[float]:
+    """
+    Recompute the account's counter from usage_logs.
+
+    Returns:
+        The reconciled usage, or None if another worker is reconciling the counter
+    """
+    key = _counter_key(user_id, start_of_month)
+    lock_key = f"{key}:reconciling"
+    if not await redis.set(lock_key, "1", ex=RECONCILE_LOCK_TTL, nx=True):
+        return None
+
+    try:
+        redis_client = await redis.get_client()
+        # Logs created from now on are not in base and stay counted by delta
+        cutoff = datetime.now(timezone.utc)
+        base, message_ids = await _sum_usage_logs(client, user_id, start_of_month, before=cutoff)
+
+        delta = await redis_client.eval(
+            _RECONCILE_SCRIPT, 1, key, COUNTER_TTL, repr(base), repr(time.time()), *message_ids
+        )
+
+        total = base + float(delta)
+        logger.debug(f"Reconciled usage counter for {user_id}: ${total:.4f}")
+        return total
+    finally:
+        try:
+            await redis.delete(lock_key)
+        except Exception as e:
+            logger.warning(f"Failed to release usage counter lock for {user_id}: {str(e)}")
+
+
+async def _reconcile_safe(client, user_id: str, start_of_month: datetime) -> None:
+    try:
+        await reconcile_usage_counter(client, user_id, start_of_month)
+    except Exception as e:
+        logger.warning(f"Failed to reconcile usage counter for {user_id}: {str(e)}")
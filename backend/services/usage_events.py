@@ -0,0 +1,247 @@
+"""
+Usage Event Pipeline
+
+Moves credit deduction and usage_logs persistence off the agent loop. Each
+assistant_response_end is recorded as one entry on a Redis stream, and a
+Dramatiq actor drains the stream in batches: it resolves thread owners in one
+query, inserts usage_logs in bulk and applies credit deductions once per user.
+
+usage_logs.message_id is unique, so replayed or redelivered events never log
+usage twice. Charging is tracked separately on each log (credits_applied_at,
+set in the same transaction as the deduction): every uncharged log of a batch
+is charged, so a batch that fails after logging is charged when it is retried,
+and never twice.
+"""
+
+import json
+import os
+import socket
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from services import redis
+from services.billing import calculate_token_cost, calculate_monthly_usage, handle_usage_with_credits
+from services.supabase import DBConnection
+from services.usage_counters import record_usage
+from utils.logger import logger
+
+USAGE_EVENTS_STREAM = "usage_events"
+USAGE_EVENTS_GROUP = "usage_billing"
+USAGE_EVENTS_FLUSH_KEY = "usage_events:flush_scheduled"
+
+# Delay before a scheduled flush runs, so events from concurrent runs share a batch
+FLUSH_DELAY_MS = 1000
+# Safety TTL on the schedule marker in case the scheduled actor never runs
+FLUSH_KEY_TTL = 30
+BATCH_SIZE = 200
+# Entries left unacknowledged this long (crashed or failed consumer) are reclaimed
+CLAIM_IDLE_MS = 60_000
+STREAM_MAX_LENGTH = 100_000
+
+
+def _consumer_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+async def record_usage_event(thread_id: str, message_id: str, content: Dict[str, Any]) -> None:
+    """Queue an assistant_response_end for billing.
+
+    Args:
+        thread_id: Thread the response belongs to
+        message_id: ID of the saved assistant_response_end message, used as idempotency key
+        content: The assistant_response_end content including usage and model
+    """
+    usage = content.get("usage", {}) or {}
+    event = {
+        "thread_id": thread_id,
+        "message_id": message_id,
+        "prompt_tokens": int(usage.get("prompt_tokens", 0) or 0),
+        "completion_tokens": int(usage.get("completion_tokens", 0) or 0),
+        "model": content.get("model") or "unknown",
+        "content": content,
+    }
+
+    redis_client = await redis.get_client()
+    await redis_client.xadd(
+        USAGE_EVENTS_STREAM,
+        {"event": json.dumps(event, default=str)},
+        maxlen=STREAM_MAX_LENGTH,
+        approximate=True
+    )
+    await _schedule_flush()
+
+
+async def _schedule_flush() -> None:
+    """Schedule one delayed flush for all events queued until it runs."""
+    if not await redis.set(USAGE_EVENTS_FLUSH_KEY, "1", ex=FLUSH_KEY_TTL, nx=True):
+        return
+
+    # Imported lazily: the actor lives with the other worker actors
+    from run_agent_background import process_usage_events
+    process_usage_events.send_with_options(delay=FLUSH_DELAY_MS)
+
+
+async def _ensure_consumer_group(redis_client) -> None:
+    try:
+        await redis_client.xgroup_create(USAGE_EVENTS_STREAM, USAGE_EVENTS_GROUP, id="0", mkstream=True)
+    except Exception as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def process_usage_events(consumer_name: Optional[str] = None) -> int:
+    """Drain the usage event stream, billing events in batches.
+
+    Returns:
+        Number of events processed
+    """
+    consumer_name = consumer_name or _consumer_name()
+    redis_client = await redis.get_client()
+    await _ensure_consumer_group(redis_client)
+
+    # Clear the marker first so events queued while draining schedule a new flush
+    await redis.delete(USAGE_EVENTS_FLUSH_KEY)
+
+    db_client = await DBConnection().client
+    processed = 0
+
+    # Retry entries a previous consumer read but never acknowledged
+    claimed = await redis_client.xautoclaim(
+        USAGE_EVENTS_STREAM, USAGE_EVENTS_GROUP, consumer_name,
+        min_idle_time=CLAIM_IDLE_MS, start_id="0-0", count=BATCH_SIZE
+    )
+    if claimed and claimed[1]:
+        processed += await _process_entries(redis_client, db_client, claimed[1])
+
+    while True:
+        response = await redis_client.xreadgroup(
+            USAGE_EVENTS_GROUP, consumer_name, {USAGE_EVENTS_STREAM: ">"}, count=BATCH_SIZE
+        )
+        if not response:
+            break
+        batch_count = 0
+        for _stream, entries in response:
+            batch_count += await _process_entries(redis_client, db_client, entries)
+        if batch_count == 0:
+            break
+        processed += batch_count
+
+    if processed:
+        logger.debug(f"Processed {processed} usage events")
+    return processed
+
+
+async def _process_entries(redis_client, db_client, entries: List[Tuple[str, Dict[str, str]]]) -> int:
+    """Bill a batch of stream entries and acknowledge them once applied."""
+    entry_ids = []
+    events = []
+    for entry_id, fields in entries:
+        entry_ids.append(entry_id)
+        if not fields:
+            # Entry was trimmed from the stream before it could be reclaimed
+            continue
+        try:
+            events.append(json.loads(fields["event"]))
+        except (KeyError, TypeError, json.JSONDecodeError):
+            logger.error(f"Dropping malformed usage event {entry_id}: {fields}")
+
+    if not entry_ids:
+        return 0
+
+    try:
+        await apply_usage_events(db_client, events)
+    except Exception as e:
+        # Leave the entries pending, they are reclaimed after CLAIM_IDLE_MS
+        logger.error(f"Failed to apply {len(events)} usage events: {str(e)}", exc_info=True)
+        return 0
+
+    await redis_client.xack(USAGE_EVENTS_STREAM, USAGE_EVENTS_GROUP, *entry_ids)
+    await redis_client.xdel(USAGE_EVENTS_STREAM, *entry_ids)
+    return len(entry_ids)
+
+
+async def apply_usage_events(db_client, events: List[Dict[str, Any]]) -> None:
+    """Insert usage_logs for a batch of events and deduct credits per user."""
+    if not events:
+        return
+
+    thread_ids = list({event["thread_id"] for event in events})
+    thread_rows = await db_client.table('threads').select('thread_id, account_id').in_('thread_id', thread_ids).execute()
+    account_by_thread = {row['thread_id']: row['account_id'] for row in (thread_rows.data or [])}
+
+    usage_rows = []
+    for event in events:
+        user_id = account_by_thread.get(event["thread_id"])
+        token_cost = calculate_token_cost(event["prompt_tokens"], event["completion_tokens"], event["model"])
+        if not user_id or token_cost <= 0:
+            continue
+        usage_rows.append({
+            'user_id': user_id,
+            'thread_id': event["thread_id"],
+            'message_id': event["message_id"],
+            'total_prompt_tokens': event["prompt_tokens"],
+            'total_completion_tokens': event["completion_tokens"],
+            'total_tokens': event["prompt_tokens"] + event["completion_tokens"],
+            'estimated_cost': float(token_cost),
+            'content': event["content"]
+        })
+
+    if not usage_rows:
+        return
+
+    # Read usage before inserting so the new logs are not counted twice when applying credits.
+    # Logs an earlier attempt already inserted are part of that usage and are subtracted below.
+    message_ids = [row['message_id'] for row in usage_rows]
+    existing = await db_client.table('usage_logs').select('message_id').in_('message_id', message_ids).execute()
+    logged_before = {row['message_id'] for row in (existing.data or [])}
+    user_ids = {row['user_id'] for row in usage_rows}
+    usage_before = {user_id: await calculate_monthly_usage(db_client, user_id) for user_id in user_ids}
+
+    # Duplicates (already logged message_ids) are skipped
+    await db_client.table('usage_logs').upsert(
+        usage_rows, on_conflict='message_id', ignore_duplicates=True
+    ).execute()
+
+    # Count the logs towards monthly usage in every mode; the counter skips logs it already has
+    costs_by_user: Dict[str, Dict[str, float]] = defaultdict(dict)
+    for row in usage_rows:
+        costs_by_user[row['user_id']][row['message_id']] = row['estimated_cost']
+    for user_id, costs in costs_by_user.items():
+        await record_usage(user_id, costs)
+
+    # Charge every log of the batch that has not been charged yet, including logs inserted
+    # by an earlier attempt that failed before charging them
+    pending = await db_client.table('usage_logs') \
+        .select('user_id, thread_id, message_id, estimated_cost, model:content->>model') \
+        .in_('message_id', message_ids) \
+        .is_('credits_applied_at', 'null') \
+        .execute()
+
+    rows_by_user: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for row in pending.data or []:
+        rows_by_user[row['user_id']].append(row)
+
+    failed_users = []
+    for user_id, user_rows in rows_by_user.items():
+        total_cost = sum(float(row['estimated_cost']) for row in user_rows)
+        thread_ids = {row['thread_id'] for row in user_rows}
+        models = {row.get('model') for row in user_rows}
+        already_counted = sum(float(row['estimated_cost']) for row in user_rows if row['message_id'] in logged_before)
+        try:
+            await handle_usage_with_credits(
+                db_client,
+                user_id,
+                total_cost,
+                thread_id=next(iter(thread_ids)) if len(thread_ids) == 1 else None,
+                message_id=user_rows[0]['message_id'] if len(user_rows) == 1 else None,
+                model=next(iter(models)) if len(models) == 1 else "multiple",
+                current_usage=max(usage_before[user_id] - already_counted, 0.0),
+                message_ids=[row['message_id'] for row in user_rows]
+            )
+        except Exception as e:
+            logger.error(f"Error handling credit usage for user {user_id}: {str(e)}", exc_info=True)
+            failed_users.append(user_id)
+
+    if failed_users:
+        # Keep the entries pending; users charged above are skipped when they are retried
+        raise RuntimeError(f"Failed to charge usage for {len(failed_users)} users")
@@ -0,0 +1,149 @@
+"""
+Web Content Caching Service
+
+Caches web search results and scraped page content in Redis so repeated
+research (the same query or URL across turns, runs and users) is served without
+calling Tavily or Firecrawl again. Keys are hashes of the normalized query and
+search options, or of the normalized URL (lower-cased scheme and host, default
+port, fragment, utm_* and click-id parameters removed, query parameters sorted).
+
+A small per-process LRU in front of Redis answers hot entries without a round
+trip. It honours the same TTLs and can be disabled with LOCAL_CACHE_ENTRIES = 0.
+"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from services import redis
+from utils.logger import logger
+
+# Click identifiers that only track the visitor and never change the page (utm_* too).
+# Generic names such as ref are left alone: some sites route or render by them.
+_TRACKING_PARAMS = {"gclid", "dclid", "gbraid", "wbraid", "fbclid", "msclkid"}
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    """Normalize a URL so trivially different spellings share a cache entry."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != _DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    path = parts.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/")
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in _TRACKING_PARAMS
+    ))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a search query: case and whitespace do not change results."""
+    return " ".join(query.lower().split())
+
+
+class WebCache:
+    """Redis-based cache for web search results and scraped pages."""
+
+    # Search results go stale faster than page content
+    SEARCH_TTL = 3600
+    SCRAPE_TTL = 6 * 3600
+
+    LOCAL_CACHE_ENTRIES = 256
+
+    CACHE_PREFIX = "web_cache"
+
+    _local: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    @staticmethod
+    def _key(kind: str, identity: str) -> str:
+        key_hash = hashlib.sha256(identity.encode()).hexdigest()[:32]
+        return f"{WebCache.CACHE_PREFIX}:{kind}:{key_hash}"
+
+    @staticmethod
+    def search_key(query: str, **options: Any) -> str:
+        identity = json.dumps({"query": normalize_query(query), **options}, sort_keys=True)
+        return WebCache._key("search", identity)
+
+    @staticmethod
+    def scrape_key(url: str) -> str:
+        return WebCache._key("scrape", normalize_url(url))
+
+    @staticmethod
+    def _get_local(key: str) -> Optional[Dict[str, Any]]:
+        entry = WebCache._local.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            WebCache._local.pop(key, None)
+            return None
+        WebCache._local.move_to_end(key)
+        return value
+
+    @staticmethod
+    def _set_local(key: str, value: Dict[str, Any], ttl: float) -> None:
+        if WebCache.LOCAL_CACHE_ENTRIES <= 0:
+            return
+        WebCache._local[key] = (time.monotonic() + ttl, value)
+        WebCache._local.move_to_end(key)
+        while len(WebCache._local) > WebCache.LOCAL_CACHE_ENTRIES:
+            WebCache._local.popitem(last=False)
+
+    @staticmethod
+    async def get(key: str) -> Optional[Dict[str, Any]]:
+        """
+        Retrieve a cached web response.
+
+        Args:
+            key: Key from search_key() or scrape_key()
+
+        Returns:
+            The cached response or None if not found
+        """
+        cached = WebCache._get_local(key)
+        if cached is not None:
+            return cached
+        try:
+            redis_client = await redis.get_client()
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.get(key)
+            pipe.ttl(key)
+            cached_data, ttl = await pipe.execute()
+            if not cached_data:
+                logger.debug(f"Cache MISS for web content: {key}")
+                return None
+            value = json.loads(cached_data)
+            if ttl and ttl > 0:
+                WebCache._set_local(key, value, ttl)
+            logger.debug(f"Cache HIT for web content: {key}")
+            return value
+
+        except Exception as e:
+            logger.warning(f"Failed to retrieve cached web content for {key}: {e}")
+            return None
+
+    @staticmethod
+    async def set(key: str, value: Dict[str, Any], ttl: int) -> None:
+        """
+        Cache a web response.
+
+        Args:
+            key: Key from search_key() or scrape_key()
+            value: JSON-serializable response
+            ttl: Seconds until the entry expires
+        """
+        WebCache._set_local(key, value, ttl)
+        try:
+            await redis.set(key, json.dumps(value, ensure_ascii=False), ex=ttl)
+            logger.debug(f"Cached web content: {key}")
+
+        except Exception as e:
+            logger.warning(f"Failed to cache web content for {key}: {e}")
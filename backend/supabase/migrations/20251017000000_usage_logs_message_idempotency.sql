@@ -0,0 +1,23 @@
+-- Make usage_logs.message_id an idempotency key for batched usage billing.
+-- The usage event consumer upserts usage_logs on message_id and only charges
+-- credits for rows it actually inserted, so redelivered events never double-charge.
+
+BEGIN;
+
+-- Remove duplicate usage logs for the same message, keeping the earliest one
+DELETE FROM public.usage_logs a
+USING public.usage_logs b
+WHERE a.message_id IS NOT NULL
+  AND a.message_id = b.message_id
+  AND (a.created_at, a.id) > (b.created_at, b.id);
+
+ALTER TABLE public.usage_logs
+DROP CONSTRAINT IF EXISTS usage_logs_message_id_key;
+
+ALTER TABLE public.usage_logs
+ADD CONSTRAINT usage_logs_message_id_key UNIQUE (message_id);
+
+COMMENT ON CONSTRAINT usage_logs_message_id_key ON public.usage_logs IS
+'Idempotency key for usage billing: each assistant response is logged and charged at most once.';
+
+COMMIT;
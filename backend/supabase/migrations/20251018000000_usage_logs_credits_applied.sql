@@ -0,0 +1,58 @@
+-- Make credit deduction for usage_logs idempotent per message.
+-- The usage event consumer charges every usage log of a batch that has no
+-- credits_applied_at yet, so logs inserted by an attempt that failed before
+-- charging are charged on retry. apply_usage_credits marks the logs and deducts
+-- their overage in one transaction, so a log is never charged twice.
+
+BEGIN;
+
+ALTER TABLE public.usage_logs
+ADD COLUMN IF NOT EXISTS credits_applied_at TIMESTAMPTZ;
+
+-- Logs that existed before this migration were charged by the previous pipeline
+UPDATE public.usage_logs
+SET credits_applied_at = created_at
+WHERE credits_applied_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_usage_logs_credits_pending
+ON public.usage_logs(message_id)
+WHERE credits_applied_at IS NULL;
+
+CREATE OR REPLACE FUNCTION public.apply_usage_credits(
+    p_user_id UUID,
+    p_message_ids UUID[],
+    p_amount DECIMAL,
+    p_description TEXT DEFAULT NULL,
+    p_thread_id UUID DEFAULT NULL,
+    p_message_id UUID DEFAULT NULL
+)
+RETURNS BOOLEAN
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    marked INTEGER;
+BEGIN
+    UPDATE public.usage_logs
+    SET credits_applied_at = NOW()
+    WHERE user_id = p_user_id
+      AND message_id = ANY(p_message_ids)
+      AND credits_applied_at IS NULL;
+    GET DIAGNOSTICS marked = ROW_COUNT;
+
+    -- Another consumer charged some of these logs meanwhile; roll back so the caller recomputes
+    IF marked <> COALESCE(array_length(p_message_ids, 1), 0) THEN
+        RAISE EXCEPTION 'usage logs already charged: marked % of %', marked, COALESCE(array_length(p_message_ids, 1), 0);
+    END IF;
+
+    IF p_amount > 0 THEN
+        RETURN public.use_credits(p_user_id, p_amount, p_description, p_thread_id, p_message_id);
+    END IF;
+
+    RETURN TRUE;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION public.apply_usage_credits TO service_role;
+
+COMMIT;
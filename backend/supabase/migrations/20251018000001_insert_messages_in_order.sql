@@ -0,0 +1,50 @@
+-- Bulk message inserts with database-assigned, ordered timestamps.
+-- The agent's message sink buffers status and tool messages and inserts them in
+-- batches. Timestamps must come from the database clock, like every other
+-- message insert, so thread order and the created_at watermark used to fetch new
+-- messages do not depend on a worker's clock. Rows of a batch get consecutive
+-- microseconds in array order, so the batch keeps the order it was produced in.
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION public.insert_messages_in_order(p_messages JSONB)
+RETURNS SETOF public.messages
+LANGUAGE plpgsql
+SECURITY INVOKER
+AS $$
+DECLARE
+    v_base TIMESTAMPTZ := clock_timestamp();
+BEGIN
+    RETURN QUERY
+    INSERT INTO public.messages (
+        message_id,
+        thread_id,
+        type,
+        is_llm_message,
+        content,
+        metadata,
+        agent_id,
+        agent_version_id,
+        created_at,
+        updated_at
+    )
+    SELECT
+        COALESCE((m->>'message_id')::UUID, gen_random_uuid()),
+        (m->>'thread_id')::UUID,
+        m->>'type',
+        COALESCE((m->>'is_llm_message')::BOOLEAN, TRUE),
+        m->'content',
+        COALESCE(m->'metadata', '{}'::JSONB),
+        (m->>'agent_id')::UUID,
+        (m->>'agent_version_id')::UUID,
+        v_base + (t.ord - 1) * INTERVAL '1 microsecond',
+        v_base + (t.ord - 1) * INTERVAL '1 microsecond'
+    FROM jsonb_array_elements(p_messages) WITH ORDINALITY AS t(m, ord)
+    ORDER BY t.ord
+    RETURNING *;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION public.insert_messages_in_order TO authenticated, service_role;
+
+COMMIT;
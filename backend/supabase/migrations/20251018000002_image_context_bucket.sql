@@ -0,0 +1,17 @@
+-- Private bucket for images the agent looks at (image_context messages).
+-- Objects are only read by the backend with the service role, which bypasses
+-- storage policies, so the bucket has no public access and no policies.
+
+BEGIN;
+
+INSERT INTO storage.buckets (id, name, public, allowed_mime_types, file_size_limit)
+VALUES (
+    'image-context',
+    'image-context',
+    false,
+    ARRAY['image/jpeg', 'image/png', 'image/gif', 'image/webp', 'application/octet-stream'],
+    10485760
+)
+ON CONFLICT (id) DO UPDATE SET public = false;
+
+COMMIT;
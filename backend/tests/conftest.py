@@ -0,0 +1,16 @@
+"""Shared fixtures for backend tests."""
+
+import fakeredis
+import pytest
+
+from services import redis
+
+
+@pytest.fixture
+async def fake_redis(monkeypatch):
+    """Point services.redis at an in-memory Redis for the duration of a test."""
+    client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    monkeypatch.setattr(redis, "client", client)
+    monkeypatch.setattr(redis, "_initialized", True)
+    yield client
+    await client.aclose()
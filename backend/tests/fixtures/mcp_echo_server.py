@@ -0,0 +1,45 @@
+"""
+Minimal stdio MCP server for tests.
+
+Appends a line to the file named by SPAWN_LOG each time it starts, so tests can
+count how many server processes a client opened.
+"""
+
+import asyncio
+import os
+
+from mcp.server.fastmcp import FastMCP
+
+with open(os.environ["SPAWN_LOG"], "a") as spawn_log:
+    spawn_log.write("spawn\n")
+
+mcp = FastMCP("echo")
+_active = 0
+_peak = 0
+
+
+@mcp.tool()
+def echo(text: str) -> str:
+    return text
+
+
+@mcp.tool()
+async def slow(seconds: float) -> int:
+    """Sleep, returning the highest number of slow calls seen running at once."""
+    global _active, _peak
+    _active += 1
+    _peak = max(_peak, _active)
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        _active -= 1
+    return _peak
+
+
+@mcp.tool()
+def crash() -> str:
+    os._exit(1)
+
+
+if __name__ == "__main__":
+    mcp.run()
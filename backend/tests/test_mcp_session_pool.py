@@ -0,0 +1,115 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+from agent.tools.utils.mcp_session_pool import MCPSessionPool, stdio_server
+
+ECHO_SERVER = Path(__file__).parent / "fixtures" / "mcp_echo_server.py"
+
+
+@pytest.fixture
+def spawn_log(tmp_path):
+    return tmp_path / "spawns.log"
+
+
+@pytest.fixture
+def server(spawn_log):
+    return stdio_server(sys.executable, [str(ECHO_SERVER)], env={"SPAWN_LOG": str(spawn_log)})
+
+
+@pytest.fixture
+async def pool():
+    pool = MCPSessionPool(server_concurrency=2, connect_timeout=30)
+    yield pool
+    await pool.close_all()
+
+
+def spawns(spawn_log: Path) -> int:
+    return len(spawn_log.read_text().splitlines()) if spawn_log.exists() else 0
+
+
+def text(result) -> str:
+    return result.content[0].text
+
+
+async def test_session_is_reused(pool, server, spawn_log):
+    tools = await pool.list_tools(server)
+    assert {tool.name for tool in tools.tools} == {"echo", "slow", "crash"}
+
+    assert text(await pool.call_tool(server, "echo", {"text": "one"})) == "one"
+    assert text(await pool.call_tool(server, "echo", {"text": "two"})) == "two"
+    assert spawns(spawn_log) == 1
+    assert pool.stats()["sessions"] == 1
+
+
+async def test_call_not_sent_is_retried_on_new_session(pool, server, spawn_log):
+    await pool.call_tool(server, "echo", {"text": "warm up"})
+
+    # The transport is gone before the next request is written
+    await pool._sessions[server.key].session._write_stream.aclose()
+
+    assert text(await pool.call_tool(server, "echo", {"text": "again"})) == "again"
+    assert spawns(spawn_log) == 2
+
+
+async def test_call_that_was_sent_is_not_retried(pool, server, spawn_log):
+    await pool.call_tool(server, "echo", {"text": "warm up"})
+
+    with pytest.raises(Exception):
+        await pool.call_tool(server, "crash", {}, timeout=10)
+    assert spawns(spawn_log) == 1
+    assert pool.stats()["sessions"] == 0
+
+    assert text(await pool.call_tool(server, "echo", {"text": "recovered"})) == "recovered"
+    assert spawns(spawn_log) == 2
+
+
+async def test_idle_sessions_are_reaped(server):
+    pool = MCPSessionPool(idle_timeout=0.2, connect_timeout=30)
+    try:
+        await pool.call_tool(server, "echo", {"text": "hi"})
+        assert pool.stats()["sessions"] == 1
+        for _ in range(50):
+            await asyncio.sleep(0.1)
+            if not pool.stats()["sessions"]:
+                break
+        assert pool.stats()["sessions"] == 0
+    finally:
+        await pool.close_all()
+
+
+async def test_concurrency_is_limited_per_server(pool, server):
+    results = await asyncio.gather(*(pool.call_tool(server, "slow", {"seconds": 0.2}) for _ in range(6)))
+    assert max(int(text(result)) for result in results) == 2
+
+
+async def test_timeout_does_not_break_other_calls(pool, server, spawn_log):
+    slow = asyncio.create_task(pool.call_tool(server, "slow", {"seconds": 2}, timeout=10))
+    await asyncio.sleep(0.5)
+
+    with pytest.raises(TimeoutError):
+        await pool.call_tool(server, "slow", {"seconds": 5}, timeout=0.5)
+
+    # The other call on the shared session still gets its result
+    assert int(text(await slow)) >= 1
+    assert spawns(spawn_log) == 1
+
+    # The session is pinged before its next use and kept
+    assert text(await pool.call_tool(server, "echo", {"text": "still here"})) == "still here"
+    assert spawns(spawn_log) == 1
+
+
+async def test_discarding_a_replaced_session_keeps_the_new_one(pool, server, spawn_log):
+    await pool.call_tool(server, "echo", {"text": "first"})
+    old = pool._sessions[server.key]
+    await pool._discard(old)
+    await pool.call_tool(server, "echo", {"text": "second"})
+    new = pool._sessions[server.key]
+
+    await pool._discard(old)
+
+    assert pool._sessions[server.key] is new
+    assert text(await pool.call_tool(server, "echo", {"text": "third"})) == "third"
+    assert spawns(spawn_log) == 2
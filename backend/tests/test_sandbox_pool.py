@@ -0,0 +1,203 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from daytona_sdk import SandboxState
+
+from sandbox import pool as pool_module
+from sandbox.pool import SandboxPool, provision_project_sandbox
+
+
+class FakeProcess:
+    async def create_session(self, session_id):
+        pass
+
+    async def execute_session_command(self, session_id, request):
+        pass
+
+
+class FakeSandbox:
+    def __init__(self, sandbox_id, preview_links=True):
+        self.id = sandbox_id
+        self.state = SandboxState.STARTED
+        self.labels = {}
+        self.autostop_interval = 0
+        self.preview_links = preview_links
+        self.process = FakeProcess()
+
+    async def set_labels(self, labels):
+        self.labels = labels
+
+    async def set_autostop_interval(self, interval):
+        self.autostop_interval = interval
+
+    async def get_preview_link(self, port):
+        if not self.preview_links:
+            raise RuntimeError("preview links unavailable")
+        return SimpleNamespace(url=f"https://{port}-{self.id}.preview.test", token=f"token-{self.id}")
+
+
+class FakeDaytona:
+    """In-memory stand-in for AsyncDaytona."""
+
+    def __init__(self, preview_links=True):
+        self.sandboxes = {}
+        self.deleted = []
+        self.preview_links = preview_links
+        self.on_create = None
+
+    async def create(self, params):
+        sandbox = FakeSandbox(f"sb-{len(self.sandboxes) + len(self.deleted)}", self.preview_links)
+        self.sandboxes[sandbox.id] = sandbox
+        if self.on_create:
+            await self.on_create()
+        return sandbox
+
+    async def get(self, sandbox_id):
+        if sandbox_id not in self.sandboxes:
+            raise RuntimeError(f"Sandbox {sandbox_id} not found")
+        return self.sandboxes[sandbox_id]
+
+    async def start(self, sandbox):
+        sandbox.state = SandboxState.STARTED
+
+    async def delete(self, sandbox):
+        self.sandboxes.pop(sandbox.id, None)
+        self.deleted.append(sandbox.id)
+
+
+@pytest.fixture(autouse=True)
+def no_startup_wait(monkeypatch):
+    monkeypatch.setattr(pool_module, "SERVICES_STARTUP_SECONDS", 0)
+
+
+@pytest.fixture
+def daytona():
+    return FakeDaytona()
+
+
+@pytest.fixture
+def pool(fake_redis, daytona):
+    return SandboxPool(snapshot="test-snapshot", low_watermark=1, high_watermark=2, daytona=daytona)
+
+
+async def test_refill_and_claim(pool, daytona, fake_redis):
+    assert await pool.refill() == 2
+    assert await fake_redis.llen(pool._pool_key) == 2
+    assert await fake_redis.get(pool._refill_lock_key) is None
+
+    sandbox, info = await pool.claim("project-1")
+    assert info["id"] == sandbox.id
+    assert info["vnc_preview"] == f"https://6080-{sandbox.id}.preview.test"
+    assert info["token"] == f"token-{sandbox.id}"
+    assert sandbox.labels == {"id": "project-1"}
+    assert sandbox.autostop_interval == pool_module.SANDBOX_AUTO_STOP_INTERVAL
+    await pool._refill_task
+
+    stats = await pool.get_stats()
+    assert stats["hits"] == 1 and stats["created"] == 2
+    # One sandbox left is not below the low watermark, so nothing was refilled
+    assert stats["size"] == 1
+
+    await pool.claim("project-2")
+    await pool._refill_task
+    assert (await pool.get_stats())["size"] == 2
+
+
+async def test_claim_skips_stale_entries(pool, daytona, fake_redis):
+    await pool.refill()
+    await fake_redis.lpush(pool._pool_key, json.dumps({"id": "deleted-in-daytona"}))
+
+    sandbox, _ = await pool.claim("project-1")
+    assert sandbox.id in daytona.sandboxes
+    assert (await pool.get_stats())["failures"] == 1
+
+
+async def test_claim_deletes_sandbox_that_fails_to_activate(pool, daytona, fake_redis):
+    await pool.refill()
+    broken = daytona.sandboxes["sb-0"]
+
+    async def set_labels(labels):
+        raise RuntimeError("label update failed")
+
+    broken.set_labels = set_labels
+
+    sandbox, _ = await pool.claim("project-1")
+    assert sandbox.id == "sb-1"
+    assert daytona.deleted == ["sb-0"]
+    assert (await pool.get_stats())["failures"] == 1
+
+
+async def test_claim_deletes_old_sandboxes(pool, daytona, fake_redis):
+    await pool.refill()
+    raw_entry = await fake_redis.lpop(pool._pool_key)
+    entry = json.loads(raw_entry)
+    entry["created_at"] -= pool_module.MAX_POOLED_AGE + 1
+    await fake_redis.lpush(pool._pool_key, json.dumps(entry))
+
+    sandbox, _ = await pool.claim("project-1")
+    assert sandbox.id != entry["id"]
+    assert daytona.deleted == [entry["id"]]
+
+
+async def test_cancelled_claim_returns_sandbox_to_pool(pool, daytona, fake_redis):
+    await pool.refill()
+    activating = asyncio.Event()
+
+    async def set_labels(labels):
+        activating.set()
+        await asyncio.sleep(10)
+
+    daytona.sandboxes["sb-0"].set_labels = set_labels
+
+    claim = asyncio.create_task(pool.claim("project-1"))
+    await activating.wait()
+    claim.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await claim
+
+    assert json.loads(await fake_redis.lindex(pool._pool_key, 0))["id"] == "sb-0"
+    assert daytona.deleted == []
+
+
+async def test_claim_from_empty_pool(fake_redis, daytona):
+    pool = SandboxPool(snapshot="test-snapshot", low_watermark=0, high_watermark=0, daytona=daytona)
+    assert await pool.claim("project-1") is None
+
+    pool = SandboxPool(snapshot="test-snapshot", low_watermark=0, high_watermark=1, daytona=daytona)
+    assert await pool.claim("project-1") is None
+    assert (await pool.get_stats())["misses"] == 1
+
+
+async def test_refill_skips_while_locked(pool, fake_redis):
+    await fake_redis.set(pool._refill_lock_key, "other-process")
+    assert await pool.refill() == 0
+    assert await fake_redis.get(pool._refill_lock_key) == "other-process"
+
+
+async def test_refill_keeps_lock_taken_over_by_another_process(pool, daytona, fake_redis):
+    async def lock_expires_and_is_taken():
+        await fake_redis.set(pool._refill_lock_key, "other-process")
+
+    daytona.on_create = lock_expires_and_is_taken
+    assert await pool.refill() == 2
+    assert await fake_redis.get(pool._refill_lock_key) == "other-process"
+
+
+async def test_provision_raises_without_preview_links(monkeypatch, pool, fake_redis):
+    failing = FakeDaytona(preview_links=False)
+    monkeypatch.setattr(pool_module, "sandbox_pool", SandboxPool(snapshot="test-snapshot", low_watermark=0, high_watermark=0, daytona=failing))
+    monkeypatch.setattr(pool_module.sandbox_module, "daytona", failing)
+
+    async def create_sandbox(password, project_id):
+        return await failing.create(None)
+
+    monkeypatch.setattr(pool_module, "create_sandbox", create_sandbox)
+
+    with pytest.raises(RuntimeError):
+        await provision_project_sandbox("project-1")
+    assert failing.deleted == ["sb-0"]
+
+    sandbox, info = await provision_project_sandbox("project-2", require_preview_links=False)
+    assert info["id"] == sandbox.id and info["vnc_preview"] is None
@@ -0,0 +1,158 @@
+from types import SimpleNamespace
+
+import pytest
+
+from services import billing
+from services import usage_events
+from services.usage_events import apply_usage_events
+from utils.config import EnvMode
+
+USER_ID = "user-1"
+THREAD_ID = "thread-1"
+
+
+class FakeQuery:
+    """Just enough of a PostgREST query builder for the usage pipeline."""
+
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.filters = []
+        self.upsert_rows = None
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def in_(self, column, values):
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def is_(self, column, value):
+        assert value == 'null'
+        self.filters.append(lambda row: row.get(column) is None)
+        return self
+
+    def gte(self, column, value):
+        return self
+
+    def lt(self, column, value):
+        return self
+
+    def order(self, column, desc=False):
+        return self
+
+    def range(self, start, end):
+        return self
+
+    def upsert(self, rows, on_conflict, ignore_duplicates):
+        self.upsert_rows = rows
+        return self
+
+    async def execute(self):
+        rows = self.db.tables[self.table]
+        if self.upsert_rows is not None:
+            logged = {row['message_id'] for row in rows}
+            rows.extend(dict(row, credits_applied_at=None) for row in self.upsert_rows if row['message_id'] not in logged)
+            return SimpleNamespace(data=[])
+        data = [dict(row, model=row.get('content', {}).get('model')) for row in rows if all(f(row) for f in self.filters)]
+        return SimpleNamespace(data=data)
+
+
+class FakeRpc:
+    def __init__(self, db, params):
+        self.db = db
+        self.params = params
+
+    async def execute(self):
+        if self.db.fail_charges:
+            raise RuntimeError("connection reset")
+        for row in self.db.tables['usage_logs']:
+            if row['message_id'] in self.params['p_message_ids']:
+                row['credits_applied_at'] = 'now'
+        self.db.charges.append(self.params['p_amount'])
+        return SimpleNamespace(data=True)
+
+
+class FakeDB:
+    def __init__(self):
+        self.tables = {
+            'threads': [{'thread_id': THREAD_ID, 'account_id': USER_ID}],
+            'usage_logs': [],
+        }
+        self.charges = []
+        self.fail_charges = False
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, name, params):
+        assert name == 'apply_usage_credits'
+        return FakeRpc(self, params)
+
+
+@pytest.fixture
+def db(fake_redis, monkeypatch):
+    monkeypatch.setattr(billing.config, "ENV_MODE", EnvMode.STAGING)
+    monkeypatch.setitem(billing.SUBSCRIPTION_TIERS, billing.config.STRIPE_FREE_TIER_ID, {'name': 'free', 'minutes': 60, 'cost': 5})
+
+    async def get_user_subscription(user_id):
+        return None
+
+    async def get_user_credit_balance(client, user_id):
+        return SimpleNamespace(balance_dollars=10.0, balance_credits=1000, can_purchase_credits=True)
+
+    monkeypatch.setattr(billing, "get_user_subscription", get_user_subscription)
+    monkeypatch.setattr(billing, "get_user_credit_balance", get_user_credit_balance)
+    # One cent per prompt token keeps the costs readable
+    monkeypatch.setattr(usage_events, "calculate_token_cost", lambda prompt, completion, model: prompt / 100)
+
+    db = FakeDB()
+    db.tables['usage_logs'].append({
+        'user_id': USER_ID, 'thread_id': THREAD_ID, 'message_id': 'm-0',
+        'estimated_cost': 4.90, 'content': {}, 'credits_applied_at': 'earlier'
+    })
+    return db
+
+
+def _event(message_id, prompt_tokens):
+    return {
+        'thread_id': THREAD_ID,
+        'message_id': message_id,
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': 0,
+        'model': 'test-model',
+        'content': {'model': 'test-model'},
+    }
+
+
+async def test_charges_only_overage(db):
+    await apply_usage_events(db, [_event('m-1', 20)])
+
+    assert db.charges == [pytest.approx(0.10)]
+
+
+async def test_retry_after_failed_charge_charges_once(db):
+    db.fail_charges = True
+    with pytest.raises(RuntimeError):
+        await apply_usage_events(db, [_event('m-1', 20)])
+    assert db.charges == []
+
+    db.fail_charges = False
+    await apply_usage_events(db, [_event('m-1', 20)])
+    await apply_usage_events(db, [_event('m-1', 20)])
+
+    # The log counted by the failed attempt is not counted again as prior usage
+    assert db.charges == [pytest.approx(0.10)]
+
+
+async def test_marks_logs_processed_when_credit_tracking_is_disabled(db, monkeypatch):
+    monkeypatch.setattr(billing.config, "ENV_MODE", EnvMode.PRODUCTION)
+
+    await apply_usage_events(db, [_event('m-1', 20)])
+
+    assert db.charges == [0.0]
+    assert all(row['credits_applied_at'] for row in db.tables['usage_logs'])
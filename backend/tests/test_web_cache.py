@@ -0,0 +1,111 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from agent.tools.web_search_tool import SandboxWebSearchTool
+from services import http_client
+from services.web_cache import WebCache, normalize_query, normalize_url
+
+
+@pytest.fixture(autouse=True)
+def clear_local_cache():
+    WebCache._local.clear()
+    yield
+    WebCache._local.clear()
+
+
+@pytest.fixture
+def stub_transport(monkeypatch):
+    """Route the shared HTTP client through a handler set by the test."""
+    def install(handler):
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(http_client, "get_http_client", lambda: client)
+        return client
+    return install
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("HTTPS://Example.COM:443/Path/?b=2&a=1#section", "https://example.com/Path?a=1&b=2"),
+    ("http://example.com:8080", "http://example.com:8080/"),
+    ("https://example.com/page?utm_source=x&gclid=1&msclkid=2&id=7", "https://example.com/page?id=7"),
+    # ref and ref_src can change what a page serves
+    ("https://example.com/?ref=main&ref_src=twsrc", "https://example.com/?ref=main&ref_src=twsrc"),
+])
+def test_normalize_url(url, expected):
+    assert normalize_url(url) == expected
+
+
+def test_normalize_query():
+    assert normalize_query("  Latest   AI\tNews ") == "latest ai news"
+    assert WebCache.search_key("Latest AI news", max_results=5) == WebCache.search_key("latest  ai NEWS", max_results=5)
+    assert WebCache.search_key("latest ai news", max_results=5) != WebCache.search_key("latest ai news", max_results=10)
+
+
+async def test_cache_miss_then_hit(fake_redis):
+    key = WebCache.scrape_key("https://example.com/a")
+    assert await WebCache.get(key) is None
+
+    await WebCache.set(key, {"data": {"markdown": "# A"}}, 60)
+    assert await WebCache.get(key) == {"data": {"markdown": "# A"}}
+    assert 0 < await fake_redis.ttl(key) <= 60
+
+    # Served from Redis when the local LRU is cold
+    WebCache._local.clear()
+    assert await WebCache.get(key) == {"data": {"markdown": "# A"}}
+
+
+async def test_cache_entries_expire(fake_redis):
+    key = WebCache.scrape_key("https://example.com/b")
+    await WebCache.set(key, {"data": {"markdown": "# B"}}, 1)
+    await asyncio.sleep(1.1)
+    assert await WebCache.get(key) is None
+
+
+async def test_web_search_hit_keeps_ttl(fake_redis, stub_transport):
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(json.loads(request.content))
+        return httpx.Response(200, json={"query": "q", "answer": "yes", "results": [{"url": "https://example.com"}]})
+
+    stub_transport(handler)
+    tool = SandboxWebSearchTool.__new__(SandboxWebSearchTool)
+    tool.tavily_api_key = "test-key"
+
+    first = await tool.web_search("Some Query", num_results=5)
+    assert first.success and len(calls) == 1
+
+    key = WebCache.search_key("some query", max_results=5, include_images=True, include_answer="advanced", search_depth="advanced")
+    await fake_redis.expire(key, 100)
+    WebCache._local.clear()
+
+    second = await tool.web_search("some   query", num_results=5)
+    assert second.success and len(calls) == 1
+    # A hit must not push the expiry back
+    assert await fake_redis.ttl(key) <= 100
+
+
+async def test_requests_are_limited_per_host(monkeypatch, stub_transport):
+    active = {}
+    peak = {}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        active[host] = active.get(host, 0) + 1
+        peak[host] = max(peak.get(host, 0), active[host])
+        await asyncio.sleep(0.02)
+        active[host] -= 1
+        return httpx.Response(200)
+
+    stub_transport(handler)
+    monkeypatch.setattr(http_client, "HOST_CONCURRENCY", {})
+    http_client.set_host_concurrency("Limited.test", 2)
+
+    await asyncio.gather(
+        *(http_client.request("GET", "https://limited.test/x") for _ in range(6)),
+        *(http_client.request("GET", "https://other.test/x") for _ in range(6)),
+    )
+    assert peak["limited.test"] == 2
+    assert peak["other.test"] == 6
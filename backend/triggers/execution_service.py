@@ -183,26 +183,14 @@ class SessionManager:
         client = await self._db.client
         
         try:
-            from sandbox.sandbox import create_sandbox, delete_sandbox
+            from sandbox.sandbox import delete_sandbox
+            from sandbox.pool import provision_project_sandbox
             
-            sandbox_pass = str(uuid.uuid4())
-            sandbox = await create_sandbox(sandbox_pass, project_id)
+            sandbox, sandbox_info = await provision_project_sandbox(project_id)
             sandbox_id = sandbox.id
             
-            vnc_link = await sandbox.get_preview_link(6080)
-            website_link = await sandbox.get_preview_link(8080)
-            vnc_url = self._extract_url(vnc_link)
-            website_url = self._extract_url(website_link)
-            token = self._extract_token(vnc_link)
-            
             update_result = await client.table('projects').update({
-                'sandbox': {
-                    'id': sandbox_id,
-                    'pass': sandbox_pass,
-                    'vnc_preview': vnc_url,
-                    'sandbox_url': website_url,
-                    'token': token
-                }
+                'sandbox': sandbox_info
             }).eq('project_id', project_id).execute()
             
             if not update_result.data:
@@ -213,17 +201,6 @@ class SessionManager:
             await client.table('projects').delete().eq('project_id', project_id).execute()
             raise Exception(f"Failed to create sandbox: {str(e)}")
     
-    def _extract_url(self, link) -> str:
-        if hasattr(link, 'url'):
-            return link.url
-        return str(link).split("url='")[1].split("'")[0]
-    
-    def _extract_token(self, link) -> str:
-        if hasattr(link, 'token'):
-            return link.token
-        if "token='" in str(link):
-            return str(link).split("token='")[1].split("'")[0]
-        return None
 
 
 class AgentExecutor:
@@ -609,7 +586,7 @@ class WorkflowExecutor:
         
         tool_mapping = {
             'sb_shell_tool': ['execute_command'],
-            'sb_files_tool': ['create_file', 'str_replace', 'full_file_rewrite', 'delete_file'],
+            'sb_files_tool': ['create_file', 'str_replace', 'full_file_rewrite', 'batch_file_operations', 'delete_file'],
             'browser_tool': ['browser_navigate_to', 'browser_screenshot'],
             'sb_vision_tool': ['see_image'],
             'sb_deploy_tool': ['deploy'],
@@ -263,6 +263,10 @@ class Configuration:
     SANDBOX_SNAPSHOT_NAME = "neuralarcai/he2:0.1.1"
     SANDBOX_ENTRYPOINT = "/usr/bin/supervisord -n -c /etc/supervisor/conf.d/supervisord.conf"
 
+    # Warm sandbox pool: refilled up to the high watermark once it falls below the low watermark (0 disables it)
+    SANDBOX_POOL_LOW_WATERMARK: int = 0
+    SANDBOX_POOL_HIGH_WATERMARK: int = 0
+
     # LangFuse configuration
     LANGFUSE_PUBLIC_KEY: Optional[str] = None
     LANGFUSE_SECRET_KEY: Optional[str] = None